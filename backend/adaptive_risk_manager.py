@@ -4,6 +4,9 @@ import argparse, csv, json, math, os, sys, time
 from statistics import fmean
 from urllib.request import urlopen, Request
 
+import walkforward
+from common import tpsl
+
 def jget(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -27,92 +30,6 @@ def fetch_trades(base_url):
     except Exception:
         return []
 
-def reconstruct_roundtrips(trades):
-    # FIFO; returns list of dicts with ret (pnl/alloc_cost)
-    lots = []
-    out = []
-    for row in trades:
-        side = (row.get("side") or "").lower()
-        ts = float(row.get("time") or row.get("ts") or 0.0)
-        px = float(row.get("price") or 0.0)
-        qty = float(row.get("qty") or 0.0)
-        fee = float(row.get("fee") or 0.0)
-        if qty <= 0 or px <= 0: continue
-        if side == "buy":
-            lots.append([qty, px*qty + fee, ts, px])
-        elif side == "sell":
-            remain = qty; proceeds = px*qty - fee
-            alloc_cost = 0.0; entry_ts = None; entry_px = None
-            while remain > 1e-12 and lots:
-                lqty, lcost, lts, lpx = lots[0]
-                use = min(lqty, remain)
-                unit_cost = (lcost / lqty) if lqty > 0 else 0.0
-                alloc_cost += unit_cost * use
-                if entry_ts is None: entry_ts = float(lts); entry_px = float(lpx)
-                lqty -= use; remain -= use
-                if lqty <= 1e-12: lots.pop(0)
-                else:
-                    lots[0][0] = lqty
-                    lots[0][1] = unit_cost * lqty
-            pnl = proceeds - alloc_cost
-            ret = (pnl / alloc_cost) if alloc_cost > 0 else 0.0
-            out.append({"entry_ts": entry_ts or ts, "exit_ts": ts, "ret": ret})
-    return out
-
-def estimate_break_even(params):
-    pr = params.get("params", {})
-    prefer_maker = bool(pr.get("PREFER_MAKER", True))
-    maker_fee_buy = float(pr.get("MAKER_FEE_BUY", 0.00075))
-    maker_fee_sell = float(pr.get("MAKER_FEE_SELL", 0.00075))
-    taker_fee_buy = float(pr.get("FEE_RATE_BUY", 0.0010))
-    taker_fee_sell = float(pr.get("FEE_RATE_SELL", 0.0010))
-    slip = float(pr.get("SLIPPAGE", 0.0002))
-    buf  = float(pr.get("FEE_BUFFER_PCT", 0.0005))
-    fee_buy = maker_fee_buy if prefer_maker else taker_fee_buy
-    fee_sell = maker_fee_sell if prefer_maker else taker_fee_sell
-    return fee_buy + fee_sell + slip + buf
-
-def tp_grid_search(returns, break_even, size, tp_min, tp_max, tp_step):
-    tp_min_eff = max(tp_min, break_even + 0.0001)
-    tps = []
-    v = tp_min_eff
-    while v <= tp_max + 1e-12:
-        tps.append(round(v, 8)); v += tp_step
-    best = {"tp": None, "hit_rate": 0.0, "net": 0.0}
-    n = len(returns)
-    if n == 0: return best
-    for tp in tps:
-        hit = sum(1 for r in returns if r >= tp)
-        hr = hit / n
-        net = size * (tp - break_even) * hr
-        if best["tp"] is None or net >= best["net"]:
-            best = {"tp": tp, "hit_rate": hr, "net": net}
-    if best["hit_rate"] == 0.0:
-        best["tp"] = tp_min_eff
-    return best
-
-
-def losses_quantile(losses_abs, q):
-    if not losses_abs: return None
-    vs = sorted(losses_abs)
-    idx = (len(vs)-1) * q
-    lo = int(idx//1); hi = int(-(-idx//1))  # ceil
-    if lo == hi: return vs[lo]
-    frac = idx - lo
-    return vs[lo]*(1-frac) + vs[hi]*frac
-
-def recommend_tp_sl(returns, break_even, size, tp_grid, sl_quantile, sl_floor):
-    best = tp_grid_search(returns, break_even, size, *tp_grid)
-    losses = [abs(x) for x in returns if x < 0]
-    if len(losses) >= 5:
-        q = max(0.5, min(sl_quantile, 0.99))
-        sl_rec = max(sl_floor, losses_quantile(losses, q))
-        sl_method = f"quantile_{q:.2f}"
-    else:
-        sl_rec = sl_floor
-        sl_method = "floor"
-    return best, sl_rec, sl_method, len(losses)
-
 def blend(values, weights):
     wsum = sum(weights)
     if wsum <= 0: return None
@@ -148,6 +65,8 @@ def main():
     ap.add_argument("--poll-sec", type=float, default=10.0, help="Période de scrutation des trades.")
     ap.add_argument("--dry-run", action="store_true", help="Ne pas appeler l'API de mise à jour, seulement logguer.")
     ap.add_argument("--log-csv", default="adaptive_risk_log.csv")
+    ap.add_argument("--oos-check", default=None, metavar="TRAIN:TEST",
+                    help="N'applique que si le walk-forward (TRAIN roundtrips fit, TEST évalués) a une espérance OOS > 0.")
     args = ap.parse_args()
 
     base = args.base_url
@@ -190,9 +109,9 @@ def main():
     while True:
         try:
             params = fetch_params(base)
-            be = estimate_break_even(params)
+            be = walkforward.break_even(params)
             trades = fetch_trades(base)
-            rts = reconstruct_roundtrips(trades)
+            rts = walkforward.reconstruct_roundtrips(trades)
             n_rt = len(rts)
 
             now = time.time()
@@ -200,20 +119,15 @@ def main():
 
             if should_reeval and n_rt > 0:
                 rets_all = [rt["ret"] for rt in rts]
-                # Per-window recompute
-                tp_list = []
-                sl_list = []
-                used_windows = []
-                for i, (N, _) in enumerate(windows):
-                    if n_rt < 1: break
-                    seg = rets_all[-N:] if n_rt >= N else rets_all[:]
-                    best, sl_rec, sl_method, n_losses = recommend_tp_sl(
-                        seg, be, args.primary_size, (args.tp_min, args.tp_max, args.tp_step),
-                        args.sl_quantile, args.sl_floor
-                    )
-                    tp_list.append(best["tp"] if best["tp"] is not None else args.tp_min)
-                    sl_list.append(sl_rec)
-                    used_windows.append(len(seg))
+                tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step, floor=be + 0.0001)
+                # Per-window recompute (un seul tri pour toutes les fenêtres; ex aequo -> plus grand TP)
+                table = tpsl.rolling_table(
+                    rets_all, [N for N, _ in windows], tps, be, args.primary_size,
+                    args.sl_quantile, args.sl_floor, ties="last",
+                )
+                tp_list = [args.tp_min if math.isnan(t) else float(t) for t in table["tp"]]
+                sl_list = [float(x) for x in table["sl"]]
+                used_windows = [int(x) for x in table["n"]]
 
                 tp_final = blend(tp_list, weights[:len(tp_list)])
                 sl_final = max(sl_list) if sl_list else args.sl_floor  # conservative: max across windows
@@ -228,6 +142,18 @@ def main():
                     return abs(new - prev) >= (args.hysteresis_bps / 10000.0)
 
                 can_apply = (now - last_apply_ts >= args.cooldown_sec)
+                oos_exp = None
+                if args.oos_check:
+                    train, test = walkforward.parse_walk_forward(args.oos_check)
+                    wf = walkforward.walk_forward_roundtrips(
+                        rets_all, train, test, break_even=be, size=args.primary_size,
+                        tps=tps,
+                        sl_quantile=args.sl_quantile, sl_floor=args.sl_floor,
+                        ties="last", exit_ts=[rt["exit_ts"] for rt in rts],
+                    )
+                    oos_exp = wf["stability"]["oos_expectancy"]
+                    # pas assez d'historique pour un fold ou espérance OOS <= 0: on n'applique pas
+                    can_apply = can_apply and oos_exp is not None and oos_exp > 0
                 tp_ok = changed_enough(last_applied_tp, tp_final)
                 sl_ok = changed_enough(last_applied_sl, sl_final)
 
@@ -261,6 +187,7 @@ def main():
                     "windows_used": json.dumps(used_windows),
                     "applied_tp": applied["tp"],
                     "applied_sl": applied["sl"],
+                    "oos_expectancy": oos_exp,
                 })
 
                 print(f"Reeval: N={n_rt} | be={be*100:.3f}% | TP*≈{tp_final*100:.3f}% | SL*≈{sl_final*100:.3f}% | applied={applied}")
@@ -1,120 +1,269 @@
-
 #!/usr/bin/env python3
 """
 analyze_trades_offline.py
 -------------------------
-But : analyser la rentabilité à partir d'un export /api/trades (JSON) ou d'un CSV des trades.
-- Calcule PnL réalisé (FIFO), PnL non réalisé (via mark price fourni en argument), drawdown, Sharpe simple.
+But : analyser la rentabilité à partir d'un export /api/trades (JSON, JSON lines) ou d'un CSV des trades.
+- Calcule PnL réalisé (FIFO, frais inclus), PnL non réalisé (via mark price fourni en argument), drawdown, Sharpe simple.
 - Produit un rapport texte + un CSV enrichi + deux graphiques (equity reconstruit & drawdown).
 
 Exemples
 - python analyze_trades_offline.py --trades my_trades.json --mark 65000
-- python analyze_trades_offline.py --trades my_trades.csv --price-col close  (si CSV avec colonnes)
+- python analyze_trades_offline.py --trades my_trades.csv --prices klines_1m.csv --price-col close
+- python analyze_trades_offline.py --trades export.jsonl --no-plot
 
 Notes
 - Le format des trades étant variable, le script essaie côté clefs courantes: time/timestamp, side, qty/amount, price, fee.
-- Si vous passez aussi un fichier de prix (CSV OHLC), on peut reconstruire une equity curve plus réaliste.
+- CSV et JSON lines sont lus par blocs (--chunk lignes) et réduits à 5 colonnes float64: un export
+  de plusieurs millions de lignes tient en quelques dizaines de Mo.
+- FIFO vectorisé: la quantité consommée par les ventes est c_k = min(c_{k-1} + q_k, achats cumulés au
+  trade k) (une vente au-delà du stock n'apparie que le stock, comme la boucle d'origine), soit
+  c_k = Q_k + min(0, min_{j<=k} (B_j - Q_j)); le coût de [c_{k-1}, c_k) se lit sur la courbe
+  cumulée des achats (searchsorted). Frais d'achat répartis au prorata de la quantité.
+- Avec --prices (CSV de bougies: time + close; open_time/minute décalés d'une bougie, pour marquer
+  au close sans look-ahead), l'equity est marquée au marché à chaque bougie;
+  sinon au dernier prix de trade, rééchantillonnée à l'heure (dernière valeur de chaque heure).
+- Benchmark sur 1M de trades synthétiques: python bench_analyze_trades.py
 """
 
 import argparse
 import json
-import os
-from typing import Any, Dict, List, Tuple
+from typing import Dict, Iterator, Optional
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
+TIME_KEYS = ("timestamp", "time", "ts", "created_at")
+OPEN_TIME_KEYS = ("open_time", "minute", "t")  # bougies datées à l'ouverture
+SIDE_KEYS = ("side", "type")
+QTY_KEYS = ("qty", "amount", "size", "quantity")
+PRICE_KEYS = ("price", "avg_price", "fill_price")
+FEE_KEYS = ("fee", "fees")
+COLS = ("time", "side", "qty", "price", "fee")  # time en epoch s, side +1 achat / -1 vente
 
-def _load_trades(path: str) -> pd.DataFrame:
-    if path.lower().endswith(".json"):
+
+def _pick(df: pd.DataFrame, keys) -> Optional[pd.Series]:
+    """Première colonne non vide parmi ``keys`` (complétée par les suivantes ligne à ligne)."""
+    out = None
+    for k in keys:
+        if k in df.columns:
+            out = df[k] if out is None else out.where(out.notna(), df[k])
+    return out
+
+
+def _to_epoch(s: pd.Series) -> np.ndarray:
+    """epoch s / ms ou dates ISO -> epoch s (NaN si illisible)."""
+    num = pd.to_numeric(s, errors="coerce")
+    if num.notna().mean() > 0.5:
+        v = num.to_numpy(dtype=np.float64)
+        return np.where(v > 1e11, v / 1000.0, v)
+    dt = pd.to_datetime(s, errors="coerce", utc=True)
+    v = (dt - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+    return v.to_numpy(dtype=np.float64)
+
+
+def _num(df: pd.DataFrame, keys) -> np.ndarray:
+    s = _pick(df, keys)
+    if s is None:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _normalize(df: pd.DataFrame) -> np.ndarray:
+    """Bloc brut -> (n, 5) [time, side, qty, price, fee], lignes invalides retirées."""
+    ts = _pick(df, TIME_KEYS)
+    side = _pick(df, SIDE_KEYS)
+    side = side.astype(str).str.lower().to_numpy() if side is not None else np.full(len(df), "")
+    a = np.empty((len(df), 5), dtype=np.float64)
+    a[:, 0] = _to_epoch(ts) if ts is not None else np.nan
+    a[:, 1] = np.select([side == "buy", side == "sell"], [1.0, -1.0], 0.0)
+    a[:, 2] = _num(df, QTY_KEYS)
+    a[:, 3] = _num(df, PRICE_KEYS)
+    a[:, 4] = np.nan_to_num(_num(df, FEE_KEYS))
+    ok = np.isfinite(a[:, 0]) & (a[:, 1] != 0) & (a[:, 2] > 0) & (a[:, 3] > 0)
+    return a[ok]
+
+
+def iter_trade_chunks(path: str, chunk: int = 250_000) -> Iterator[np.ndarray]:
+    """Blocs normalisés (n, 5) d'un CSV, d'un JSON lines (.jsonl/.ndjson) ou d'un JSON."""
+    low = path.lower()
+    if low.endswith((".jsonl", ".ndjson")):
+        reader = pd.read_json(path, lines=True, chunksize=chunk, dtype=False)
+    elif low.endswith(".json"):
         data = json.load(open(path, "r"))
+        # normaliser JSON (list/dict)
+        if isinstance(data, dict):
+            data = data.get("trades") or data.get("data") or data.get("items") or data.get("results") or list(data.values())[0]
+        if not isinstance(data, list):
+            raise SystemExit("Format JSON inattendu pour les trades.")
+        data = [r for r in data if isinstance(r, dict)]
+        reader = (pd.DataFrame.from_records(data[i:i + chunk]) for i in range(0, len(data), chunk))
     else:
         # CSV ou autre
         try:
-            return pd.read_csv(path)
+            reader = pd.read_csv(path, chunksize=chunk)
         except Exception as e:
             raise SystemExit(f"Impossible de lire {path}: {e}")
+    for df in reader:
+        yield _normalize(df)
+
 
-    # normaliser JSON (list/dict)
-    if isinstance(data, dict):
-        data = data.get("trades") or data.get("data") or data.get("items") or data.get("results") or list(data.values())[0]
-    if not isinstance(data, list):
-        raise SystemExit("Format JSON inattendu pour les trades.")
-
-    rows = []
-    for r in data:
-        if not isinstance(r, dict):
-            continue
-        ts = r.get("timestamp") or r.get("time") or r.get("ts") or r.get("created_at")
-        side = (r.get("side") or r.get("type") or "").lower()
-        qty = r.get("qty") or r.get("amount") or r.get("size") or r.get("quantity")
-        price = r.get("price") or r.get("avg_price") or r.get("fill_price")
-        fee = r.get("fee") or r.get("fees") or 0.0
-        rows.append({"time": ts, "side": side, "qty": qty, "price": price, "fee": fee})
-    df = pd.DataFrame(rows)
-    # nettoyage minimal
-    df = df.dropna(subset=["side", "qty", "price"])
-    df["qty"] = pd.to_numeric(df["qty"], errors="coerce")
-    df["price"] = pd.to_numeric(df["price"], errors="coerce")
-    df["fee"] = pd.to_numeric(df["fee"], errors="coerce").fillna(0.0)
-    df = df[df["qty"] > 0]
-    df = df[df["price"] > 0]
-    df["time"] = pd.to_datetime(df["time"], errors="coerce")
-    df = df.sort_values("time")
+def load_trade_arrays(path: str, chunk: int = 250_000) -> Dict[str, np.ndarray]:
+    """Trades triés par temps (tri stable: l'ordre du fichier départage) sous forme de tableaux."""
+    parts = list(iter_trade_chunks(path, chunk))
+    a = np.concatenate(parts) if parts else np.zeros((0, 5))
+    a = a[np.argsort(a[:, 0], kind="stable")]
+    return {k: np.ascontiguousarray(a[:, i]) for i, k in enumerate(COLS)}
+
+
+def _load_trades(path: str) -> pd.DataFrame:
+    t = load_trade_arrays(path)
+    df = pd.DataFrame({
+        "time": pd.to_datetime(t["time"], unit="s", errors="coerce"),
+        "side": np.where(t["side"] > 0, "buy", "sell"),
+        "qty": t["qty"],
+        "price": t["price"],
+        "fee": t["fee"],
+    })
     return df
 
 
-def fifo_metrics(trades: pd.DataFrame, mark: float = None) -> Dict[str, float]:
-    buys = []
-    realized = 0.0
-    pos_qty = 0.0
-    for _, tr in trades.iterrows():
-        side, qty, price = tr["side"], tr["qty"], tr["price"]
-        if side == "buy":
-            buys.append([qty, price])
-            pos_qty += qty
-        elif side == "sell":
-            remaining = qty
-            while remaining > 1e-12 and buys:
-                lot_qty, lot_price = buys[0]
-                take = min(remaining, lot_qty)
-                realized += (price - lot_price) * take
-                lot_qty -= take
-                remaining -= take
-                if lot_qty <= 1e-12:
-                    buys.pop(0)
-                else:
-                    buys[0][0] = lot_qty
-            pos_qty -= qty
-    # vwap
-    numer = sum(q*p for q, p in buys)
-    denom = sum(q for q, _ in buys)
-    vwap = numer / denom if denom else 0.0
+def _arrays(trades) -> Dict[str, np.ndarray]:
+    if isinstance(trades, dict):
+        return trades
+    side = trades["side"].astype(str).str.lower().to_numpy()
+    t = trades["time"]
+    ts = (pd.to_datetime(t) - pd.Timestamp(0)).dt.total_seconds().to_numpy(dtype=np.float64) \
+        if not np.issubdtype(t.dtype, np.number) else t.to_numpy(dtype=np.float64)
+    return {
+        "time": ts,
+        "side": np.where(side == "buy", 1.0, np.where(side == "sell", -1.0, 0.0)),
+        "qty": trades["qty"].to_numpy(dtype=np.float64),
+        "price": trades["price"].to_numpy(dtype=np.float64),
+        "fee": trades["fee"].to_numpy(dtype=np.float64) if "fee" in trades else np.zeros(len(trades)),
+    }
+
+
+def fifo_arrays(t: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    FIFO vectorisé. Par trade: ``matched`` (qté appariée, ventes), ``realized_gross`` (prix seuls),
+    ``realized`` (net des frais d'achat alloués et des frais de vente); plus l'état final du stock.
+    """
+    side, qty, price, fee = t["side"], t["qty"], t["price"], t["fee"]
+    buy = side > 0
+    qb = np.where(buy, qty, 0.0)
+    qs = np.where(buy, 0.0, qty)
+    B = np.cumsum(qb)  # achats cumulés au trade k
+    Q = np.cumsum(qs)  # ventes cumulées
+    c = Q + np.minimum(np.minimum.accumulate(B - Q), 0.0)  # quantité d'achats consommée
+    c_prev = np.concatenate([[0.0], c[:-1]])
+    matched = np.where(buy, 0.0, c - c_prev)
+
+    # courbe cumulée des achats (quantité -> notionnel, frais), linéaire par lot
+    bq, bp, bf = qty[buy], price[buy], fee[buy]
+    CB = np.concatenate([[0.0], np.cumsum(bq)])
+    CP = np.concatenate([[0.0], np.cumsum(bq * bp)])
+    CF = np.concatenate([[0.0], np.cumsum(bf)])
+
+    def cost(x):
+        i = np.clip(np.searchsorted(CB, x, side="right") - 1, 0, max(bq.size - 1, 0))
+        if not bq.size:
+            return np.zeros_like(x), np.zeros_like(x)
+        part = np.clip(x - CB[i], 0.0, bq[i])
+        return CP[i] + part * bp[i], CF[i] + part * (bf[i] / bq[i])
+
+    (p1, f1), (p0, f0) = cost(c), cost(c_prev)
+    sell = ~buy
+    realized_gross = np.where(sell, price * matched - (p1 - p0), 0.0)
+    realized = np.where(sell, realized_gross - (f1 - f0) - fee, 0.0)
+    c_end = float(c[-1]) if c.size else 0.0
+    pe, fe = cost(np.array([c_end]))
+    open_qty = float(CB[-1] - c_end)
+    open_cost = float(CP[-1] - pe[0])
+    return {
+        "matched": matched,
+        "realized_gross": realized_gross,
+        "realized": realized,
+        "open_qty": open_qty,
+        "open_cost": open_cost,
+        "open_fees": float(CF[-1] - fe[0]),
+        "pos_qty": float(B[-1] - Q[-1]) if B.size else 0.0,
+    }
+
+
+def fifo_metrics(trades, mark: float = None) -> Dict[str, float]:
+    t = _arrays(trades)
+    f = fifo_arrays(t)
+    denom = f["open_qty"] if f["open_qty"] > 1e-12 else 0.0
+    vwap = f["open_cost"] / denom if denom else 0.0
     unrealized = (mark - vwap) * denom if (mark and denom) else 0.0
-    return {"realized": realized, "unrealized": unrealized, "pos_qty": pos_qty, "vwap": vwap}
+    return {
+        "realized": float(f["realized"].sum()),
+        "realized_gross": float(f["realized_gross"].sum()),
+        "fees": float(np.sum(t["fee"])),
+        "unrealized": unrealized,
+        "pos_qty": f["pos_qty"],
+        "vwap": vwap,
+    }
 
 
-def equity_curve_from_trades(trades: pd.DataFrame, start_cash: float = 10_000.0) -> pd.DataFrame:
+def load_prices(path: str, price_col: str = "close", chunk: int = 500_000,
+                bar_s: Optional[float] = None) -> Dict[str, np.ndarray]:
     """
-    Reconstruit une equity curve naïve en supposant qu'on part avec start_cash USDT.
+    CSV de bougies (close_time/time/timestamp/ts ou open_time/minute/t + ``price_col``) -> (t, close)
+    triés, datés à la clôture: une heure d'ouverture est décalée de ``bar_s`` (défaut: pas médian),
+    sinon l'equity serait marquée au close de la bougie une bougie trop tôt.
     """
-    cash = start_cash
-    inventory = 0.0
-    equity = []
-    for _, tr in trades.iterrows():
-        side, qty, price = tr["side"], tr["qty"], tr["price"]
-        if side == "buy":
-            cost = qty * price
-            cash -= cost
-            inventory += qty
-        else:
-            revenue = qty * price
-            cash += revenue
-            inventory -= qty
-        equity.append({"time": tr["time"], "equity": cash + inventory * price})
-    df = pd.DataFrame(equity).set_index("time")
-    df = df.asfreq("H").ffill()  # lisser à l'heure pour un graphe propre
+    ts, px, opened = [], [], []
+    for df in pd.read_csv(path, chunksize=chunk):
+        tcol = _pick(df, ("close_time",) + TIME_KEYS)
+        ocol = _pick(df, OPEN_TIME_KEYS)
+        if (tcol is None and ocol is None) or price_col not in df.columns:
+            raise SystemExit(f"{path}: colonnes time / {price_col} introuvables")
+        t = _to_epoch(tcol) if tcol is not None else np.full(len(df), np.nan)
+        is_open = ~np.isfinite(t) & (ocol is not None)
+        if ocol is not None:
+            t = np.where(is_open, _to_epoch(ocol), t)
+        ts.append(t)
+        opened.append(is_open)
+        px.append(pd.to_numeric(df[price_col], errors="coerce").to_numpy(dtype=np.float64))
+    if ts:
+        t, p, o = np.concatenate(ts), np.concatenate(px), np.concatenate(opened)
+    else:
+        t, p, o = np.zeros(0), np.zeros(0), np.zeros(0, dtype=bool)
+    if o.any():
+        if bar_s is None:
+            d = np.diff(np.unique(t[o & np.isfinite(t)]))
+            bar_s = float(np.median(d)) if d.size else 60.0
+        t = np.where(o, t + bar_s, t)
+    ok = np.isfinite(t) & (p > 0)
+    order = np.argsort(t[ok], kind="stable")
+    return {"time": t[ok][order], "close": p[ok][order]}
+
+
+def equity_curve_from_trades(trades, start_cash: float = 10_000.0,
+                             prices: Optional[Dict[str, np.ndarray]] = None,
+                             freq: str = "1h") -> pd.DataFrame:
+    """
+    Equity = cash (frais déduits) + stock x prix, en cumuls vectorisés. Avec ``prices``: marquée à
+    chaque bougie (état des trades <= bougie); sinon au prix de chaque trade, dernière valeur par ``freq``.
+    """
+    t = _arrays(trades)
+    side, qty, price = t["side"], t["qty"], t["price"]
+    cash = start_cash - np.cumsum(side * qty * price + t["fee"])
+    inv = np.cumsum(side * qty)
+    if prices is not None and prices["time"].size:
+        pt, close = prices["time"], prices["close"]
+        # bougies à partir du 1er trade; i = dernier trade <= bougie
+        pt_ok = pt >= t["time"][0]
+        pt, close = pt[pt_ok], close[pt_ok]
+        i = np.searchsorted(t["time"], pt, side="right") - 1
+        eq = cash[i] + inv[i] * close
+        df = pd.DataFrame({"time": pd.to_datetime(pt, unit="s"), "equity": eq,
+                           "cash": cash[i], "inventory": inv[i], "mark": close}).set_index("time")
+    else:
+        df = pd.DataFrame({"time": pd.to_datetime(t["time"], unit="s"),
+                           "equity": cash + inv * price}).set_index("time")
+        df = df.resample(freq).last().ffill()  # lisser à l'heure pour un graphe propre
     df["ret"] = df["equity"].pct_change().fillna(0.0)
     # drawdown
     roll_max = df["equity"].cummax()
@@ -123,36 +272,47 @@ def equity_curve_from_trades(trades: pd.DataFrame, start_cash: float = 10_000.0)
 
 
 def main():
-    import argparse
     p = argparse.ArgumentParser()
-    p.add_argument("--trades", required=True, help="Fichier JSON/CSV des trades")
+    p.add_argument("--trades", required=True, help="Fichier JSON/JSON lines/CSV des trades")
     p.add_argument("--mark", type=float, default=None, help="Prix spot pour calculer l'unrealized")
     p.add_argument("--start-cash", type=float, default=10_000.0, help="Capital initial pour equity curve reconstruite")
+    p.add_argument("--prices", default=None, help="CSV de bougies pour marquer l'equity au marché")
+    p.add_argument("--price-col", default="close", help="colonne de prix du CSV --prices")
+    p.add_argument("--chunk", type=int, default=250_000, help="lignes lues par bloc")
+    p.add_argument("--no-plot", action="store_true", help="pas de graphiques (matplotlib non importé)")
     args = p.parse_args()
 
-    trades = _load_trades(args.trades)
-    if trades.empty:
+    t = load_trade_arrays(args.trades, args.chunk)
+    if not t["time"].size:
         raise SystemExit("Pas de trades valides.")
+    prices = load_prices(args.prices, args.price_col) if args.prices else None
+    mark = args.mark if args.mark is not None else (float(prices["close"][-1]) if prices and prices["close"].size else None)
 
     # FIFO metrics
-    m = fifo_metrics(trades, mark=args.mark)
-    print(f"Realized PnL: {m['realized']:.2f}")
+    m = fifo_metrics(t, mark=mark)
+    print(f"Realized PnL: {m['realized']:.2f} (avant frais {m['realized_gross']:.2f}, frais {m['fees']:.2f})")
     print(f"Unrealized PnL: {m['unrealized']:.2f}")
     print(f"Position qty: {m['pos_qty']:.6f} @ vwap {m['vwap']:.2f}")
 
     # Equity curve
-    curve = equity_curve_from_trades(trades, start_cash=args.start_cash)
+    curve = equity_curve_from_trades(t, start_cash=args.start_cash, prices=prices)
     curve.to_csv("equity_curve.csv")
     print("Equity curve -> equity_curve.csv")
 
-    # KPI
-    sharpe = (curve["ret"].mean() / (curve["ret"].std() + 1e-12)) * (365**0.5 * 24**0.5)
+    # KPI (annualisation selon le pas de la courbe)
+    step = curve.index.to_series().diff().median()
+    per_year = (365 * 86400.0 / step.total_seconds()) if pd.notna(step) and step.total_seconds() > 0 else 365 * 24
+    sharpe = (curve["ret"].mean() / (curve["ret"].std() + 1e-12)) * (per_year ** 0.5)
     max_dd = curve["drawdown"].min()
     print(f"Sharpe (approx): {sharpe:.2f} | Max Drawdown: {max_dd:.2%}")
 
+    if args.no_plot:
+        return
+    import matplotlib.pyplot as plt
+
     # Graphiques
     plt.figure()
-    curve["equity"].plot(title="Equity (reconstruite depuis les trades)")
+    curve["equity"].plot(title="Equity (reconstruite depuis les trades)" if prices is None else "Equity (marquée au marché)")
     plt.xlabel("Time"); plt.ylabel("Equity")
     plt.savefig("equity_curve.png", bbox_inches="tight")
     print("Graphique equity -> equity_curve.png")
@@ -1,6 +1,6 @@
 # --- Consolidated imports (auto-generated) ---
 from __future__ import annotations
-import os, time, json, sqlite3, math, random, threading, re
+import os, time, json, sqlite3, math, random, threading, re, functools
 import statistics as _stats
 from datetime import datetime, timezone
 from collections import deque, defaultdict
@@ -20,6 +20,29 @@ from flask import Flask, Response, abort, jsonify, render_template, request, sen
 from common.logging import setup_logging
 from common.validators import validate_symbol, validate_qty
 from common.config import START_TIME, APP_VERSION, GIT_SHA
+from common.budget import TickBudget
+from common.triggers import TriggerIndex
+from common.params import ParamSnapshot, compile_params
+from common.leader import LeaderLease
+from common.shm_state import SharedState
+from common.kvcheckpoint import KVCheckpoint
+import engine_client
+import ml_sgd
+import ml_multiclass
+import calibration
+import model_monitor
+import feature_store
+import labeler
+import bandit
+import bandit_eval
+import gridsearch
+import walkforward
+import montecarlo
+import exit_sim
+import training_jobs
+from training_pool import TrainingPool
+from jobs import JobQueue
+from model_registry import REGISTRY as MODEL_REGISTRY
 import requests
 from common.http import HTTP as _HTTP
 from dotenv import load_dotenv
@@ -40,7 +63,7 @@ from datetime import datetime, timezone, date
 from dotenv import load_dotenv
 from flask import Flask, jsonify, render_template, request, abort
 from sentiment_sources import get_sentiment_features, ingest_twitter_texts
-from tri_patch import apply_trade_patch, train_mc_once
+from tri_patch import apply_trade_patch
 from typing import Any, Dict, List, Optional, Iterable, Union
 import json, math
 import logging
@@ -51,7 +74,6 @@ from sentiment_sources import ingest_twitter_texts
 import os
 import numpy as _np
 import json
-import itertools
 import traceback
 try:
     import ccxt
@@ -127,6 +149,16 @@ REQUEST_COUNT = Counter(
 )
 ERROR_COUNT = Counter("app_errors_total", "Total application errors", ["type"])
 TRADES_TOTAL = Counter("trades_total", "Total trades recorded", ["side"])
+ENGINE_DEGRADED_TOTAL = Counter(
+    "engine_degraded_total",
+    "Engine stages served from cache because the tick budget was spent",
+    ["stage"],
+)
+ENGINE_TICK_SECONDS = Histogram(
+    "engine_tick_duration_seconds",
+    "Duration of one decide_and_maybe_trade tick (seconds)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20),
+)
 
 # --- _validate_common CORRIGÉ ---
 # [MOVED IMPORT] from flask import request, jsonify
@@ -301,7 +333,7 @@ _BG_STARTED = False
 
 def _start_autotrader_once():
     global _AUTOTRADER
-    if _AUTOTRADER is not None:
+    if _AUTOTRADER is not None or not _is_leader():
         return
     if str(os.getenv("AUTO_TRADE_ENABLED", "0")).lower() in ("1", "true", "yes", "on"):
         symbols = SYMBOLS_DEFAULT
@@ -312,12 +344,191 @@ def _start_autotrader_once():
         LOG_BUFFER.append("[AUTOTRADE] disabled by env (AUTO_TRADE_ENABLED=0)")
 
 
+# --- élection du leader: un seul worker gunicorn fait tourner les boucles de trading ---
+_LEADER: Optional[LeaderLease] = None
+
+
+# all = web + moteur dans chaque worker (historique); web = HTTP seul; engine = engine.py;
+# backtest = backtest.py (moteur piloté par l'horloge simulée, aucune boucle de fond)
+APP_ROLE = engine_client.app_role()
+
+
+def _data_dir() -> str:
+    return engine_client.data_dir()
+
+
+def _leader_lease() -> LeaderLease:
+    global _LEADER
+    if _LEADER is None:
+        _LEADER = LeaderLease(
+            env_str("LEADER_LOCK_PATH") or os.path.join(_data_dir(), "leader.lock"),
+            heartbeat_s=float(env_str("LEADER_HEARTBEAT_S") or 5.0),
+            on_acquire=_start_leader_loops,
+            logger=logging.getLogger("leader"),
+        )
+    return _LEADER
+
+
+def _is_leader() -> bool:
+    """LEADER_ELECTION=0 -> chaque process se comporte comme avant (toujours leader)."""
+    if APP_ROLE == "web":
+        return False
+    if APP_ROLE == "backtest" or not env_bool("LEADER_ELECTION", True):
+        return True
+    return _LEADER is not None and _LEADER.is_leader
+
+
+_LEADER_LOOPS_STARTED = False
+_LEADER_LOOPS_LOCK = threading.Lock()
+
+
+def _start_leader_loops():
+    """
+    Boucles réservées au leader; seul point d'entrée, appelé par le bail (``on_acquire``) à
+    l'acquisition comme au failover, ou directement sans élection. Une seule fois par process.
+    """
+    global _LEADER_LOOPS_STARTED
+    with _LEADER_LOOPS_LOCK:
+        if _LEADER_LOOPS_STARTED:
+            return
+        _start_leader_loops_locked()
+        _LEADER_LOOPS_STARTED = True
+
+
+def _start_leader_loops_locked():
+    _start_autotrader_once()
+    _start_rss_once()
+    _start_ingestors_once()
+    _start_feature_store_once()
+    if os.getenv("ENGINE_AUTOSTART", "1") == "1":
+        _start_engine_once()
+    mc_every = float(env_str("MC_TRAIN_INTERVAL_S") or 600)
+    if _start_training_once() is None and mc_every > 0:
+        ml_multiclass.start_background_trainer(
+            _q, kv_get, kv_set, interval_s=mc_every, logger=app.logger, asof=_train_asof()
+        )
+    LOG_BUFFER.append(f"[leader] loops started (pid={os.getpid()})")
+
+
+# --- état partagé entre workers: le leader publie, les followers lisent sans verrou ---
+_SHM_WRITER: Optional[SharedState] = None
+_SHM_READER: Optional[SharedState] = None
+
+
+def _shm_enabled() -> bool:
+    # sans élection chaque process serait écrivain: le seqlock exige un writer unique
+    if APP_ROLE == "backtest" or not env_bool("SHM_STATE", True):
+        return False
+    return APP_ROLE != "all" or env_bool("LEADER_ELECTION", True)
+
+
+def _shm_path() -> str:
+    return engine_client.shm_path()
+
+
+def _publish_shared_state():
+    """Leader: recopie prix/bid/ask/p_up/ev/position/cash dans le segment partagé."""
+    global _SHM_WRITER
+    if not _shm_enabled() or not _is_leader():
+        return
+    try:
+        if _SHM_WRITER is None:
+            _SHM_WRITER = SharedState(_shm_path(), writer=True)
+        tc = TICKER_CACHE or {}
+        _SHM_WRITER.write(
+            price=STATE.get("price"),
+            price_prev=STATE.get("price_prev"),
+            bid=tc.get("bid"),
+            ask=tc.get("ask"),
+            p_up=STATE.get("p_up"),
+            ev=STATE.get("ev"),
+            position_qty=STATE.get("position_qty"),
+            cash=STATE.get("cash"),
+            in_position=1.0 if STATE.get("in_position") else 0.0,
+        )
+    except Exception:
+        pass
+
+
+def _read_shared_state() -> Optional[Dict[str, float]]:
+    global _SHM_READER
+    if not _shm_enabled():
+        return None
+    try:
+        if _SHM_READER is None:
+            _SHM_READER = SharedState(_shm_path())
+        return _SHM_READER.read()
+    except Exception:
+        return None
+
+
+def _adopt_shared_state(max_age_s: float) -> bool:
+    """Follower: applique le segment du leader à STATE/TICKER_CACHE; False si absent ou périmé."""
+    global LAST_TICK_TS
+    sh = _read_shared_state()
+    if not sh or sh["price"] <= 0.0 or time.time() - sh["ts"] > max_age_s:
+        return False
+    STATE["price_prev"] = sh["price_prev"] or sh["price"]
+    STATE["price"] = sh["price"]
+    STATE["price_chg"] = sh["price"] - STATE["price_prev"]
+    STATE["p_up"] = sh["p_up"]
+    STATE["ev"] = sh["ev"]
+    STATE["position_qty"] = sh["position_qty"]
+    STATE["cash"] = sh["cash"]
+    STATE["in_position"] = sh["in_position"] > 0.5
+    try:
+        with TICKER_LOCK:
+            TICKER_CACHE.update(
+                {
+                    "bid": sh["bid"] or None,
+                    "ask": sh["ask"] or None,
+                    "last": sh["price"],
+                    "ts": sh["ts"],
+                    "source": "shm",
+                }
+            )
+    except Exception:
+        pass
+    LAST_TICK_TS = sh["ts"]
+    return True
+
+
+def _engine_forward(view: str):
+    """APP_ROLE=web: rejoue la requête courante dans engine.py (voir engine.FORWARDABLE_VIEWS)."""
+    out = engine_client.command(
+        "view",
+        timeout=30.0,
+        name=view,
+        method=request.method,
+        path=request.path,
+        query=request.query_string.decode(),
+        json=request.get_json(silent=True),
+    )
+    if not out.get("ok"):
+        return jsonify({"ok": False, "error": out.get("error") or "engine error"}), 503
+    res = out.get("result") or {}
+    return jsonify(res.get("json")), int(res.get("status") or 200)
+
+
 def start_background_loops_once():
     global _BG_STARTED
     with _start_lock:
-        if _BG_STARTED:
+        if _BG_STARTED or __name__ == "__mp_main__":
+            # __mp_main__: app.py ré-importé par un worker du pool d'entraînement
+            return
+        if APP_ROLE == "web":
+            # les boucles tournent dans engine.py; ce worker ne fait que servir HTTP
+            _BG_STARTED = True
+            LOG_BUFFER.append("[bg] APP_ROLE=web -> loops run in the engine process")
             return
-        _start_autotrader_once()
+        if APP_ROLE == "backtest":
+            _BG_STARTED = True
+            return
+        if env_bool("LEADER_ELECTION", True):
+            # le bail démarre les boucles via on_acquire, tout de suite ou au failover (follower)
+            _leader_lease().start()
+        else:
+            _start_leader_loops()
         _BG_STARTED = True
 
 
@@ -328,21 +539,6 @@ try:
 except Exception as e:
     LOG_BUFFER.append(f"[db-init-error] {e}")
 
-# Auto-start du thread à l'import du module (idempotent)
-if str(os.getenv("AUTO_TRADE_ENABLED", "1")).strip().lower() in (
-    "1",
-    "true",
-    "yes",
-    "on",
-):
-    try:
-        start_background_loops_once()
-        LOG_BUFFER.append("[bg] start_background_loops_once() called at import")
-    except Exception as e:
-        LOG_BUFFER.append(f"[bg-start-at-import-error] {e}")
-else:
-    LOG_BUFFER.append("[bg] AUTO_TRADE_ENABLED=0 -> autostart skipped")
-
 
 # --- utils numériques sûrs (à mettre en haut du fichier, près des helpers)
 def _sane_float(x, default=0.0):
@@ -388,7 +584,13 @@ def api_health():
     Exemples:
     - curl -X GET "http://localhost:5000/api/health"
     """
-    return jsonify({"ok": True, "ts": int(time.time() * 1000)})
+    return jsonify(
+        {
+            "ok": True,
+            "ts": int(time.time() * 1000),
+            "leader": _leader_lease().info() if env_bool("LEADER_ELECTION", True) else None,
+        }
+    )
 
 @app.route("/api/admin/refresh_news", methods=["POST"])
 def api_admin_refresh_news():
@@ -821,6 +1023,8 @@ def api_admin_start_autotrader():
     Exemples:
     - curl -X POST "http://localhost:5000/api/admin/start_autotrader" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_admin_start_autotrader")
     try:
         start_background_loops_once()
         ok = _AUTOTRADER is not None
@@ -1060,9 +1264,15 @@ def _rss_loop():
             logger.exception("RSS loop error")
         time.sleep(max(60, RSS_TTL))  # garde un plancher 60s
 
-# Dans ton bootstrap (après création de app et avant de lancer autotrade)
-if ENABLE_RSS and RSS_FEEDS:
-    threading.Thread(target=_rss_loop, daemon=True).start()
+_RSS_THREAD = None
+
+
+def _start_rss_once():
+    global _RSS_THREAD
+    if _RSS_THREAD is not None or not (ENABLE_RSS and RSS_FEEDS) or not _is_leader():
+        return
+    _RSS_THREAD = threading.Thread(target=_rss_loop, name="rss", daemon=True)
+    _RSS_THREAD.start()
 
 
 
@@ -2003,6 +2213,8 @@ def api_sgd_status():
                 "win_rate": win_rate,
                 "avg_pnl_pct": avg_pnl,
                 "proba": proba,
+                # modèles actifs en mémoire: version + heure de chargement
+                "models": MODEL_REGISTRY.info(),
             }
         )
     except Exception as e:
@@ -2018,20 +2230,23 @@ def api_ml_eval_simple():
     
     Exemples:
     - curl -X GET "http://localhost:5000/api/ml/eval_simple"
+    - curl -X GET "http://localhost:5000/api/ml/eval_simple?window=200"
     """
-    # version HTTP de ta fonction d’éval simple (win_rate, avg_pnl)
+    # éval simple lue dans le monitor (win_rate = tp / (tp + sl) sur les derniers labels)
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT pnl_pct FROM trades WHERE pnl_pct IS NOT NULL")
-        vals = [float(r[0]) for r in c.fetchall() if r and r[0] is not None]
-        n = len(vals)
-        if not n:
-            return jsonify({"ok": True, "n": 0, "win_rate": None, "avg_pnl_pct": None})
-        win_rate = sum(1 for v in vals if v > 0.0) / n
-        avg_pnl = sum(vals) / n
+        mon = model_monitor_get()
+        w = int((request.args or {}).get("window", 500))
+        m = mon.window(w)
         return jsonify(
-            {"ok": True, "n": n, "win_rate": win_rate, "avg_pnl_pct": avg_pnl}
+            {
+                "ok": True,
+                "window": w,
+                "n": m["n_labeled"],
+                "win_rate": m["hit_rate"],
+                "brier": m["brier"],
+                "logloss": m["logloss"],
+                "model": mon.summary()["windows"],
+            }
         )
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -2069,6 +2284,8 @@ def http_ml_learn_online():
     Exemples:
     - curl -X POST "http://localhost:5000/api/ml/learn_online" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("http_ml_learn_online")
     return api_learn_online()
 
 
@@ -2165,6 +2382,8 @@ def api_admin_flatten():
     Exemples:
     - curl -X POST "http://localhost:5000/api/admin/flatten" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_admin_flatten")
     # reconstruit les positions à partir des trades
     conn = get_db()
     c = conn.cursor()
@@ -2827,6 +3046,8 @@ def api_force_buy():
     Exemples:
     - curl -X POST "http://localhost:5000/api/force/buy" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_force_buy")
     data = request.get_json(silent=True) or {}
     sym = _symbol_norm(request.args.get("symbol") or data.get("symbol") or "BTCUSDT")
     usdt = (
@@ -2903,6 +3124,8 @@ def api_force_sell():
     Exemples:
     - curl -X POST "http://localhost:5000/api/force/sell" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_force_sell")
     data = request.get_json(silent=True) or {}
     sym = _symbol_norm(request.args.get("symbol") or data.get("symbol") or "BTCUSDT")
 
@@ -3025,6 +3248,8 @@ def api_force_sell_all():
     Exemples:
     - curl -X POST "http://localhost:5000/api/force/sell_all" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_force_sell_all")
     js = request.get_json(force=True, silent=True) or {}
     js["sell_all"] = True
     request._cached_json = (js, js)  # pour que l'autre handler le relise
@@ -3632,6 +3857,8 @@ def api_autotrade_pause():
     Exemples:
     - curl -X POST "http://localhost:5000/api/autotrade/pause" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_autotrade_pause")
     kv_set("AUTO_TRADE_PAUSED", "1")
     _AUTOTRADE_STATE["paused"] = True
     _AUTOTRADE_STATE["status"] = "paused"
@@ -3649,6 +3876,8 @@ def api_autotrade_resume():
     Exemples:
     - curl -X POST "http://localhost:5000/api/autotrade/resume" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_autotrade_resume")
     kv_set("AUTO_TRADE_PAUSED", "0")
     _AUTOTRADE_STATE["paused"] = False
     _AUTOTRADE_STATE["status"] = "running"
@@ -3666,6 +3895,8 @@ def api_autotrade_toggle():
     Exemples:
     - curl -X POST "http://localhost:5000/api/autotrade_toggle" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_autotrade_toggle")
     paused = kv_get_bool("AUTO_TRADE_PAUSED", True)
     if paused:
         kv_set("AUTO_TRADE_PAUSED", "0")
@@ -3723,6 +3954,8 @@ def api_admin_reset_paper():
     Exemples:
     - curl -X POST "http://localhost:5000/api/admin/reset_paper" -H "Content-Type: application/json" -d '{}'
     """
+    if APP_ROLE == "web":
+        return _engine_forward("api_admin_reset_paper")
     js = request.get_json(force=True, silent=True) or {}
     cash = float(js.get("cash") or 0)
     wipe_news = bool(js.get("wipe_news", False))
@@ -3930,10 +4163,11 @@ class AutoTrader(threading.Thread):
             except Exception:
                 min_notional = 5.0
 
-            base_usdt = float(env_str("BUY_USDT_PER_TRADE") or 0.0)
-            frac = float(env_str("BUY_FRACTION_NET") or 0.03)
-            floor_usd = float(env_str("BUY_MIN_USDT") or 6.0)
-            buf = float(env_str("NOTIONAL_BUFFER") or 1.3)
+            P = _params_snapshot()
+            base_usdt = P.buy_usdt_per_trade
+            frac = P.buy_fraction_net
+            floor_usd = P.buy_min_usdt
+            buf = P.notional_buffer
 
             net = float(_AUTOTRADE_STATE.get("last_net_usdt") or 0.0)
             if not net:
@@ -3957,7 +4191,7 @@ class AutoTrader(threading.Thread):
             except Exception:
                 amount_digits, min_amount = None, 0.0
 
-            step_env = float(env_str("QTY_STEP") or 0.0)
+            step_env = P.qty_step
             step = (
                 (10.0 ** -(amount_digits or 0))
                 if (amount_digits is not None and amount_digits >= 0)
@@ -4009,14 +4243,15 @@ class AutoTrader(threading.Thread):
             except Exception:
                 amount_digits, min_notional, min_amount = None, 0.0, 0.0
 
-            step_env = float(env_str("QTY_STEP") or 0.0)
+            P = _params_snapshot()
+            step_env = P.qty_step
             step = (
                 (10.0 ** -(amount_digits or 0))
                 if (amount_digits is not None and amount_digits >= 0)
                 else (step_env if step_env > 0 else 1e-6)
             )
 
-            min_qty_env = float(env_str("MIN_BASE_QTY") or 0.0)
+            min_qty_env = P.min_base_qty
             min_qty = max(float(min_amount or 0.0), float(min_qty_env or 0.0))
 
             qty_rounded = step * math.floor(held / step)
@@ -4494,26 +4729,181 @@ if EXECUTION_MODE == "ccxt" and ccxt is not None:
     except Exception as e:
         LOG_BUFFER.append(f"[ERR] ccxt init: {e}")
 
-# Lance l'autotrader (démarre en pause si AUTO_TRADE_PAUSED=1)
-start_background_loops_once()
+# --- feature store 1m (feature_store.py): matérialisé par le leader, lu partout ---
+FEATURE_STORE_SYMBOLS = [
+    _symbol_norm(x)
+    for x in (env_str("FEATURE_STORE_SYMBOLS") or SYMBOLS_DEFAULT[0]).split(",")
+    if x.strip()
+]
+_FEATURE_MAT: Optional[feature_store.Materializer] = None
+_FS_LIVE = {"key": None, "row": None}
+
+
+def _start_feature_store_once():
+    global _FEATURE_MAT
+    if _FEATURE_MAT is not None or not _is_leader() or not env_bool("FEATURE_STORE", True):
+        return
+    _FEATURE_MAT = feature_store.Materializer(
+        get_db,
+        lambda sym, limit: http_klines(sym, "1m", limit, ttl=0),
+        FEATURE_STORE_SYMBOLS,
+        interval_s=float(env_str("FEATURE_STORE_INTERVAL_S") or 60),
+        logger=app.logger,
+    )
+    _FEATURE_MAT.start()
+
+
+def feature_store_live(symbol: str, now: Optional[float] = None,
+                       cached_only: bool = False) -> Optional[dict]:
+    """
+    Features visibles maintenant (point-in-time), une requête par minute au plus;
+    ``cached_only``: sans I/O (budget du tick épuisé), None si la minute n'est pas en cache.
+    """
+    now = time.time() if now is None else float(now)
+    key = (_symbol_norm(symbol), int(now // 60))
+    if _FS_LIVE["key"] == key:
+        return _FS_LIVE["row"]
+    if cached_only:
+        return None
+    conn = get_db()
+    try:
+        row = feature_store.asof(conn, key[0], now, max_age_s=180)
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    _FS_LIVE["key"], _FS_LIVE["row"] = key, row
+    return row
+
+
+def _train_symbol() -> str:
+    """Symbole des exemples d'entraînement (FEATURE_STORE_TRAIN_SYMBOL, défaut: 1er du store)."""
+    return _symbol_norm(env_str("FEATURE_STORE_TRAIN_SYMBOL") or FEATURE_STORE_SYMBOLS[0])
+
+
+def features_asof(ts, features, symbol: Optional[str] = None):
+    """asof(ts, features) -> (X, has) pour les trainers; ``symbol`` défaut: _train_symbol()."""
+    conn = get_db()
+    try:
+        return feature_store.asof_matrix(conn, _symbol_norm(symbol or _train_symbol()), ts, features)
+    finally:
+        conn.close()
+
+
+def _train_asof():
+    if not env_bool("FEATURE_STORE_TRAIN", True):
+        return None
+    sym = _train_symbol()
+    return lambda ts, features: features_asof(ts, features, sym)
+
+
+# --- pool d'entraînement (training_pool.py): labeling / fits hors du thread moteur ---
+_TRAINING: Optional[TrainingPool] = None
+
+
+def _training_pool() -> Optional[TrainingPool]:
+    return _TRAINING
+
+
+def _publish_sgd(res):
+    """Modèle binaire écrit par le worker -> registre (sans attendre le refresh)."""
+    if not (res or {}).get("trained"):
+        return
+    conn = get_db()
+    try:
+        m = ml_sgd.load_model(conn)
+    finally:
+        conn.close()
+    if m is not None:
+        MODEL_REGISTRY.publish(ml_sgd.MODEL_KEY, m, float(m.trained_at), source="pool")
+
+
+def _publish_mc(res):
+    if (res or {}).get("status") == "ok":
+        MODEL_REGISTRY.invalidate(ml_multiclass.MODEL_KEY)
+        MODEL_REGISTRY.ensure(ml_multiclass.MODEL_KEY, ml_multiclass._mc_loader(kv_get))
+
+
+def _apply_platt(res):
+    """Fit du job calibrate -> _PARAMS seulement si CALIB_AUTO_APPLY (sinon calibrate_platt à la demande)."""
+    res = res or {}
+    fit = res.get("platt") or {}
+    if not _params_snapshot().calib_auto_apply:
+        return
+    if res.get("ok") and int(fit.get("n") or 0) >= 50:
+        _PARAMS["A0_BIAS"] = fit["A0_BIAS"]
+        _PARAMS["SIGMOID_SCALE"] = fit["SIGMOID_SCALE"]
+        params_changed()
+
+
+def _training_jobs() -> dict:
+    """nom -> (intervalle s, fabrique du job); priorités: label < sgd < mc < calibrate."""
+    asof_sym = _train_symbol() if _train_asof() is not None else None
+    job = TrainingPool.job
+    return {
+        "label": (
+            float(env_str("LABEL_INTERVAL_S") or 90),
+            lambda: job("label", training_jobs.label, DB_PATH, 5, MONITOR_FEATURES,
+                        priority=0, on_done=_apply_labels),
+        ),
+        "sgd": (
+            float(env_str("SGD_TRAIN_INTERVAL_S") or 180),
+            lambda: job("sgd", training_jobs.train_sgd, DB_PATH, SGD_FEATURES, 1200, 0.05, 1e-4,
+                        asof_sym, priority=1, on_done=_publish_sgd),
+        ),
+        "mc": (
+            float(env_str("MC_TRAIN_INTERVAL_S") or 600),
+            lambda: job("mc", training_jobs.train_mc, DB_PATH, 20000, asof_sym,
+                        priority=2, on_done=_publish_mc),
+        ),
+        "calibrate": (
+            float(env_str("CALIB_INTERVAL_S") or 900),
+            lambda: job("calibrate", training_jobs.calibrate, _calib_stats().to_json(),
+                        _params_snapshot().calib_window_days or None,
+                        priority=3, on_done=_apply_platt),
+        ),
+    }
+
+
+def _start_training_once() -> Optional[TrainingPool]:
+    """Leader: démarre le pool et ses jobs périodiques (TRAINING_POOL=0 -> ancien mode inline)."""
+    global _TRAINING
+    if _TRAINING is not None or not _is_leader() or not env_bool("TRAINING_POOL", True):
+        return _TRAINING
+    pool = TrainingPool(int(env_str("TRAINING_WORKERS") or 1), logger=app.logger)
+    for name, (every_s, make) in _training_jobs().items():
+        if every_s > 0:
+            pool.every(name, every_s, make, first_in_s=min(30.0, every_s))
+    _TRAINING = pool.start()
+    return _TRAINING
+
+
+_INGESTORS_STARTED = False
+
+
+def _start_ingestors_once():
+    """Lance les ingestors si clés présentes (leader uniquement)."""
+    global _INGESTORS_STARTED
+    if _INGESTORS_STARTED or not _is_leader():
+        return
+    _INGESTORS_STARTED = True
+    try:
+        if env_str("CRYPTOPANIC_TOKEN") or env_str("NEWSAPI_KEY"):
+            NewsIngestor().start()
+        if env_str("TWITTER_BEARER_TOKEN") or env_str("TW_BEARER"):
+            TwitterIngestor().start()
+        if (
+            env_str("REDDIT_CLIENT_ID")
+            and env_str("REDDIT_CLIENT_SECRET")
+            and env_str("REDDIT_USERNAME")
+            and env_str("REDDIT_PASSWORD")
+        ):
+            RedditIngestor().start()
+        # Trends facultatif (tentera et se désactivera si non installé)
+        TrendsIngestor().start()
+    except Exception as e:
+        LOG_BUFFER.append(f"[ingestors] start error: {e}")
 
-# Lancer les ingestors si clés présentes
-try:
-    if env_str("CRYPTOPANIC_TOKEN") or env_str("NEWSAPI_KEY"):
-        NewsIngestor().start()
-    if env_str("TWITTER_BEARER_TOKEN") or env_str("TW_BEARER"):
-        TwitterIngestor().start()
-    if (
-        env_str("REDDIT_CLIENT_ID")
-        and env_str("REDDIT_CLIENT_SECRET")
-        and env_str("REDDIT_USERNAME")
-        and env_str("REDDIT_PASSWORD")
-    ):
-        RedditIngestor().start()
-    # Trends facultatif (tentera et se désactivera si non installé)
-    TrendsIngestor().start()
-except Exception as e:
-    LOG_BUFFER.append(f"[ingestors] start error: {e}")
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -4911,6 +5301,8 @@ def set_price(px: float, source: str = "market"):
         PRICE_RING.append(px)
     except Exception:
         pass
+    _publish_shared_state()
+    _exit_watch_on_price(px, source)
 
 
 def _ensure_meta_json_column():
@@ -4940,6 +5332,9 @@ def _maybe_refresh_price(force: bool = False):
         max_age = int(_PARAMS.get("MAX_TICK_AGE_S", 60))
     except Exception:
         max_age = 60
+    # follower: le leader publie le prix en mémoire partagée, pas de fetch réseau ici
+    if not force and not _is_leader() and _adopt_shared_state(max_age):
+        return
     now = time.time()
     age = now - (LAST_TICK_TS or 0)
     curr = float(STATE.get("price") or 0.0)
@@ -5109,6 +5504,71 @@ def _json_errors(e):
     return jsonify({"ok": False, "error": msg, "code": code}), code
 
 
+# Snapshot typé/immuable de _PARAMS (+ env du sizing), reconstruit à chaque modification
+_PSNAP: Optional[ParamSnapshot] = None
+_PSNAP_LOCK = threading.Lock()
+_PSNAP_VERSION = 0
+
+
+def params_changed() -> ParamSnapshot:
+    """À appeler après toute écriture dans _PARAMS: recompile et incrémente la version."""
+    global _PSNAP, _PSNAP_VERSION
+    with _PSNAP_LOCK:
+        _PSNAP_VERSION += 1
+        _PSNAP = compile_params(_PARAMS, _PSNAP_VERSION)
+        return _PSNAP
+
+
+def _params_snapshot() -> ParamSnapshot:
+    snap = _PSNAP
+    return snap if snap is not None else params_changed()
+
+
+def params_update(values: Optional[Dict[str, Any]] = None, replace: bool = False) -> ParamSnapshot:
+    """Écrit ``values`` dans _PARAMS (remplacement complet si ``replace``) puis params_changed()."""
+    P = globals().setdefault("_PARAMS", {})
+    if replace:
+        P.clear()
+    P.update(values or {})
+    return params_changed()
+
+
+# Index des déclencheurs TP/SL des lots (clé = seuils qui ont servi au calcul)
+LOT_INDEX = TriggerIndex()
+# Plus haut vu depuis le dernier scan complet: les peaks des lots sont rattrapés paresseusement
+_PEAK_HW = {"since": 0.0, "hi": 0.0}
+
+
+def _lot_trigger_key() -> tuple:
+    """Seuils communs à tous les lots; un changement de clé reconstruit l'index."""
+    P = _params_snapshot()
+    must_cover = P.must_cover
+    return (
+        P.strict_profit_loss_only,
+        must_cover + P.profit_sell_min_pct,
+        must_cover + P.loss_hard_sl_pct,
+    )
+
+
+def _lot_trigger_prices(lot: dict, key: tuple) -> Tuple[float, float]:
+    strict, profit_threshold, loss_threshold = key
+    ent = float(lot.get("entry") or 0.0)
+    tp = float(lot.get("tp_pct") or 0.0)
+    sl = float(lot.get("sl_pct") or 0.0)
+    if strict:
+        tp, sl = max(tp, profit_threshold), max(sl, loss_threshold)
+    return ent * (1.0 + tp), ent * (1.0 - sl)
+
+
+def _lot_index_sync_locked(key: tuple):
+    """À appeler sous POS_LOCK: reconstruit l'index si les seuils ou les lots ont changé."""
+    if LOT_INDEX.key == key and len(LOT_INDEX) == len(POSITIONS):
+        return
+    LOT_INDEX.clear(key)
+    for lot in POSITIONS:
+        LOT_INDEX.upsert(lot["id"], *_lot_trigger_prices(lot, key), payload=lot)
+
+
 def ml_total_qty() -> float:
     with POS_LOCK:
         return sum(float(l.get("qty") or 0.0) for l in POSITIONS)
@@ -5140,6 +5600,10 @@ def ml_add_lot(
             "partial_last_ts": 0.0,
         }
         POSITIONS.append(lot)
+        if LOT_INDEX.key is not None:
+            LOT_INDEX.upsert(
+                lot["id"], *_lot_trigger_prices(lot, LOT_INDEX.key), payload=lot
+            )
 
     # compatibilité avec l’existant
     STATE["in_position"] = True
@@ -5148,8 +5612,29 @@ def ml_add_lot(
     return lot["id"]
 
 
-def ml_tick(price: float, p_up: float):
+# Une seule évaluation de sortie à la fois (moteur, exit watcher, routes).
+# POS_LOCK, lui, ne protège que les mutations de POSITIONS (jamais d'I/O dessous).
+_EXIT_LOCK = threading.Lock()
+
+
+def ml_tick(
+    price: float, p_up: float, blocking: bool = True, full_scan: Optional[bool] = None
+):
+    """Point d'entrée sérialisé de _ml_tick_locked (blocking=False: ignore si occupé)."""
+    if not _EXIT_LOCK.acquire(blocking=blocking):
+        return {"closed": 0, "partials": 0, "busy": True}
+    try:
+        return _ml_tick_locked(price, p_up, full_scan)
+    finally:
+        _EXIT_LOCK.release()
+
+
+def _ml_tick_locked(price: float, p_up: float, full_scan: Optional[bool] = None):
     """
+    full_scan=False: seuls les lots dont un déclencheur TP/SL est franchi (LOT_INDEX)
+    sont évalués, en O(log n + k). Par défaut: scan complet hors mode strict, car
+    BE/hystérésis/time-stop/partiels ne sont pas indexables par prix.
+
     Évalue chaque lot et vend:
       - en mode STRICT_PROFIT_LOSS_ONLY: uniquement si
            • pnl_pct >= must_cover + PROFIT_SELL_MIN_PCT  (profit net >= +3%)
@@ -5162,41 +5647,58 @@ def ml_tick(price: float, p_up: float):
 
     now = time.time()
 
+    # ---- paramètres (snapshot compilé) ----
+    P = _params_snapshot()
+
     # ---- coût total estimé (frais + 2*slippage + buffer) ----
-    cs = _costs_snapshot()
-    must_cover = float(cs.get("total", 0.0))
+    must_cover = P.must_cover
 
-    # ---- lecture des paramètres ----
-    strict = bool(_PARAMS.get("STRICT_PROFIT_LOSS_ONLY", True))
-    prof_min = float(_PARAMS.get("PROFIT_SELL_MIN_PCT", 0.03))
-    loss_hard = float(_PARAMS.get("LOSS_HARD_SL_PCT", 0.05))
+    strict = P.strict_profit_loss_only
+    prof_min = P.profit_sell_min_pct
+    loss_hard = P.loss_hard_sl_pct
 
     # seuils nets
     profit_threshold = must_cover + prof_min
     loss_threshold = must_cover + loss_hard
 
     # (utilisés si strict=False)
-    trail_to_be = float(_PARAMS.get("TRAIL_TO_BREAKEVEN_PCT", 0.004))
-    be_min_hold = int(_PARAMS.get("BE_MIN_HOLD_SEC", 120))
-    be_trail_back = float(_PARAMS.get("BE_TRAIL_BACK_PCT", 0.003))
-    time_stop_min = int(_PARAMS.get("TIME_STOP_MIN", 0))
-    hys = float(_PARAMS.get("HYS_PCT", 0.015))
-    psell = float(_PARAMS.get("PSELL", 0.40))
+    trail_to_be = P.trail_to_breakeven_pct
+    be_min_hold = P.be_min_hold_sec
+    be_trail_back = P.be_trail_back_pct
+    time_stop_min = P.time_stop_min
+    hys = P.hys_pct
+    psell = P.psell
+    min_hold_sec = P.min_hold_sec
 
     # take-partial (ne fera rien si TAKE_PARTIAL_AT_PCT==0.0)
-    take_at = float(_PARAMS.get("TAKE_PARTIAL_AT_PCT", 0.0))
-    take_pct = float(_PARAMS.get("TAKE_PARTIAL_PCT", 0.33))
-    part_min_hold = int(_PARAMS.get("PARTIAL_MIN_HOLD_SEC", 60))
-    part_min_not = float(_PARAMS.get("PARTIAL_MIN_NOTIONAL", 10.0))
-    allow_multiple = bool(_PARAMS.get("PARTIAL_ALLOW_MULTIPLE", False))
-    partial_cooldown = int(_PARAMS.get("PARTIAL_COOLDOWN_SEC", 0))
+    take_at = P.take_partial_at_pct
+    take_pct = P.take_partial_pct
+    part_min_hold = P.partial_min_hold_sec
+    part_min_not = P.partial_min_notional
+    allow_multiple = P.partial_allow_multiple
+    partial_cooldown = P.partial_cooldown_sec
 
     closed_full = []  # [(lot, reason, pnl_pct)]
     partials = []  # [(lot, q_part, pnl_pct)]
     total_qty_to_sell = 0.0
 
+    if full_scan is None:
+        full_scan = not strict
+    key = (strict, profit_threshold, loss_threshold)
+
     with POS_LOCK:
-        for lot in list(POSITIONS):
+        _lot_index_sync_locked(key)
+        if full_scan:
+            candidates = list(POSITIONS)
+            hw_since, hw_hi = float(_PEAK_HW["since"]), float(_PEAK_HW["hi"])
+            _PEAK_HW["since"], _PEAK_HW["hi"] = now, float(price)
+        else:
+            candidates = [LOT_INDEX.payload(i) for i in LOT_INDEX.crossed(price)]
+            hw_since, hw_hi = 0.0, 0.0
+
+        for lot in candidates:
+            if lot is None:
+                continue
             ent = float(lot.get("entry") or price)
             qty = float(lot.get("qty") or 0.0)
             tp = float(lot.get("tp_pct") or 0.0)
@@ -5205,8 +5707,10 @@ def ml_tick(price: float, p_up: float):
             if qty <= 0.0:
                 continue
 
-            # peak
+            # peak (rattrapage paresseux du plus haut vu depuis le dernier scan)
             lot_peak = max(float(lot.get("peak") or price), price)
+            if float(lot.get("opened_at") or now) <= hw_since:
+                lot_peak = max(lot_peak, hw_hi)
             lot["peak"] = lot_peak
 
             pnl_pct = (price - ent) / max(ent, 1e-9)
@@ -5256,9 +5760,7 @@ def ml_tick(price: float, p_up: float):
                 continue
 
             # Hystérésis vendeuse
-            if (p_up <= (psell - hys)) and (
-                age >= int(_PARAMS.get("MIN_HOLD_SEC", 120))
-            ):
+            if (p_up <= (psell - hys)) and (age >= min_hold_sec):
                 if pnl_pct >= must_cover:
                     closed_full.append((lot, "hys", pnl_pct))
                     total_qty_to_sell += qty
@@ -5303,6 +5805,7 @@ def ml_tick(price: float, p_up: float):
         return {"closed": 0, "partials": 0}
 
     pnl_total = 0.0
+    done = []  # [(decision, q, pnl_val, meta, arm_id)] -> I/O hors POS_LOCK
     with POS_LOCK:
         ids_closed = set()
 
@@ -5315,38 +5818,20 @@ def ml_tick(price: float, p_up: float):
             pnl_val = (px - float(lot.get("entry") or px)) * q - part_fee
             pnl_total += pnl_val
             ids_closed.add(lot["id"])
-
-            _record_trace(
-                reason,
-                px,
-                q,
-                float(STATE.get("p_up", 0.5)),
-                float(STATE.get("ev", 0.0)),
-                {
-                    "pnl_pct": float(pnl_pct),
-                    "lot_id": (
-                        int(lot["id"]) if isinstance(lot["id"], int) else lot["id"]
-                    ),
-                    "exec": (
-                        "strict_profit"
-                        if (reason == "tp" and strict)
-                        else (
-                            "strict_loss"
-                            if (reason == "sl" and strict)
-                            else f"ml_exit:{reason}"
-                        )
-                    ),
-                },
-            )
-            if lot.get("arm_id"):
-                try:
-                    bandit_update_reward(lot["arm_id"], float(pnl_val))
-                except Exception:
-                    pass
-            try:
-                risk_on_trade_result(float(pnl_val))
-            except Exception:
-                pass
+            meta = {
+                "pnl_pct": float(pnl_pct),
+                "lot_id": (int(lot["id"]) if isinstance(lot["id"], int) else lot["id"]),
+                "exec": (
+                    "strict_profit"
+                    if (reason == "tp" and strict)
+                    else (
+                        "strict_loss"
+                        if (reason == "sl" and strict)
+                        else f"ml_exit:{reason}"
+                    )
+                ),
+            }
+            done.append((reason, q, pnl_val, meta, lot.get("arm_id")))
 
         # sorties partielles (actives seulement si strict=False et take_at>0)
         for lot, q_part, pnl_pct in partials:
@@ -5360,67 +5845,136 @@ def ml_tick(price: float, p_up: float):
             lot["qty"] = max(0.0, float(lot.get("qty") or 0.0) - q)
             lot["partial_done"] = True
             lot["partial_last_ts"] = now
-
-            _record_trace(
-                "tp_partial",
-                px,
-                q,
-                float(STATE.get("p_up", 0.5)),
-                float(STATE.get("ev", 0.0)),
-                {
-                    "pnl_pct": float(pnl_pct),
-                    "lot_id": (
-                        int(lot["id"]) if isinstance(lot["id"], int) else lot["id"]
-                    ),
-                    "exec": "ml_exit:partial",
-                },
-            )
-            if lot.get("arm_id"):
-                try:
-                    bandit_update_reward(lot["arm_id"], float(pnl_val))
-                except Exception:
-                    pass
-            try:
-                risk_on_trade_result(float(pnl_val))
-            except Exception:
-                pass
+            meta = {
+                "pnl_pct": float(pnl_pct),
+                "lot_id": (int(lot["id"]) if isinstance(lot["id"], int) else lot["id"]),
+                "exec": "ml_exit:partial",
+            }
+            done.append(("tp_partial", q, pnl_val, meta, lot.get("arm_id")))
 
         # purge des lots totalement fermés
         if ids_closed:
             remain = [l for l in POSITIONS if l["id"] not in ids_closed]
             POSITIONS.clear()
             POSITIONS.extend(remain)
+            for lot_id in ids_closed:
+                LOT_INDEX.remove(lot_id)
 
         STATE["in_position"] = len(POSITIONS) > 0
 
+    # traces / bandit / risque: I/O SQLite, donc après libération de POS_LOCK
+    for decision, q, pnl_val, meta, arm_id in done:
+        _record_trace(
+            decision,
+            px,
+            q,
+            float(STATE.get("p_up", 0.5)),
+            float(STATE.get("ev", 0.0)),
+            meta,
+        )
+        if arm_id:
+            try:
+                bandit_update_reward(arm_id, float(pnl_val))
+            except Exception:
+                pass
+        try:
+            risk_on_trade_result(float(pnl_val))
+        except Exception:
+            pass
+
     # tirelire de réinvestissement
-    reinv_pct = float(_PARAMS.get("REINVEST_PCT_OF_PROFIT", 0.5))
+    reinv_pct = P.reinvest_pct_of_profit
     add = max(0.0, pnl_total) * max(0.0, min(1.0, reinv_pct))
     globals()["REINVEST_POOL"] = float(globals().get("REINVEST_POOL", 0.0) + add)
 
     return {"closed": len(closed_full), "partials": len(partials)}
 
 
-def api_twitter_ingest():
-# [MOVED IMPORT]     from sentiment_sources import ingest_twitter_texts
+# ---- Exit watcher: TP/SL des lots évalués à chaque mise à jour de prix ----
+EXIT_WATCH_TOTAL = Counter(
+    "exit_watch_total", "Exit watcher evaluations by outcome", ["result"]
+)
+_EXIT_WAKE = threading.Event()
+_EXIT_WATCH = {"thread": None, "px": 0.0}
+_EXIT_WATCH_START_LOCK = threading.Lock()
 
-    texts = (request.json or {}).get("texts") or []
-    feats = ingest_twitter_texts([str(t) for t in texts])
-    return {"ok": True, "features": feats}, 200
 
+def _exit_triggers_crossed(px: float) -> bool:
+    """Test TP/SL de tous les lots via LOT_INDEX, sans I/O (POS_LOCK tenu quelques µs)."""
+    key = _lot_trigger_key()
+    with POS_LOCK:
+        _lot_index_sync_locked(key)
+        return LOT_INDEX.any_crossed(px)
 
-def set_params():
-    """
-    Définit les paramètres d'auto-trade.
-    - mode: "learning" | "normal"
-    - preset: "aggressive" | "neutral" | "safe" | "scalper_1pc" (optionnel en mode normal)
-    - params: { ... }  (overrides fins, optionnels)
-    Persistance dans KV: AUTOTRADE_MODE, AUTOTRADE_PRESET, AUTOTRADE_PARAMS
-    """
-    global LEARNING_MODE, _PARAMS
 
-    data = request.get_json(silent=True) or {}
-    mode = (data.get("mode") or "normal").lower()
+def _exit_watcher_loop():
+    while True:
+        _EXIT_WAKE.wait()
+        _EXIT_WAKE.clear()
+        px = float(_EXIT_WATCH.get("px") or STATE.get("price") or 0.0)
+        try:
+            res = ml_tick(
+                px, float(STATE.get("p_up") or 0.5), blocking=False, full_scan=False
+            )
+            if res.get("busy"):
+                EXIT_WATCH_TOTAL.labels(result="busy").inc()
+            elif res.get("closed") or res.get("partials"):
+                EXIT_WATCH_TOTAL.labels(result="exit").inc()
+            else:
+                EXIT_WATCH_TOTAL.labels(result="noop").inc()
+        except Exception:
+            app.logger.exception("exit_watcher error")
+
+
+def _start_exit_watcher_once():
+    with _EXIT_WATCH_START_LOCK:
+        th = _EXIT_WATCH.get("thread")
+        if th is not None and th.is_alive():
+            return
+        th = threading.Thread(target=_exit_watcher_loop, name="exit-watch", daemon=True)
+        _EXIT_WATCH["thread"] = th
+        th.start()
+
+
+def _exit_watch_on_price(px: float, source: str = "market"):
+    """Appelé par set_price/_feed_price: ne fait qu'un test en mémoire et réveille le watcher."""
+    if source in ("fill", "boot", "boot_snapshot") or not _is_leader():
+        return
+    try:
+        if float(px) > _PEAK_HW["hi"]:
+            _PEAK_HW["hi"] = float(px)
+        if not POSITIONS or not _params_snapshot().exit_watch_enabled:
+            return
+        if _exit_triggers_crossed(float(px)):
+            _EXIT_WATCH["px"] = float(px)
+            _start_exit_watcher_once()
+            _EXIT_WAKE.set()
+    except Exception:
+        pass
+
+
+def api_twitter_ingest():
+# [MOVED IMPORT]     from sentiment_sources import ingest_twitter_texts
+
+    texts = (request.json or {}).get("texts") or []
+    feats = ingest_twitter_texts([str(t) for t in texts])
+    return {"ok": True, "features": feats}, 200
+
+
+def set_params():
+    """
+    Définit les paramètres d'auto-trade.
+    - mode: "learning" | "normal"
+    - preset: "aggressive" | "neutral" | "safe" | "scalper_1pc" (optionnel en mode normal)
+    - params: { ... }  (overrides fins, optionnels)
+    Persistance dans KV: AUTOTRADE_MODE, AUTOTRADE_PRESET, AUTOTRADE_PARAMS
+    """
+    global LEARNING_MODE, _PARAMS
+    if APP_ROLE == "web":
+        return _engine_forward("set_params")
+
+    data = request.get_json(silent=True) or {}
+    mode = (data.get("mode") or "normal").lower()
     preset = (data.get("preset") or "").lower()
     overrides = data.get("params") or {}
 
@@ -5552,6 +6106,7 @@ def set_params():
         "PARTIAL_MIN_NOTIONAL",
         "PARTIAL_ALLOW_MULTIPLE",
         "PARTIAL_COOLDOWN_SEC",
+        "TICK_BUDGET_S",
     }
 
     # Base normal
@@ -5691,6 +6246,7 @@ def set_params():
 
     # Application
     _PARAMS.update(new_params)
+    params_changed()
 
     # Persistance
     try:
@@ -5844,10 +6400,18 @@ def apply_fill(side: str, price: float, qty: float, fee: float = 0.0):
     try:
         cur = conn.cursor()
 
-        cur.execute(
-            "INSERT INTO trades(ts,side,price,qty,fee) VALUES (?,?,?,?,?)",
-            (float(ts), side_u, px, q, f),
-        )
+        try:
+            cur.execute(
+                "INSERT INTO trades(ts,symbol,side,price,qty,fee) VALUES (?,?,?,?,?,?)",
+                (float(ts), _symbol_norm(globals().get("SYMBOL") or os.getenv("SYMBOL")),
+                 side_u, px, q, f),
+            )
+        except sqlite3.OperationalError:
+            # ancien schéma trades (sans colonne symbol)
+            cur.execute(
+                "INSERT INTO trades(ts,side,price,qty,fee) VALUES (?,?,?,?,?)",
+                (float(ts), side_u, px, q, f),
+            )
 
         valuation = new_cash + new_qty * px
         try:
@@ -5880,6 +6444,7 @@ def apply_fill(side: str, price: float, qty: float, fee: float = 0.0):
     STATE["cash"] = float(new_cash)
     set_price(px, source="fill")
     STATE["in_position"] = STATE.get("position_qty", 0.0) > 1e-12
+    _publish_shared_state()
 
 
 def _start_cash():
@@ -6168,16 +6733,30 @@ def get_account_snapshot_safe():
         }
 
 
-def backfill_snapshots_from_ohlc(tf: str = "1m", limit: int = 1000):
-    """Crée des snapshots (ts, price) à partir de l'OHLC, sans toucher au cash/positions."""
+def backfill_snapshots_from_ohlc(tf: str = "1m", limit: int = 1000, progress=None):
+    """
+    Crée des snapshots (ts, price) à partir de l'OHLC, sans toucher au cash/positions.
+    ``progress(frac)`` est appelé en cours de route (jobs.py); ce qu'il lève annule sans commit.
+    """
     items = fetch_ohlc(SYMBOL, tf, limit) or []
     if not items:
         return 0
     conn = get_db()
+    try:
+        done = _insert_ohlc_snapshots(conn, items, progress)
+        conn.commit()
+    finally:
+        conn.close()
+    return done
+
+
+def _insert_ohlc_snapshots(conn, items, progress=None):
     c = conn.cursor()
     # on insère en utilisant 'close' comme proxy de prix
     done = 0
-    for it in items:
+    for i, it in enumerate(items):
+        if progress is not None and i % 200 == 0:
+            progress(i / len(items))
         # accepte dicts de /api/ohlc: {'t':..., 'open':..., 'high':..., 'low':..., 'close':...}
         t = it.get("t") or it.get("ts")
         px = it.get("close") or it.get("c") or it.get("price")
@@ -6196,8 +6775,6 @@ def backfill_snapshots_from_ohlc(tf: str = "1m", limit: int = 1000):
             (ts, price, 0.0, 0.0, 0.0, price, 0.0, 0.0),
         )
         done += 1
-    conn.commit()
-    conn.close()
     return done
 
 
@@ -6214,6 +6791,8 @@ def api_admin_reset_account():
     # Globals potentiels utilisés par le moteur
     global ENTRY_PRICE, PEAK_PRICE, LAST_ORDER_TS
     global POSITION, POSITIONS, ORDERS_LAST_HOUR, REINVEST_POOL
+    if APP_ROLE == "web":
+        return _engine_forward("api_admin_reset_account")
 
     # 1) montant de départ
     try:
@@ -6291,6 +6870,7 @@ def api_admin_reset_account():
         if "POSITIONS" in globals() and POSITIONS is not None:
             try:
                 POSITIONS.clear()
+                LOT_INDEX.clear()
             except Exception:
                 try:
                     POSITIONS = []
@@ -6573,275 +7153,228 @@ def _kv_get(key, default=None):
 # --- REMOVED DUPLICATE BLOCK (lines 6177-6186) ---
 
 
-def _zscore_vec(x, mu, sigma):
-    out = []
-    for k in FEATURES:
-        v = float(x.get(k, 0.0))
-        m = float(mu.get(k, 0.0))
-        s = float(sigma.get(k, 1.0)) or 1.0
-        out.append((v - m) / s)
-    return out
+def sigmoid_np(x, k: float = 1.0):
+    z = k * x
+    return np.where(z >= 0, 1.0 / (1.0 + np.exp(-z)), np.exp(z) / (1.0 + np.exp(z)))
 
 
-def _dot(w, x):
-    return sum((w[i] if i < len(w) else 0.0) * x[i] for i in range(len(x)))
+# colonnes d'examples du modèle binaire (mêmes features que le tri-classe)
+SGD_FEATURES = tuple(ml_multiclass.FEATURES)
 
 
-def sigmoid_np(x, k: float = 1.0):
-    z = k * x
-    return np.where(z >= 0, 1.0 / (1.0 + np.exp(-z)), np.exp(z) / (1.0 + np.exp(z)))
+def _sgd_model_loader(cur_version):
+    """Recharge le blob ml_sgd seulement si sa version (ts) a changé."""
+    conn = get_db()
+    try:
+        ts = ml_sgd.model_version(conn)
+        if ts is None:
+            # ancien format JSON en KV (avant ml_sgd)
+            legacy = ml_sgd.from_legacy(_kv_get("sgd_model", {}) or {}, SGD_FEATURES)
+            return (legacy, "legacy") if legacy is not None else None
+        if ts == cur_version:
+            return None
+        m = ml_sgd.load_model(conn)
+        return (m, ts) if m is not None else None
+    finally:
+        conn.close()
 
 
 def sgd_predict_proba(row):
-    """row = dict(features) → p_up_raw"""
-    state = _kv_get("sgd_model", {})
-    w = state.get("w", [0.0] * len(FEATURES))
-    b = float(state.get("b", 0.0))
-    mu = state.get("mu", {k: 0.0 for k in FEATURES})
-    sigma = state.get("sigma", {k: 1.0 for k in FEATURES})
-    x = _zscore_vec(row, mu, sigma)
-    return _sigmoid(_dot(w, x) + b)
+    """row = dict(features) → p_up_raw (poids en mémoire, aucune I/O hors refresh)"""
+    h = MODEL_REGISTRY.ensure(ml_sgd.MODEL_KEY, _sgd_model_loader)
+    if h is None:
+        return 0.5
+    return h.model.predict_row(row)
 
 
 def sgd_train_online(limit=1000, lr=0.05, l2=1e-4):
     """
-    Prend les derniers exemples tp/sl, met à jour mu/sigma (robuste) + w,b par SGD.
-    Gère rows en tuple OU mapping (sqlite3.Row/dict).
+    Entraîne le modèle binaire tp/sl sur les derniers exemples (ml_sgd: matrice chargée
+    une fois, standardisation robuste, mini-batch Adam + early stopping, blob binaire).
     """
-    rows = _q(
-        """
-       SELECT
-         CAST(ts          AS REAL)   AS ts,
-         CAST(price       AS REAL)   AS price,
-         CAST(reddit_avg  AS REAL)   AS reddit_avg,
-         CAST(twitter_ema AS REAL)   AS twitter_ema,
-         CAST(sig_tech    AS REAL)   AS sig_tech,
-         CAST(atr_pct     AS REAL)   AS atr_pct,
-         CAST(ema_slope   AS REAL)   AS ema_slope,
-         CAST(hour_of_day AS INTEGER) AS hour_of_day,
-         CAST(vol_norm    AS REAL)   AS vol_norm,
-         CAST(p_up        AS REAL)   AS p_up,
-         outcome
-       FROM examples
-       WHERE outcome IN ('tp','sl')
-       ORDER BY id DESC
-       LIMIT ?
-    """,
-        (int(limit),),
-    )
-
-    if not rows:
-        return {"trained": 0}
-
-    KEYS = [
-        "ts",
-        "price",
-        "reddit_avg",
-        "twitter_ema",
-        "sig_tech",
-        "atr_pct",
-        "ema_slope",
-        "hour_of_day",
-        "vol_norm",
-        "p_up",
-        "outcome",
-    ]
+    conn = get_db()
+    try:
+        return ml_sgd.train_from_db(
+            conn,
+            SGD_FEATURES,
+            limit=int(limit),
+            lr=float(lr),
+            l2=float(l2),
+            registry=MODEL_REGISTRY,
+            asof=_train_asof(),
+        )
+    finally:
+        conn.close()
 
 
 def sgd_train_online_job():
     r1 = sgd_train_online(limit=2000)  # modèle binaire existant
-    r2 = train_mc_once(_q, kv_get, kv_set, limit=2000)  # tri-classe
+    r2 = ml_multiclass.sgd_mc_train_online(
+        _q, kv_get, kv_set, limit=2000, asof=_train_asof()
+    )  # tri-classe
     return {"bin": r1, "mc": r2}
 
-    # helpers
-    def row_to_dict(row):
-        # sqlite3.Row est mapping: row["col"] OK ; mais iter(row) donne les noms !
-        try:
-            # mapping/dict-like
-            return {k: (row.get(k) if hasattr(row, "get") else row[k]) for k in KEYS}
-        except Exception:
-            # tuple-like
-            return dict(zip(KEYS, row))
 
-    def fnum(v, default=0.0):
-        if v is None:
-            return default
-        try:
-            return float(v)
-        except Exception:
-            try:
-                return float(str(v).strip())
-            except Exception:
-                return default
-
-    # FEATURES doit contenir des clés présentes dans KEYS (p.ex. 'reddit_avg','twitter_ema',...)
-    feats = {k: [] for k in FEATURES}
-    D = []
-    Y = []
+def _safe_logit(p):
+    eps = 1e-6
+    p = min(max(p, eps), 1 - eps)
+    return math.log(p / (1 - p))
 
-    for r in rows:
-        d = row_to_dict(r)
-        D.append(d)
-        for k in FEATURES:
-            feats[k].append(fnum(d.get(k), 0.0))
-        Y.append(1 if str(d.get("outcome")) == "tp" else 0)
-
-    if not Y:
-        return {"trained": 0}
-
-    # µ et σ robustes
-# [MOVED IMPORT]     import numpy as _np
-
-    mu = {k: (sum(feats[k]) / len(feats[k]) if feats[k] else 0.0) for k in FEATURES}
-    sigma = {}
-    for k in FEATURES:
-        a = _np.array(feats[k]) if feats[k] else _np.array([0.0])
-        if a.size > 4:
-            p16, p84 = _np.percentile(a, [16, 84])
-            sd = (p84 - p16) / 2.0
-        else:
-            m = float(a.mean())
-            sd = float(a.std())
-            if sd <= 1e-6:
-                sd = 1.0
-        sigma[k] = float(sd)
 
-    # état précédent
-# [MOVED IMPORT]     import json
+# ---------- calibration en ligne (calibration.py) ----------
+# Stats binnées par jour, mises à jour par label_examples_k; checkpoint en KV
+# partagé entre process (common.kvcheckpoint).
+def _calib_backfill(st, before=None):
+    """Reconstruction initiale; ``before`` = ts du lot en cours de labellisation (exclu)."""
+    since = time.time() - st.max_days * 86400
+    until = math.inf if before is None else float(before)
+    rows = _q(
+        "SELECT CAST(ts AS REAL) AS ts, CAST(p_up AS REAL) AS p_up, outcome FROM examples "
+        "WHERE outcome IN ('tp','sl') AND p_up IS NOT NULL "
+        "AND CAST(ts AS REAL) >= ? AND CAST(ts AS REAL) < ?",
+        (since, until),
+    )
+    st.update(
+        [r["ts"] for r in rows],
+        [r["p_up"] for r in rows],
+        [1.0 if r["outcome"] == "tp" else 0.0 for r in rows],
+    )
 
-    try:
-        state_raw = kv_get("sgd_model")  # adapte si c'est _kv_get chez toi
-        state = json.loads(state_raw) if state_raw else {}
-    except Exception:
-        state = {}
 
-    w = list(state.get("w", [0.0] * len(FEATURES)))
-    b = float(state.get("b", 0.0))
+_CALIB = KVCheckpoint(
+    calibration.CalibrationStats(), "calib_stats_v1", kv_get, kv_set,
+    seq_key="calib_stats_seq", backfill=_calib_backfill,
+)
+_CALIB_FIT = {"key": None, "fit": None}
+_CALIB_ISO = {"key": None, "fit": None}
 
-    # 1 passe SGD (ancien -> récent)
-    trained = 0
-    for d in D[::-1]:
-        # vector z-score
-        x = []
-        for k in FEATURES:
-            v = (fnum(d.get(k), 0.0) - mu[k]) / max(1e-9, sigma[k])
-            x.append(v)
 
-        z = _dot(w, x) + b
-        global _PARAMS
-        k = float((_PARAMS or {}).get("SIGMOID_SCALE", 3.0))
+def _calib_stats(max_age_s: float = 30.0):
+    return _CALIB.get(max_age_s)
 
-        # appel compatible quelle que soit la signature (_sigmoid(x, k) ou _sigmoid(x, k=...))
-        try:
-            p = float(_sigmoid(z, k))
-        except TypeError:
-            p = float(_sigmoid(z, k=k))
-        # garde-fous numériques
-        p = max(1e-6, min(1.0 - 1e-6, p))
-        y = 1 if str(d.get("outcome")) == "tp" else 0
-
-        err = p - y
-        for i in range(len(w)):
-            w[i] -= lr * (err * x[i] + l2 * w[i])
-        b -= lr * err
-        trained += 1
-
-    # save
-    try:
-        kv_set(
-            "sgd_model",
-            json.dumps(
-                {"w": w, "b": b, "mu": mu, "sigma": sigma, "features": FEATURES}
-            ),
-        )
-    except Exception:
-        pass
 
-    return {"trained": trained, "w_norm": sum(abs(v) for v in w)}
+def calibration_update(ts, p_up, outcome):
+    """Appelé par le labeler: ajoute les paires tp/sl et publie le checkpoint."""
+    ts = _np.asarray(ts, dtype=float)
+    y = _np.where(outcome == "tp", 1.0, _np.where(outcome == "sl", 0.0, _np.nan))
+    # lot déjà écrit dans examples: le backfill du 1er démarrage s'arrête avant lui
+    before = float(_np.nanmin(ts)) if _np.isfinite(ts).any() else None
+    return _CALIB.update(lambda st: st.update(ts, p_up, y), before=before)
 
 
-def _safe_logit(p):
-    eps = 1e-6
-    p = min(max(p, eps), 1 - eps)
-    return math.log(p / (1 - p))
+# ---------- monitoring qualité modèle (model_monitor.py) ----------
+MONITOR_FEATURES = tuple(ml_multiclass.FEATURES)
 
 
-def calibrate_platt(limit=3000):
+def _monitor_backfill(mon, before=None):
+    """Derniers labels en base; ``before`` = 1er id du lot en cours de labellisation (exclu)."""
+    cols = ", ".join(f"CAST({f} AS REAL) AS {f}" for f in MONITOR_FEATURES)
     rows = _q(
-        "SELECT p_up, outcome FROM examples WHERE p_up IS NOT NULL AND outcome IS NOT NULL ORDER BY id DESC LIMIT ?",
-        (int(limit),),
+        f"SELECT CAST(p_up AS REAL) AS p_up, outcome, {cols} FROM ("
+        "  SELECT * FROM examples WHERE outcome IS NOT NULL AND id < ? ORDER BY id DESC LIMIT ?"
+        ") ORDER BY id ASC",
+        (math.inf if before is None else int(before), mon.capacity),
     )
-    X = []
-    Y = []
-    for p, out in rows:
-        y = 1 if str(out) == "tp" else (0 if str(out) == "sl" else None)
-        if y is None:
-            continue
-        X.append([1.0, _safe_logit(float(p))])  # intercept + logit(p)
-        Y.append(float(y))
-    if len(Y) < 50:
+    if rows:
+        mon.update(
+            [_np.nan if r["p_up"] is None else r["p_up"] for r in rows],
+            [r["outcome"] for r in rows],
+            [[_np.nan if r[f] is None else r[f] for f in MONITOR_FEATURES] for r in rows],
+        )
+
+
+_MONITOR = KVCheckpoint(
+    model_monitor.ModelMonitor(MONITOR_FEATURES), "model_monitor_v1", kv_get, kv_set,
+    backfill=_monitor_backfill,
+)
+
+
+def model_monitor_get(max_age_s: float = 30.0):
+    return _MONITOR.get(max_age_s)
+
+
+def monitor_update(p_up, outcome, X, ids=None):
+    """``ids`` du lot (déjà écrit dans examples) pour borner le backfill du 1er démarrage."""
+    before = int(_np.min(ids)) if ids is not None and len(ids) else None
+    return _MONITOR.update(lambda mon: mon.update(p_up, outcome, X), before=before)
+
+
+def _calib_platt_fit(days=None):
+    """Fit Platt mémorisé tant que les stats n'ont pas bougé."""
+    st = _calib_stats()
+    key = (days, st.updated_at)
+    if _CALIB_FIT["key"] != key:
+        _CALIB_FIT["fit"] = st.platt(days)
+        _CALIB_FIT["key"] = key
+    return _CALIB_FIT["fit"]
+
+
+def _calib_isotonic_fit(days=None):
+    """(n, xs, ys) isotonique mémorisé tant que les stats n'ont pas bougé (et le jour UTC)."""
+    st = _calib_stats()
+    key = (days, st.updated_at, int(time.time() // 86400))
+    if _CALIB_ISO["key"] != key:
+        xs, ys = st.isotonic(days)
+        _CALIB_ISO["fit"] = (st.count(days), xs, ys)
+        _CALIB_ISO["key"] = key
+    return _CALIB_ISO["fit"]
+
+
+def calibrate_platt(limit=3000, days=None):
+    """
+    Platt (A0_BIAS, SIGMOID_SCALE) depuis les stats en ligne, sans relire examples.
+    ``limit`` est gardé pour compat API; la fenêtre est ``days`` (défaut CALIB_WINDOW_DAYS).
+    """
+    P = _params_snapshot()
+    days = P.calib_window_days if days is None else days
+    fit = _calib_platt_fit(days or None)
+    if not fit or fit["n"] < 50:
         return {"ok": False, "error": "not_enough_labels"}
-    # régression logistique 2 paramètres via 5 itérations Newton
-    X = _np.array(X)
-    Y = _np.array(Y)
-    w = _np.zeros(2)
-    for _ in range(5):
-        z = X.dot(w)
-        p = 1.0 / (1.0 + _np.exp(-_np.clip(z, -30, 30)))
-        W = _np.diag(p * (1 - p))
-        H = X.T.dot(W).dot(X) + 1e-6 * _np.eye(2)
-        g = X.T.dot(p - Y)
-        try:
-            step = _np.linalg.solve(H, g)
-        except Exception:
-            break
-        w -= step
-    A0_BIAS = float(w[0])
-    SIGMOID_SCALE = float(w[1])
     # pousse dans _PARAMS pour utilisation dans ta décision
-    _PARAMS["A0_BIAS"] = A0_BIAS
-    _PARAMS["SIGMOID_SCALE"] = SIGMOID_SCALE
+    _PARAMS["A0_BIAS"] = fit["A0_BIAS"]
+    _PARAMS["SIGMOID_SCALE"] = fit["SIGMOID_SCALE"]
+    params_changed()
     return {
         "ok": True,
-        "A0_BIAS": A0_BIAS,
-        "SIGMOID_SCALE": SIGMOID_SCALE,
-        "n": int(len(Y)),
+        "A0_BIAS": fit["A0_BIAS"],
+        "SIGMOID_SCALE": fit["SIGMOID_SCALE"],
+        "n": fit["n"],
+        "days": days,
     }
 
 
 def apply_calibration(p_raw):
-    a = float(_PARAMS.get("A0_BIAS", 0.0))
-    s = float(_PARAMS.get("SIGMOID_SCALE", 1.0))
-    return _sigmoid(a + s * _safe_logit(p_raw))
+    P = _params_snapshot()
+    mode = (P.calibration_mode or "platt").lower()
+    if mode == "isotonic":
+        n, xs, ys = _calib_isotonic_fit(P.calib_window_days or None)
+        if n >= 50:
+            return float(_np.interp(float(p_raw), xs, ys))
+    elif mode == "none":
+        return float(p_raw)
+    return _sigmoid(P.a0_bias + P.sigmoid_scale * _safe_logit(p_raw), 1.0)
 
 
 def brier_score_rolling(limit=1000):
-    rows = _q(
-        "SELECT p_up, outcome FROM examples WHERE p_up IS NOT NULL AND outcome IS NOT NULL ORDER BY id DESC LIMIT ?",
-        (int(limit),),
-    )
-    vals = []
-    for p, out in rows:
-        y = 1 if str(out) == "tp" else (0 if str(out) == "sl" else None)
-        if y is None:
-            continue
-        vals.append((float(p) - y) ** 2)
-    if not vals:
-        return None
-    return float(sum(vals) / len(vals))
+    """Brier sur les ``limit`` derniers labels (lu dans le monitor, sans requête)."""
+    return model_monitor_get().brier(limit)
 
 
-def detect_drift(threshold=0.25):
-    bs = brier_score_rolling(limit=500)
+def detect_drift(threshold=0.25, psi_threshold=0.25):
+    mon = model_monitor_get()
+    bs = mon.brier(500)
     if bs is None:
         return {"ok": False, "reason": "no_labels"}
+    psis = mon.psi()
+    drifted = sorted(f for f, v in psis.items() if v > psi_threshold)
     action = None
     if bs > threshold:
         # durcir un peu la gate: VOL_MIN ↑, PBUY ↑ de 0.01
         _PARAMS["VOL_MIN"] = float(_PARAMS.get("VOL_MIN", 0.0025)) * 1.1
         _PARAMS["PBUY"] = min(0.99, float(_PARAMS.get("PBUY", 0.6)) + 0.01)
         action = {"VOL_MIN": _PARAMS["VOL_MIN"], "PBUY": _PARAMS["PBUY"]}
-    return {"ok": True, "brier": bs, "action": action}
+        params_changed()
+    return {"ok": True, "brier": bs, "action": action, "psi": psis, "drifted": drifted}
 
 
 def _engine_loop():
@@ -6857,7 +7390,7 @@ def _engine_loop():
 
 def _start_engine_once():
     global ENGINE_THREAD_STARTED, ENGINE_THREAD
-    if ENGINE_THREAD_STARTED:
+    if ENGINE_THREAD_STARTED or not _is_leader():
         return
     ENGINE_THREAD_STARTED = True
     ENGINE_THREAD = threading.Thread(target=_engine_loop, name="engine", daemon=True)
@@ -6910,70 +7443,33 @@ def get_snapshots_between(t0: float, t1: float):
 def label_examples_k(k_minutes: int = 10) -> int:
     """
     Pose outcome (tp/sl/timeout) et ret_k sur examples,
-    avec fenêtre [ts .. ts + k] minutes. Robuste aux valeurs texte.
+    avec fenêtre [ts .. ts + k] minutes (labeler.label_pending: balayage unique).
+    Les paires (p_up, outcome) alimentent ensuite la calibration et le monitor.
     """
-    k_s = max(60.0, float(k_minutes) * 60.0)
-    now = time.time()
-
-    rows = _q(
-        "SELECT id, CAST(ts AS REAL) AS ts, CAST(price AS REAL) AS price, "
-        "       CAST(tp_pct AS REAL) AS tp_pct, CAST(sl_pct AS REAL) AS sl_pct "
-        "FROM examples "
-        "WHERE outcome IS NULL AND CAST(ts AS REAL) <= ? "
-        "ORDER BY id ASC",
-        (now - k_s,),
-    )
-    if not rows:
-        return 0
-
     conn = get_db()
-    c = conn.cursor()
-    labeled = 0
-    for ex_id, ts0, entry, tp_pct, sl_pct in rows:
-        # sécurise conversions
-        try:
-            ts0 = float(ts0)
-            entry = float(entry)
-            tp_pct = float(tp_pct) if tp_pct is not None else 0.0
-            sl_pct = float(sl_pct) if sl_pct is not None else 0.0
-        except Exception:
-            continue
-        if not (ts0 > 0.0 and entry > 0.0):
-            continue
-
-        # fenêtre de label
-        t1 = ts0 + k_s
-
-        # récup hi/lo/last avec fallback prices si snapshots pauvre
-        hi, lo, last = get_hilo_last_between(ts0, t1)
-
-        if last is None:
-            outcome, ret_k = "timeout", 0.0
-        else:
-            thr_tp = entry * (1.0 + tp_pct)
-            thr_sl = entry * (1.0 - sl_pct)
-            tp_hit = hi >= entry * (1.0 + tp)
-            sl_hit = lo <= entry * (1.0 - sl)
-            if tp_hit and sl_hit:
-                outcome = "timeout"
-            elif tp_hit:
-                outcome = "tp"
-            elif sl_hit:
-                outcome = "sl"
-            else:
-                outcome = "timeout"
+    try:
+        res = labeler.label_pending(conn, k_minutes, MONITOR_FEATURES)
+    finally:
+        conn.close()
+    _apply_labels(res)
+    return int(res["n"])
 
-            ret_k = (float(last) / entry) - 1.0
 
-        c.execute(
-            "UPDATE examples SET outcome=?, ret_k=? WHERE id=?",
-            (outcome, float(ret_k), int(ex_id)),
+def _apply_labels(res):
+    """Calibration + monitor depuis le résultat de labeler.label_pending (ici ou d'un worker)."""
+    if not res or not res.get("n"):
+        return
+    outcome = _np.asarray(res["outcome"])
+    try:
+        calibration_update(_np.asarray(res["ts"]), _np.asarray(res["p_up"]), outcome)
+    except Exception as e:
+        logger.warning(f"[calib] update failed: {e}")
+    try:
+        monitor_update(
+            _np.asarray(res["p_up"]), outcome, _np.asarray(res["X"]), ids=res.get("ids")
         )
-        labeled += 1
-
-    conn.commit()
-    conn.close()
-    return labeled
+    except Exception as e:
+        logger.warning(f"[monitor] update failed: {e}")
 
 
 def compute_roundtrip_pnls():
@@ -7061,25 +7557,10 @@ def compute_kpis():
         wst = lst = wc = lc = 0
         slip_avg = None
     else:
-        # hit-rate sur exemples (tp/sl) si dispo, sinon sur pnls>0
-        ex = _q(
-            "SELECT outcome FROM examples WHERE outcome IS NOT NULL ORDER BY id DESC LIMIT 200"
-        )
-        lab = [r[0] for r in ex]
-
-        def _hr(arr, k):
-            arrk = arr[-k:] if len(arr) >= k else arr
-            if not arrk:
-                return None
-            wins = sum(1 for x in arrk if x == "tp")
-            losses = sum(1 for x in arrk if x == "sl")
-            denom = wins + losses
-            if denom == 0:
-                return None
-            return wins / denom
-
-        hr50 = _hr(lab, 50)
-        hr200 = _hr(lab, 200)
+        # hit-rate tp/(tp+sl) sur les derniers labels (monitor)
+        mon = model_monitor_get()
+        hr50 = mon.hit_rate(50)
+        hr200 = mon.hit_rate(200)
         exp = sum(pnls) / n
         pos = sum(p for p in pnls if p > 0)
         neg = sum(p for p in pnls if p < 0)
@@ -7152,6 +7633,12 @@ def ensure_bandit_schema():
       cfg_json TEXT
     )"""
     )
+    if "reward_sq" not in cols:
+        # somme des carrés (Thompson gaussien); colonne ajoutée sans perdre les compteurs
+        try:
+            c.execute("ALTER TABLE bandit_arms ADD COLUMN reward_sq REAL DEFAULT 0.0")
+        except sqlite3.OperationalError:
+            pass
     conn.commit()
     conn.close()
 
@@ -7250,8 +7737,6 @@ def migrate_snapshots_to_modern():
     conn.commit()
     conn.close()
 
-    # au boot :
-    init_db()  # (existant) crée les tables si besoin
     migrate_snapshots_to_modern()
     # optionnel mais conseillé
     ensure_schema()
@@ -7600,7 +8085,7 @@ def _normalize_symbol(sym: str) -> str:
     return s
 
 
-def fetch_ohlc(symbol: str, interval: str, limit: int):
+def fetch_ohlc(symbol: str, interval: str, limit: int, timeout_s: float = 10.0):
     """OHLC via ccxt, fallback synthétique si indispo."""
     market = _normalize_symbol(symbol)
     try:
@@ -7608,7 +8093,7 @@ def fetch_ohlc(symbol: str, interval: str, limit: int):
             ex = ccxt.binance(
                 {"enableRateLimit": True, "options": {"adjustForTimeDifference": True}}
             )
-            ex.timeout = 10_000
+            ex.timeout = max(1, int(1000 * min(10.0, float(timeout_s))))  # ms; pas de plancher à 1 s
             rows = ex.fetch_ohlcv(market, timeframe=interval, limit=limit)
             return [
                 {"t": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4]}
@@ -7731,6 +8216,19 @@ def get_latest_price() -> Optional[float]:
     return float(STATE.get("price", 30000.0))
 
 
+def _ema_series(values: List[float], span: int) -> List[float]:
+    """EMA (alpha = 2 / (span + 1)) à chaque point; mêmes valeurs que feature_store._ema."""
+    out = []
+    if not values:
+        return out
+    a = 2.0 / (float(span) + 1.0)
+    e = float(values[0])
+    for x in values:
+        e = a * float(x) + (1.0 - a) * e
+        out.append(e)
+    return out
+
+
 def _atr(ohlc, win=14):
     trs = []
     prev = None
@@ -7739,7 +8237,7 @@ def _atr(ohlc, win=14):
         tr = max(h - l, abs(h - c_prev), abs(l - c_prev))
         trs.append(tr)
         prev = r
-    atr_series = _ema(trs, win)
+    atr_series = _ema_series(trs, win)
     return atr_series[-1] if atr_series else None
 
 
@@ -7762,8 +8260,8 @@ def _rsi(closes, win=14):
 
 def _tech_signal(items):
     closes = [r["close"] for r in items]
-    ema_fast_hist = _ema(closes, 12)
-    ema_slow_hist = _ema(closes, 48)
+    ema_fast_hist = _ema_series(closes, 12)
+    ema_slow_hist = _ema_series(closes, 48)
     ema_fast = ema_fast_hist[-1] if ema_fast_hist else None
     ema_slow = ema_slow_hist[-1] if ema_slow_hist else None
     atr = _atr(items, 14)
@@ -8006,49 +8504,54 @@ def bandit_seed_default(reset=False):
             "INSERT OR REPLACE INTO bandit_arms(id,pulls,reward_sum,last_update,cfg_json) VALUES(?,?,?,?,?)",
             (arm_id, 0, 0.0, now, json.dumps(cfg)),
         )
+    _bandit_sync(discard=reset)
 
 
-def _bandit_fetch_all():
-    return _q("SELECT * FROM bandit_arms ORDER BY id")
+# Bras en mémoire (cfg déjà parsée); les récompenses partent en base via le flusher
+_BANDIT = bandit.ArmTable()
+_BANDIT_INIT_LOCK = threading.Lock()
 
 
-def bandit_choose_arm() -> Dict[str, Any]:
-    rows = _bandit_fetch_all()
-    if not rows:
-        bandit_seed_default(reset=False)
-        rows = _bandit_fetch_all()
-    if random.random() < float(_PARAMS.get("BANDIT_EPSILON", 0.03)):
-        return random.choice(rows)
-    n_total = sum(int(r["pulls"] or 0) for r in rows) or 1
-    best = None
-    best_ucb = -1e9
-    for r in rows:
-        pulls = max(1, int(r["pulls"] or 0))
-        mean = float(r.get("reward_sum") or 0.0) / pulls
-        ucb = mean + math.sqrt(2.0 * math.log(n_total) / pulls)
-        if ucb > best_ucb:
-            best_ucb, best = ucb, r
-    return best
+def _bandit_sync(discard: bool = False):
+    conn = get_db()
+    try:
+        _BANDIT.sync(conn, discard=discard)
+    finally:
+        conn.close()
+
+
+def _bandit_table() -> bandit.ArmTable:
+    if not _BANDIT.loaded:
+        with _BANDIT_INIT_LOCK:
+            if not _BANDIT.loaded:
+                _bandit_sync()
+                if not len(_BANDIT):
+                    bandit_seed_default(reset=False)
+    if not _BANDIT.flushing:
+        with _BANDIT_INIT_LOCK:
+            if not _BANDIT.flushing:
+                _BANDIT.start_flusher(
+                    get_db, interval_s=float(env_str("BANDIT_FLUSH_S") or 10), logger=app.logger
+                )
+    P = _params_snapshot()
+    _BANDIT.set_policy(P.bandit_policy, epsilon=P.bandit_epsilon, window=P.bandit_window)
+    return _BANDIT
+
+
+def bandit_choose_arm() -> Optional[bandit.Arm]:
+    return _bandit_table().choose()
 
 
 def bandit_update_reward(arm_id: str, reward: float):
-    now = time.time()
-    _exec(
-        "UPDATE bandit_arms SET pulls=pulls+1, reward_sum=reward_sum+?, last_update=? WHERE id=?",
-        (float(reward), now, str(arm_id or "")),
-    )
+    _bandit_table().update(str(arm_id or ""), float(reward))
 
 
 def _costs_snapshot():
-    fee_buy = float(_PARAMS.get("FEE_RATE_BUY", 0.0010))
-    fee_sell = float(_PARAMS.get("FEE_RATE_SELL", 0.0010))
-    slip = float(_PARAMS.get("SLIPPAGE", 0.0005))
-    buf = float(_PARAMS.get("FEE_BUFFER_PCT", 0.0002))
-    prefer = bool(_PARAMS.get("PREFER_MAKER", True))
-    maker_fb = float(_PARAMS.get("MAKER_FEE_BUY", 0.0001))
-    maker_fs = float(_PARAMS.get("MAKER_FEE_SELL", 0.0001))
-    if prefer:
-        fee_buy, fee_sell, slip = maker_fb, maker_fs, 0.0
+    P = _params_snapshot()
+    fee_buy, fee_sell, slip = P.fee_rate_buy, P.fee_rate_sell, P.slippage
+    buf = P.fee_buffer_pct
+    if P.prefer_maker:
+        fee_buy, fee_sell, slip = P.maker_fee_buy, P.maker_fee_sell, 0.0
     return {
         "fee_buy": fee_buy,
         "fee_sell": fee_sell,
@@ -8190,6 +8693,7 @@ def _record_trace(
 ):
     """Enregistre une trace 'plate' (TRACE), une trace enrichie (DECISION_TRACE), et persiste en DB."""
     meta = dict(extra or {})
+    meta.setdefault("param_version", _params_snapshot().version)
     rec = {
         "time": datetime.utcnow().isoformat(timespec="seconds") + "Z",
         "decision": str(decision),
@@ -8268,15 +8772,50 @@ def _record_trace(
             pass
 
 
+# Dernières valeurs connues, servies quand le budget du tick est épuisé (état et sorties
+# seulement: une entrée exige risque, prix, OHLC, p_up et compte frais de ce tick)
+_TICK_CACHE: Dict[str, Any] = {}
+
+
+def _note_degraded(stage: str):
+    try:
+        ENGINE_DEGRADED_TOTAL.labels(stage=stage).inc()
+    except Exception:
+        pass
+
+
 def decide_and_maybe_trade():
+    """Un tick moteur borné par TICK_BUDGET_S (0 = sans limite)."""
+    budget = TickBudget(_params_snapshot().tick_budget_s, on_degrade=_note_degraded)
+    try:
+        return _decide_and_maybe_trade_impl(budget)
+    finally:
+        STATE["tick_degraded"] = list(budget.degraded)
+        _publish_shared_state()
+        try:
+            ENGINE_TICK_SECONDS.observe(budget.elapsed())
+        except Exception:
+            pass
+
+
+def _decide_and_maybe_trade_impl(budget: TickBudget):
     global LAST_ORDER_TS, ENTRY_PRICE, PEAK_PRICE, POSITION, LAST_TICK_TS
 
     now = time.time()
     LAST_TICK_TS = now
+    P = _params_snapshot()
+
+    # --- Sorties d'abord: lots ouverts évalués au dernier prix connu (sans I/O) ---
+    # (les chemins de sortie anticipée ci-dessous n'ont pas d'autre prix: pas de 2e passage)
+    if P.multi_trade_mode:
+        try:
+            ml_tick(float(STATE.get("price") or 0.0), float(STATE.get("p_up") or 0.5))
+        except Exception:
+            pass
 
     # --- Cooldown & limites ---
-    cooldown = float(_PARAMS.get("MIN_SECONDS_BETWEEN_ORDERS", 20))
-    max_per_hour = int(_PARAMS.get("MAX_ORDERS_PER_HOUR", 20))
+    cooldown = P.min_seconds_between_orders
+    max_per_hour = P.max_orders_per_hour
     while ORDERS_LAST_HOUR and (now - ORDERS_LAST_HOUR[0] > 3600):
         ORDERS_LAST_HOUR.popleft()
     if LAST_ORDER_TS and (now - LAST_ORDER_TS < cooldown):
@@ -8288,13 +8827,6 @@ def decide_and_maybe_trade():
             float(STATE.get("ev", 0.0)),
             {"reason": "cooldown"},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
-            try:
-                ml_tick(
-                    float(STATE.get("price") or 0.0), float(STATE.get("p_up") or 0.5)
-                )
-            except Exception:
-                pass
         return {"skipped": "cooldown"}
     if len(ORDERS_LAST_HOUR) >= max_per_hour:
         _record_trace(
@@ -8305,43 +8837,45 @@ def decide_and_maybe_trade():
             float(STATE.get("ev", 0.0)),
             {"reason": "max_per_hour"},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
-            try:
-                ml_tick(
-                    float(STATE.get("price") or 0.0), float(STATE.get("p_up") or 0.5)
-                )
-            except Exception:
-                pass
         return {"skipped": "max_per_hour"}
 
-    # --- Risque global ---
-    rk = risk_update_and_check()
-    if rk.get("blocked"):
+    # --- Risque global (fail closed: sans contrôle de ce tick, pas d'entrée) ---
+    # (SQLite sous RISK_LOCK: borné par le budget restant, None s'il ne répond pas à temps)
+    rk = budget.call("risk", risk_update_and_check)
+    if rk is None or rk.get("blocked"):
+        reason = "risk_block" if rk is not None else "risk_unavailable"
         _record_trace(
             "hold",
             float(STATE.get("price") or 0.0),
             0.0,
             float(STATE.get("p_up", 0.5)),
             float(STATE.get("ev", 0.0)),
-            {"reason": "risk_block"},
+            {"reason": reason},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
-            try:
-                ml_tick(
-                    float(STATE.get("price") or 0.0), float(STATE.get("p_up") or 0.5)
-                )
-            except Exception:
-                pass
-        return {"skipped": "risk_block"}
+        return {"skipped": reason}
 
-    # --- Données marché ---
-    price = float(get_latest_price() or 0.0)
+    # --- Données marché (dernières valeurs connues si budget épuisé) ---
+    # get_latest_price (ccxt, 10 s) et snapshot_now (SQLite) n'acceptent pas de timeout:
+    # budget.call arrête d'attendre quand le budget est épuisé
+    px = budget.call("price", get_latest_price)
+    if "price" in budget.degraded:
+        price = float(STATE.get("price") or 0.0)
+    else:
+        price = float(px or 0.0)
     try:
-        snapshot_now()
+        budget.call("snapshot", snapshot_now)
     except Exception:
         pass
 
-    items = fetch_ohlc(SYMBOL, "1m", 240)
+    if budget.allow("ohlc"):
+        # WARMUP_MIN bougies: la fenêtre sur laquelle feature_store calcule les mêmes EMAs
+        items = fetch_ohlc(
+            SYMBOL, "1m", feature_store.WARMUP_MIN, timeout_s=budget.remaining() or 10.0
+        )
+        if items:
+            _TICK_CACHE["ohlc"] = items
+    else:
+        items = _TICK_CACHE.get("ohlc") or []
     if not items:
         _record_trace(
             "hold",
@@ -8351,7 +8885,7 @@ def decide_and_maybe_trade():
             float(STATE.get("ev", 0.0)),
             {"reason": "no_ohlc"},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, float(STATE.get("p_up") or 0.5))
             except Exception:
@@ -8378,11 +8912,31 @@ def decide_and_maybe_trade():
     except Exception:
         pass
 
+    # -- Features matérialisées (feature_store): mêmes valeurs qu'à l'entraînement --
+    # (lecture SQLite seulement si le budget le permet; l'ATR live reste celui des TP/SL et du
+    # filtre de volatilité, celui du store ne sert qu'à défaut)
+    feats = functools.partial(feature_store_live, SYMBOL, now)
+    fs = budget.call("features", feats)
+    if "features" in budget.degraded:
+        fs = feats(cached_only=True)
+    if fs:
+        sig_tech, ema_slope = float(fs["sig_tech"]), float(fs["ema_slope"])
+        if not atr:
+            atr = float(fs["atr_pct"]) * price
+        for k in ("sig_tech", "ema_slope", "atr_pct", "vol_norm", "reddit_avg", "twitter_ema"):
+            STATE[k] = float(fs[k])
+
     # =======================================================================
     # --- Sentiment + Tri-classe + Sizing (patch) ---
-    p_up_patch, size_usdt_patch, skipped = apply_trade_patch(
-        STATE, _PARAMS, price, _costs_snapshot, _record_trace, kv_get
-    )
+    if budget.allow("sentiment"):
+        p_up_patch, size_usdt_patch, skipped = apply_trade_patch(
+            STATE, _PARAMS, price, _costs_snapshot, _record_trace, kv_get
+        )
+    else:
+        # budget épuisé: on garde le dernier p_up et la dernière taille suggérée
+        p_up_patch = float(STATE.get("p_up", 0.5))
+        size_usdt_patch = float(STATE.get("last_size_suggested") or 0.0)
+        skipped = None
     if skipped:
         _record_trace(
             "hold",
@@ -8392,7 +8946,7 @@ def decide_and_maybe_trade():
             float(STATE.get("ev", 0.0)),
             {"reason": skipped},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, float(STATE.get("p_up", 0.5)))
             except Exception:
@@ -8420,7 +8974,7 @@ def decide_and_maybe_trade():
 
     # --- Conditions vol ---
     atr_pct = (float(atr) / price) if (atr and price > 0) else 0.0
-    vol_min = float(_PARAMS.get("VOL_MIN", 0.0025))
+    vol_min = P.vol_min
     if atr_pct < vol_min and not LEARNING_MODE:
         _record_trace(
             "hold",
@@ -8430,7 +8984,7 @@ def decide_and_maybe_trade():
             STATE["ev"],
             {"reason": "low_vol", "atr_pct": atr_pct},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
@@ -8439,38 +8993,36 @@ def decide_and_maybe_trade():
 
     # --- Targets dynamiques de base ---
     tp_pct = max(
-        float(_PARAMS.get("MIN_TP_PCT", 0.0105)),
+        P.min_tp_pct,
         (
-            (float(atr) / price) * float(_PARAMS.get("TP_ATR_MULT", 0.9))
+            (float(atr) / price) * P.tp_atr_mult
             if atr and price > 0
             else 0.0105
         ),
     )
     sl_pct = max(
-        float(_PARAMS.get("MIN_SL_PCT", 0.0065)),
+        P.min_sl_pct,
         (
-            (float(atr) / price) * float(_PARAMS.get("SL_ATR_MULT", 0.7))
+            (float(atr) / price) * P.sl_atr_mult
             if atr and price > 0
             else 0.0065
         ),
     )
 
     # --- Coûts: plancher TP ---
-    maker_bps = float(_PARAMS.get("COST_MAKER_BPS", 2.0))
-    taker_bps = float(_PARAMS.get("COST_TAKER_BPS", 5.0))
-    other_bps = float(_PARAMS.get("OTHER_COST_BPS", 2.0))
-    prefer_maker = bool(_PARAMS.get("PREFER_MAKER", True))
+    maker_bps = P.cost_maker_bps
+    taker_bps = P.cost_taker_bps
+    other_bps = P.other_cost_bps
+    prefer_maker = P.prefer_maker
 
     if prefer_maker:
         roundtrip_bps = (maker_bps + maker_bps + other_bps) / 10000.0
-        net_margin = float(
-            _PARAMS.get("NET_MARGIN_PCT", 0.003)
-        )  # +0.3% net au-dessus des coûts
+        net_margin = P.net_margin_pct  # +0.3% net au-dessus des coûts
         tp_floor = max(tp_pct, roundtrip_bps + net_margin)
         tp_pct = max(tp_pct, tp_floor)
     else:
         roundtrip_bps = (taker_bps + taker_bps + other_bps) / 10000.0
-        fee_buffer_bps = float(_PARAMS.get("FEE_BUFFER_BPS", 5.0)) / 10000.0
+        fee_buffer_bps = P.fee_buffer_bps / 10000.0
         must_cover = roundtrip_bps + fee_buffer_bps
         tp_pct = max(tp_pct, must_cover)
 
@@ -8482,15 +9034,19 @@ def decide_and_maybe_trade():
     STATE["ev_net"] = float(ev_net)
 
     # --- Bandit / seuils ---
-    arm = bandit_choose_arm()
-    arm_cfg = json.loads(arm.get("cfg_json") or "{}") if arm else {}
-    pbuy = float(arm_cfg.get("PBUY", _PARAMS.get("PBUY", 0.60)))
-    psell = float(arm_cfg.get("PSELL", _PARAMS.get("PSELL", 0.40)))
-    min_ev_net = float(arm_cfg.get("MIN_EV_NET", _PARAMS.get("MIN_EV_NET", 0.0003)))
+    if budget.allow("bandit"):
+        arm = bandit_choose_arm()
+        _TICK_CACHE["arm"] = arm
+    else:
+        arm = _TICK_CACHE.get("arm")
+    arm_cfg = arm.cfg if arm else {}
+    pbuy = float(arm_cfg.get("PBUY", P.pbuy))
+    psell = float(arm_cfg.get("PSELL", P.psell))
+    min_ev_net = float(arm_cfg.get("MIN_EV_NET", P.min_ev_net))
 
     # Bonus heures liquides
     if datetime.utcnow().hour not in {12, 13, 14, 15, 16, 17, 18, 19, 20}:
-        pbuy = min(0.99, pbuy + float(_PARAMS.get("PBUY_OFF_HOURS_ADD", 0.03)))
+        pbuy = min(0.99, pbuy + P.pbuy_off_hours_add)
 
     # --- Trend & assouplissements apprentissage ---
     if LEARNING_MODE:
@@ -8503,22 +9059,22 @@ def decide_and_maybe_trade():
             and ema_slow is not None
             and float(ema_fast) >= float(ema_slow)
         )
-        rsi_min = float(_PARAMS.get("RSI_MIN", 45.0))
+        rsi_min = P.rsi_min
         rsi_ok = (rsi_val is None) or (rsi_min <= 0.0) or (float(rsi_val) >= rsi_min)
-        sig_ok = (sig_tech or 0.0) >= float(_PARAMS.get("TECH_TREND_MIN", 0.02))
+        sig_ok = (sig_tech or 0.0) >= P.tech_trend_min
         trend_ok = ema_ok or (
             sig_ok
-            and (atr_pct >= float(_PARAMS.get("VOL_MIN_HIGH", 0.0035)))
+            and (atr_pct >= P.vol_min_high)
             and rsi_ok
         )
 
     # --- Taille ordre ---
-    snap = get_account_snapshot_safe() or {}
+    snap = budget.call("account", get_account_snapshot_safe) or {}
     cash = float(snap.get("cash") or 0.0)
-    base_buy_pct = float(_PARAMS.get("BUY_PCT", 0.25))
+    base_buy_pct = P.buy_pct
     conv = 0.0 if p_up <= pbuy else min(1.0, (p_up - pbuy) / max(1e-9, 1.0 - pbuy))
     buy_pct_eff = max(0.05, min(base_buy_pct, 0.10 + conv * base_buy_pct))
-    min_notional = float(os.getenv("RISK_MIN_ORDER_NOTIONAL", "10"))
+    min_notional = P.risk_min_order_notional
 
     # >>> override avec la taille calculée par le patch
     size_usdt = float(size_usdt_patch)
@@ -8530,6 +9086,18 @@ def decide_and_maybe_trade():
     # <<<
 
     # --- Guards d’entrée ---
+    # fail closed: prix, OHLC, p_up ou compte repris d'un tick précédent -> pas d'entrée
+    stale = [s for s in ("price", "ohlc", "sentiment", "account") if s in budget.degraded]
+    if stale:
+        _record_trace(
+            "hold", price, 0.0, p_up, STATE["ev"], {"reason": "stale_data", "stages": stale}
+        )
+        if P.multi_trade_mode:
+            try:
+                ml_tick(price, p_up)
+            except Exception:
+                pass
+        return {"skipped": "stale_data"}
     if cash <= 0 or usd_amt > cash + 1e-9:
         _record_trace(
             "hold",
@@ -8539,7 +9107,7 @@ def decide_and_maybe_trade():
             STATE["ev"],
             {"reason": "insufficient_cash", "cash": cash, "need": usd_amt},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
@@ -8547,7 +9115,7 @@ def decide_and_maybe_trade():
         return {"skipped": "insufficient_cash"}
     if not trend_ok:
         _record_trace("hold", price, 0.0, p_up, STATE["ev"], {"reason": "trend_not_ok"})
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
@@ -8562,7 +9130,7 @@ def decide_and_maybe_trade():
             STATE["ev"],
             {"reason": "p_up_below", "p_up": float(p_up), "pbuy": float(pbuy)},
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
@@ -8581,7 +9149,7 @@ def decide_and_maybe_trade():
                 "min_ev_net": float(min_ev_net),
             },
         )
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
@@ -8596,7 +9164,7 @@ def decide_and_maybe_trade():
             _record_trace(
                 "hold", price, 0.0, p_up, STATE["ev"], {"reason": "buy_qty_zero"}
             )
-            if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+            if P.multi_trade_mode:
                 try:
                     ml_tick(price, p_up)
                 except Exception:
@@ -8615,16 +9183,16 @@ def decide_and_maybe_trade():
             "opened_at": now,
             "target_pct": tp_pct,
             "stop_pct": sl_pct,
-            "arm_id": (arm["id"] if arm else None),
+            "arm_id": (arm.id if arm else None),
         }
         STATE["entries_count"] = 1
         STATE["last_entry_price"] = px
 
         lot_id = None
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 lot_id = ml_add_lot(
-                    qty, px, tp_pct, sl_pct, (arm["id"] if arm else None)
+                    qty, px, tp_pct, sl_pct, (arm.id if arm else None)
                 )
             except Exception as e:
                 app.logger.exception(f"ml_add_lot (initial) failed: {e}")
@@ -8641,7 +9209,7 @@ def decide_and_maybe_trade():
                 "ev_net": float(ev_net),
                 "buy_pct": float(buy_pct_eff),
                 "usd_amt": float(usd_amt),
-                "arm": (arm["id"] if arm else None),
+                "arm": (arm.id if arm else None),
                 "slippage": float(slippage),
                 "lot_id": (int(lot_id) if isinstance(lot_id, int) else lot_id),
                 "reason": (
@@ -8673,42 +9241,40 @@ def decide_and_maybe_trade():
         LAST_ORDER_TS = now
         ORDERS_LAST_HOUR.append(now)
 
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+        if P.multi_trade_mode:
             try:
                 ml_tick(price, p_up)
             except Exception:
                 pass
 
-        return {"enter": "buy", "arm": (arm["id"] if arm else None)}
+        return {"enter": "buy", "arm": (arm.id if arm else None)}
 
     # --- Re-entry (pyramiding ou lot supplémentaire) ---
-    if STATE.get("in_position") and bool(_PARAMS.get("ALLOW_MULTIPLE", True)):
-        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+    if STATE.get("in_position") and P.allow_multiple:
+        if P.multi_trade_mode:
             try:
                 open_lots = len(POSITIONS)
             except Exception:
                 open_lots = int(STATE.get("entries_count") or 1)
-            maxe = int(_PARAMS.get("MAX_CONCURRENT_ENTRIES", 3))
+            maxe = P.max_concurrent_entries
             entries_ok = open_lots < maxe
         else:
-            maxe = int(_PARAMS.get("MAX_CONCURRENT_ENTRIES", 3))
+            maxe = P.max_concurrent_entries
             entries_ok = int(STATE.get("entries_count") or 1) < maxe
 
         if entries_ok:
-            min_bps = int(_PARAMS.get("MIN_REENTRY_DISTANCE_BPS", 15))
+            min_bps = P.min_reentry_distance_bps
             last_entry = float(STATE.get("last_entry_price") or ENTRY_PRICE or price)
             need_reentry = price >= last_entry * (1.0 + (min_bps / 10000.0))
-            reentry_need_trend = bool(_PARAMS.get("REENTRY_REQUIRE_TREND", False))
+            reentry_need_trend = P.reentry_require_trend
             if (
                 (p_up >= pbuy)
                 and (ev_net >= min_ev_net)
                 and (trend_ok or not reentry_need_trend)
                 and need_reentry
             ):
-                re_pct = float(_PARAMS.get("REENTRY_BUY_PCT", 0.15))
-                usd_amt_re = max(
-                    float(os.getenv("RISK_MIN_ORDER_NOTIONAL", "10")), cash * re_pct
-                )
+                re_pct = P.reentry_buy_pct
+                usd_amt_re = max(P.risk_min_order_notional, cash * re_pct)
                 if usd_amt_re <= cash + 1e-9:
                     prev_qty = float(STATE.get("position_qty") or 0.0)
                     pre_px = price
@@ -8722,7 +9288,7 @@ def decide_and_maybe_trade():
                             STATE["ev"],
                             {"reason": "reentry_qty_zero"},
                         )
-                        if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+                        if P.multi_trade_mode:
                             try:
                                 ml_tick(price, p_up)
                             except Exception:
@@ -8757,10 +9323,10 @@ def decide_and_maybe_trade():
                     STATE["last_entry_price"] = px
                     STATE["last_decision"] = "buy_add"
 
-                    if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+                    if P.multi_trade_mode:
                         try:
                             ml_add_lot(
-                                qty, px, tp_pct, sl_pct, (arm["id"] if arm else None)
+                                qty, px, tp_pct, sl_pct, (arm.id if arm else None)
                             )
                         except Exception as e:
                             app.logger.exception(f"ml_add_lot (reentry) failed: {e}")
@@ -8777,7 +9343,7 @@ def decide_and_maybe_trade():
                             "ev_net": float(ev_net),
                             "buy_pct": float(re_pct),
                             "usd_amt": float(usd_amt_re),
-                            "arm": (arm["id"] if arm else None),
+                            "arm": (arm.id if arm else None),
                             "slippage": float(slippage),
                             "reason": "pyramiding",
                         },
@@ -8789,16 +9355,16 @@ def decide_and_maybe_trade():
                     LAST_ORDER_TS = now
                     ORDERS_LAST_HOUR.append(now)
 
-                    if bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+                    if P.multi_trade_mode:
                         try:
                             ml_tick(price, p_up)
                         except Exception:
                             pass
 
-                    return {"enter": "buy_add", "arm": (arm["id"] if arm else None)}
+                    return {"enter": "buy_add", "arm": (arm.id if arm else None)}
 
     # --- Sorties (TP/SL/BE/time/hystérésis) ---
-    if not bool(_PARAMS.get("MULTI_TRADE_MODE", True)):
+    if not P.multi_trade_mode:
         time_stop_min = int(_PARAMS.get("TIME_STOP_MIN", 10))
         trail_to_be = float(_PARAMS.get("TRAIL_TO_BREAKEVEN_PCT", 0.006))
         min_hold_sec = int(_PARAMS.get("MIN_HOLD_SEC", 120))
@@ -9412,6 +9978,8 @@ def api_examples_cleanup():
 
 
 def api_calibrate():
+    if APP_ROLE == "web":
+        return _engine_forward("api_calibrate")
     j = request.get_json(silent=True) or {}
     out = calibrate_platt(limit=int(j.get("limit", 3000)))
     return jsonify(out)
@@ -9429,9 +9997,12 @@ def api_learn_online():
 
 def api_params_update():
     global LEARNING_MODE
+    if APP_ROLE == "web":
+        return _engine_forward("api_params_update")
     data = request.get_json(silent=True) or {}
     for k, v in data.items():
         _PARAMS[k] = v
+    params_changed()
     if "LEARNING_MODE" in data:
         LEARNING_MODE = bool(data["LEARNING_MODE"])
     app.logger.info(f"params.update {data}")
@@ -9439,6 +10010,8 @@ def api_params_update():
 
 
 def api_strategy_run():
+    if APP_ROLE == "web":
+        return _engine_forward("api_strategy_run")
     res = decide_and_maybe_trade()
     return jsonify(
         {
@@ -9696,27 +10269,21 @@ def api_risk_reset():
 
 
 def api_bandit_seed():
+    if APP_ROLE == "web":
+        return _engine_forward("api_bandit_seed")
     data = request.get_json(silent=True) or {}
     reset = bool(data.get("reset"))
+    if reset:
+        return _submit_job("bandit_reset", {})
     ensure_bandit_schema()
-    bandit_seed_default(reset=reset)
+    bandit_seed_default(reset=False)
     return jsonify({"ok": True})
 
 
 def api_bandit_status():
-    rows = _bandit_fetch_all()
-    n_total = sum(int(r["pulls"] or 0) for r in rows) or 1
-    out = []
-    for r in rows:
-        pulls = max(1, int(r["pulls"] or 0))
-        mean = float(r.get("reward_sum") or 0.0) / pulls
-        ucb = mean + math.sqrt(2.0 * math.log(n_total) / pulls)
-        try:
-            cfg = json.loads(r.get("cfg_json") or "{}")
-        except Exception:
-            cfg = {}
-        out.append({**r, "mean": mean, "ucb": ucb, "cfg": cfg})
-    return jsonify({"ok": True, "arms": out, "n_total": n_total})
+    if request.args.get("sync"):
+        _bandit_sync()
+    return jsonify({"ok": True, **_bandit_table().status()})
 
 
 def api_logs_get():
@@ -10780,6 +11347,8 @@ def api_why_last_actions():
 
 def api_learning_set():
     global LEARNING_MODE
+    if APP_ROLE == "web":
+        return _engine_forward("api_learning_set")
     body = request.get_json(force=True, silent=True) or {}
     if "enable" not in body:
         abort(400, description="missing 'enable'")
@@ -11320,6 +11889,8 @@ def _hard_reset_position_state():
 
 
 def api_manual_buy():
+    if APP_ROLE == "web":
+        return _engine_forward("api_manual_buy")
     j = request.get_json(force=True) or {}
     # on accepte soit un montant (usdt), soit une quantité (qty)
     usdt = float(
@@ -11702,9 +12273,8 @@ def get_hilo_last_between(ts0: float, t1: float):
     return (None, None, None)
 
 
-def api_admin_backfill_snapshots():
-    j = request.get_json(silent=True) or {}
-    limit = int(j.get("limit", 1500))
+def backfill_snapshots_from_prices(limit: int = 1500, progress=None):
+    """Snapshots (compte fictif 200$) rejoués depuis ``prices``; None s'il n'y a aucun prix."""
     rows = _q(
         """
       SELECT COALESCE(CAST(ts AS REAL), CAST(t AS REAL)/1000.0) AS ts,
@@ -11713,48 +12283,58 @@ def api_admin_backfill_snapshots():
       ORDER BY ts DESC
       LIMIT ?
     """,
-        (limit,),
+        (int(limit),),
     )
     if not rows:
-        return jsonify({"ok": False, "msg": "no prices"}), 400
+        return None
 
     conn = get_db()
-    c = conn.cursor()
-    cols = [r[1] for r in c.execute("PRAGMA table_info(snapshots)").fetchall()]
-    has_simple = {"ts", "cash", "btc", "valuation"}.issubset(set(cols))
-    has_rich = {"ts", "price", "cash", "position_qty", "valuation"}.issubset(set(cols))
-
-    cash = 200
-    btc = 0.0
-    inserted = 0
-    for ts, px in reversed(rows):
-        px = float(px or 0.0)
-        valuation = cash + btc * px
-        if has_rich:
-            c.execute(
-                "INSERT OR IGNORE INTO snapshots(ts,price,cash,position_qty,position_avg,valuation,realized_pnl,unrealized_pnl) "
-                "VALUES(?,?,?,?,?,?,?,?)",
-                (float(ts), px, cash, btc, None, valuation, None, None),
-            )
-        elif has_simple:
-            c.execute(
-                "INSERT OR IGNORE INTO snapshots(ts,cash,btc,valuation) VALUES(?,?,?,?)",
-                (float(ts), cash, btc, valuation),
-            )
-        else:
-            try:
+    try:
+        c = conn.cursor()
+        cols = [r[1] for r in c.execute("PRAGMA table_info(snapshots)").fetchall()]
+        has_simple = {"ts", "cash", "btc", "valuation"}.issubset(set(cols))
+        has_rich = {"ts", "price", "cash", "position_qty", "valuation"}.issubset(set(cols))
+
+        cash = 200
+        btc = 0.0
+        inserted = 0
+        for ts, px in reversed(rows):
+            if progress is not None and inserted % 500 == 0:
+                progress(inserted / len(rows))
+            px = float(px or 0.0)
+            valuation = cash + btc * px
+            if has_rich:
                 c.execute(
-                    "CREATE TABLE IF NOT EXISTS snapshots(ts REAL PRIMARY KEY, price REAL)"
+                    "INSERT OR IGNORE INTO snapshots(ts,price,cash,position_qty,position_avg,valuation,realized_pnl,unrealized_pnl) "
+                    "VALUES(?,?,?,?,?,?,?,?)",
+                    (float(ts), px, cash, btc, None, valuation, None, None),
                 )
-            except Exception:
-                pass
-            c.execute(
-                "INSERT OR IGNORE INTO snapshots(ts,price) VALUES(?,?)", (float(ts), px)
-            )
-        inserted += 1
-    conn.commit()
-    conn.close()
-    return jsonify({"ok": True, "inserted": inserted})
+            elif has_simple:
+                c.execute(
+                    "INSERT OR IGNORE INTO snapshots(ts,cash,btc,valuation) VALUES(?,?,?,?)",
+                    (float(ts), cash, btc, valuation),
+                )
+            else:
+                try:
+                    c.execute(
+                        "CREATE TABLE IF NOT EXISTS snapshots(ts REAL PRIMARY KEY, price REAL)"
+                    )
+                except Exception:
+                    pass
+                c.execute(
+                    "INSERT OR IGNORE INTO snapshots(ts,price) VALUES(?,?)", (float(ts), px)
+                )
+            inserted += 1
+        conn.commit()
+    finally:
+        conn.close()
+    return inserted
+
+
+def api_admin_backfill_snapshots():
+    """Lancé en job (jobs.py): renvoie l'id à suivre sur /api/jobs/<id>."""
+    j = request.get_json(silent=True) or {}
+    return _submit_job("backfill_snapshots", {"limit": int(j.get("limit", 1500))})
 
 
 def _examples_labeled_since(days: int = 7):
@@ -11788,73 +12368,191 @@ def _safe_float(x, default=0.0):
 def api_metrics_reliability():
     j = request.args or {}
     days = int(j.get("days", 7))
-    bins = int(j.get("bins", 10))
-    rows = _examples_labeled_since(days)
-    if not rows:
+    bins = max(5, min(20, int(j.get("bins", 10))))
+    rel = _calib_stats().reliability(days, bins)
+    if not rel["n"]:
         return jsonify({"ok": True, "bins": [], "brier": None, "n": 0})
+    return jsonify({"ok": True, **rel})
 
-    pairs = []
-    for _, p, outcome, ret_k, *_ in rows:
-        p = _safe_float(p, None)
-        if p is None:
-            continue
-        if outcome == "tp":
-            y = 1.0
-        elif outcome == "sl":
-            y = 0.0
-        else:
-            continue
-        pairs.append((p, y))
-    n = len(pairs)
-    if n == 0:
-        return jsonify({"ok": True, "bins": [], "brier": None, "n": 0})
 
-    brier = sum((p - y) ** 2 for p, y in pairs) / n
+@app.get("/api/ml/monitor")
+def api_ml_monitor():
+    """
+    Qualité modèle glissante (Brier, log-loss, hit-rate, bins de calibration, PSI).
 
-    bins = max(5, min(20, int(bins)))
-    step = 1.0 / bins
-    bucket = [[] for _ in range(bins)]
-    for p, y in pairs:
-        idx = min(bins - 1, max(0, int(p / step)))
-        bucket[idx].append((p, y))
-    out = []
-    for i, arr in enumerate(bucket):
-        if arr:
-            p_mean = sum(p for p, _ in arr) / len(arr)
-            y_mean = sum(y for _, y in arr) / len(arr)
-            out.append(
-                {
-                    "bin_from": i * step,
-                    "bin_to": (i + 1) * step,
-                    "p_mean": p_mean,
-                    "hit": y_mean,
-                    "count": len(arr),
-                }
-            )
-        else:
-            out.append(
-                {
-                    "bin_from": i * step,
-                    "bin_to": (i + 1) * step,
-                    "p_mean": None,
-                    "hit": None,
-                    "count": 0,
-                }
-            )
-    return jsonify({"ok": True, "bins": out, "brier": brier, "n": n})
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/ml/monitor?window=500"
+    """
+    mon = model_monitor_get()
+    w = int((request.args or {}).get("window", 500))
+    out = mon.summary()
+    out["calibration"] = {"window": w, "bins": mon.calibration_bins(w)}
+    return jsonify({"ok": True, **out})
+
+
+@app.get("/api/features/asof")
+def api_features_asof():
+    """
+    Ligne du feature store visible à ``ts`` (défaut: maintenant) + état du matérialiseur.
+
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/features/asof?symbol=BTCUSDT"
+    """
+    j = request.args or {}
+    sym = _symbol_norm(j.get("symbol") or FEATURE_STORE_SYMBOLS[0])
+    ts = float(j.get("ts") or time.time())
+    conn = get_db()
+    try:
+        row = feature_store.asof(conn, sym, ts)
+    except sqlite3.Error as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+    return jsonify(
+        {
+            "ok": True,
+            "symbol": sym,
+            "ts": ts,
+            "row": row,
+            "materializer": (_FEATURE_MAT.last_run if _FEATURE_MAT is not None else None),
+        }
+    )
+
+
+@app.get("/api/training/status")
+def api_training_status():
+    """
+    Pool d'entraînement: jobs (état, runs, durées, dernier succès, erreur), file d'attente.
+
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/training/status"
+    """
+    pool = _training_pool()
+    if pool is None:
+        return jsonify({"ok": True, "enabled": False, "leader": _is_leader()})
+    return jsonify({"ok": True, "enabled": True, **pool.status()})
+
+
+@app.post("/api/training/run")
+def api_training_run():
+    """
+    Lance un job maintenant (label | sgd | mc | calibrate); ignoré s'il est déjà en file/en cours.
+
+    Exemples:
+    - curl -X POST "http://localhost:5000/api/training/run" -H "Content-Type: application/json" -d '{"job":"sgd"}'
+    """
+    j = request.get_json(silent=True) or {}
+    name = str(j.get("job") or "")
+    pool = _training_pool()
+    if pool is None:
+        return jsonify({"ok": False, "error": "training pool not running here"}), 409
+    jobs = _training_jobs()
+    if name not in jobs:
+        return jsonify({"ok": False, "error": f"unknown job {name!r}", "jobs": sorted(jobs)}), 400
+    return jsonify({"ok": True, "job": name, "queued": pool.submit_job(jobs[name][1]())})
+
+
+def _bandit_eval_defaults() -> dict:
+    """Valeurs de decide pour les clés absentes d'un bras + coûts aller-retour."""
+    P = _params_snapshot()
+    return {
+        "PBUY": P.pbuy,
+        "PSELL": P.psell,
+        "TP_ATR_MULT": P.tp_atr_mult,
+        "SL_ATR_MULT": P.sl_atr_mult,
+        "MIN_EV_NET": P.min_ev_net,
+        "MIN_TP_PCT": P.min_tp_pct,
+        "MIN_SL_PCT": P.min_sl_pct,
+        "PBUY_OFF_HOURS_ADD": P.pbuy_off_hours_add,
+        "COST": float(_costs_snapshot().get("total", 0.0)),
+    }
+
+
+def _publish_bandit_eval(res):
+    if (res or {}).get("ok"):
+        kv_set("bandit_eval_last", {**res, "finished_at": time.time()})
+
+
+@app.get("/api/bandit/eval")
+def api_bandit_eval_get():
+    """
+    Dernière évaluation contrefactuelle des bras (bandit_eval.py) + état du job.
+
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/bandit/eval"
+    """
+    pool = _training_pool()
+    job = ((pool.status()["jobs"].get("bandit_eval") if pool is not None else None) or {})
+    return jsonify({"ok": True, "job": job, "result": kv_get("bandit_eval_last", None)})
+
+
+@app.post("/api/bandit/eval")
+def api_bandit_eval_run():
+    """
+    Rejoue examples + prix enregistrés sous chaque bras (actuels, ``arms`` et/ou ``grid``)
+    et les politiques du bandit, en tâche de fond dans le pool d'entraînement.
+
+    Body JSON (tout optionnel): {"arms": [{"id","cfg"}], "grid": {"PBUY": [..], ...},
+    "base": {...}, "current": true, "days": 30, "horizon_s": 600,
+    "policies": ["ucb1","thompson","swucb"], "seeds": 3}
+
+    Exemples:
+    - curl -X POST "http://localhost:5000/api/bandit/eval" -H "Content-Type: application/json" -d '{"grid":{"PBUY":[0.6,0.65,0.7],"TP_ATR_MULT":[0.6,0.8,1.0]}}'
+    """
+    j = request.get_json(silent=True) or {}
+    pool = _training_pool()
+    if pool is None:
+        return jsonify({"ok": False, "error": "training pool not running here"}), 409
+    arms = []
+    if j.get("current", True):
+        arms += [{"id": a.id, "cfg": a.cfg} for a in _bandit_table().arms]
+    for a in j.get("arms") or []:
+        if isinstance(a, dict) and isinstance(a.get("cfg"), dict):
+            arms.append({"id": str(a.get("id") or f"arm_{len(arms)}"), "cfg": a["cfg"]})
+    grid, base = j.get("grid") or {}, j.get("base") or {}
+    if not isinstance(grid, dict) or not isinstance(base, dict):
+        return jsonify({"ok": False, "error": "grid / base must be objects"}), 400
+    try:
+        n_grid = bandit_eval.grid_size(grid) if grid else 0
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    # taille vérifiée avant de construire le produit cartésien
+    if len(arms) + n_grid > 500:
+        return jsonify({"ok": False, "error": "too many arms (max 500)"}), 400
+    if n_grid:
+        arms += bandit_eval.expand_grid(dict(base), grid)
+    if not arms:
+        return jsonify({"ok": False, "error": "no arms"}), 400
+    P = _params_snapshot()
+    job = TrainingPool.job(
+        "bandit_eval",
+        training_jobs.eval_bandit_arms,
+        DB_PATH,
+        arms,
+        _bandit_eval_defaults(),
+        float(j["days"]) if j.get("days") else None,
+        float(j.get("horizon_s") or 600),
+        tuple(j.get("policies") or ("ucb1", "thompson", "swucb")),
+        int(j.get("seeds") or 3),
+        P.bandit_epsilon,
+        P.bandit_window,
+        priority=5,
+        on_done=_publish_bandit_eval,
+    )
+    return jsonify({"ok": True, "arms": len(arms), "queued": pool.submit_job(job)})
 
 
 def api_drift_check():
     j = request.get_json(silent=True) or {}
-    days = int(j.get("days", 7))
+    window = int(j.get("window", 500))
     apply_changes = bool(j.get("apply", False))
+    if apply_changes and APP_ROLE == "web":
+        return _engine_forward("api_drift_check")
 
-    with app.test_request_context(f"/api/metrics/reliability?days={days}&bins=10"):
-        rel = json.loads(api_metrics_reliability().get_data(as_text=True))
-    if not rel.get("ok"):
-        return jsonify({"ok": False, "error": "reliability failed"}), 500
-    brier = rel.get("brier")
-    bins = rel.get("bins", [])
+    # Brier + bins de calibration des ``window`` derniers labels (monitor, sans requête)
+    mon = model_monitor_get()
+    brier = mon.brier(window)
+    bins = [b for b in mon.calibration_bins(window) if b["count"]]
     if brier is None or not bins:
         return jsonify({"ok": True, "suggestions": [], "brier": brier})
 
@@ -11926,20 +12624,29 @@ def api_drift_check():
     if apply_changes and suggestions:
         for s in suggestions:
             _PARAMS[s["param"]] = s["new"]
+        params_changed()
 
     return jsonify(
         {
             "ok": True,
+            "window": window,
             "brier": brier,
             "slope": slope,
             "bias": bias,
             "suggestions": suggestions,
             "applied": apply_changes,
+            "windows": mon.summary()["windows"],
+            "psi": mon.psi(),
         }
     )
 
 
 def api_research_gridsearch():
+    """
+    Grille PBUY x VOL_MIN x TP_ATR_MULT x SL_ATR_MULT sur les exemples labellisés
+    (gridsearch.py): sorties TP/SL/timeout simulées sur les chemins de prix stockés.
+    Lancée en job: le résultat (50 meilleurs points + avg_cost) est sur /api/jobs/<id>.
+    """
     j = request.get_json(silent=True) or {}
     grid = {
         "PBUY": j.get("PBUY", [float(_PARAMS.get("PBUY", 0.6))]),
@@ -11947,6 +12654,16 @@ def api_research_gridsearch():
         "TP_ATR_MULT": j.get("TP_ATR_MULT", [float(_PARAMS.get("TP_ATR_MULT", 0.6))]),
         "SL_ATR_MULT": j.get("SL_ATR_MULT", [float(_PARAMS.get("SL_ATR_MULT", 0.6))]),
     }
+    try:
+        grid = {k: [float(x) for x in (v if isinstance(v, list) else [v])] for k, v in grid.items()}
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "grid values must be numbers"}), 400
+    # taille vérifiée avant de soumettre le job (un dict résultat par point, trié)
+    n_grid = bandit_eval.grid_size(grid)
+    if n_grid > gridsearch.MAX_GRID_POINTS:
+        return jsonify(
+            {"ok": False, "error": f"grid too large ({n_grid} points, max {gridsearch.MAX_GRID_POINTS})"}
+        ), 400
     cost = j.get("cost", {})
     fee_b = float(cost.get("fee_buy", _PARAMS.get("FEE_RATE_BUY", 0.001)))
     fee_s = float(cost.get("fee_sell", _PARAMS.get("FEE_RATE_SELL", 0.001)))
@@ -11954,80 +12671,206 @@ def api_research_gridsearch():
     buff = float(cost.get("buffer", _PARAMS.get("FEE_BUFFER_PCT", 0.0002)))
     avg_cost = fee_b + fee_s + 2 * slip + buff
 
-    rows = _q(
-        """
-      SELECT
-        CAST(p_up AS REAL), outcome, CAST(ret_k AS REAL),
-        CAST(atr_pct AS REAL), CAST(tp_pct AS REAL), CAST(sl_pct AS REAL)
-      FROM examples
-      WHERE outcome IS NOT NULL
-    """
+    params = {
+        "grid": grid,
+        "defaults": {**_bandit_eval_defaults(), "COST": avg_cost},
+        "horizon_s": float(j.get("horizon_s", 600.0)),
+    }
+    return _submit_job("gridsearch", params)
+
+
+# --- jobs de recherche asynchrones (jobs.py): id immédiat, suivi sur /api/jobs/<id> ---
+def _job_gridsearch(ctx, grid, defaults, horizon_s=600.0):
+    res = gridsearch.run(DB_PATH, grid, defaults, horizon_s=horizon_s, progress=ctx.progress)
+    if res.get("ok"):
+        res["results"] = res["results"][:50]
+        res["avg_cost"] = defaults["COST"]
+    return res
+
+
+def _job_backfill_snapshots(ctx, limit=1500):
+    n = backfill_snapshots_from_prices(limit, progress=ctx.progress)
+    if n is None:
+        return {"ok": False, "msg": "no prices"}
+    return {"ok": True, "inserted": n}
+
+
+def _job_backfill_ohlc(ctx, tf="1m", limit=1000):
+    return {"ok": True, "inserted": backfill_snapshots_from_ohlc(tf, int(limit), progress=ctx.progress)}
+
+
+def _job_walkforward(ctx, grid=None, horizon_s=600.0, train_days=7.0, test_days=1.0,
+                     step_days=None, anchored=False, min_count=30, workers=None):
+    """Walk-forward PBUY/VOL_MIN/TP/SL sur les exemples labellisés (walkforward.py)."""
+    P = _params_snapshot()
+    grid = grid or {
+        "PBUY": [round(P.pbuy + d, 3) for d in (-0.04, -0.02, 0.0, 0.02, 0.04)],
+        "VOL_MIN": [0.0, float(_PARAMS.get("VOL_MIN", 0.0025))],
+        "TP_ATR_MULT": [0.4, 0.6, 0.8, 1.0, 1.2],
+        "SL_ATR_MULT": [0.4, 0.6, 0.8, 1.0],
+    }
+    workers = int(workers or env_str("GRIDSEARCH_WORKERS") or min(4, os.cpu_count() or 1))
+    return walkforward.walk_forward_examples(
+        DB_PATH, grid, _bandit_eval_defaults(), horizon_s, train_days, test_days, step_days,
+        anchored, min_count, workers, progress=ctx.progress,
     )
-    data = []
-    for p, outc, r, atrp, tp, sl in rows:
-        p = _safe_float(p, None)
-        r = _safe_float(r, None)
-        atrp = _safe_float(atrp, None)
-        tp = _safe_float(tp, None)
-        sl = _safe_float(sl, None)
-        if None in (p, r, atrp, tp, sl):
-            continue
-        data.append((p, outc, r, atrp, tp, sl))
-    if not data:
-        return jsonify({"ok": False, "error": "no labeled examples"}), 400
 
-# [MOVED IMPORT]     import itertools
 
-    results = []
-    for PBUY, VOL_MIN, TPM, SLM in itertools.product(
-        grid["PBUY"], grid["VOL_MIN"], grid["TP_ATR_MULT"], grid["SL_ATR_MULT"]
-    ):
-        PBUY = float(PBUY)
-        VOL_MIN = float(VOL_MIN)
-        TPM = float(TPM)
-        SLM = float(SLM)
-        subset = [
-            (p, outc, r, atrp, tp, sl)
-            for (p, outc, r, atrp, tp, sl) in data
-            if (p >= PBUY and atrp >= VOL_MIN)
-        ]
-        if not subset:
-            results.append(
-                {
-                    "PBUY": PBUY,
-                    "VOL_MIN": VOL_MIN,
-                    "TP_ATR_MULT": TPM,
-                    "SL_ATR_MULT": SLM,
-                    "count": 0,
-                    "expectancy": None,
-                    "hit_rate": None,
-                }
-            )
-            continue
-        rets = [_safe_float(r, 0.0) for _, _, r, _, _, _ in subset]
-        exp = (sum(rets) / len(rets)) - avg_cost
-        wins = sum(1 for _, o, _, _, _, _ in subset if o == "tp")
-        losses = sum(1 for _, o, _, _, _, _ in subset if o == "sl")
-        hr = wins / max(1, (wins + losses)) if (wins + losses) > 0 else None
-        results.append(
-            {
-                "PBUY": PBUY,
-                "VOL_MIN": VOL_MIN,
-                "TP_ATR_MULT": TPM,
-                "SL_ATR_MULT": SLM,
-                "count": len(subset),
-                "expectancy": exp,
-                "hit_rate": hr,
-            }
-        )
-    results.sort(
-        key=lambda x: (
-            x["expectancy"] if x["expectancy"] is not None else -1e9,
-            x["count"],
-        ),
-        reverse=True,
+MONTECARLO_MAX_SET_DAYS = float(os.getenv("MONTECARLO_MAX_SET_DAYS", "1500"))
+
+
+def _job_montecarlo(ctx, source="trades", sets=None, days=30.0, n_paths=10000, block=None,
+                    history_days=None, seed=None):
+    """Bootstrap par blocs des roundtrips du ledger ou des bougies 1m (montecarlo.py)."""
+    P = _params_snapshot()
+    base = {
+        "MIN_TP_PCT": P.min_tp_pct,
+        "MIN_SL_PCT": P.min_sl_pct,
+        "PBUY": P.pbuy,
+        "BUY_PCT": P.buy_pct,
+        "DAILY_LOSS_LIMIT_PCT": float(_PARAMS.get("DAILY_LOSS_LIMIT_PCT", 0.1)),
+        "MAX_CONSECUTIVE_LOSSES": int(_PARAMS.get("MAX_CONSECUTIVE_LOSSES", 3)),
+        "COST": _bandit_eval_defaults()["COST"],
+    }
+    sets = [{**base, **s} for s in (sets or [{}])]
+    days = float(days)
+    # coût ~ chemins × jours × jeux: on borne chaque facteur (les blocs sont bornés dans montecarlo)
+    if not 0 < days <= 365 or days * len(sets) > MONTECARLO_MAX_SET_DAYS:
+        return {"ok": False, "msg": f"days × sets must be <= {MONTECARLO_MAX_SET_DAYS} (days <= 365)",
+                "days": days, "sets": len(sets)}
+    return montecarlo.run(
+        DB_PATH, source, sets, days, min(int(n_paths), 100_000), block, history_days,
+        base_pbuy=P.pbuy, seed=seed, progress=ctx.progress,
+    )
+
+
+EXIT_SIM_MAX_CONFIGS = int(os.getenv("EXIT_SIM_MAX_CONFIGS", "200"))
+EXIT_SIM_MAX_CELLS = int(os.getenv("EXIT_SIM_MAX_CELLS", "2000000"))
+
+
+def _job_exit_sim(ctx, grid=None, days=None, horizon_s=86400.0, step_s=60.0):
+    """Règles de sortie de ml_tick rejouées sur les entrées enregistrées (exit_sim.py)."""
+    grid = grid or {
+        "STRICT_PROFIT_LOSS_ONLY": [True, False],
+        "TIME_STOP_MIN": [0, 30, 120],
+        "HYS_PCT": [0.0, float(_PARAMS.get("HYS_PCT", 0.015))],
+    }
+    configs = bandit_eval.expand_grid({}, grid, prefix="exit")
+    if len(configs) > EXIT_SIM_MAX_CONFIGS:
+        return {"ok": False, "msg": f"too many configs (> {EXIT_SIM_MAX_CONFIGS})", "n": len(configs)}
+    # entrées × pas bornés: ~7 matrices float64 (N, T) construites dans ce worker
+    return exit_sim.run(
+        DB_PATH, configs, days, float(horizon_s), float(step_s), base=dict(_PARAMS),
+        progress=ctx.progress, max_cells=EXIT_SIM_MAX_CELLS,
+    )
+
+
+def _job_bandit_reset(ctx):
+    ensure_bandit_schema()
+    bandit_seed_default(reset=True)
+    return {"ok": True, "arms": len(_BANDIT)}
+
+
+_JOBS: Optional[JobQueue] = None
+_JOBS_LOCK = threading.Lock()
+
+
+def _job_queue() -> JobQueue:
+    global _JOBS
+    if _JOBS is None:
+        with _JOBS_LOCK:
+            if _JOBS is None:
+                q = JobQueue(
+                    get_db,
+                    max_workers=int(env_str("JOBS_WORKERS") or 2),
+                    ttl_s=float(env_str("JOBS_TTL_S") or 86400),
+                    logger=app.logger,
+                )
+                q.register("gridsearch", _job_gridsearch)
+                q.register("backfill_snapshots", _job_backfill_snapshots)
+                q.register("backfill_ohlc", _job_backfill_ohlc)
+                q.register("bandit_reset", _job_bandit_reset)
+                q.register("walkforward", _job_walkforward)
+                q.register("montecarlo", _job_montecarlo)
+                q.register("exit_sim", _job_exit_sim)
+                _JOBS = q
+    return _JOBS
+
+
+def _submit_job(kind: str, params: dict):
+    job_id, created = _job_queue().submit(kind, params)
+    return (
+        jsonify({"ok": True, "job_id": job_id, "kind": kind, "deduped": not created,
+                 "status_url": f"/api/jobs/{job_id}"}),
+        202,
     )
-    return jsonify({"ok": True, "results": results[:50], "avg_cost": avg_cost})
+
+
+@app.post("/api/jobs")
+def api_jobs_submit():
+    """
+    Soumet un job (gridsearch | backfill_snapshots | backfill_ohlc | bandit_reset | walkforward |
+    montecarlo | exit_sim); un job identique déjà en file/en cours est renvoyé tel quel (deduped=true).
+
+    Exemples:
+    - curl -X POST "http://localhost:5000/api/jobs" -H "Content-Type: application/json" -d '{"kind":"backfill_ohlc","params":{"tf":"1m","limit":1000}}'
+    - curl -X POST "http://localhost:5000/api/jobs" -H "Content-Type: application/json" -d '{"kind":"walkforward","params":{"train_days":7,"test_days":1}}'
+    - curl -X POST "http://localhost:5000/api/jobs" -H "Content-Type: application/json" -d '{"kind":"montecarlo","params":{"source":"trades","days":30,"sets":[{"MIN_TP_PCT":0.008},{"MIN_TP_PCT":0.0105}]}}'
+    - curl -X POST "http://localhost:5000/api/jobs" -H "Content-Type: application/json" -d '{"kind":"exit_sim","params":{"days":14,"grid":{"STRICT_PROFIT_LOSS_ONLY":[true,false],"TIME_STOP_MIN":[0,30]}}}'
+    """
+    j = request.get_json(silent=True) or {}
+    kind = str(j.get("kind") or "")
+    q = _job_queue()
+    if kind not in q.kinds:
+        return jsonify({"ok": False, "error": f"unknown kind {kind!r}", "kinds": q.kinds}), 400
+    params = j.get("params") or {}
+    if not isinstance(params, dict):
+        return jsonify({"ok": False, "error": "params must be an object"}), 400
+    err = q.check_params(kind, params)
+    if err:
+        return jsonify({"ok": False, "error": err, "kind": kind}), 400
+    return _submit_job(kind, params)
+
+
+@app.get("/api/jobs")
+def api_jobs_list():
+    """
+    Derniers jobs (sans les résultats).
+
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/jobs?state=running&limit=20"
+    """
+    a = request.args or {}
+    limit = max(1, min(500, int(a.get("limit", 50))))
+    return jsonify({"ok": True, "jobs": _job_queue().list(limit, a.get("state") or None)})
+
+
+@app.get("/api/jobs/<job_id>")
+def api_jobs_get(job_id):
+    """
+    État, progression (0..1), message, résultat ou erreur d'un job.
+
+    Exemples:
+    - curl -X GET "http://localhost:5000/api/jobs/<id>"
+    """
+    job = _job_queue().get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "unknown or expired job"}), 404
+    return jsonify({"ok": True, "job": job})
+
+
+@app.post("/api/jobs/<job_id>/cancel")
+def api_jobs_cancel(job_id):
+    """
+    Annule un job en file ou en cours (arrêt au prochain point de progression).
+
+    Exemples:
+    - curl -X POST "http://localhost:5000/api/jobs/<id>/cancel"
+    """
+    q = _job_queue()
+    if q.get(job_id) is None:
+        return jsonify({"ok": False, "error": "unknown or expired job"}), 404
+    return jsonify({"ok": True, "cancel_requested": q.cancel(job_id)})
 
 
 def _auto_loop():
@@ -12065,7 +12908,10 @@ def _auto_loop():
             # 1) cycle stratégie
             decide_and_maybe_trade()
 
-            # 2) tâches périodiques
+            # 2) tâches périodiques: dans le pool d'entraînement s'il tourne (leader),
+            #    sinon inline comme avant (TRAINING_POOL=0)
+            if _start_training_once() is not None:
+                continue
             now = time.time()
 
             # --- labeling (toutes ~90s)
@@ -12202,6 +13048,8 @@ def _feed_price(mid: float, source: str = "na"):
                 TICKER_CACHE.update({"last": mid, "ts": time.time(), "source": source})
         except Exception:
             pass
+        _publish_shared_state()
+        _exit_watch_on_price(mid, source)
     except Exception:
         pass
 
@@ -12250,8 +13098,12 @@ def _ws_bookticker_worker(symbol: str):
 def api_price_stream_start():
     symbol = (request.args.get("symbol") or "BTCUSDT").upper()
     global WS_THREAD, WS_STOP
+    if APP_ROLE == "web":
+        return _engine_forward("api_price_stream_start")
     if websocket is None:
         return jsonify(ok=False, error="websocket-client non installé"), 500
+    if not _is_leader():
+        return jsonify(ok=False, error="not leader", leader=_leader_lease().info()), 409
     if WS_THREAD and WS_THREAD.is_alive():
         return jsonify(ok=True, message="already running", symbol=symbol)
     WS_STOP.clear()
@@ -12264,6 +13116,8 @@ def api_price_stream_start():
 
 def api_price_stream_stop():
     global WS_THREAD, WS_STOP
+    if APP_ROLE == "web":
+        return _engine_forward("api_price_stream_stop")
     try:
         WS_STOP.set()
         if WS_THREAD and WS_THREAD.is_alive():
@@ -12603,6 +13457,23 @@ if 'app' in globals() and callable(getattr(app, 'route', None)):
 
 
 
+# Auto-start à l'import, une fois tout le module défini (_start_leader_loops appelle des
+# fonctions définies plus haut, dont _start_engine_once); sinon au 1er before_request.
+if str(os.getenv("AUTO_TRADE_ENABLED", "1")).strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+):
+    try:
+        start_background_loops_once()
+        LOG_BUFFER.append("[bg] start_background_loops_once() called at import")
+    except Exception as e:
+        LOG_BUFFER.append(f"[bg-start-at-import-error] {e}")
+else:
+    LOG_BUFFER.append("[bg] AUTO_TRADE_ENABLED=0 -> autostart skipped")
+
+
 # --- __main__ entrypoint(s) moved to the end by cleanup ---
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5000"))
@@ -0,0 +1,437 @@
+"""
+Event-driven backtester: the live decide_and_maybe_trade + ml_tick code driven
+by a simulated clock over historical 1m candles.
+
+app.py is imported with ``APP_ROLE=backtest`` (no background loops, no shared
+memory, always leader) and ``DB_PATH`` pointing at a fresh simulation database,
+so fills, snapshots (equity), decision traces and examples are written by the
+production code in the production schema. Three pieces are swapped in:
+
+- clock     ``SimClock``: ``time.time()``, ``datetime.utcnow()/now()`` and
+            ``date.today()`` as seen by app.py follow the simulated time;
+- data      ``CandleFeed``: closed candles from the local store (klines_1m of
+            feature_store.py) replace fetch_ohlc / get_latest_price, and the
+            point-in-time features_1m rows replace feature_store_live;
+- execution ``PaperExecution``: paper fills at the current price moved by the
+            slippage of ``_costs_snapshot`` (fees stay those of _paper_buy/_paper_sell).
+
+Each candle is walked open -> first extreme -> second extreme -> close (low
+first on an up candle); exits run through ml_tick at every point and
+decide_and_maybe_trade runs at the close, so cooldowns, MAX_ORDERS_PER_HOUR,
+risk cool-offs and multi-lot exits behave as live at one decision per minute.
+
+The probability comes from the live ``apply_trade_patch`` by default;
+``RecordedSignal`` replays the p_up recorded in decision_trace instead.
+
+    python backtest.py --source data/app.db --from 2025-01-01 --to 2025-04-01 \\
+        --cash 1000 --params '{"PBUY": 0.62}' --out /tmp/bt.db
+"""
+from __future__ import annotations
+import argparse
+import bisect
+import datetime as _dt
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time as _time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import feature_store
+
+log = logging.getLogger("backtest")
+
+# tables recopiées de la base source: modèles, calibration, presets du bandit
+COPY_TABLES = ("kv", "model_blobs", "bandit_arms")
+# seules ces clés de kv sont reprises (pas de pause/cash/état autotrade de la prod)
+COPY_KV_KEYS = ("mc_model_v1", "sgd_model", "calib_stats_v1")
+# globals moteur qu'app.py ne crée qu'au démarrage des boucles live: valeurs d'un moteur neuf
+ENGINE_GLOBALS: Dict[str, Callable[[], Any]] = {
+    "STATE": dict,
+    "POS_LOCK": threading.RLock,
+    "RISK_LOCK": threading.RLock,
+    "TICKER_LOCK": threading.RLock,
+    "LEARNING_MODE": bool,
+    "LOT_SEQ": int,
+    "REINVEST_POOL": float,
+}
+# paramètres imposés: pas de budget temps réel, sorties évaluées par ml_tick ici
+SIM_PARAMS = {"TICK_BUDGET_S": 0, "EXIT_WATCH_ENABLED": False}
+
+
+# ---------- horloge ----------
+
+
+class SimClock:
+    def __init__(self, t0: float = 0.0):
+        self.now = float(t0)
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, t: float):
+        self.now = float(t)
+
+
+class _TimeShim:
+    """Module ``time`` dont seul ``time()`` suit l'horloge simulée."""
+
+    def __init__(self, clock: SimClock):
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.now
+
+    def __getattr__(self, name):
+        return getattr(_time, name)
+
+
+def _sim_datetime(clock: SimClock):
+    class SimDatetime(_dt.datetime):
+        @classmethod
+        def utcnow(cls):
+            return _dt.datetime.utcfromtimestamp(clock.now)
+
+        @classmethod
+        def now(cls, tz=None):
+            return _dt.datetime.fromtimestamp(clock.now, tz)
+
+    return SimDatetime
+
+
+def _sim_date(clock: SimClock):
+    class SimDate(_dt.date):
+        @classmethod
+        def today(cls):
+            return _dt.date.fromtimestamp(clock.now)
+
+    return SimDate
+
+
+# ---------- données ----------
+
+
+class CandleFeed:
+    """Bougies 1m du store local (klines_1m), servies au format de fetch_ohlc."""
+
+    def __init__(self, conn, symbol: str, t_from: float, t_to: float, warmup_min: int = 240):
+        self.symbol = symbol
+        self.warmup = int(warmup_min)
+        m0 = int(t_from // 60) * 60
+        self.kl = feature_store.load_klines(conn, symbol, m0 - self.warmup * 60, int(t_to))
+        self.items = [
+            {"t": int(m * 1000), "open": o, "high": h, "low": lo, "close": c}
+            for m, o, h, lo, c in self.kl.tolist()
+        ]
+        self.start = int(np.searchsorted(self.kl[:, 0], m0)) if len(self.items) else 0
+        self.i = self.start
+
+    def __len__(self) -> int:
+        return len(self.items) - self.start
+
+    def path(self, i: int):
+        """(décalage s, prix) dans la bougie i: open, extrêmes (bas d'abord si hausse), close."""
+        m, o, h, lo, c = self.kl[i].tolist()
+        first, second = (lo, h) if c >= o else (h, lo)
+        return m, ((0.0, o), (20.0, first), (40.0, second), (59.0, c))
+
+    def ohlc(self, limit: int) -> List[Dict[str, float]]:
+        """``limit`` dernières bougies jusqu'à la courante incluse (aucune bougie future)."""
+        return self.items[max(0, self.i + 1 - int(limit)) : self.i + 1]
+
+
+class RecordedSignal:
+    """p_up enregistré (decision_trace) à la place d'apply_trade_patch; taille = cash * BUY_PCT."""
+
+    def __init__(self, conn, t_from: float, t_to: float, clock: SimClock):
+        rows = conn.execute(
+            "SELECT CAST(ts AS REAL), CAST(p_up AS REAL) FROM decision_trace "
+            "WHERE ts BETWEEN ? AND ? AND p_up IS NOT NULL ORDER BY ts",
+            (float(t_from) - 3600.0, float(t_to)),
+        ).fetchall()
+        self.ts = [r[0] for r in rows]
+        self.p = [r[1] for r in rows]
+        self.clock = clock
+
+    def __call__(self, STATE, PARAMS, price, costs_fn, trace_fn, kv_get):
+        j = bisect.bisect_right(self.ts, self.clock.now) - 1
+        if j < 0:
+            return 0.5, 0.0, "no_signal"
+        cash = float(STATE.get("cash") or 0.0)
+        return float(self.p[j]), cash * float(PARAMS.get("BUY_PCT", 0.25)), None
+
+
+# ---------- exécution ----------
+
+
+class PaperExecution:
+    """Fills papier au prix courant ± slippage de _costs_snapshot."""
+
+    def __init__(self, slippage: Optional[float] = None):
+        self.slippage = slippage
+
+    def install(self, bt: "Backtest"):
+        core = bt.core
+        buy, sell = core._paper_buy, core._paper_sell
+
+        def slip() -> float:
+            if self.slippage is not None:
+                return float(self.slippage)
+            return float(core._costs_snapshot().get("slip") or 0.0)
+
+        def _paper_buy(usd_amt, price=None):
+            px = float(price or core.STATE.get("price") or 0.0)
+            return buy(usd_amt, px * (1.0 + slip()))
+
+        def _paper_sell(qty, price=None):
+            px = float(price or core.STATE.get("price") or 0.0)
+            return sell(qty, px * (1.0 - slip()))
+
+        bt.patch("_paper_buy", _paper_buy)
+        bt.patch("_paper_sell", _paper_sell)
+
+
+# ---------- moteur ----------
+
+
+class Backtest:
+    def __init__(
+        self,
+        core,
+        feed: CandleFeed,
+        clock: Optional[SimClock] = None,
+        execution: Optional[PaperExecution] = None,
+        signal: Optional[Callable] = None,
+        features_conn=None,
+    ):
+        self.core = core
+        self.feed = feed
+        self.clock = clock or SimClock()
+        self.execution = execution or PaperExecution()
+        self.signal = signal
+        self.features_conn = features_conn
+        self._saved: Dict[str, Any] = {}
+        self.results: Dict[str, int] = {}
+
+    def patch(self, name: str, value):
+        if name not in self._saved:
+            self._saved[name] = getattr(self.core, name, None)
+        setattr(self.core, name, value)
+
+    def install(self):
+        core, feed, clock = self.core, self.feed, self.clock
+        self.patch("SYMBOL", feed.symbol)
+        self.patch("time", _TimeShim(clock))
+        self.patch("datetime", _sim_datetime(clock))
+        self.patch("date", _sim_date(clock))
+        self.patch("fetch_ohlc", lambda symbol, interval, limit, timeout_s=10.0: feed.ohlc(limit))
+        self.patch("get_latest_price", lambda: float(core.STATE.get("price") or 0.0))
+        if self.features_conn is not None:
+            sym = feed.symbol
+            self.patch(
+                "feature_store_live",
+                lambda symbol, now=None, cached_only=False: feature_store.asof(
+                    self.features_conn, sym, clock.now if now is None else now, max_age_s=180
+                ),
+            )
+        else:
+            self.patch("feature_store_live", lambda symbol, now=None, cached_only=False: None)
+        if self.signal is not None:
+            self.patch("apply_trade_patch", self.signal)
+        self.execution.install(self)
+
+    def restore(self):
+        for k, v in self._saved.items():
+            setattr(self.core, k, v)
+        self._saved.clear()
+
+    def reset_account(self, cash: float):
+        core = self.core
+        for name, make in ENGINE_GLOBALS.items():
+            if getattr(core, name, None) is None:
+                setattr(core, name, make())
+        core.POSITIONS = []
+        core.ORDERS_LAST_HOUR = deque()
+        core.LOT_INDEX.clear()
+        core.POSITION = {}
+        core.ENTRY_PRICE = None
+        core.PEAK_PRICE = None
+        core.LAST_ORDER_TS = None
+        core._TICK_CACHE.clear()
+        px = float(self.feed.kl[self.feed.start, 1]) if len(self.feed) else 0.0
+        core.STATE.update(
+            {"cash": float(cash), "position_qty": 0.0, "in_position": False,
+             "entries_count": 0, "price": px, "price_prev": px, "p_up": 0.5, "ev": 0.0}
+        )
+        core.account_snapshot_write(
+            ts=self.clock.now, price=px, cash=float(cash), position_qty=0.0, valuation=float(cash)
+        )
+
+    def run(self, cash: float = 1000.0, params: Optional[Dict[str, Any]] = None,
+            progress_every: int = 0) -> Dict[str, Any]:
+        core, feed, clock = self.core, self.feed, self.clock
+        if not len(feed):
+            return {"ok": False, "error": "no candles in range"}
+        clock.set(float(feed.kl[feed.start, 0]))
+        saved_params = dict(core.params_update().raw)
+        core.params_update({**SIM_PARAMS, **(params or {})})
+        self.install()
+        t0 = _time.perf_counter()
+        try:
+            self.reset_account(cash)
+            for n, i in enumerate(range(feed.start, len(feed.items))):
+                feed.i = i
+                m, path = feed.path(i)
+                for dt, px in path:
+                    clock.set(m + dt)
+                    core.set_price(px, source="backtest")
+                    if dt < 59.0:
+                        core.ml_tick(px, float(core.STATE.get("p_up") or 0.5))
+                try:
+                    res = core.decide_and_maybe_trade() or {}
+                except Exception as e:
+                    res = {"error": type(e).__name__}
+                    log.debug("decide failed at %s: %s", clock.now, e)
+                key = res.get("enter") or res.get("skipped") or res.get("error") or "hold"
+                self.results[key] = self.results.get(key, 0) + 1
+                if progress_every and n % progress_every == 0:
+                    log.info("[backtest] %s / %s candles", n, len(feed))
+        finally:
+            self.restore()
+            core.params_update(saved_params, replace=True)
+        return {
+            "ok": True,
+            "candles": len(feed),
+            "decisions": dict(sorted(self.results.items(), key=lambda kv: -kv[1])),
+            "seconds": round(_time.perf_counter() - t0, 2),
+            "open_lots": len(core.POSITIONS),
+        }
+
+
+# ---------- résultats ----------
+
+
+def summarize(conn) -> Dict[str, Any]:
+    """Trades, frais, valorisation et drawdown lus dans la base de simulation."""
+    out: Dict[str, Any] = {}
+    r = conn.execute(
+        "SELECT COUNT(*), SUM(CASE WHEN UPPER(side)='BUY' THEN 1 ELSE 0 END), COALESCE(SUM(fee),0) FROM trades"
+    ).fetchone()
+    out["trades"], out["buys"], out["fees"] = int(r[0] or 0), int(r[1] or 0), float(r[2] or 0.0)
+    val = np.array(
+        [v for (v,) in conn.execute(
+            "SELECT valuation FROM snapshots WHERE valuation IS NOT NULL ORDER BY ts"
+        ).fetchall()],
+        dtype=float,
+    )
+    if val.size:
+        peak = np.maximum.accumulate(val)
+        out.update(
+            start_valuation=float(val[0]),
+            end_valuation=float(val[-1]),
+            return_pct=float(val[-1] / val[0] - 1.0) if val[0] > 0 else None,
+            max_drawdown_pct=float(((peak - val) / np.where(peak > 0, peak, np.nan)).max()),
+        )
+    return out
+
+
+def _copy_tables(dst: sqlite3.Connection, src_path: str, tables: Sequence[str] = COPY_TABLES,
+                 kv_keys: Sequence[str] = COPY_KV_KEYS):
+    dst.execute("ATTACH DATABASE ? AS src", (src_path,))
+    try:
+        for t in tables:
+            src_cols = [r[1] for r in dst.execute(f"PRAGMA src.table_info({t})").fetchall()]
+            dst_cols = [r[1] for r in dst.execute(f"PRAGMA main.table_info({t})").fetchall()]
+            cols = [c for c in src_cols if c in dst_cols] if dst_cols else src_cols
+            if not cols:
+                continue
+            if not dst_cols:
+                dst.execute(f"CREATE TABLE main.{t} AS SELECT * FROM src.{t} WHERE 0")
+            cl = ",".join(cols)
+            where, args = "", ()
+            if t == "kv":
+                # schéma kv(key,value) ou historique kv(k,v)
+                kcol = "key" if "key" in cols else "k"
+                where = f" WHERE {kcol} IN ({','.join('?' * len(kv_keys))})"
+                args = tuple(kv_keys)
+            dst.execute(f"INSERT OR REPLACE INTO main.{t}({cl}) SELECT {cl} FROM src.{t}{where}", args)
+        dst.commit()
+    finally:
+        dst.execute("DETACH DATABASE src")
+
+
+def _ts(s: str) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        d = _dt.datetime.fromisoformat(s)
+        if d.tzinfo is None:
+            d = d.replace(tzinfo=_dt.timezone.utc)
+        return d.timestamp()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Backtest du moteur live sur bougies 1m (klines_1m)")
+    ap.add_argument("--source", required=True, help="base contenant klines_1m / features_1m / kv")
+    ap.add_argument("--symbol", default="BTCUSDT")
+    ap.add_argument("--from", dest="t_from", required=True, help="ISO (UTC) ou epoch s")
+    ap.add_argument("--to", dest="t_to", required=True)
+    ap.add_argument("--cash", type=float, default=1000.0)
+    ap.add_argument("--params", default="{}", help="surcharges _PARAMS (JSON)")
+    ap.add_argument("--signal", choices=("live", "recorded"), default="live")
+    ap.add_argument("--slippage", type=float, default=None, help="défaut: _costs_snapshot()['slip']")
+    ap.add_argument("--out", default=None, help="base de simulation (défaut: fichier temporaire)")
+    a = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    out = a.out or os.path.join(tempfile.mkdtemp(prefix="backtest-"), "sim.db")
+    if os.path.exists(out):
+        os.remove(out)
+    # avant l'import d'app.py: base et rôle de simulation
+    os.environ.update(
+        DB_PATH=out,
+        DATA_DIR=os.path.dirname(os.path.abspath(out)),
+        APP_ROLE="backtest",
+        AUTO_TRADE_ENABLED="0",
+        START_CASH=str(a.cash),
+    )
+    import app as core
+
+    core.app.logger.setLevel(logging.WARNING)
+    core.init_db()
+    sim = core.get_db()
+    try:
+        _copy_tables(sim, a.source)
+    finally:
+        sim.close()
+
+    t_from, t_to = _ts(a.t_from), _ts(a.t_to)
+    src = sqlite3.connect(f"file:{a.source}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        sym = core._symbol_norm(a.symbol)
+        feed = CandleFeed(src, sym, t_from, t_to)
+        clock = SimClock(t_from)
+        signal = RecordedSignal(src, t_from, t_to, clock) if a.signal == "recorded" else None
+        bt = Backtest(core, feed, clock=clock, execution=PaperExecution(a.slippage),
+                      signal=signal, features_conn=src)
+        res = bt.run(a.cash, json.loads(a.params), progress_every=10000)
+    finally:
+        src.close()
+    conn = sqlite3.connect(out)
+    try:
+        res["summary"] = summarize(conn)
+    finally:
+        conn.close()
+    res["db"] = out
+    print(json.dumps(res, indent=2))
+    return 0 if res.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,396 @@
+"""
+Bandit over the threshold presets (``bandit_arms``), held in memory.
+
+The arm table is loaded once with its ``cfg_json`` already parsed; choosing an
+arm is a loop over a handful of floats and never touches SQLite. Rewards are
+accumulated as deltas and written back by ``sync`` (periodic thread + atexit) as
+``pulls = pulls + ?`` increments, so several processes sharing the database
+merge their counts instead of overwriting each other; ``sync`` then reloads the
+totals, which is how a process that does not trade sees the leader's updates.
+
+Policies (``make_policy``):
+- ``ucb1``     UCB1 with epsilon exploration (historical behaviour);
+- ``thompson`` Thompson sampling, Gaussian rewards (posterior N(mean, var/n));
+- ``swucb``    UCB1 over the last ``window`` rewards only (non-stationary market).
+The sliding window lives in memory only: after a restart it refills from new pulls.
+"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+log = logging.getLogger("bandit")
+
+HISTORY_MAX = 10000
+
+
+@dataclass
+class Arm:
+    id: str
+    cfg: Dict[str, Any] = field(default_factory=dict)
+    cfg_json: str = "{}"
+    pulls: int = 0
+    reward_sum: float = 0.0
+    reward_sq: float = 0.0
+    last_update: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.reward_sum / max(1, self.pulls)
+
+    @property
+    def var(self) -> Optional[float]:
+        if self.pulls < 2:
+            return None
+        m = self.reward_sum / self.pulls
+        return max(0.0, (self.reward_sq - self.pulls * m * m) / (self.pulls - 1))
+
+    def row(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "pulls": self.pulls,
+            "reward_sum": self.reward_sum,
+            "reward_sq": self.reward_sq,
+            "last_update": self.last_update,
+            "cfg_json": self.cfg_json,
+        }
+
+
+def _parse_cfg(s: Any) -> Dict[str, Any]:
+    try:
+        cfg = json.loads(s or "{}")
+    except (TypeError, ValueError):
+        return {}
+    return cfg if isinstance(cfg, dict) else {}
+
+
+def ucb1_score(arm: Arm, n_total: int) -> float:
+    pulls = max(1, arm.pulls)
+    return arm.mean + math.sqrt(2.0 * math.log(max(1, n_total)) / pulls)
+
+
+# ---------- politiques ----------
+
+
+class Policy:
+    name = "base"
+
+    def choose(self, arms: Sequence[Arm], n_total: int, rng: random.Random) -> int:
+        raise NotImplementedError
+
+    def observe(self, idx: int, reward: float):
+        pass
+
+    def scores(self, arms: Sequence[Arm], n_total: int) -> List[float]:
+        """Score déterministe par bras (affichage /api/bandit/status)."""
+        return [ucb1_score(a, n_total) for a in arms]
+
+
+class UCB1Epsilon(Policy):
+    name = "ucb1"
+
+    def __init__(self, epsilon: float = 0.03):
+        self.epsilon = float(epsilon)
+
+    def choose(self, arms, n_total, rng):
+        if rng.random() < self.epsilon:
+            return rng.randrange(len(arms))
+        n = max(1, n_total)
+        best, best_ucb = 0, -1e18
+        for i, a in enumerate(arms):
+            u = ucb1_score(a, n)
+            if u > best_ucb:
+                best, best_ucb = i, u
+        return best
+
+
+class GaussianThompson(Policy):
+    """
+    Tire mu_i ~ N(mean_i, var_i / n_i) et joue l'argmax. La variance d'un bras peu
+    tiré est la variance poolée de tous les bras (``prior_var`` à défaut).
+    """
+
+    name = "thompson"
+
+    def __init__(self, prior_var: float = 1.0):
+        self.prior_var = float(prior_var)
+
+    def _pooled(self, arms) -> float:
+        n = sum(a.pulls for a in arms)
+        if n < 2:
+            return self.prior_var
+        s = sum(a.reward_sum for a in arms)
+        sq = sum(a.reward_sq for a in arms)
+        v = (sq - s * s / n) / (n - 1)
+        return v if v > 0.0 else self.prior_var
+
+    def choose(self, arms, n_total, rng):
+        pooled = self._pooled(arms)
+        best, best_draw = 0, -1e18
+        for i, a in enumerate(arms):
+            v = a.var if a.pulls >= 5 else None
+            sd = math.sqrt((v if v else pooled) / max(1, a.pulls))
+            d = rng.gauss(a.mean if a.pulls else 0.0, sd)
+            if d > best_draw:
+                best, best_draw = i, d
+        return best
+
+    def scores(self, arms, n_total):
+        return [a.mean for a in arms]
+
+
+class SlidingWindowUCB(Policy):
+    """UCB1 sur les ``window`` dernières récompenses (compteurs incrémentaux)."""
+
+    name = "swucb"
+
+    def __init__(self, window: int = 500, n_arms: int = 0, history: Sequence = ()):
+        self.window = max(1, int(window))
+        self.buf: deque = deque()
+        self.n: List[int] = [0] * n_arms
+        self.s: List[float] = [0.0] * n_arms
+        for idx, r in list(history)[-self.window :]:
+            self.observe(idx, r)
+
+    def _grow(self, k: int):
+        while len(self.n) < k:
+            self.n.append(0)
+            self.s.append(0.0)
+
+    def observe(self, idx, reward):
+        self._grow(idx + 1)
+        self.buf.append((idx, reward))
+        self.n[idx] += 1
+        self.s[idx] += reward
+        if len(self.buf) > self.window:
+            j, r = self.buf.popleft()
+            self.n[j] -= 1
+            self.s[j] -= r
+
+    def scores(self, arms, n_total):
+        self._grow(len(arms))
+        lw = math.log(max(2, len(self.buf)))
+        return [
+            (self.s[i] / self.n[i] + math.sqrt(2.0 * lw / self.n[i])) if self.n[i] else math.inf
+            for i in range(len(arms))
+        ]
+
+    def choose(self, arms, n_total, rng):
+        sc = self.scores(arms, n_total)
+        return max(range(len(sc)), key=sc.__getitem__)
+
+
+def make_policy(name: str, epsilon: float = 0.03, window: int = 500,
+                prior_var: float = 1.0, n_arms: int = 0, history: Sequence = ()) -> Policy:
+    name = (name or "ucb1").lower()
+    if name in ("thompson", "ts"):
+        return GaussianThompson(prior_var)
+    if name in ("swucb", "sw-ucb", "sliding"):
+        return SlidingWindowUCB(window, n_arms, history)
+    return UCB1Epsilon(epsilon)
+
+
+# ---------- table en mémoire ----------
+
+
+class ArmTable:
+    def __init__(self, policy: Optional[Policy] = None, rng: Optional[random.Random] = None):
+        self.arms: List[Arm] = []
+        self.index: Dict[str, int] = {}
+        self.policy: Policy = policy or UCB1Epsilon()
+        self.policy_key: Any = None
+        self.history: deque = deque(maxlen=HISTORY_MAX)  # (idx, reward), pour swucb
+        self.n_total = 0
+        self.loaded = False
+        self.last_sync = 0.0
+        self._pending: Dict[str, List[float]] = {}  # id -> [pulls, sum, sq, last_update]
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.arms)
+
+    @property
+    def flushing(self) -> bool:
+        return self._flusher is not None
+
+    def set_policy(self, name: str, epsilon: float = 0.03, window: int = 500,
+                   prior_var: float = 1.0):
+        """Reconstruit la politique seulement si ses paramètres changent."""
+        key = ((name or "ucb1").lower(), float(epsilon), int(window), float(prior_var))
+        if key == self.policy_key:
+            return
+        with self._lock:
+            self.policy = make_policy(
+                key[0], key[1], key[2], key[3], len(self.arms), list(self.history)
+            )
+            self.policy_key = key
+
+    def choose(self) -> Optional[Arm]:
+        arms = self.arms
+        if not arms:
+            return None
+        return arms[self.policy.choose(arms, self.n_total, self._rng)]
+
+    def get(self, arm_id: str) -> Optional[Arm]:
+        i = self.index.get(str(arm_id))
+        return None if i is None else self.arms[i]
+
+    def update(self, arm_id: str, reward: float, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else float(now)
+        r = float(reward)
+        with self._lock:
+            i = self.index.get(str(arm_id))
+            if i is None:
+                return False
+            a = self.arms[i]
+            a.pulls += 1
+            a.reward_sum += r
+            a.reward_sq += r * r
+            a.last_update = now
+            self.n_total += 1
+            d = self._pending.setdefault(a.id, [0, 0.0, 0.0, 0.0])
+            d[0] += 1
+            d[1] += r
+            d[2] += r * r
+            d[3] = now
+            self.history.append((i, r))
+            self.policy.observe(i, r)
+        return True
+
+    # ---------- persistance ----------
+
+    def sync(self, conn, discard: bool = False) -> int:
+        """
+        Écrit les deltas en attente puis recharge les totaux (et les bras ajoutés ou
+        retirés ailleurs). ``discard`` jette les deltas (reset de la table).
+        Renvoie le nombre de bras mis à jour.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if discard:
+            pending = {}
+        try:
+            if pending:
+                conn.executemany(
+                    "UPDATE bandit_arms SET pulls=pulls+?, reward_sum=reward_sum+?, "
+                    "reward_sq=COALESCE(reward_sq,0)+?, last_update=MAX(COALESCE(last_update,0),?) "
+                    "WHERE id=?",
+                    [(int(d[0]), d[1], d[2], d[3], k) for k, d in pending.items()],
+                )
+                conn.commit()
+            rows = conn.execute(
+                "SELECT id, pulls, reward_sum, reward_sq, last_update, cfg_json "
+                "FROM bandit_arms ORDER BY id"
+            ).fetchall()
+        except Exception:
+            # rien n'est perdu: les deltas repartent au prochain sync
+            with self._lock:
+                for k, d in pending.items():
+                    cur = self._pending.setdefault(k, [0, 0.0, 0.0, 0.0])
+                    cur[0] += d[0]
+                    cur[1] += d[1]
+                    cur[2] += d[2]
+                    cur[3] = max(cur[3], d[3])
+            raise
+        self.load_rows(rows)
+        return len(pending)
+
+    def load_rows(self, rows):
+        with self._lock:
+            old = {a.id: a for a in self.arms}
+            arms: List[Arm] = []
+            for r in rows:
+                aid, pulls, rsum, rsq, lu, cfg_json = tuple(r)
+                a = old.get(str(aid))
+                if a is None or a.cfg_json != (cfg_json or "{}"):
+                    a = Arm(str(aid), _parse_cfg(cfg_json), cfg_json or "{}")
+                a.pulls = int(pulls or 0)
+                a.reward_sum = float(rsum or 0.0)
+                a.reward_sq = float(rsq or 0.0)
+                a.last_update = float(lu or 0.0)
+                # deltas arrivés pendant l'écriture: pas encore en base
+                d = self._pending.get(a.id)
+                if d:
+                    a.pulls += int(d[0])
+                    a.reward_sum += d[1]
+                    a.reward_sq += d[2]
+                    a.last_update = max(a.last_update, d[3])
+                arms.append(a)
+            if [a.id for a in arms] != [a.id for a in self.arms]:
+                self.history.clear()
+                if self.policy_key is not None:
+                    self.policy = make_policy(*self.policy_key, n_arms=len(arms))
+            self.arms = arms
+            self.index = {a.id: i for i, a in enumerate(arms)}
+            self.n_total = sum(a.pulls for a in arms)
+            self.loaded = True
+            self.last_sync = time.time()
+
+    def start_flusher(self, connect: Callable[[], Any], interval_s: float = 10.0,
+                      logger=None) -> "ArmTable":
+        """Thread de sync périodique + sync final à l'arrêt du process."""
+        if self._flusher is not None:
+            return self
+        lg = logger or log
+
+        def _sync_once():
+            conn = connect()
+            try:
+                self.sync(conn)
+            finally:
+                conn.close()
+
+        def _loop():
+            while not self._stop.wait(max(0.5, float(interval_s))):
+                try:
+                    _sync_once()
+                except Exception as e:
+                    lg.warning(f"[bandit] flush failed: {e}")
+
+        def _final():
+            self._stop.set()
+            if self._pending:
+                try:
+                    _sync_once()
+                except Exception as e:
+                    lg.warning(f"[bandit] final flush failed: {e}")
+
+        self._flusher = threading.Thread(target=_loop, name="bandit-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(_final)
+        return self
+
+    # ---------- état ----------
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            arms = list(self.arms)
+            n_total = max(1, self.n_total)
+            scores = self.policy.scores(arms, n_total)
+            pending = sum(int(d[0]) for d in self._pending.values())
+        out = []
+        for a, sc in zip(arms, scores):
+            out.append({
+                **a.row(),
+                "mean": a.mean,
+                "ucb": ucb1_score(a, n_total),
+                "score": (sc if math.isfinite(sc) else None),
+                "cfg": a.cfg,
+            })
+        return {
+            "arms": out,
+            "n_total": n_total,
+            "policy": self.policy.name,
+            "pending": pending,
+            "last_sync": self.last_sync,
+        }
@@ -0,0 +1,381 @@
+"""
+Offline counterfactual evaluation of bandit arms over recorded history.
+
+Every recorded ``examples`` row is a tick where decide reached the threshold
+stage (price, p_up, atr_pct). For each arm the entry rule of
+decide_and_maybe_trade is replayed on all rows at once:
+
+    enter  if p_up >= PBUY (+ off-hours add) and p_up - 0.5 - cost >= MIN_EV_NET
+    exit   first of TP (entry * (1 + tp)), SL (entry * (1 - sl)),
+           signal (a later example with p_up <= PSELL), timeout (ts + horizon)
+
+with tp/sl = max(MIN_TP/SL_PCT, atr_pct * TP/SL_ATR_MULT) floored by the costs.
+The exits are first-passage queries on the recorded price path
+(common.pricepath), so A arms x N examples cost a few vectorized passes.
+TP and SL crossed at the same recorded point count as SL (conservative).
+An arm holds at most one open lot: an entry signal before the previous exit of
+the same arm is skipped, so trades never overlap and the metrics are per trade.
+
+Per arm: trades, expectancy (net return per trade), hit rate, total return and
+max drawdown of the cumulated returns. The bandit policies of bandit.py are then
+replayed over the same rows (rewards delivered at exit time), which estimates
+what the live policy would have earned with these arms.
+
+Inputs (examples + price paths) are cached per process and reused while the
+database has no new rows, so re-evaluating candidates only redoes the maths.
+"""
+from __future__ import annotations
+import heapq
+import itertools
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import bandit
+import labeler
+from common.pricepath import PricePath, first_passage, merge_windows, pick_source
+
+LIQUID_HOURS = (12, 13, 14, 15, 16, 17, 18, 19, 20)
+EXITS = ("tp", "sl", "signal", "timeout")
+
+_CACHE: Dict[Any, Dict[str, Any]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+# ---------- entrées ----------
+
+
+def _stamp(conn) -> tuple:
+    """Change dès qu'un exemple est ajouté ou labellisé, ou qu'un prix arrive."""
+    out = []
+    for sql in (
+        "SELECT MAX(id) FROM examples",
+        "SELECT COUNT(outcome) FROM examples",
+        "SELECT MAX(CAST(ts AS REAL)) FROM snapshots",
+        "SELECT MAX(COALESCE(CAST(ts AS REAL), CAST(t AS REAL)/1000.0)) FROM prices",
+    ):
+        try:
+            r = conn.execute(sql).fetchone()
+            out.append(r[0] if r else None)
+        except sqlite3.Error:
+            out.append(None)
+    return tuple(out)
+
+
+def load_inputs(conn, days: Optional[float] = None, horizon_s: float = 600.0,
+                now: Optional[float] = None, cache_key: Any = None,
+                labeled_only: bool = False) -> Dict[str, Any]:
+    """
+    Exemples (ts, price, p_up, atr_pct) triés par ts + sources de prix couvrant
+    [ts_min, ts_max + horizon]. Mis en cache sous ``cache_key`` tant que ``_stamp`` ne bouge pas.
+    ``labeled_only``: seulement les exemples dont la fenêtre est close (outcome posé).
+    """
+    now = time.time() if now is None else float(now)
+    since = (now - float(days) * 86400.0) if days else 0.0
+    key = (cache_key, None if not days else round(since / 3600.0), float(horizon_s), labeled_only)
+    stamp = _stamp(conn)
+    if cache_key is not None:
+        with _CACHE_LOCK:
+            hit = _CACHE.get(key)
+        if hit is not None and hit["stamp"] == stamp:
+            return hit
+
+    rows = conn.execute(
+        "SELECT CAST(ts AS REAL), CAST(price AS REAL), CAST(p_up AS REAL), CAST(atr_pct AS REAL) "
+        "FROM examples WHERE CAST(ts AS REAL) >= ? AND price IS NOT NULL AND p_up IS NOT NULL "
+        + ("AND outcome IS NOT NULL " if labeled_only else "")
+        + "ORDER BY ts ASC",
+        (since,),
+    ).fetchall()
+    arr = np.array(
+        [tuple(np.nan if v is None else v for v in r) for r in rows], dtype=float
+    ).reshape(-1, 4)
+    ok = np.isfinite(arr[:, 0]) & (arr[:, 1] > 0.0) & np.isfinite(arr[:, 2])
+    arr = arr[ok]
+    ts, price, p_up = arr[:, 0], arr[:, 1], arr[:, 2]
+    atr_pct = np.nan_to_num(arr[:, 3], nan=0.0)
+
+    paths: List[Optional[PricePath]] = []
+    src = np.zeros(0, dtype=np.int64)
+    if ts.size:
+        paths = labeler.load_label_paths(conn, float(ts[0]), float(ts[-1] + horizon_s))
+        src = pick_source(paths, ts, ts + horizon_s)
+    out = {
+        "stamp": stamp,
+        "ts": ts,
+        "price": price,
+        "p_up": p_up,
+        "atr_pct": atr_pct,
+        "hour": ((ts // 3600.0) % 24).astype(np.int64),
+        "paths": paths,
+        "src": src,
+        # p_up comme série "prix": la sortie signal est un franchissement par le bas
+        "signal": PricePath(ts, close=p_up) if ts.size else None,
+        "horizon_s": float(horizon_s),
+    }
+    if cache_key is not None:
+        with _CACHE_LOCK:
+            _CACHE[key] = out
+    return out
+
+
+# ---------- bras ----------
+
+
+def grid_size(grid: Dict[str, Any]) -> int:
+    """Nombre de bras de ``expand_grid`` sans les construire; ValueError si une valeur n'est pas une liste."""
+    n = 1
+    for k, v in grid.items():
+        if not isinstance(v, (list, tuple)):
+            raise ValueError(f"grid[{k!r}] must be a list")
+        n *= len(v)
+    return n
+
+
+def expand_grid(base: Dict[str, Any], grid: Dict[str, Sequence[Any]], prefix: str = "grid") -> List[Dict[str, Any]]:
+    """Produit cartésien ``grid`` appliqué sur ``base`` -> [{"id", "cfg"}]."""
+    keys = sorted(grid)
+    out = []
+    for vals in itertools.product(*(list(grid[k]) for k in keys)):
+        cfg = {**base, **dict(zip(keys, vals))}
+        tag = ",".join(f"{k}={v}" for k, v in zip(keys, vals))
+        out.append({"id": f"{prefix}[{tag}]", "cfg": cfg})
+    return out
+
+
+def _arm_matrix(arms: Sequence[Dict[str, Any]], defaults: Dict[str, float]) -> Dict[str, np.ndarray]:
+    cols = ("PBUY", "PSELL", "TP_ATR_MULT", "SL_ATR_MULT", "MIN_EV_NET")
+    return {
+        c: np.array([float((a.get("cfg") or {}).get(c, defaults[c])) for a in arms])[:, None]
+        for c in cols
+    }
+
+
+# ---------- simulation ----------
+
+
+def target_pcts(atr_pct: np.ndarray, tp_mult, sl_mult, defaults: Dict[str, float]):
+    """tp/sl de decide: max(MIN_*_PCT, atr_pct * mult), planchers de coûts; défauts sans ATR."""
+    cost = float(defaults["COST"])
+    tp = np.maximum(np.maximum(defaults["MIN_TP_PCT"], atr_pct * tp_mult), cost * 1.2)
+    sl = np.maximum(np.maximum(defaults["MIN_SL_PCT"], atr_pct * sl_mult), cost)
+    tp = np.where(atr_pct > 0.0, tp, max(defaults["MIN_TP_PCT"], 0.0105, cost * 1.2))
+    sl = np.where(atr_pct > 0.0, sl, max(defaults["MIN_SL_PCT"], 0.0065, cost))
+    return tp, sl
+
+
+def simulate_exits(inputs: Dict[str, Any], ni: np.ndarray, tp: np.ndarray, sl: np.ndarray,
+                   cost: float, psell: Optional[np.ndarray] = None):
+    """
+    Sortie de chaque entrée (exemple ``ni`` avec ses ``tp``/``sl``): premier de TP, SL,
+    signal (si ``psell``) et timeout. Renvoie (ret net, t_exit, kind); NaN / -1 sans prix.
+    """
+    ts, price = inputs["ts"], inputs["price"]
+    t0, e = ts[ni], price[ni]
+    t1 = t0 + inputs["horizon_s"]
+    paths, src = inputs["paths"], inputs["src"][ni]
+    t_tp = first_passage(paths, t0, t1, e * (1.0 + tp), up=True, src=src)
+    t_sl = first_passage(paths, t0, t1, e * (1.0 - sl), up=False, src=src)
+    # signal: exemple strictement postérieur avec p_up <= PSELL
+    t_sig = np.full(ni.shape, np.nan)
+    if psell is not None and inputs["signal"] is not None:
+        j = inputs["signal"].first_passage(np.nextafter(t0, np.inf), t1, psell, up=False)
+        t_sig[j >= 0] = inputs["signal"].t[j[j >= 0]]
+
+    big = np.inf
+    cand = np.stack([
+        np.where(np.isnan(t_tp), big, t_tp),
+        np.where(np.isnan(t_sl), big, t_sl),
+        np.where(np.isnan(t_sig), big, t_sig),
+        np.where(src >= 0, t1, big),
+    ])
+    # SL avant TP à égalité (même point): argmin prend le premier, on passe SL devant
+    order = np.array([1, 0, 2, 3])
+    k = order[np.argmin(cand[order], axis=0)]
+    tx = cand[k, np.arange(k.size)]
+    done = np.isfinite(tx)
+
+    gross = np.full(ni.shape, np.nan)
+    gross[k == 0] = tp[k == 0]
+    gross[k == 1] = -sl[k == 1]
+    # signal / timeout: dernier prix connu à la sortie
+    m = done & (k >= 2)
+    if m.any():
+        _, _, last, has = merge_windows(paths, t0[m], tx[m])
+        gross[np.flatnonzero(m)[has]] = last[has] / e[m][has] - 1.0
+
+    ok = done & np.isfinite(gross)
+    return (
+        np.where(ok, gross - cost, np.nan),
+        np.where(ok, tx, np.nan),
+        np.where(ok, k, -1),
+    )
+
+
+def one_lot_per_arm(ai: np.ndarray, t0: np.ndarray, tx: np.ndarray) -> np.ndarray:
+    """
+    Masque des entrées retenues avec au plus un lot ouvert par bras: une entrée est
+    ignorée tant que la précédente du même bras n'est pas sortie (``ai`` trié, puis ``t0``).
+    """
+    keep = np.zeros(ai.size, dtype=bool)
+    starts = np.flatnonzero(np.r_[True, ai[1:] != ai[:-1]]) if ai.size else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], ai.size]
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        i = s
+        while i < e:
+            keep[i] = True
+            i = max(i + 1, s + int(np.searchsorted(t0[s:e], tx[i], side="left")))
+    return keep
+
+
+def simulate(inputs: Dict[str, Any], arms: Sequence[Dict[str, Any]],
+             defaults: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """
+    Matrices (A, N): ``enter`` (bool), ``ret`` (rendement net, NaN sans entrée),
+    ``t_exit`` et ``exit`` (indice dans EXITS, -1 sans entrée). Un seul lot ouvert
+    par bras (``one_lot_per_arm``). ``ret_all`` / ``t_exit_all``: mêmes sorties avant
+    ce filtre (chaque signal d'entrée), pour ``replay_policy`` qui applique la règle
+    sur ses propres choix.
+    """
+    ts, price, p_up = inputs["ts"], inputs["price"], inputs["p_up"]
+    A, N = len(arms), int(ts.size)
+    cost = float(defaults["COST"])
+    M = _arm_matrix(arms, defaults)
+
+    off = ~np.isin(inputs["hour"], LIQUID_HOURS)
+    pbuy = np.minimum(0.99, M["PBUY"] + np.where(off, float(defaults["PBUY_OFF_HOURS_ADD"]), 0.0))
+    ev_net = p_up - 0.5 - cost
+    enter = (p_up >= pbuy) & (ev_net >= M["MIN_EV_NET"]) & np.isfinite(price)
+    tp, sl = target_pcts(inputs["atr_pct"], M["TP_ATR_MULT"], M["SL_ATR_MULT"], defaults)
+
+    ret = np.full((A, N), np.nan)
+    t_exit = np.full((A, N), np.nan)
+    kind = np.full((A, N), -1, dtype=np.int64)
+    ai, ni = np.nonzero(enter)
+    ret_all, t_exit_all = ret.copy(), t_exit.copy()
+    if ai.size == 0:
+        return {"enter": enter, "ret": ret, "t_exit": t_exit, "exit": kind,
+                "ret_all": ret_all, "t_exit_all": t_exit_all}
+
+    r, tx, k = simulate_exits(inputs, ni, tp[ai, ni], sl[ai, ni], cost, M["PSELL"][ai, 0])
+    ok = np.flatnonzero(k >= 0)
+    ret_all[ai[ok], ni[ok]] = r[ok]
+    t_exit_all[ai[ok], ni[ok]] = tx[ok]
+    ok = ok[one_lot_per_arm(ai[ok], ts[ni[ok]], tx[ok])]
+    ret[ai[ok], ni[ok]] = r[ok]
+    t_exit[ai[ok], ni[ok]] = tx[ok]
+    kind[ai[ok], ni[ok]] = k[ok]
+    enter = np.zeros((A, N), dtype=bool)
+    enter[ai[ok], ni[ok]] = True
+    return {"enter": enter, "ret": ret, "t_exit": t_exit, "exit": kind,
+            "ret_all": ret_all, "t_exit_all": t_exit_all}
+
+
+def arm_report(arms: Sequence[Dict[str, Any]], sim: Dict[str, np.ndarray],
+               ts: np.ndarray) -> List[Dict[str, Any]]:
+    ret, enter = sim["ret"], sim["enter"]
+    n = enter.sum(axis=1)
+    r0 = np.where(enter, ret, 0.0)
+    total = r0.sum(axis=1)
+    hits = (enter & (ret > 0.0)).sum(axis=1)
+    eq = np.cumsum(r0, axis=1)
+    peak = np.maximum.accumulate(np.concatenate([np.zeros((len(arms), 1)), eq], axis=1), axis=1)[:, 1:]
+    mdd = (peak - eq).max(axis=1) if eq.shape[1] else np.zeros(len(arms))
+    hold = np.where(enter, sim["t_exit"] - ts[None, :], 0.0).sum(axis=1)
+    out = []
+    for i, a in enumerate(arms):
+        ni = int(n[i])
+        out.append({
+            "id": a["id"],
+            "cfg": a.get("cfg") or {},
+            "trades": ni,
+            "expectancy": (float(total[i]) / ni) if ni else None,
+            "hit_rate": (float(hits[i]) / ni) if ni else None,
+            "total_return": float(total[i]),
+            "max_drawdown": float(mdd[i]),
+            "avg_hold_s": (float(hold[i]) / ni) if ni else None,
+            "exits": {x: int((sim["exit"][i] == j).sum()) for j, x in enumerate(EXITS)},
+        })
+    return out
+
+
+def replay_policy(name: str, arms: Sequence[Dict[str, Any]], sim: Dict[str, np.ndarray],
+                  ts: np.ndarray, seed: int = 0, epsilon: float = 0.03,
+                  window: int = 500) -> Dict[str, Any]:
+    """
+    Rejoue une politique de bandit.py: à chaque exemple elle choisit un bras; si ce bras
+    serait entré, la récompense (rendement net) lui est rendue à l'instant de sortie.
+    Un seul lot ouvert, le long des choix de la politique: pas de nouvelle entrée avant
+    la sortie du lot qu'elle a ouvert (sorties non filtrées par bras de ``simulate``).
+    """
+    table = bandit.ArmTable(rng=random.Random(seed))
+    table.load_rows([(a["id"], 0, 0.0, 0.0, 0.0, json.dumps(a.get("cfg") or {})) for a in arms])
+    table.set_policy(name, epsilon=epsilon, window=window)
+    col = {a.id: i for i, a in enumerate(table.arms)}
+    ret, tx = sim["ret_all"], sim["t_exit_all"]
+    pending: list = []
+    rets: List[float] = []
+    picks = [0] * len(arms)
+    busy_until = -np.inf
+    for j in range(int(ts.size)):
+        t = ts[j]
+        while pending and pending[0][0] <= t:
+            _, aid, r = heapq.heappop(pending)
+            table.update(aid, r, now=t)
+        arm = table.choose()
+        i = col[arm.id]
+        picks[i] += 1
+        r = ret[i, j]
+        if r == r and t >= busy_until:  # non NaN: le bras entre (lot précédent sorti)
+            busy_until = tx[i, j]
+            heapq.heappush(pending, (tx[i, j], arm.id, float(r)))
+            rets.append(float(r))
+    r = np.asarray(rets)
+    eq = np.cumsum(r)
+    mdd = float((np.maximum.accumulate(np.concatenate([[0.0], eq]))[1:] - eq).max()) if r.size else 0.0
+    return {
+        "trades": int(r.size),
+        "expectancy": float(r.mean()) if r.size else None,
+        "hit_rate": float((r > 0.0).mean()) if r.size else None,
+        "total_return": float(r.sum()),
+        "max_drawdown": mdd,
+        "picks": {a.id: picks[col[a.id]] for a in table.arms},
+    }
+
+
+def evaluate(inputs: Dict[str, Any], arms: Sequence[Dict[str, Any]], defaults: Dict[str, float],
+             policies: Sequence[str] = ("ucb1", "thompson", "swucb"), seeds: int = 3,
+             epsilon: float = 0.03, window: int = 500) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    ts = inputs["ts"]
+    sim = simulate(inputs, arms, defaults)
+    report = arm_report(arms, sim, ts)
+    t_sim = time.perf_counter() - t0
+    pol = {}
+    for name in policies:
+        runs = [replay_policy(name, arms, sim, ts, seed=s, epsilon=epsilon, window=window)
+                for s in range(max(1, int(seeds)))]
+        agg = {}
+        for k in ("trades", "expectancy", "hit_rate", "total_return", "max_drawdown"):
+            vals = [r[k] for r in runs if r[k] is not None]
+            agg[k] = float(np.mean(vals)) if vals else None
+        agg["picks"] = {a: float(np.mean([r["picks"][a] for r in runs])) for a in runs[0]["picks"]}
+        agg["seeds"] = len(runs)
+        pol[name] = agg
+    best = max((r for r in report if r["trades"]), key=lambda r: r["total_return"], default=None)
+    return {
+        "ok": True,
+        "n_examples": int(ts.size),
+        "from_ts": float(ts[0]) if ts.size else None,
+        "to_ts": float(ts[-1]) if ts.size else None,
+        "horizon_s": inputs["horizon_s"],
+        "arms": report,
+        "best_arm": (best or {}).get("id"),
+        "policies": pol,
+        "seconds": {"simulate": round(t_sim, 4), "total": round(time.perf_counter() - t0, 4)},
+    }
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark de analyze_trades_offline.py sur un export synthétique (1M de trades par défaut).
+
+Écrit un CSV (ou JSON lines) de trades buy/sell aléatoires + un CSV de bougies 1m, puis chronomètre
+la lecture par blocs, le FIFO vectorisé et l'equity (trades seuls, puis marquée au marché). Les
+``--check`` premiers trades sont recalculés avec la boucle FIFO lot par lot pour contrôle.
+
+Exemples
+- python bench_analyze_trades.py
+- python bench_analyze_trades.py --n 3000000 --format jsonl --keep /tmp/bench
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import analyze_trades_offline as ato
+
+
+def make_trades(n: int, seed: int = 0, t0: float = 1.7e9) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ts = t0 + np.cumsum(rng.exponential(20.0, n))
+    price = 60000.0 * np.exp(np.cumsum(rng.normal(0.0, 3e-4, n)))
+    side = np.where(rng.random(n) < 0.52, "buy", "sell")
+    qty = np.round(rng.uniform(0.0005, 0.01, n), 6)
+    fee = qty * price * 0.001
+    return pd.DataFrame({"time": ts, "side": side, "qty": qty, "price": price, "fee": fee})
+
+
+def make_candles(trades: pd.DataFrame) -> pd.DataFrame:
+    m = (trades["time"] // 60 * 60).astype(np.int64)
+    c = trades.groupby(m)["price"].last()
+    grid = np.arange(c.index[0], c.index[-1] + 60, 60)
+    return pd.DataFrame({"minute": grid, "close": c.reindex(grid).ffill().to_numpy()})
+
+
+def fifo_loop(t, n: int):
+    """Boucle FIFO de référence (lot par lot, frais d'achat au prorata) sur les n premiers trades."""
+    lots, realized, gross = [], 0.0, 0.0
+    for k in range(n):
+        side, q, px, fee = t["side"][k], t["qty"][k], t["price"][k], t["fee"][k]
+        if side > 0:
+            lots.append([q, px, fee / q])
+            continue
+        remain, proceeds, cost, cost_fee = q, 0.0, 0.0, 0.0
+        while remain > 1e-12 and lots:
+            lq, lp, lf = lots[0]
+            take = min(remain, lq)
+            proceeds += take * px
+            cost += take * lp
+            cost_fee += take * lf
+            remain -= take
+            if lq - take <= 1e-12:
+                lots.pop(0)
+            else:
+                lots[0][0] = lq - take
+        gross += proceeds - cost
+        realized += proceeds - cost - cost_fee - fee
+    return realized, gross
+
+
+def _timed(label, fn):
+    t = time.perf_counter()
+    out = fn()
+    print(f"{label:<28} {time.perf_counter() - t:8.3f} s")
+    return out
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--n", type=int, default=1_000_000)
+    p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    p.add_argument("--check", type=int, default=50_000, help="trades recalculés par la boucle de référence")
+    p.add_argument("--keep", default=None, help="dossier où garder les fichiers générés")
+    args = p.parse_args()
+
+    d = args.keep or tempfile.mkdtemp(prefix="bench_trades_")
+    os.makedirs(d, exist_ok=True)
+    try:
+        df = make_trades(args.n)
+        path = os.path.join(d, f"trades.{args.format}")
+        if args.format == "csv":
+            _timed("write csv", lambda: df.to_csv(path, index=False))
+        else:
+            _timed("write jsonl", lambda: df.to_json(path, orient="records", lines=True))
+        cpath = os.path.join(d, "candles.csv")
+        make_candles(df).to_csv(cpath, index=False)
+        print(f"{args.n} trades -> {path} ({os.path.getsize(path) / 1e6:.0f} Mo)")
+
+        t = _timed("load (par blocs)", lambda: ato.load_trade_arrays(path))
+        f = _timed("fifo vectorisé", lambda: ato.fifo_arrays(t))
+        _timed("fifo_metrics", lambda: ato.fifo_metrics(t, mark=float(t["price"][-1])))
+        _timed("equity (trades, 1h)", lambda: ato.equity_curve_from_trades(t))
+        prices = _timed("load bougies", lambda: ato.load_prices(cpath))
+        curve = _timed("equity (mark-to-market 1m)", lambda: ato.equity_curve_from_trades(t, prices=prices))
+        print(f"bougies: {len(curve)} | realized {f['realized'].sum():.2f}")
+
+        n = min(args.check, args.n)
+        if n:
+            sub = {k: v[:n] for k, v in t.items()}
+            ref, ref_gross = _timed(f"boucle FIFO ({n})", lambda: fifo_loop(sub, n))
+            fs = ato.fifo_arrays(sub)
+            print(f"écart realized {abs(fs['realized'].sum() - ref):.3e} | "
+                  f"avant frais {abs(fs['realized_gross'].sum() - ref_gross):.3e}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
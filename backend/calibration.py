@@ -0,0 +1,209 @@
+"""
+Streaming probability calibration from binned sufficient statistics.
+
+Every labelled (p_up, y) pair lands in one of ``N_BINS`` fine probability bins of
+its UTC day. Per bin we keep count, positives, sum p, sum p^2, sum p*y and
+sum logit(p), which is enough to:
+  - fit Platt scaling (a + s * logit p) by weighted Newton on the bins;
+  - fit an isotonic map (pool-adjacent-violators on the bins);
+  - give the reliability curve and the Brier score for any window of days,
+without re-reading ``examples``. Only non-empty bins go into the JSON checkpoint.
+"""
+from __future__ import annotations
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+N_BINS = 200
+_DAY = 86400.0
+_EPS = 1e-6
+# lignes: count, pos, sum_p, sum_p2, sum_py, sum_logit
+_CNT, _POS, _SP, _SP2, _SPY, _SL = range(6)
+
+
+def _logit(p: np.ndarray) -> np.ndarray:
+    p = np.clip(p, _EPS, 1.0 - _EPS)
+    return np.log(p / (1.0 - p))
+
+
+class CalibrationStats:
+    def __init__(self, max_days: int = 120):
+        self.max_days = int(max_days)
+        self._days: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._iso_cache: Dict[Any, Tuple[np.ndarray, np.ndarray]] = {}
+        self.updated_at = 0.0
+
+    # ---------- alimentation ----------
+
+    def update(self, ts, p, y) -> int:
+        """Ajoute des paires (ts, p, y∈{0,1}); ignore les p non finis. Renvoie le nombre pris."""
+        ts = np.atleast_1d(np.asarray(ts, dtype=np.float64))
+        p = np.atleast_1d(np.asarray(p, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        ok = np.isfinite(ts) & np.isfinite(p) & np.isfinite(y)
+        ts, p, y = ts[ok], np.clip(p[ok], 0.0, 1.0), y[ok]
+        if ts.size == 0:
+            return 0
+        day = (ts // _DAY).astype(np.int64)
+        b = np.minimum((p * N_BINS).astype(np.int64), N_BINS - 1)
+        lg = _logit(p)
+        with self._lock:
+            for d in np.unique(day):
+                m = day == d
+                acc = self._days.get(int(d))
+                if acc is None:
+                    acc = self._days[int(d)] = np.zeros((6, N_BINS))
+                bb = b[m]
+                acc[_CNT] += np.bincount(bb, minlength=N_BINS)
+                acc[_POS] += np.bincount(bb, weights=y[m], minlength=N_BINS)
+                acc[_SP] += np.bincount(bb, weights=p[m], minlength=N_BINS)
+                acc[_SP2] += np.bincount(bb, weights=p[m] ** 2, minlength=N_BINS)
+                acc[_SPY] += np.bincount(bb, weights=p[m] * y[m], minlength=N_BINS)
+                acc[_SL] += np.bincount(bb, weights=lg[m], minlength=N_BINS)
+            if len(self._days) > self.max_days:
+                for d in sorted(self._days)[: len(self._days) - self.max_days]:
+                    del self._days[d]
+            self._iso_cache.clear()
+            self.updated_at = time.time()
+        return int(ts.size)
+
+    def window(self, days: Optional[float] = None, now: Optional[float] = None) -> np.ndarray:
+        """Stats cumulées (6, N_BINS) des ``days`` derniers jours (tout si None)."""
+        now = time.time() if now is None else float(now)
+        first = -math.inf if days is None else int((now - float(days) * _DAY) // _DAY)
+        with self._lock:
+            out = np.zeros((6, N_BINS))
+            for d, acc in self._days.items():
+                if d >= first:
+                    out += acc
+        return out
+
+    def count(self, days: Optional[float] = None) -> int:
+        return int(self.window(days)[_CNT].sum())
+
+    # ---------- Platt ----------
+
+    def platt(self, days: Optional[float] = None, iters: int = 25) -> Optional[Dict[str, float]]:
+        """Régression logistique 2 paramètres sur les bins (x = logit moyen du bin)."""
+        st = self.window(days)
+        m = st[_CNT] > 0
+        n = st[_CNT][m]
+        if n.sum() < 1:
+            return None
+        k = st[_POS][m]
+        x = st[_SL][m] / n
+        w = np.zeros(2)
+        for _ in range(iters):
+            z = np.clip(w[0] + w[1] * x, -30, 30)
+            q = 1.0 / (1.0 + np.exp(-z))
+            r = n * q * (1.0 - q)
+            g = np.array([np.sum(n * q - k), np.sum((n * q - k) * x)])
+            H = np.array(
+                [[r.sum() + 1e-6, np.sum(r * x)], [np.sum(r * x), np.sum(r * x * x) + 1e-6]]
+            )
+            try:
+                step = np.linalg.solve(H, g)
+            except np.linalg.LinAlgError:
+                break
+            w -= step
+            if np.abs(step).max() < 1e-9:
+                break
+        return {"A0_BIAS": float(w[0]), "SIGMOID_SCALE": float(w[1]), "n": int(n.sum())}
+
+    # ---------- isotonique ----------
+
+    def isotonic(self, days: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(p_centres, hit_monotone) par PAV pondéré sur les bins non vides."""
+        key = (days, int(time.time() // _DAY))
+        hit = self._iso_cache.get(key)
+        if hit is not None:
+            return hit
+        st = self.window(days)
+        m = st[_CNT] > 0
+        if not m.any():
+            return np.array([0.0, 1.0]), np.array([0.0, 1.0])
+        xs = st[_SP][m] / st[_CNT][m]
+        vals = list(st[_POS][m] / st[_CNT][m])
+        wts = list(st[_CNT][m])
+        sizes = [1] * len(vals)
+        i = 0
+        while i < len(vals) - 1:
+            if vals[i] > vals[i + 1]:
+                wsum = wts[i] + wts[i + 1]
+                vals[i] = (vals[i] * wts[i] + vals[i + 1] * wts[i + 1]) / wsum
+                wts[i] = wsum
+                sizes[i] += sizes[i + 1]
+                del vals[i + 1], wts[i + 1], sizes[i + 1]
+                i = max(i - 1, 0)
+            else:
+                i += 1
+        ys = np.repeat(vals, sizes)
+        out = (xs, ys)
+        self._iso_cache[key] = out
+        return out
+
+    def apply_isotonic(self, p: float, days: Optional[float] = None) -> float:
+        xs, ys = self.isotonic(days)
+        return float(np.interp(float(p), xs, ys))
+
+    # ---------- fiabilité ----------
+
+    def reliability(self, days: Optional[float] = None, bins: int = 10) -> Dict[str, Any]:
+        st = self.window(days)
+        n = int(st[_CNT].sum())
+        if n == 0:
+            return {"bins": [], "brier": None, "n": 0}
+        # Brier = E[p^2] - 2 E[p y] + E[y]  (y ∈ {0,1})
+        brier = float((st[_SP2].sum() - 2.0 * st[_SPY].sum() + st[_POS].sum()) / n)
+        bins = int(bins)
+        step = 1.0 / bins
+        centers = (np.arange(N_BINS) + 0.5) / N_BINS
+        coarse = np.minimum((centers * bins).astype(np.int64), bins - 1)
+        cnt = np.bincount(coarse, weights=st[_CNT], minlength=bins)
+        pos = np.bincount(coarse, weights=st[_POS], minlength=bins)
+        sp = np.bincount(coarse, weights=st[_SP], minlength=bins)
+        out: List[Dict[str, Any]] = []
+        for i in range(bins):
+            c = int(cnt[i])
+            out.append(
+                {
+                    "bin_from": i * step,
+                    "bin_to": (i + 1) * step,
+                    "p_mean": float(sp[i] / c) if c else None,
+                    "hit": float(pos[i] / c) if c else None,
+                    "count": c,
+                }
+            )
+        return {"bins": out, "brier": brier, "n": n}
+
+    # ---------- checkpoint ----------
+
+    def to_json(self) -> Dict[str, Any]:
+        """Checkpoint creux: par jour, [bin, count, pos, sum_p, sum_p2, sum_py, sum_logit] des bins non vides."""
+        with self._lock:
+            days = {}
+            for d, acc in self._days.items():
+                nz = np.flatnonzero(acc[_CNT])
+                days[str(d)] = [[int(b)] + acc[:, b].round(10).tolist() for b in nz]
+        return {"v": 1, "n_bins": N_BINS, "days": days}
+
+    def load_json(self, js: Optional[Dict[str, Any]]) -> bool:
+        if not isinstance(js, dict) or int(js.get("n_bins") or 0) != N_BINS:
+            return False
+        days: Dict[int, np.ndarray] = {}
+        for d, cells in (js.get("days") or {}).items():
+            acc = np.zeros((6, N_BINS))
+            for cell in cells:
+                b = int(cell[0])
+                if 0 <= b < N_BINS and len(cell) == 7:
+                    acc[:, b] = cell[1:]
+            days[int(d)] = acc
+        with self._lock:
+            self._days = days
+            self._iso_cache.clear()
+            self.updated_at = time.time()
+        return True
@@ -0,0 +1,84 @@
+"""
+Per-tick deadline budget for the decision engine.
+
+Stages ask the budget before doing slow I/O (exchange, SQLite, sentiment);
+once the budget is spent they fall back to cached / last-known values (or, for
+the stages that gate new entries, refuse to enter) and the degradation is
+reported through ``on_degrade(stage)``.
+
+Blocking calls that cannot take a timeout themselves go through ``call()``: they
+run on a small shared pool and the tick stops waiting once the budget is spent.
+The call keeps running in the background; while it is still in flight the same
+stage is not resubmitted, so a hung exchange or a locked SQLite file cannot pile
+up threads.
+"""
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as _FutTimeout
+from typing import Any, Callable, Dict, List, Optional
+
+_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tick-stage")
+_INFLIGHT: Dict[str, Any] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+class TickBudget:
+    def __init__(
+        self,
+        budget_s: float,
+        on_degrade: Optional[Callable[[str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.budget_s = max(0.0, float(budget_s))
+        self._clock = clock
+        self._t0 = clock()
+        self._on_degrade = on_degrade
+        self.degraded: List[str] = []
+
+    def elapsed(self) -> float:
+        return self._clock() - self._t0
+
+    def remaining(self) -> float:
+        return max(0.0, self.budget_s - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def allow(self, stage: str) -> bool:
+        """True if ``stage`` may run live; otherwise records a degradation."""
+        if self.budget_s <= 0.0 or self.remaining() > 0.0:
+            return True
+        self._degrade(stage)
+        return False
+
+    def call(self, stage: str, fn: Callable[..., Any], *args, default: Any = None, **kwargs):
+        """``fn(*args, **kwargs)`` bounded by the remaining budget; ``default`` if it is
+        not allowed, still busy from an earlier tick, or does not finish in time.
+        Exceptions raised by ``fn`` propagate as with a direct call."""
+        if self.budget_s <= 0.0:
+            return fn(*args, **kwargs)
+        if not self.allow(stage):
+            return default
+        with _INFLIGHT_LOCK:
+            prev = _INFLIGHT.get(stage)
+            if prev is not None and not prev.done():
+                fut = None
+            else:
+                fut = _INFLIGHT[stage] = _POOL.submit(fn, *args, **kwargs)
+        if fut is None:
+            self._degrade(stage)
+            return default
+        try:
+            return fut.result(timeout=self.remaining())
+        except _FutTimeout:
+            self._degrade(stage)
+            return default
+
+    def _degrade(self, stage: str) -> None:
+        self.degraded.append(stage)
+        if self._on_degrade is not None:
+            try:
+                self._on_degrade(stage)
+            except Exception:
+                pass
@@ -0,0 +1,74 @@
+"""
+Minimal local RPC over a Unix socket: one JSON request line, one JSON reply line.
+
+Request:  {"cmd": "<name>", "args": {...}}
+Reply:    {"ok": true, "result": ...} | {"ok": false, "error": "..."}
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Optional
+
+Handler = Callable[..., Any]
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_unix(path: str, handlers: Dict[str, Handler], logger=None) -> socketserver.BaseServer:
+    """Démarre le serveur dans un thread daemon et le renvoie (``.shutdown()`` pour l'arrêter)."""
+
+    class _Req(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline(1 << 20)
+            if not line:
+                return
+            try:
+                req = json.loads(line)
+                fn = handlers.get(str(req.get("cmd") or ""))
+                if fn is None:
+                    out = {"ok": False, "error": f"unknown cmd {req.get('cmd')!r}"}
+                else:
+                    out = {"ok": True, "result": fn(**(req.get("args") or {}))}
+            except Exception as e:
+                if logger is not None:
+                    logger.exception("ipc handler failed")
+                out = {"ok": False, "error": str(e)}
+            self.wfile.write(json.dumps(out, default=str).encode() + b"\n")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    srv = _ThreadingUnixServer(path, _Req)
+    threading.Thread(target=srv.serve_forever, name="ipc", daemon=True).start()
+    return srv
+
+
+def call(path: str, cmd: str, timeout: float = 5.0, **args) -> Dict[str, Any]:
+    """Envoie une commande; lève OSError si le serveur est absent ou ne répond pas."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps({"cmd": cmd, "args": args}).encode() + b"\n")
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    if not buf:
+        raise ConnectionError(f"empty reply from {path}")
+    return json.loads(buf)
+
+
+def try_call(path: str, cmd: str, timeout: float = 5.0, **args) -> Optional[Dict[str, Any]]:
+    try:
+        return call(path, cmd, timeout=timeout, **args)
+    except (OSError, ValueError):
+        return None
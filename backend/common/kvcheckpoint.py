@@ -0,0 +1,76 @@
+"""
+In-memory state shared between processes through a KV checkpoint.
+
+The wrapped object exposes ``to_json()`` / ``load_json(js) -> bool``. A writer
+updates it under the lock, then publishes the JSON plus a sequence token.
+Readers compare the token (a tiny KV read, at most every ``max_age_s``) and
+reload the JSON only when another process published something newer.
+
+On first start (no token anywhere) ``backfill(obj, before)`` rebuilds the state
+from the database. ``before`` is the bound given by the first ``update``: the
+rows that update is about to add are already written, so the backfill stops
+short of them instead of counting them twice.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+class KVCheckpoint:
+    def __init__(
+        self,
+        obj: Any,
+        key: str,
+        kv_get: Callable[[str, Any], Any],
+        kv_set: Callable[[str, Any], Any],
+        seq_key: Optional[str] = None,
+        backfill: Optional[Callable[[Any, Any], Any]] = None,
+    ):
+        self.obj = obj
+        self.key = key
+        self.seq_key = seq_key or f"{key}:seq"
+        self._kv_get = kv_get
+        self._kv_set = kv_set
+        self._backfill = backfill
+        self.lock = threading.RLock()
+        self.seq: Optional[int] = None
+        self.checked = 0.0
+
+    def get(self, max_age_s: float = 30.0, before: Any = None) -> Any:
+        """Objet courant; rechargé depuis KV si un autre process a publié depuis."""
+        if time.time() - self.checked < max_age_s:
+            return self.obj
+        with self.lock:
+            if time.time() - self.checked < max_age_s:
+                return self.obj
+            seq = self._kv_get(self.seq_key, None)
+            if seq is None and self.seq is None:
+                # premier démarrage: reconstruction unique depuis la base
+                if self._backfill is not None:
+                    self._backfill(self.obj, before)
+                    self._save_locked()
+            elif seq is not None and seq != self.seq:
+                if self.obj.load_json(self._kv_get(self.key, None)):
+                    self.seq = seq
+            self.checked = time.time()
+        return self.obj
+
+    def update(self, fn: Callable[[Any], Any], before: Any = None) -> Any:
+        """
+        ``fn(obj)`` sur l'état le plus récent, puis publication si ``fn`` renvoie vrai.
+        ``before``: borne du backfill initial excluant les lignes que ``fn`` ajoute.
+        """
+        self.get(0.0, before)
+        with self.lock:
+            out = fn(self.obj)
+            if out:
+                self._save_locked()
+        return out
+
+    def _save_locked(self):
+        # entier: relu tel quel par un kv_get qui décode le JSON
+        self.seq = time.time_ns() + os.getpid() % 1000
+        self._kv_set(self.key, self.obj.to_json())
+        self._kv_set(self.seq_key, self.seq)
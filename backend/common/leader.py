@@ -0,0 +1,156 @@
+"""
+Leader election between gunicorn workers (and any other process sharing DATA_DIR).
+
+The leader holds an exclusive ``flock`` on a lock file for its whole lifetime and
+rewrites a small JSON heartbeat (pid, host, ts) into it. The kernel releases the
+lock when the process dies, so a follower polling ``try_acquire`` takes over on
+its next attempt. Followers read the heartbeat to report who leads and whether it
+is still alive.
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+try:  # POSIX uniquement; ailleurs chaque process se considère leader
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class LeaderLease:
+    def __init__(
+        self,
+        path: str,
+        heartbeat_s: float = 5.0,
+        on_acquire: Optional[Callable[[], None]] = None,
+        logger=None,
+    ):
+        self.path = path
+        self.heartbeat_s = max(0.5, float(heartbeat_s))
+        self.on_acquire = on_acquire
+        self.logger = logger
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.acquired_at: Optional[float] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def _log(self, msg: str):
+        if self.logger is not None:
+            try:
+                self.logger.info(msg)
+            except Exception:
+                pass
+
+    def try_acquire(self) -> bool:
+        """Prend le verrou sans bloquer; True si ce process est (ou devient) leader."""
+        with self._lock:
+            if self._fd is not None:
+                return True
+            if fcntl is None:
+                self._fd = -1
+                self.acquired_at = time.time()
+                return True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            self.acquired_at = time.time()
+            self._write_heartbeat()
+        self._log(f"leader: acquired {self.path} (pid={os.getpid()})")
+        if self.on_acquire is not None:
+            try:
+                self.on_acquire()
+            except Exception as e:
+                self._log(f"leader: on_acquire failed: {e}")
+        return True
+
+    def _write_heartbeat(self):
+        if self._fd is None or self._fd < 0:
+            return
+        payload = json.dumps(
+            {
+                "pid": os.getpid(),
+                "host": socket.gethostname(),
+                "ts": time.time(),
+                "since": self.acquired_at,
+            }
+        ).encode()
+        try:
+            os.ftruncate(self._fd, 0)
+            os.pwrite(self._fd, payload, 0)
+        except OSError:
+            pass
+
+    def heartbeat(self):
+        with self._lock:
+            self._write_heartbeat()
+
+    def release(self):
+        with self._lock:
+            fd, self._fd = self._fd, None
+            self.acquired_at = None
+        if fd is not None and fd >= 0:
+            try:
+                os.ftruncate(fd, 0)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except OSError:
+                pass
+            os.close(fd)
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat_s):
+            try:
+                if self.is_leader:
+                    self.heartbeat()
+                else:
+                    self.try_acquire()
+            except Exception as e:
+                self._log(f"leader: loop error: {e}")
+
+    def start(self) -> bool:
+        """Tente l'acquisition puis lance le thread heartbeat/failover (idempotent)."""
+        leader = self.try_acquire()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="leader-lease", daemon=True
+                )
+                self._thread.start()
+        return leader
+
+    def stop(self):
+        self._stop.set()
+        self.release()
+
+    def info(self) -> Dict[str, Any]:
+        """Etat vu par ce process + dernier heartbeat du leader (lu dans le fichier)."""
+        hb: Dict[str, Any] = {}
+        try:
+            with open(self.path, "r") as f:
+                hb = json.loads(f.read() or "{}")
+        except (OSError, ValueError):
+            hb = {}
+        ts = hb.get("ts")
+        age = (time.time() - float(ts)) if ts else None
+        return {
+            "is_leader": self.is_leader,
+            "pid": os.getpid(),
+            "leader_pid": hb.get("pid"),
+            "leader_host": hb.get("host"),
+            "heartbeat_age_s": age,
+            "stale": age is None or age > 3 * self.heartbeat_s,
+        }
@@ -0,0 +1,166 @@
+"""
+Compiled, immutable snapshot of the strategy parameters.
+
+The engine reads ``_PARAMS`` (a mutable dict of loosely typed values) dozens of
+times per tick. ``compile_params`` converts the hot keys once into typed
+attributes and stamps the result with a version number; callers rebuild it
+whenever the dict changes and read attributes instead of ``float(d.get(...))``.
+"""
+from __future__ import annotations
+import os
+from dataclasses import field, fields, make_dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+# (attribute, _PARAMS key, type, default)
+PARAM_SPEC = (
+    # cadence / moteur
+    ("min_seconds_between_orders", "MIN_SECONDS_BETWEEN_ORDERS", float, 20.0),
+    ("max_orders_per_hour", "MAX_ORDERS_PER_HOUR", int, 20),
+    ("multi_trade_mode", "MULTI_TRADE_MODE", bool, True),
+    ("tick_budget_s", "TICK_BUDGET_S", float, 2.0),
+    ("exit_watch_enabled", "EXIT_WATCH_ENABLED", bool, True),
+    # entrée
+    ("pbuy", "PBUY", float, 0.60),
+    ("psell", "PSELL", float, 0.40),
+    ("min_ev_net", "MIN_EV_NET", float, 0.0003),
+    ("pbuy_off_hours_add", "PBUY_OFF_HOURS_ADD", float, 0.03),
+    ("vol_min", "VOL_MIN", float, 0.0025),
+    ("vol_min_high", "VOL_MIN_HIGH", float, 0.0035),
+    ("tech_trend_min", "TECH_TREND_MIN", float, 0.02),
+    ("rsi_min", "RSI_MIN", float, 45.0),
+    ("buy_pct", "BUY_PCT", float, 0.25),
+    ("allow_multiple", "ALLOW_MULTIPLE", bool, True),
+    ("max_concurrent_entries", "MAX_CONCURRENT_ENTRIES", int, 3),
+    ("min_reentry_distance_bps", "MIN_REENTRY_DISTANCE_BPS", int, 15),
+    ("reentry_require_trend", "REENTRY_REQUIRE_TREND", bool, False),
+    ("reentry_buy_pct", "REENTRY_BUY_PCT", float, 0.15),
+    # cibles
+    ("min_tp_pct", "MIN_TP_PCT", float, 0.0105),
+    ("min_sl_pct", "MIN_SL_PCT", float, 0.0065),
+    ("tp_atr_mult", "TP_ATR_MULT", float, 0.9),
+    ("sl_atr_mult", "SL_ATR_MULT", float, 0.7),
+    ("net_margin_pct", "NET_MARGIN_PCT", float, 0.003),
+    # coûts
+    ("cost_maker_bps", "COST_MAKER_BPS", float, 2.0),
+    ("cost_taker_bps", "COST_TAKER_BPS", float, 5.0),
+    ("other_cost_bps", "OTHER_COST_BPS", float, 2.0),
+    ("fee_buffer_bps", "FEE_BUFFER_BPS", float, 5.0),
+    ("prefer_maker", "PREFER_MAKER", bool, True),
+    ("fee_rate_buy", "FEE_RATE_BUY", float, 0.0010),
+    ("fee_rate_sell", "FEE_RATE_SELL", float, 0.0010),
+    ("slippage", "SLIPPAGE", float, 0.0005),
+    ("fee_buffer_pct", "FEE_BUFFER_PCT", float, 0.0002),
+    ("maker_fee_buy", "MAKER_FEE_BUY", float, 0.0001),
+    ("maker_fee_sell", "MAKER_FEE_SELL", float, 0.0001),
+    # sorties multi-lots (ml_tick)
+    ("strict_profit_loss_only", "STRICT_PROFIT_LOSS_ONLY", bool, True),
+    ("profit_sell_min_pct", "PROFIT_SELL_MIN_PCT", float, 0.03),
+    ("loss_hard_sl_pct", "LOSS_HARD_SL_PCT", float, 0.05),
+    ("trail_to_breakeven_pct", "TRAIL_TO_BREAKEVEN_PCT", float, 0.004),
+    ("be_min_hold_sec", "BE_MIN_HOLD_SEC", int, 120),
+    ("be_trail_back_pct", "BE_TRAIL_BACK_PCT", float, 0.003),
+    ("time_stop_min", "TIME_STOP_MIN", int, 0),
+    ("hys_pct", "HYS_PCT", float, 0.015),
+    ("min_hold_sec", "MIN_HOLD_SEC", int, 120),
+    ("take_partial_at_pct", "TAKE_PARTIAL_AT_PCT", float, 0.0),
+    ("take_partial_pct", "TAKE_PARTIAL_PCT", float, 0.33),
+    ("partial_min_hold_sec", "PARTIAL_MIN_HOLD_SEC", int, 60),
+    ("partial_min_notional", "PARTIAL_MIN_NOTIONAL", float, 10.0),
+    ("partial_allow_multiple", "PARTIAL_ALLOW_MULTIPLE", bool, False),
+    ("partial_cooldown_sec", "PARTIAL_COOLDOWN_SEC", int, 0),
+    ("reinvest_pct_of_profit", "REINVEST_PCT_OF_PROFIT", float, 0.5),
+    # calibration
+    ("a0_bias", "A0_BIAS", float, 0.0),
+    ("sigmoid_scale", "SIGMOID_SCALE", float, 1.0),
+    ("calibration_mode", "CALIBRATION_MODE", str, "platt"),  # platt | isotonic | none
+    ("calib_window_days", "CALIB_WINDOW_DAYS", int, 30),
+    ("calib_auto_apply", "CALIB_AUTO_APPLY", bool, False),  # job calibrate -> A0_BIAS/SIGMOID_SCALE
+    # bandit des presets de seuils
+    ("bandit_policy", "BANDIT_POLICY", str, "ucb1"),  # ucb1 | thompson | swucb
+    ("bandit_epsilon", "BANDIT_EPSILON", float, 0.03),
+    ("bandit_window", "BANDIT_WINDOW", int, 500),
+)
+
+# (attribute, variable d'environnement, type, défaut) — lus une fois par compilation
+ENV_SPEC = (
+    ("buy_usdt_per_trade", "BUY_USDT_PER_TRADE", float, 0.0),
+    ("buy_fraction_net", "BUY_FRACTION_NET", float, 0.03),
+    ("buy_min_usdt", "BUY_MIN_USDT", float, 6.0),
+    ("notional_buffer", "NOTIONAL_BUFFER", float, 1.3),
+    ("qty_step", "QTY_STEP", float, 0.0),
+    ("min_base_qty", "MIN_BASE_QTY", float, 0.0),
+    ("risk_min_order_notional", "RISK_MIN_ORDER_NOTIONAL", float, 10.0),
+)
+
+
+def _conv(typ, v, default):
+    if v is None:
+        return default
+    try:
+        if typ is bool:
+            if isinstance(v, str):
+                return v.strip().lower() in ("1", "true", "yes", "on")
+            return bool(v)
+        if typ is int:
+            return int(float(v))
+        return typ(v)
+    except Exception:
+        return default
+
+
+def _env_raw(name: str, environ: Mapping[str, str]) -> Optional[str]:
+    v = environ.get(name)
+    if v is None:
+        return None
+    v = v.strip()
+    if len(v) >= 2 and v[0] == v[-1] and v[0] in ("'", '"'):
+        v = v[1:-1]
+    return v or None
+
+
+class _SnapshotBase:
+    def get(self, key: str, default: Any = None) -> Any:
+        """Accès aux clés non compilées (chemins froids)."""
+        return self.raw.get(key, default)
+
+    @property
+    def must_cover(self) -> float:
+        """Coût aller-retour estimé (même formule que _costs_snapshot)."""
+        if self.prefer_maker:
+            return self.maker_fee_buy + self.maker_fee_sell + self.fee_buffer_pct
+        return (
+            self.fee_rate_buy + self.fee_rate_sell + 2 * self.slippage + self.fee_buffer_pct
+        )
+
+
+ParamSnapshot = make_dataclass(
+    "ParamSnapshot",
+    [
+        ("version", int, field(default=0)),
+        ("raw", Mapping[str, Any], field(default_factory=lambda: MappingProxyType({}))),
+    ]
+    + [(attr, typ, field(default=d)) for attr, _, typ, d in PARAM_SPEC + ENV_SPEC],
+    bases=(_SnapshotBase,),
+    frozen=True,
+    namespace={"__module__": __name__},
+)
+
+
+def compile_params(
+    params: Optional[Mapping[str, Any]],
+    version: int,
+    environ: Optional[Mapping[str, str]] = None,
+) -> ParamSnapshot:
+    params = dict(params or {})
+    environ = os.environ if environ is None else environ
+    kw = {}
+    for attr, key, typ, default in PARAM_SPEC:
+        kw[attr] = _conv(typ, params.get(key), default)
+    for attr, name, typ, default in ENV_SPEC:
+        kw[attr] = _conv(typ, _env_raw(name, environ), default)
+    return ParamSnapshot(version=int(version), raw=MappingProxyType(params), **kw)
+
+
+def snapshot_fields() -> tuple:
+    return tuple(f.name for f in fields(ParamSnapshot))
@@ -0,0 +1,183 @@
+"""
+Price series loaded once, with O(1) range max/min/last queries.
+
+``PricePath`` holds sorted timestamps with high/low/close arrays and a sparse
+table for range max/min. ``window(t0, t1)`` answers any number of [t0, t1]
+windows at once (vectorized ``searchsorted`` plus one table lookup per window),
+which is what a sweep labeler or a counterfactual replay needs.
+``first_passage`` descends the same table to find, per window, the first point
+crossing a level (O(log n) vectorized steps for all windows together).
+"""
+from __future__ import annotations
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+
+def _sparse(a: np.ndarray, op) -> list:
+    tab = [a]
+    j = 1
+    while (1 << j) <= a.size:
+        prev = tab[-1]
+        h = 1 << (j - 1)
+        tab.append(op(prev[:-h], prev[h:]))
+        j += 1
+    return tab
+
+
+class PricePath:
+    def __init__(self, t, high=None, low=None, close=None):
+        t = np.asarray(t, dtype=np.float64)
+        close = np.asarray(close if close is not None else high, dtype=np.float64)
+        high = close if high is None else np.asarray(high, dtype=np.float64)
+        low = close if low is None else np.asarray(low, dtype=np.float64)
+        ok = np.isfinite(t) & np.isfinite(close)
+        high = np.where(np.isfinite(high), high, close)
+        low = np.where(np.isfinite(low), low, close)
+        order = np.argsort(t[ok], kind="stable")
+        self.t = t[ok][order]
+        self.high = high[ok][order]
+        self.low = low[ok][order]
+        self.close = close[ok][order]
+        self._max = _sparse(self.high, np.maximum) if self.t.size else []
+        self._min = _sparse(self.low, np.minimum) if self.t.size else []
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple], has_hilo: bool = False) -> "PricePath":
+        """rows = (t, price) ou (t, high, low, close) si ``has_hilo``."""
+        arr = np.array(
+            [tuple(np.nan if v is None else v for v in r) for r in rows], dtype=np.float64
+        )
+        if arr.size == 0:
+            return cls(np.zeros(0), close=np.zeros(0))
+        if has_hilo:
+            return cls(arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3])
+        return cls(arr[:, 0], close=arr[:, 1])
+
+    def __len__(self) -> int:
+        return int(self.t.size)
+
+    def bounds(self, t0, t1) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices [i0, i1) des points dans [t0, t1] (bornes incluses)."""
+        i0 = np.searchsorted(self.t, np.asarray(t0, dtype=np.float64), side="left")
+        i1 = np.searchsorted(self.t, np.asarray(t1, dtype=np.float64), side="right")
+        return i0, i1
+
+    def range_max_min(self, i0: np.ndarray, i1: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        n = np.maximum(i1 - i0, 0)
+        hi = np.full(n.shape, np.nan)
+        lo = np.full(n.shape, np.nan)
+        has = n > 0
+        if not has.any():
+            return hi, lo
+        k = np.zeros(n.shape, dtype=np.int64)
+        k[has] = np.floor(np.log2(n[has])).astype(np.int64)
+        for j in np.unique(k[has]):
+            m = has & (k == j)
+            a, b = i0[m], i1[m] - (1 << int(j))
+            hi[m] = np.maximum(self._max[j][a], self._max[j][b])
+            lo[m] = np.minimum(self._min[j][a], self._min[j][b])
+        return hi, lo
+
+    def window(self, t0, t1):
+        """(hi, lo, last, has) pour chaque fenêtre [t0, t1]; NaN si aucun point."""
+        i0, i1 = self.bounds(t0, t1)
+        hi, lo = self.range_max_min(np.atleast_1d(i0), np.atleast_1d(i1))
+        i1 = np.atleast_1d(i1)
+        has = i1 > np.atleast_1d(i0)
+        last = np.full(hi.shape, np.nan)
+        last[has] = self.close[i1[has] - 1]
+        return hi, lo, last, has
+
+    def first_passage(self, t0, t1, level, up: bool = True) -> np.ndarray:
+        """
+        Index du premier point de [t0, t1] avec high >= level (``up``) ou low <= level;
+        -1 si le niveau n'est pas atteint. ``level`` peut varier par fenêtre.
+        """
+        i0, i1 = self.bounds(t0, t1)
+        i0, i1 = np.atleast_1d(i0).astype(np.int64), np.atleast_1d(i1).astype(np.int64)
+        level = np.broadcast_to(np.asarray(level, dtype=np.float64), i0.shape)
+        out = np.full(i0.shape, -1, dtype=np.int64)
+        if not self.t.size:
+            return out
+        tab = self._max if up else self._min
+        pos = i0.copy()
+        # saut de 2^j tant que le bloc [pos, pos + 2^j) reste strictement sous (sur) le niveau
+        for j in range(len(tab) - 1, -1, -1):
+            step = 1 << j
+            m = pos + step <= i1
+            if not m.any():
+                continue
+            idx = np.flatnonzero(m)
+            blk = tab[j][pos[idx]]
+            clear = blk < level[idx] if up else blk > level[idx]
+            pos[idx[clear]] += step
+        hit = pos < i1
+        out[hit] = pos[hit]
+        return out
+
+
+def pick_source(paths, t0, t1) -> np.ndarray:
+    """Indice de la première source ayant un point dans chaque fenêtre (-1 sinon)."""
+    t0 = np.atleast_1d(np.asarray(t0, dtype=np.float64))
+    t1 = np.atleast_1d(np.asarray(t1, dtype=np.float64))
+    src = np.full(t0.shape, -1, dtype=np.int64)
+    for k, p in enumerate(paths):
+        if p is None or not len(p):
+            continue
+        todo = src < 0
+        if not todo.any():
+            break
+        i0, i1 = p.bounds(t0[todo], t1[todo])
+        src[np.flatnonzero(todo)[i1 > i0]] = k
+    return src
+
+
+def first_passage(paths, t0, t1, level, up: bool = True, src=None) -> np.ndarray:
+    """
+    Instant du premier franchissement de ``level`` dans [t0, t1] (NaN sinon), lu sur la
+    même source que ``merge_windows`` (``src`` de ``pick_source`` pour la réutiliser).
+    """
+    t0 = np.atleast_1d(np.asarray(t0, dtype=np.float64))
+    t1 = np.atleast_1d(np.asarray(t1, dtype=np.float64))
+    level = np.broadcast_to(np.asarray(level, dtype=np.float64), t0.shape)
+    src = pick_source(paths, t0, t1) if src is None else src
+    out = np.full(t0.shape, np.nan)
+    for k, p in enumerate(paths):
+        m = src == k
+        if not m.any():
+            continue
+        i = p.first_passage(t0[m], t1[m], level[m], up=up)
+        idx = np.flatnonzero(m)
+        ok = i >= 0
+        out[idx[ok]] = p.t[i[ok]]
+    return out
+
+
+def merge_windows(paths, t0, t1):
+    """
+    Première source (par ordre de priorité) ayant au moins un point dans la fenêtre.
+    Renvoie (hi, lo, last, has) comme ``PricePath.window``.
+    """
+    t0 = np.atleast_1d(np.asarray(t0, dtype=np.float64))
+    hi = np.full(t0.shape, np.nan)
+    lo = hi.copy()
+    last = hi.copy()
+    has = np.zeros(t0.shape, dtype=bool)
+    t1 = np.atleast_1d(np.asarray(t1, dtype=np.float64))
+    for p in paths:
+        if p is None or not len(p):
+            continue
+        todo = ~has
+        if not todo.any():
+            break
+        h, l, c, ok = p.window(t0[todo], t1[todo])
+        idx = np.flatnonzero(todo)[ok]
+        hi[idx], lo[idx], last[idx] = h[ok], l[ok], c[ok]
+        has[idx] = True
+    return hi, lo, last, has
+
+
+def optional_path(rows, has_hilo: bool = False) -> Optional[PricePath]:
+    p = PricePath.from_rows(rows or [], has_hilo=has_hilo)
+    return p if len(p) else None
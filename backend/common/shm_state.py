@@ -0,0 +1,118 @@
+"""
+Fixed-layout shared state between the trading process and the web workers.
+
+The segment is an mmap'd file: a header (magic, field count, sequence) followed by
+one float64 per field of ``FIELDS``. A single writer bumps the sequence to an odd
+value, writes the body, then bumps it to the next even value (seqlock). Readers
+never lock: they copy the body and retry if the sequence was odd or moved while
+they were reading.
+"""
+from __future__ import annotations
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Optional
+
+FIELDS = (
+    "ts",
+    "price",
+    "price_prev",
+    "bid",
+    "ask",
+    "p_up",
+    "ev",
+    "position_qty",
+    "cash",
+    "in_position",
+)
+
+_MAGIC = b"TBS1"
+_HDR = struct.Struct("<4sIQ")  # magic, nfields, seq
+_SEQ_OFF = 8
+_SEQ = struct.Struct("<Q")
+_BODY = struct.Struct("<" + "d" * len(FIELDS))
+SIZE = _HDR.size + _BODY.size
+
+
+class SharedState:
+    def __init__(self, path: str, writer: bool = False):
+        self.path = path
+        self.writer = writer
+        self._mm: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        self._vals: Dict[str, float] = {k: 0.0 for k in FIELDS}
+
+    def _open(self) -> Optional[mmap.mmap]:
+        if self._mm is not None:
+            return self._mm
+        if self.writer:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < SIZE:
+                    os.ftruncate(fd, SIZE)
+                mm = mmap.mmap(fd, SIZE, access=mmap.ACCESS_WRITE)
+            finally:
+                os.close(fd)
+            magic, n, seq = _HDR.unpack_from(mm, 0)
+            if magic != _MAGIC or n != len(FIELDS):
+                _HDR.pack_into(mm, 0, _MAGIC, len(FIELDS), 0)
+            else:
+                # reprise après failover: on repart des dernières valeurs publiées
+                self._vals.update(zip(FIELDS, _BODY.unpack_from(mm, _HDR.size)))
+                if seq & 1:  # writer précédent mort en pleine écriture
+                    _SEQ.pack_into(mm, _SEQ_OFF, seq + 1)
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return None
+            try:
+                if os.fstat(fd).st_size < SIZE:
+                    return None
+                mm = mmap.mmap(fd, SIZE, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        self._mm = mm
+        return mm
+
+    def write(self, **values: float) -> None:
+        """Publie les champs donnés (les autres gardent leur dernière valeur publiée)."""
+        if not self.writer:
+            raise RuntimeError("SharedState opened read-only")
+        with self._lock:
+            mm = self._open()
+            for k, v in values.items():
+                if k in self._vals and v is not None:
+                    self._vals[k] = float(v)
+            self._vals["ts"] = float(values.get("ts") or time.time())
+            seq = _SEQ.unpack_from(mm, _SEQ_OFF)[0]
+            _SEQ.pack_into(mm, _SEQ_OFF, seq + 1)
+            _BODY.pack_into(mm, _HDR.size, *(self._vals[k] for k in FIELDS))
+            _SEQ.pack_into(mm, _SEQ_OFF, seq + 2)
+
+    def read(self, retries: int = 100) -> Optional[Dict[str, float]]:
+        """Copie cohérente du segment, ou None s'il n'a jamais été écrit."""
+        mm = self._open()
+        if mm is None:
+            return None
+        for _ in range(max(1, retries)):
+            magic, n, s1 = _HDR.unpack_from(mm, 0)
+            if magic != _MAGIC or n != len(FIELDS) or s1 == 0:
+                return None
+            if s1 & 1:
+                continue
+            body = _BODY.unpack_from(mm, _HDR.size)
+            if _SEQ.unpack_from(mm, _SEQ_OFF)[0] == s1:
+                out = dict(zip(FIELDS, body))
+                out["seq"] = s1
+                return out
+        return None
+
+    def close(self):
+        with self._lock:
+            mm, self._mm = self._mm, None
+        if mm is not None:
+            mm.close()
@@ -0,0 +1,169 @@
+"""
+TP/SL kernels on closed-roundtrip returns, shared by the offline scripts.
+
+Returns are sorted once (``SortedReturns``); the hit count at every TP of a grid
+is then one ``searchsorted`` (hit = ret >= tp), and loss quantiles are read off
+the same sorted array. ``rolling_table`` answers all trailing windows (last N
+trades) from one argsort: each window is a mask on positions over the sorted
+array, so no window is re-sorted. The TP objective is the scripts' historical
+one, ``size * (tp - break_even) * hit_rate``; SL is a quantile of absolute losses.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+ROLLING_DTYPE = np.dtype([
+    ("window", np.int64),
+    ("n", np.int64),
+    ("tp", np.float64),
+    ("hit_rate", np.float64),
+    ("net_per_trade", np.float64),
+    ("sl", np.float64),
+    ("n_losses", np.int64),
+    ("sl_quantile", np.bool_),  # False: plancher (moins de ``min_losses`` pertes)
+])
+
+
+def tp_grid(tp_min: float, tp_max: float, tp_step: float, floor: Optional[float] = None,
+            decimals: int = 8) -> np.ndarray:
+    """[max(tp_min, floor), tp_max] par pas de tp_step, mêmes points que les boucles des scripts."""
+    v = tp_min if floor is None else max(tp_min, floor)
+    tps = []
+    while v <= tp_max + 1e-12:
+        tps.append(round(v, decimals))
+        v += tp_step
+    return np.asarray(tps, dtype=np.float64)
+
+
+def _quantile_sorted(s: np.ndarray, q: float) -> float:
+    """Quantile linéaire (= np.quantile) d'un tableau déjà trié."""
+    idx = (s.size - 1) * q
+    lo = int(np.floor(idx))
+    hi = min(lo + 1, s.size - 1)
+    return float(s[lo] + (s[hi] - s[lo]) * (idx - lo))
+
+
+class SortedReturns:
+    def __init__(self, returns: Sequence[float], presorted: bool = False):
+        r = np.asarray(returns, dtype=np.float64)
+        r = r[np.isfinite(r)]
+        self.r = r if presorted else np.sort(r)
+        self.n = int(self.r.size)
+        # pertes absolues triées croissantes (les rendements négatifs, lus à l'envers)
+        self.losses = -self.r[: int(np.searchsorted(self.r, 0.0, side="left"))][::-1]
+
+    def hits(self, tps) -> np.ndarray:
+        return self.n - np.searchsorted(self.r, np.asarray(tps, dtype=np.float64), side="left")
+
+    def hit_rate(self, tps) -> np.ndarray:
+        tps = np.asarray(tps, dtype=np.float64)
+        return self.hits(tps) / self.n if self.n else np.zeros(tps.shape)
+
+    def net(self, tps, break_even: float, sizes) -> np.ndarray:
+        """size * (tp - be) * hit_rate; ``sizes`` scalaire -> (K,), tableau -> (S, K)."""
+        tps = np.asarray(tps, dtype=np.float64)
+        curve = (tps - break_even) * self.hit_rate(tps)
+        return np.multiply.outer(np.asarray(sizes, dtype=np.float64), curve)
+
+    def fit_tp(self, tps, break_even: float, size: float, ties: str = "first",
+               zero_hits: str = "first") -> Dict[str, Any]:
+        """
+        Meilleur TP de la grille; ``ties`` = "first" | "last" départage les ex aequo.
+        Sans aucun hit: ``zero_hits="first"`` -> premier point de la grille, "keep" -> le TP retenu par ``ties``.
+        """
+        tps = np.asarray(tps, dtype=np.float64)
+        if self.n == 0 or tps.size == 0:
+            return {"tp": None, "hit_rate": 0.0, "net_per_trade": 0.0}
+        hr = self.hit_rate(tps)
+        net = size * (tps - break_even) * hr
+        i = int(np.argmax(net)) if ties == "first" else tps.size - 1 - int(np.argmax(net[::-1]))
+        if zero_hits == "first" and not hr.any():
+            i = 0
+        return {"tp": float(tps[i]), "hit_rate": float(hr[i]), "net_per_trade": float(net[i])}
+
+    def loss_quantile(self, q: float) -> Optional[float]:
+        return _quantile_sorted(self.losses, q) if self.losses.size else None
+
+    def fit_sl(self, q: float = 0.80, floor: float = 0.0060, min_losses: int = 5) -> Dict[str, Any]:
+        """SL = max(floor, quantile q borné à [0.5, 0.99] des pertes absolues); floor sous ``min_losses``."""
+        nl = int(self.losses.size)
+        if nl >= min_losses:
+            qq = max(0.5, min(float(q), 0.99))
+            return {"sl": max(float(floor), _quantile_sorted(self.losses, qq)),
+                    "method": f"quantile_{qq:.2f}", "n_losses": nl}
+        return {"sl": float(floor), "method": "floor", "n_losses": nl}
+
+
+def hit_rate(returns, tps) -> np.ndarray:
+    return SortedReturns(returns).hit_rate(tps)
+
+
+def net_curve(returns, tps, break_even: float, sizes) -> np.ndarray:
+    return SortedReturns(returns).net(tps, break_even, sizes)
+
+
+def fit_tp(returns, tps, break_even: float, size: float, ties: str = "first",
+           zero_hits: str = "first") -> Dict[str, Any]:
+    return SortedReturns(returns).fit_tp(tps, break_even, size, ties, zero_hits)
+
+
+def fit_sl(returns, q: float = 0.80, floor: float = 0.0060, min_losses: int = 5) -> Dict[str, Any]:
+    return SortedReturns(returns).fit_sl(q, floor, min_losses)
+
+
+def quantile(values, q: float) -> Optional[float]:
+    """Quantile à interpolation linéaire; None si vide."""
+    v = np.asarray(values, dtype=np.float64)
+    return float(np.quantile(v, q)) if v.size else None
+
+
+def score_tp_sl(returns, tp: float, sl: float, break_even: float, size: float) -> Dict[str, Any]:
+    """Objectif de fit + espérance des rendements finaux écrêtés à [-sl, tp]."""
+    r = np.asarray(returns, dtype=np.float64)
+    r = r[np.isfinite(r)]
+    n = int(r.size)
+    if not n:
+        return {"n": 0, "hit_rate": None, "sl_rate": None, "net_per_trade": None, "expectancy": None}
+    hr = float(np.mean(r >= tp))
+    return {
+        "n": n,
+        "hit_rate": hr,
+        "sl_rate": float(np.mean(r <= -sl)),
+        "net_per_trade": size * (tp - break_even) * hr,
+        "expectancy": float(np.mean(np.clip(r, -sl, tp))),
+    }
+
+
+def rolling_table(
+    returns: Sequence[float],
+    windows: Sequence[int],
+    tps,
+    break_even: float,
+    size: float,
+    sl_q: float = 0.80,
+    sl_floor: float = 0.0060,
+    min_losses: int = 5,
+    ties: str = "first",
+) -> np.ndarray:
+    """
+    Une ligne (ROLLING_DTYPE) par fenêtre des N derniers trades (tous s'il y en a moins),
+    TP et SL fittés comme ``fit_tp`` / ``fit_sl``; un seul tri pour toutes les fenêtres.
+    """
+    r = np.asarray(returns, dtype=np.float64)
+    r = r[np.isfinite(r)]
+    n = int(r.size)
+    order = np.argsort(r, kind="stable")
+    rs = r[order]
+    out = np.zeros(len(windows), dtype=ROLLING_DTYPE)
+    for i, w in enumerate(windows):
+        sr = SortedReturns(rs[order >= n - int(w)], presorted=True)
+        best = sr.fit_tp(tps, break_even, size, ties)
+        sl = sr.fit_sl(sl_q, sl_floor, min_losses)
+        out[i] = (
+            int(w), sr.n,
+            np.nan if best["tp"] is None else best["tp"],
+            best["hit_rate"], best["net_per_trade"],
+            sl["sl"], sl["n_losses"], sl["method"] != "floor",
+        )
+    return out
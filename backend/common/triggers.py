@@ -0,0 +1,89 @@
+"""
+Price-indexed TP/SL triggers for open lots.
+
+Two bisect-sorted arrays hold (trigger_price, token) pairs: one for TP
+triggers (fire when price >= trigger) and one for SL triggers (fire when
+price <= trigger). A price update only touches the crossed prefix/suffix,
+i.e. O(log n + k) instead of a scan of every lot.
+"""
+from __future__ import annotations
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+_INF = float("inf")
+
+
+class TriggerIndex:
+    def __init__(self):
+        self._tp: List[Tuple[float, int]] = []
+        self._sl: List[Tuple[float, int]] = []
+        self._by_id: Dict[Hashable, Tuple[int, float, float, Any]] = {}
+        self._ids: Dict[int, Hashable] = {}
+        self._seq = 0
+        self.key: Optional[Any] = None
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, lot_id) -> bool:
+        return lot_id in self._by_id
+
+    def clear(self, key: Optional[Any] = None):
+        self._tp.clear()
+        self._sl.clear()
+        self._by_id.clear()
+        self._ids.clear()
+        self.key = key
+
+    def upsert(self, lot_id: Hashable, tp_px: float, sl_px: float, payload: Any = None):
+        self.remove(lot_id)
+        self._seq += 1
+        tok = self._seq
+        tp_px = float(tp_px) if tp_px and tp_px > 0 else _INF
+        sl_px = float(sl_px) if sl_px and sl_px > 0 else -_INF
+        insort(self._tp, (tp_px, tok))
+        insort(self._sl, (sl_px, tok))
+        self._by_id[lot_id] = (tok, tp_px, sl_px, payload)
+        self._ids[tok] = lot_id
+
+    def remove(self, lot_id: Hashable) -> bool:
+        ent = self._by_id.pop(lot_id, None)
+        if ent is None:
+            return False
+        tok, tp_px, sl_px, _ = ent
+        self._ids.pop(tok, None)
+        for arr, px in ((self._tp, tp_px), (self._sl, sl_px)):
+            i = bisect_left(arr, (px, tok))
+            if i < len(arr) and arr[i] == (px, tok):
+                del arr[i]
+        return True
+
+    def triggers(self, lot_id: Hashable) -> Optional[Tuple[float, float]]:
+        ent = self._by_id.get(lot_id)
+        return None if ent is None else (ent[1], ent[2])
+
+    def payload(self, lot_id: Hashable) -> Any:
+        ent = self._by_id.get(lot_id)
+        return None if ent is None else ent[3]
+
+    def crossed_tp(self, price: float) -> List[Hashable]:
+        hi = bisect_right(self._tp, (float(price), _INF))
+        return [self._ids[tok] for _, tok in self._tp[:hi]]
+
+    def crossed_sl(self, price: float) -> List[Hashable]:
+        lo = bisect_left(self._sl, (float(price), -1))
+        return [self._ids[tok] for _, tok in self._sl[lo:]]
+
+    def crossed(self, price: float) -> List[Hashable]:
+        """Ids of lots whose TP or SL trigger is crossed at ``price``."""
+        out = self.crossed_tp(price)
+        seen = set(out)
+        out.extend(i for i in self.crossed_sl(price) if i not in seen)
+        return out
+
+    def any_crossed(self, price: float) -> bool:
+        price = float(price)
+        return bool(
+            (self._tp and self._tp[0][0] <= price)
+            or (self._sl and self._sl[-1][0] >= price)
+        )
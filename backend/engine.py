@@ -0,0 +1,106 @@
+"""
+Engine process: trading loops, ingestors and learners without the web workers.
+
+    cd backend && APP_ROLE=engine python -m engine
+
+The web side runs with APP_ROLE=web: it reads live numbers from the shared-memory
+segment (common/shm_state.py) and forwards mutating calls here through the Unix
+socket served below (see engine_client.py).
+"""
+from __future__ import annotations
+import logging
+import os
+import signal
+import threading
+
+os.environ.setdefault("APP_ROLE", "engine")
+
+import engine_client  # noqa: E402
+from common.ipc import serve_unix  # noqa: E402
+
+# Un worker du pool d'entraînement (training_pool) ré-importe __main__ sous le nom
+# __mp_main__: il ne doit ni construire l'état de app.py ni démarrer ses boucles.
+if __name__ != "__mp_main__":
+    import app as core  # noqa: E402  (construit l'état; start_background_loops_once à l'import)
+
+log = logging.getLogger("engine")
+
+# vues Flask rejouables depuis un worker web (APP_ROLE=web): toutes celles qui modifient
+# l'état en mémoire du moteur (STATE, POSITIONS, _PARAMS, autotrader, modèle en ligne)
+FORWARDABLE_VIEWS = (
+    "api_strategy_run",
+    "api_params_update",
+    "set_params",
+    "api_price_stream_start",
+    "api_price_stream_stop",
+    "api_manual_buy",
+    "api_force_buy",
+    "api_force_sell",
+    "api_force_sell_all",
+    "api_admin_flatten",
+    "api_admin_reset_account",
+    "api_admin_reset_paper",
+    "api_admin_start_autotrader",
+    "api_autotrade_pause",
+    "api_autotrade_resume",
+    "api_autotrade_toggle",
+    "http_ml_learn_online",
+    "api_calibrate",
+    "api_drift_check",
+    "api_learning_set",
+    "api_bandit_seed",
+)
+
+
+def _h_ping():
+    return {"pid": os.getpid(), "leader": core._is_leader()}
+
+
+def _h_state():
+    keys = ("price", "price_prev", "p_up", "ev", "position_qty", "cash", "in_position")
+    out = {k: core.STATE.get(k) for k in keys}
+    out["tick_degraded"] = core.STATE.get("tick_degraded")
+    out["param_version"] = core._params_snapshot().version
+    return out
+
+
+def _h_view(name: str, method: str = "GET", path: str = "/", query: str = "", json=None):
+    """Exécute une vue de app.py dans ce process, comme si la requête arrivait ici."""
+    if name not in FORWARDABLE_VIEWS:
+        raise ValueError(f"view {name!r} not forwardable")
+    fn = getattr(core, name)
+    with core.app.test_request_context(path, method=method, query_string=query, json=json):
+        resp = core.app.make_response(fn())
+    return {"status": resp.status_code, "json": resp.get_json(silent=True)}
+
+
+HANDLERS = {"ping": _h_ping, "state": _h_state, "view": _h_view}
+
+
+def main() -> int:
+    if engine_client.app_role() != "engine":
+        log.warning("APP_ROLE=%s: expected 'engine'", engine_client.app_role())
+    core.start_background_loops_once()
+    srv = serve_unix(engine_client.socket_path(), HANDLERS, logger=log)
+    log.info(
+        "engine up (pid=%s, leader=%s, socket=%s)",
+        os.getpid(),
+        core._is_leader(),
+        engine_client.socket_path(),
+    )
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    stop.wait()
+
+    srv.shutdown()
+    try:
+        os.unlink(engine_client.socket_path())
+    except OSError:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
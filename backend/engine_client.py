@@ -0,0 +1,62 @@
+"""
+Lightweight, read-mostly view of the engine process for the web workers.
+
+Imports neither Flask nor app.py: live numbers come from the shared-memory
+segment, commands go to ``engine.py`` over its Unix socket.
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from common.ipc import try_call
+from common.shm_state import SharedState
+
+
+def _env(name: str) -> str:
+    return (os.getenv(name) or "").strip().strip("'\"")
+
+
+def data_dir() -> str:
+    return (
+        _env("DATA_DIR")
+        or os.path.dirname(_env("DB_PATH"))
+        or str(Path(__file__).resolve().parent / "data")
+    )
+
+
+def socket_path() -> str:
+    return _env("ENGINE_SOCKET") or os.path.join(data_dir(), "engine.sock")
+
+
+def shm_path() -> str:
+    return _env("SHM_STATE_PATH") or os.path.join(data_dir(), "state.shm")
+
+
+def app_role() -> str:
+    """all = web + moteur dans le même process (historique), web, engine, backtest."""
+    role = _env("APP_ROLE").lower() or "all"
+    return role if role in ("all", "web", "engine", "backtest") else "all"
+
+
+_SHM: Optional[SharedState] = None
+
+
+def read_state() -> Optional[Dict[str, float]]:
+    """Dernier état publié par le moteur (prix, bid/ask, p_up, ev, position, cash)."""
+    global _SHM
+    if _SHM is None:
+        _SHM = SharedState(shm_path())
+    return _SHM.read()
+
+
+def command(cmd: str, timeout: float = 5.0, **args) -> Dict[str, Any]:
+    """Envoie une commande au moteur; {"ok": False, "error": "engine unreachable"} s'il est absent."""
+    out = try_call(socket_path(), cmd, timeout=timeout, **args)
+    if out is None:
+        return {"ok": False, "error": "engine unreachable"}
+    return out
+
+
+def ping(timeout: float = 1.0) -> bool:
+    return bool(command("ping", timeout=timeout).get("ok"))
@@ -0,0 +1,394 @@
+"""
+Offline replay of the ml_tick exit rules over recorded entries.
+
+Entries are the ``buy`` / ``buy_add`` rows of ``decision_trace`` (price, qty and the
+lot's tp_pct / sl_pct from meta_json), or the ``trades`` buys with MIN_TP/SL_PCT
+when no trace is available. The price path after each entry is sampled on a grid
+of ``step_s`` seconds up to ``horizon_s`` from the label sources (snapshots ->
+prices -> decision_trace, then klines_1m): per step the high / low seen since the
+previous step and the last price. p_up along the path is the last recorded value
+(decision_trace, examples). That gives [entries x steps] matrices built once.
+
+Each configuration is a set of ``_PARAMS`` overrides compiled with
+common.params.compile_params (so must_cover and the defaults are the live ones)
+and replayed on the whole matrix at once, with the rules of _ml_tick_locked:
+
+- strict (STRICT_PROFIT_LOSS_ONLY): TP at max(tp_pct, must_cover + PROFIT_SELL_MIN_PCT),
+  SL at max(sl_pct, must_cover + LOSS_HARD_SL_PCT), nothing else;
+- full: SL, TP, break-even, hysteresis (p_up <= PSELL - HYS_PCT), time stop, in
+  this order at each step, plus take-partial on the steps without a full exit.
+
+TP / SL are tested on the step's high / low and filled at their level (SL first
+when both are crossed in the same step); the other rules use the step's last
+price. Lots still open at the horizon are marked to market (reason ``open``).
+Returns are net of must_cover. Per configuration: PnL, hit rate, holding time
+and exit-reason mix.
+
+    cd backend && python -m exit_sim --db data/app.db --days 14 --grid '{"STRICT_PROFIT_LOSS_ONLY":[true,false],"TIME_STOP_MIN":[0,30,120]}'
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import labeler
+from bandit_eval import expand_grid
+from common.params import compile_params
+from common.pricepath import PricePath, optional_path, pick_source
+
+REASONS = ("tp", "sl", "be", "hys", "time", "open")
+R_TP, R_SL, R_BE, R_HYS, R_TIME, R_OPEN = range(len(REASONS))
+
+
+# ---------- données ----------
+
+
+def load_base_params(conn) -> Dict[str, Any]:
+    """_PARAMS persistés (kv AUTOTRADE_PARAMS); {} si absents."""
+    for sql in ("SELECT value FROM kv WHERE key=?", "SELECT v FROM kv WHERE k=?"):
+        try:
+            r = conn.execute(sql, ("AUTOTRADE_PARAMS",)).fetchone()
+        except sqlite3.Error:
+            continue
+        if r and r[0]:
+            try:
+                v = json.loads(r[0])
+                return v if isinstance(v, dict) else {}
+            except ValueError:
+                return {}
+    return {}
+
+
+def load_entries(conn, days: Optional[float] = None, base: Optional[Dict[str, Any]] = None,
+                 now: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """Entrées triées par ts: ts, price, qty, tp_pct, sl_pct (cibles du lot à l'entrée)."""
+    now = time.time() if now is None else float(now)
+    since = (now - float(days) * 86400.0) if days else 0.0
+    S = compile_params(base or {}, 0, environ={})
+    rows = []
+    try:
+        for ts, px, qty, meta in conn.execute(
+            "SELECT CAST(ts AS REAL), CAST(price AS REAL), CAST(qty AS REAL), meta_json "
+            "FROM decision_trace WHERE decision IN ('buy','buy_add') AND CAST(ts AS REAL) >= ? "
+            "ORDER BY ts ASC",
+            (since,),
+        ):
+            try:
+                m = json.loads(meta) if meta else {}
+            except ValueError:
+                m = {}
+            rows.append((ts, px, qty, m.get("tp_pct") or S.min_tp_pct, m.get("sl_pct") or S.min_sl_pct))
+    except sqlite3.Error:
+        rows = []
+    if not rows:
+        try:
+            rows = [
+                (ts, px, qty, S.min_tp_pct, S.min_sl_pct)
+                for ts, px, qty in conn.execute(
+                    "SELECT CAST(ts AS REAL), CAST(price AS REAL), CAST(qty AS REAL) FROM trades "
+                    "WHERE LOWER(side)='buy' AND CAST(ts AS REAL) >= ? ORDER BY ts ASC",
+                    (since,),
+                )
+            ]
+        except sqlite3.Error:
+            rows = []
+    a = np.array([tuple(np.nan if v is None else float(v) for v in r) for r in rows],
+                 dtype=np.float64).reshape(-1, 5)
+    a = a[np.isfinite(a[:, 0]) & (a[:, 1] > 0)]
+    return {"ts": a[:, 0], "price": a[:, 1], "qty": np.nan_to_num(a[:, 2]),
+            "tp_pct": a[:, 3], "sl_pct": a[:, 4]}
+
+
+def load_paths(conn, ts_min: float, ts_max: float, symbol: str = "BTCUSDT") -> List[Optional[PricePath]]:
+    """Sources de labeler.load_label_paths, puis klines_1m (datées à leur clôture)."""
+    paths = labeler.load_label_paths(conn, ts_min, ts_max)
+    try:
+        rows = conn.execute(
+            "SELECT minute + 60, high, low, close FROM klines_1m "
+            "WHERE symbol=? AND minute + 60 >= ? AND minute + 60 <= ? ORDER BY minute",
+            (symbol, ts_min, ts_max),
+        ).fetchall()
+    except sqlite3.Error:
+        rows = []
+    paths.append(optional_path([tuple(r) for r in rows], has_hilo=True))
+    return paths
+
+
+def load_p_up(conn, ts_min: float, ts_max: float) -> Optional[PricePath]:
+    """p_up enregistré (traces du moteur + exemples), lu comme une série de prix."""
+    rows = []
+    for sql in (
+        "SELECT CAST(ts AS REAL), CAST(p_up AS REAL) FROM decision_trace "
+        "WHERE CAST(ts AS REAL) BETWEEN ? AND ? AND p_up IS NOT NULL",
+        "SELECT CAST(ts AS REAL), CAST(p_up AS REAL) FROM examples "
+        "WHERE CAST(ts AS REAL) BETWEEN ? AND ? AND p_up IS NOT NULL",
+    ):
+        try:
+            rows.extend(tuple(r) for r in conn.execute(sql, (ts_min, ts_max)).fetchall())
+        except sqlite3.Error:
+            pass
+    return optional_path(rows)
+
+
+def build_matrix(entries: Dict[str, np.ndarray], paths: Sequence[Optional[PricePath]],
+                 p_up: Optional[PricePath], horizon_s: float = 86400.0,
+                 step_s: float = 60.0) -> Dict[str, np.ndarray]:
+    """
+    Matrices (N, T) au pas ``step_s``: ``hi`` / ``lo`` vus depuis le pas précédent, ``close``
+    (dernier prix, reporté sur les pas sans point), ``p_up`` (NaN avant le 1er point);
+    ``age`` (T,) en secondes; ``has_path`` (N,) False si aucune source ne couvre l'entrée.
+    """
+    t0, ent = entries["ts"], entries["price"]
+    N, T = int(t0.size), max(1, int(np.ceil(float(horizon_s) / float(step_s))))
+    age = np.arange(1, T + 1) * float(step_s)
+    hi = np.full((N, T), np.nan)
+    lo = np.full((N, T), np.nan)
+    close = np.full((N, T), np.nan)
+    # ]t0, t0 + h]: la ligne de l'entrée elle-même (decision_trace) ne doit pas retenir sa source
+    src = (pick_source(paths, np.nextafter(t0, np.inf), t0 + age[-1]) if N
+           else np.zeros(0, dtype=np.int64))
+    for k, p in enumerate(paths):
+        if p is None or not len(p):
+            continue
+        # source choisie, puis repli pas par pas sur les suivantes là où elle n'a aucun point
+        rows = np.flatnonzero((src >= 0) & (src <= k))
+        i, j = np.nonzero(~np.isfinite(close[rows]))
+        if not i.size:
+            continue
+        r = rows[i]
+        # fenêtres ]t0 + (j-1) step, t0 + j step], toutes les entrées et tous les pas d'un coup
+        b = t0[r] + age[j]
+        h, l, c, _ = p.window(np.nextafter(b - float(step_s), np.inf), b)
+        hi[r, j], lo[r, j], close[r, j] = h, l, c
+    # pas sans point: dernier prix connu (prix d'entrée au départ)
+    seen = np.isfinite(close)
+    last = np.maximum.accumulate(np.where(seen, np.arange(T), -1), axis=1)
+    filled = np.take_along_axis(close, np.maximum(last, 0), axis=1)
+    close = np.where(last >= 0, filled, ent[:, None])
+    hi = np.where(seen, hi, close)
+    lo = np.where(seen, lo, close)
+
+    pu = np.full((N, T), np.nan)
+    if p_up is not None and N:
+        tg = t0[:, None] + age[None, :]
+        j = np.searchsorted(p_up.t, tg, side="right") - 1
+        pu = np.where(j >= 0, p_up.close[np.maximum(j, 0)], np.nan)
+    return {"hi": hi, "lo": lo, "close": close, "p_up": pu, "age": age,
+            "has_path": src >= 0, "step_s": float(step_s)}
+
+
+# ---------- simulation ----------
+
+
+def _first(mask: np.ndarray) -> np.ndarray:
+    """Premier pas True par ligne, T si aucun."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def simulate(entries: Dict[str, np.ndarray], mat: Dict[str, np.ndarray],
+             cfg: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Une configuration (_PARAMS complets ou partiels) sur toutes les entrées.
+    -> ret (net), t_exit (s après l'entrée), reason (indice REASONS), partial (fraction vendue avant la sortie).
+    ``TP_PCT`` / ``SL_PCT`` dans ``cfg`` remplacent les cibles enregistrées des lots.
+    """
+    S = compile_params(cfg, 0, environ={})
+    mc = S.must_cover
+    hi, lo, close, pu, age = mat["hi"], mat["lo"], mat["close"], mat["p_up"], mat["age"]
+    N, T = close.shape
+    ent = entries["price"][:, None]
+    tp = np.full(N, float(cfg["TP_PCT"])) if cfg.get("TP_PCT") is not None else entries["tp_pct"]
+    sl = np.full(N, float(cfg["SL_PCT"])) if cfg.get("SL_PCT") is not None else entries["sl_pct"]
+    if S.strict_profit_loss_only:
+        tp = np.maximum(tp, mc + S.profit_sell_min_pct)
+        sl = np.maximum(sl, mc + S.loss_hard_sl_pct)
+    pnl = close / ent - 1.0
+
+    # ordre de _ml_tick_locked: SL, TP, BE, hystérésis, time stop
+    masks = [lo <= ent * (1.0 - sl[:, None]), hi >= ent * (1.0 + tp[:, None])]
+    if not S.strict_profit_loss_only:
+        peak = np.maximum.accumulate(np.maximum(hi, ent), axis=1)
+        masks.append(
+            (pnl >= S.trail_to_breakeven_pct) & (age >= S.be_min_hold_sec)
+            & (close <= peak * (1.0 - S.be_trail_back_pct)) & (pnl >= mc) & (close <= ent)
+        )
+        with np.errstate(invalid="ignore"):
+            masks.append((pu <= S.psell - S.hys_pct) & (age >= S.min_hold_sec) & (pnl >= mc))
+        tsm = np.broadcast_to(S.time_stop_min > 0 and age >= 60 * S.time_stop_min, (N, T))
+        masks.append(tsm)
+    codes = np.array([R_SL, R_TP, R_BE, R_HYS, R_TIME][: len(masks)])
+    firsts = np.stack([_first(m) for m in masks])  # (R, N)
+    kx = firsts.min(axis=0)
+    # argmin: à égalité de pas, la première règle dans l'ordre du moteur
+    reason = np.where(kx < T, codes[np.argmin(firsts, axis=0)], R_OPEN)
+    rows = np.arange(N)
+    kc = np.minimum(kx, T - 1)
+    gross_exit = np.select(
+        [reason == R_TP, reason == R_SL], [tp, -sl], pnl[rows, kc]
+    )
+
+    # take-partial: seulement sur les pas sans sortie complète
+    q = np.ones(N)
+    gross_part = np.zeros(N)
+    take_at, take_pct = S.take_partial_at_pct, S.take_partial_pct
+    if not S.strict_profit_loss_only and take_at > 0.0 and take_pct > 0.0:
+        take = min(take_pct, 1.0)
+        qty = entries["qty"][:, None]
+        elig = (age >= S.partial_min_hold_sec) & (pnl >= take_at) & (np.arange(T) < kx[:, None])
+        if not S.partial_allow_multiple:
+            k1 = _first(elig & (qty * close >= S.partial_min_notional))
+            m = k1 < T
+            gross_part[m] = take * pnl[rows[m], k1[m]]
+            q[m] = 1.0 - take
+        else:
+            # lot réduit à chaque partiel: notionnel et cooldown dépendent du passé, pas à pas
+            last = np.full(N, -np.inf)
+            for k in range(T):
+                m = elig[:, k] & (qty[:, 0] * q * close[:, k] >= S.partial_min_notional)
+                m &= (age[k] - last) >= max(0, S.partial_cooldown_sec)
+                if m.any():
+                    gross_part[m] += q[m] * take * pnl[m, k]
+                    q[m] *= 1.0 - take
+                    last[m] = age[k]
+    ok = mat["has_path"]
+    return {
+        "ret": np.where(ok, gross_part + q * gross_exit - mc, np.nan),
+        "t_exit": np.where(ok, age[kc], np.nan),
+        "reason": np.where(ok, reason, -1),
+        "partial": np.where(ok, 1.0 - q, np.nan),
+    }
+
+
+def summarize(entries: Dict[str, np.ndarray], sim: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    ok = sim["reason"] >= 0
+    n = int(ok.sum())
+    if not n:
+        return {"n": 0}
+    ret, hold, reason = sim["ret"][ok], sim["t_exit"][ok], sim["reason"][ok]
+    closed = reason != R_OPEN
+    notional = (entries["price"] * entries["qty"])[ok]
+    counts = np.bincount(reason, minlength=len(REASONS))
+    return {
+        "n": n,
+        "pnl_quote": float(np.sum(notional * ret)),
+        "expectancy": float(ret.mean()),
+        "median_ret": float(np.median(ret)),
+        "total_return": float(ret.sum()),
+        "hit_rate": float(np.mean(ret > 0)),
+        "hold_s": {
+            "mean": float(hold[closed].mean()) if closed.any() else None,
+            "p50": float(np.median(hold[closed])) if closed.any() else None,
+            "p90": float(np.quantile(hold[closed], 0.9)) if closed.any() else None,
+        },
+        "exits": {r: int(c) for r, c in zip(REASONS, counts)},
+        "exit_mix": {r: float(c) / n for r, c in zip(REASONS, counts)},
+        "with_partial": float(np.mean(sim["partial"][ok] > 0)),
+    }
+
+
+def run(
+    db_path: str,
+    configs: Sequence[Dict[str, Any]],
+    days: Optional[float] = None,
+    horizon_s: float = 86400.0,
+    step_s: float = 60.0,
+    symbol: str = "BTCUSDT",
+    base: Optional[Dict[str, Any]] = None,
+    progress: Optional[Callable[[float], Any]] = None,
+    max_cells: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    ``configs`` = [{"id", "cfg"}] (bandit_eval.expand_grid) ou dicts d'overrides, appliqués
+    sur ``base`` (défaut: AUTOTRADE_PARAMS de la base). Résultats triés par espérance.
+    ``max_cells`` borne entrées × pas des matrices: seules les entrées les plus récentes sont gardées.
+    """
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        base = load_base_params(conn) if base is None else dict(base)
+        entries = load_entries(conn, days, base)
+        n = int(entries["ts"].size)
+        if not n:
+            return {"ok": False, "error": "no entries"}
+        steps = max(1, int(np.ceil(float(horizon_s) / float(step_s))))
+        if max_cells is not None and n * steps > max_cells:
+            keep = max(1, int(max_cells) // steps)
+            entries = {k: v[-keep:] for k, v in entries.items()}
+        n_dropped = n - int(entries["ts"].size)
+        n = int(entries["ts"].size)
+        t_min, t_max = float(entries["ts"][0]), float(entries["ts"][-1] + horizon_s)
+        paths = load_paths(conn, t_min, t_max, symbol)
+        p_up = load_p_up(conn, t_min, t_max)
+    finally:
+        conn.close()
+    mat = build_matrix(entries, paths, p_up, horizon_s, step_s)
+    out = []
+    for i, c in enumerate(configs):
+        if progress is not None:
+            progress(i / max(1, len(configs)))
+        cid, over = (c["id"], c["cfg"]) if "cfg" in c else (f"cfg{i}", c)
+        cfg = {**base, **over}
+        out.append({"id": cid, "overrides": over, **summarize(entries, simulate(entries, mat, cfg))})
+    out.sort(key=lambda r: r.get("expectancy", -1e9), reverse=True)
+    return {
+        "ok": True,
+        "n_entries": n,
+        "n_dropped": n_dropped,
+        "n_with_path": int(mat["has_path"].sum()),
+        "horizon_s": float(horizon_s),
+        "step_s": float(step_s),
+        "results": out,
+    }
+
+
+# ---------- CLI ----------
+
+
+def print_report(res: Dict[str, Any]):
+    print(f"entries={res['n_entries']} with_path={res['n_with_path']} "
+          f"horizon={res['horizon_s']:.0f}s step={res['step_s']:.0f}s")
+    head = "{:>9} {:>9} {:>6} {:>8} | " + " ".join("{:>5}" for _ in REASONS) + " | {}"
+    print(head.format("exp%", "pnl", "hit", "hold_min", *REASONS, "config"))
+    for r in res["results"]:
+        if not r.get("n"):
+            continue
+        hold = r["hold_s"]["p50"]
+        print(head.format(
+            f"{r['expectancy'] * 100:.3f}", f"{r['pnl_quote']:.2f}", f"{r['hit_rate']:.2f}",
+            "-" if hold is None else f"{hold / 60:.1f}",
+            *(f"{r['exit_mix'][k]:.2f}" for k in REASONS), r["id"],
+        ))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Rejoue les règles de sortie de ml_tick sur les entrées enregistrées")
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "data/app.db"))
+    ap.add_argument("--symbol", default="BTCUSDT")
+    ap.add_argument("--days", type=float, default=None, help="entrées des N derniers jours (défaut: toutes)")
+    ap.add_argument("--horizon-h", type=float, default=24.0, help="durée max simulée après l'entrée")
+    ap.add_argument("--step-s", type=float, default=60.0, help="pas de la grille (cadence de ml_tick)")
+    ap.add_argument("--grid", default=None, help='JSON {"CLE": [valeurs], ...} sur les _PARAMS')
+    ap.add_argument("--params", default=None, help="JSON de _PARAMS de base (défaut: kv AUTOTRADE_PARAMS)")
+    ap.add_argument("--json", default=None, help="écrit le rapport complet dans ce fichier")
+    a = ap.parse_args(argv)
+
+    grid = json.loads(a.grid) if a.grid else {"STRICT_PROFIT_LOSS_ONLY": [True, False]}
+    configs = expand_grid({}, grid, prefix="exit")
+    res = run(a.db, configs, a.days, a.horizon_h * 3600.0, a.step_s, a.symbol,
+              json.loads(a.params) if a.params else None)
+    if not res.get("ok"):
+        print(res.get("error"))
+        return 1
+    print_report(res)
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,418 @@
+"""
+Minute-level feature store keyed by (symbol, minute).
+
+``klines_1m`` keeps closed 1m candles; ``features_1m`` keeps the model features
+computed from them and from ``senti_points``. A row keyed by minute M only uses
+the candles opened at or before M (so closed by M + 60) and sentiment points
+stamped before M + 60: it becomes visible at M + 60 and ``asof(ts)`` never
+returns a row that was not knowable at ``ts``. The live engine and the trainers
+read through the same ``asof`` helpers, so both see the same numbers.
+
+Backfill from Binance history:
+
+    cd backend && python -m feature_store backfill --symbol BTCUSDT --days 30
+"""
+from __future__ import annotations
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FEATURES = ("reddit_avg", "twitter_ema", "sig_tech", "atr_pct", "ema_slope", "vol_norm", "hour_of_day")
+
+EMA_FAST = 12
+EMA_SLOW = 48
+ATR_WIN = 14
+WARMUP_MIN = 240  # bougies de la fenêtre EMA (= bougies 1m lues par le moteur), relues avant la 1re minute
+SENTI_WINDOW_S = 3600
+TW_ALPHA = 0.3
+_BINANCE = os.getenv("BINANCE_API", "https://api.binance.com")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS klines_1m(
+  symbol TEXT NOT NULL,
+  minute INTEGER NOT NULL,     -- epoch s, ouverture de la bougie
+  open REAL, high REAL, low REAL, close REAL, volume REAL,
+  PRIMARY KEY(symbol, minute)
+);
+CREATE TABLE IF NOT EXISTS features_1m(
+  symbol TEXT NOT NULL,
+  minute INTEGER NOT NULL,     -- visible à minute + 60
+  price REAL,
+  reddit_avg REAL,
+  twitter_ema REAL,
+  sig_tech REAL,
+  atr_pct REAL,
+  ema_slope REAL,
+  vol_norm REAL,
+  hour_of_day INTEGER,
+  computed_at REAL,
+  PRIMARY KEY(symbol, minute)
+);
+"""
+
+log = logging.getLogger("feature_store")
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA)
+
+
+# ---------- bougies ----------
+
+
+def upsert_klines(conn, symbol: str, rows: Iterable[dict], now: Optional[float] = None) -> int:
+    """rows = dicts {t (ms), o, h, l, c, v}; les bougies non closes à ``now`` sont ignorées."""
+    now = time.time() if now is None else float(now)
+    vals = []
+    for k in rows:
+        m = int(k["t"]) // 1000
+        if m + 60 > now:
+            continue
+        vals.append((symbol, m - m % 60, k["o"], k["h"], k["l"], k["c"], k.get("v")))
+    if vals:
+        conn.executemany(
+            "INSERT OR REPLACE INTO klines_1m(symbol, minute, open, high, low, close, volume) "
+            "VALUES (?,?,?,?,?,?,?)",
+            vals,
+        )
+        conn.commit()
+    return len(vals)
+
+
+def load_klines(conn, symbol: str, m0: int, m1: int) -> np.ndarray:
+    """(n, 5) [minute, open, high, low, close] triés, minute ∈ [m0, m1]."""
+    rows = conn.execute(
+        "SELECT minute, open, high, low, close FROM klines_1m "
+        "WHERE symbol=? AND minute BETWEEN ? AND ? ORDER BY minute",
+        (symbol, int(m0), int(m1)),
+    ).fetchall()
+    if not rows:
+        return np.zeros((0, 5))
+    return np.array([tuple(r) for r in rows], dtype=np.float64)
+
+
+def load_senti(conn, symbol: str, t0_ms: float, t1_ms: float) -> Dict[str, np.ndarray]:
+    """{'tw': (n, 2) [ts_ms, value], 'rd': ...} triés par ts."""
+    out = {"tw": np.zeros((0, 2)), "rd": np.zeros((0, 2))}
+    try:
+        rows = conn.execute(
+            "SELECT source, ts, value FROM senti_points "
+            "WHERE symbol=? AND source IN ('tw','rd') AND ts >= ? AND ts < ? ORDER BY ts",
+            (symbol, float(t0_ms), float(t1_ms)),
+        ).fetchall()
+    except sqlite3.Error:
+        return out
+    for src in out:
+        pts = [(float(r[1]), float(r[2])) for r in rows if r[0] == src and r[2] is not None]
+        if pts:
+            out[src] = np.array(pts, dtype=np.float64)
+    return out
+
+
+# ---------- calcul ----------
+
+
+def _ema(x: np.ndarray, span: int) -> np.ndarray:
+    a = 2.0 / (span + 1.0)
+    out = np.empty_like(x)
+    e = x[0] if x.size else 0.0
+    for i in range(x.size):
+        e = a * x[i] + (1.0 - a) * e
+        out[i] = e
+    return out
+
+
+def _ema_window(x: np.ndarray, span: int, window: int = WARMUP_MIN, lag: int = 0,
+                seed: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    EMA vue par le moteur à chaque bougie i: série des ``window`` dernières bougies
+    [i-window+1, i], amorcée sur sa 1re valeur (``seed``, défaut ``x``), lue ``lag`` points
+    avant i. Même valeur que app._ema_series sur les bougies live, quelle que soit la
+    profondeur d'historique relue: E_j - (1-a)^(j-s) (E_s - seed_s), E amorcée en 0.
+    """
+    if not x.size:
+        return x.copy()
+    a = 2.0 / (span + 1.0)
+    E = _ema(x, span)
+    i = np.arange(x.size)
+    s = np.maximum(i - int(window) + 1, 0)
+    j = np.maximum(i - int(lag), s)
+    sd = x if seed is None else seed
+    return E[j] - (1.0 - a) ** (j - s) * (E[s] - sd[s])
+
+
+def _asof_mean(pts: np.ndarray, end_ms: np.ndarray, window_ms: float) -> np.ndarray:
+    """Moyenne des points dans [end - window, end) pour chaque ``end``; 0 si aucun."""
+    if pts.shape[0] == 0:
+        return np.zeros(end_ms.shape)
+    cs = np.concatenate([[0.0], np.cumsum(pts[:, 1])])
+    i1 = np.searchsorted(pts[:, 0], end_ms, side="left")
+    i0 = np.searchsorted(pts[:, 0], end_ms - window_ms, side="left")
+    n = i1 - i0
+    return np.where(n > 0, (cs[i1] - cs[i0]) / np.maximum(n, 1), 0.0)
+
+
+def _asof_ema(pts: np.ndarray, end_ms: np.ndarray, window_ms: float, alpha: float) -> np.ndarray:
+    """EMA des points (dans l'ordre d'arrivée) au dernier point < end; 0 s'il est trop vieux."""
+    if pts.shape[0] == 0:
+        return np.zeros(end_ms.shape)
+    ema = np.empty(pts.shape[0])
+    e = pts[0, 1]
+    for i, v in enumerate(pts[:, 1]):
+        e = alpha * v + (1.0 - alpha) * e
+        ema[i] = e
+    i1 = np.searchsorted(pts[:, 0], end_ms, side="left")
+    last = np.maximum(i1 - 1, 0)
+    fresh = (i1 > 0) & (pts[last, 0] >= end_ms - window_ms)
+    return np.where(fresh, ema[last], 0.0)
+
+
+def compute(kl: np.ndarray, senti: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Features pour chaque bougie de ``kl`` (sortie de load_klines), point-in-time."""
+    minute, high, low, close = kl[:, 0], kl[:, 2], kl[:, 3], kl[:, 4]
+    # EMAs sur la fenêtre de WARMUP_MIN bougies du moteur (fetch_ohlc), pas sur tout l'historique
+    ef = _ema_window(close, EMA_FAST)
+    es = _ema_window(close, EMA_SLOW)
+    ef3 = _ema_window(close, EMA_FAST, lag=2)
+    prev = np.concatenate([close[:1], close[:-1]])
+    tr = np.maximum.reduce([high - low, np.abs(high - prev), np.abs(low - prev)])
+    # 1re bougie de la fenêtre live: pas de close précédent, TR = high - low
+    atr = _ema_window(tr, ATR_WIN, seed=high - low)
+    safe = np.where(close > 0, close, np.nan)
+    end_ms = (minute + 60.0) * 1000.0
+    atr_pct = np.nan_to_num(atr / safe)
+    return {
+        "price": close,
+        "sig_tech": np.nan_to_num((ef - es) / safe),
+        "atr_pct": atr_pct,
+        "vol_norm": atr_pct,
+        "ema_slope": (ef - ef3) / np.maximum(np.abs(ef3), 1e-9),
+        "hour_of_day": ((minute // 3600) % 24).astype(np.int64),
+        "reddit_avg": _asof_mean(senti["rd"], end_ms, SENTI_WINDOW_S * 1000.0),
+        "twitter_ema": _asof_ema(senti["tw"], end_ms, SENTI_WINDOW_S * 1000.0, TW_ALPHA),
+    }
+
+
+def materialize(conn, symbol: str, m_from: Optional[int] = None, m_to: Optional[int] = None) -> int:
+    """(Re)calcule features_1m sur [m_from, m_to] (défaut: après la dernière minute calculée)."""
+    if m_from is None:
+        r = conn.execute("SELECT MAX(minute) FROM features_1m WHERE symbol=?", (symbol,)).fetchone()
+        m_from = int(r[0]) + 60 if r and r[0] is not None else 0
+    if m_to is None:
+        r = conn.execute("SELECT MAX(minute) FROM klines_1m WHERE symbol=?", (symbol,)).fetchone()
+        if not r or r[0] is None:
+            return 0
+        m_to = int(r[0])
+    if m_from > m_to:
+        return 0
+    kl = load_klines(conn, symbol, m_from - WARMUP_MIN * 60, m_to)
+    if kl.shape[0] == 0:
+        return 0
+    t0 = (kl[0, 0] - SENTI_WINDOW_S) * 1000.0
+    senti = load_senti(conn, symbol, t0, (kl[-1, 0] + 60.0) * 1000.0)
+    f = compute(kl, senti)
+    keep = kl[:, 0] >= m_from
+    now = time.time()
+    cols = ("price",) + FEATURES
+    rows = [
+        (symbol, int(kl[i, 0]), *(float(f[c][i]) for c in cols), now)
+        for i in np.flatnonzero(keep)
+    ]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO features_1m(symbol, minute, {', '.join(cols)}, computed_at) "
+        f"VALUES (?,?,{','.join('?' * len(cols))},?)",
+        rows,
+    )
+    conn.commit()
+    return len(rows)
+
+
+# ---------- lectures point-in-time ----------
+
+
+def _visible_minute(ts: float) -> int:
+    """Dernière minute dont la bougie est close à ``ts``."""
+    return int(ts // 60) * 60 - 60
+
+
+def asof(conn, symbol: str, ts: float, max_age_s: Optional[float] = None) -> Optional[dict]:
+    m = _visible_minute(float(ts))
+    lo = -1 if max_age_s is None else m - int(max_age_s)
+    r = conn.execute(
+        f"SELECT minute, price, {', '.join(FEATURES)} FROM features_1m "
+        "WHERE symbol=? AND minute <= ? AND minute >= ? ORDER BY minute DESC LIMIT 1",
+        (symbol, m, lo),
+    ).fetchone()
+    if r is None:
+        return None
+    return dict(zip(("minute", "price") + FEATURES, tuple(r)))
+
+
+def asof_matrix(
+    conn, symbol: str, ts: Sequence[float], features: Sequence[str] = FEATURES,
+    max_age_s: float = 300.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Features visibles à chaque ``ts`` (n,) -> (X (n, d), has (n,)).
+    Une requête sur la plage couverte puis ``searchsorted``; colonnes inconnues en NaN.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    X = np.full((ts.size, len(features)), np.nan)
+    has = np.zeros(ts.size, dtype=bool)
+    ok = np.isfinite(ts)
+    if not ok.any():
+        return X, has
+    cols = [f for f in features if f in FEATURES]
+    m = (np.floor(ts[ok] / 60.0) * 60.0 - 60.0)
+    try:
+        rows = conn.execute(
+            f"SELECT minute, {', '.join(cols)} FROM features_1m "
+            "WHERE symbol=? AND minute BETWEEN ? AND ? ORDER BY minute",
+            (symbol, int(m.min() - max_age_s), int(m.max())),
+        ).fetchall()
+    except sqlite3.Error:
+        return X, has
+    if not rows:
+        return X, has
+    arr = np.array([tuple(np.nan if v is None else v for v in r) for r in rows], dtype=np.float64)
+    j = np.searchsorted(arr[:, 0], m, side="right") - 1
+    found = (j >= 0) & (arr[np.maximum(j, 0), 0] >= m - max_age_s)
+    idx = np.flatnonzero(ok)[found]
+    for c, f in enumerate(features):
+        if f in cols:
+            X[idx, c] = arr[j[found], 1 + cols.index(f)]
+    has[idx] = True
+    return X, has
+
+
+# ---------- matérialisation continue ----------
+
+
+class Materializer:
+    """Thread: ``fetch_klines(symbol, limit)`` -> upsert bougies closes -> features."""
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        fetch_klines: Callable[[str, int], List[dict]],
+        symbols: Sequence[str],
+        interval_s: float = 60.0,
+        logger=None,
+    ):
+        self.connect = connect
+        self.fetch_klines = fetch_klines
+        self.symbols = [s.upper() for s in symbols]
+        self.interval_s = max(5.0, float(interval_s))
+        self.log = logger or log
+        self.last_run: Dict[str, dict] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Dict[str, dict]:
+        conn = self.connect()
+        try:
+            ensure_schema(conn)
+            for sym in self.symbols:
+                r = conn.execute(
+                    "SELECT MAX(minute) FROM klines_1m WHERE symbol=?", (sym,)
+                ).fetchone()
+                gap = (time.time() - r[0]) / 60.0 if r and r[0] is not None else WARMUP_MIN
+                limit = int(min(1000, max(5, gap + 2)))
+                n_k = upsert_klines(conn, sym, self.fetch_klines(sym, limit) or [])
+                n_f = materialize(conn, sym)
+                self.last_run[sym] = {"ts": time.time(), "klines": n_k, "features": n_f}
+        finally:
+            conn.close()
+        return self.last_run
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.log.warning(f"[feature-store] {e}")
+            self._stop.wait(self.interval_s)
+
+    def start(self) -> threading.Thread:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="feature-store", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+
+# ---------- backfill (CLI) ----------
+
+
+def fetch_binance_range(symbol: str, start_ms: int, end_ms: int, session=None) -> List[dict]:
+    """Bougies 1m [start, end) depuis l'API publique Binance, par pages de 1000."""
+    import requests
+
+    http = session or requests.Session()
+    out: List[dict] = []
+    t = int(start_ms)
+    while t < end_ms:
+        r = http.get(
+            f"{_BINANCE}/api/v3/klines",
+            params={"symbol": symbol, "interval": "1m", "startTime": t,
+                    "endTime": int(end_ms) - 1, "limit": 1000},
+            timeout=10,
+        )
+        r.raise_for_status()
+        rows = r.json()
+        if not rows:
+            break
+        out.extend(
+            {"t": int(k[0]), "o": float(k[1]), "h": float(k[2]), "l": float(k[3]),
+             "c": float(k[4]), "v": float(k[5])}
+            for k in rows
+        )
+        t = int(rows[-1][0]) + 60_000
+    return out
+
+
+def backfill(conn, symbol: str, days: float, fetch=fetch_binance_range) -> Dict[str, int]:
+    ensure_schema(conn)
+    end = int(time.time() // 60) * 60
+    start = end - int(days * 86400)
+    kl = fetch(symbol, start * 1000, end * 1000)
+    n_k = upsert_klines(conn, symbol, kl)
+    n_f = materialize(conn, symbol, m_from=start, m_to=end)
+    return {"klines": n_k, "features": n_f}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Feature store 1m (klines_1m / features_1m)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("backfill", help="télécharge l'historique 1m et recalcule les features")
+    b.add_argument("--symbol", default="BTCUSDT")
+    b.add_argument("--days", type=float, default=7.0)
+    b.add_argument("--db", default=os.getenv("DB_PATH", "data/app.db"))
+    r = sub.add_parser("rebuild", help="recalcule les features depuis klines_1m déjà stockées")
+    r.add_argument("--symbol", default="BTCUSDT")
+    r.add_argument("--db", default=os.getenv("DB_PATH", "data/app.db"))
+    a = ap.parse_args(argv)
+
+    conn = sqlite3.connect(a.db)
+    try:
+        ensure_schema(conn)
+        sym = a.symbol.upper().replace("/", "")
+        if a.cmd == "backfill":
+            print(backfill(conn, sym, a.days))
+        else:
+            print({"features": materialize(conn, sym, m_from=0)})
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
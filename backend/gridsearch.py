@@ -0,0 +1,185 @@
+"""
+Grid search over PBUY x VOL_MIN x TP_ATR_MULT x SL_ATR_MULT on labeled examples.
+
+The dataset is the cached NumPy view of bandit_eval.load_inputs (labeled rows
+only), rebuilt when examples are added or labeled. Only the TP/SL multipliers
+change the exits, so each (TP, SL) pair is simulated once against the stored
+price paths (first passage of TP / SL, else last price at the horizon). With
+the examples sorted by p_up, cumulative sums then give every PBUY threshold at
+once for each VOL_MIN mask. Large grids are split by (TP, SL) pair over a
+process pool whose workers keep their own copy of the cached dataset.
+"""
+from __future__ import annotations
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import bandit_eval
+
+# en dessous de (paires TP/SL x exemples), le pool coûte plus qu'il ne rapporte
+POOL_MIN_WORK = 2_000_000
+# points de grille (un dict résultat chacun, triés en mémoire): au-delà, refusé
+MAX_GRID_POINTS = 20_000
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000;")
+    except sqlite3.Error:
+        pass
+    return conn
+
+
+def load(db_path: str, horizon_s: float = 600.0) -> Dict[str, Any]:
+    conn = _connect(db_path)
+    try:
+        return bandit_eval.load_inputs(
+            conn, None, horizon_s, cache_key=("gridsearch", db_path), labeled_only=True
+        )
+    finally:
+        conn.close()
+
+
+def evaluate_pairs(
+    inputs: Dict[str, Any],
+    pairs: Sequence[Tuple[float, float]],
+    pbuys: Sequence[float],
+    vols: Sequence[float],
+    defaults: Dict[str, float],
+    progress: Optional[Callable[[float], Any]] = None,
+) -> List[Dict[str, Any]]:
+    p_up, atr = inputs["p_up"], inputs["atr_pct"]
+    n = int(p_up.size)
+    cost = float(defaults["COST"])
+    order = np.argsort(-p_up, kind="stable")
+    ps = p_up[order]
+    pb = np.asarray(pbuys, dtype=float)
+    # nb d'exemples avec p_up >= PBUY (ps décroissant)
+    k = np.searchsorted(-ps, -pb, side="right")
+    vmask = [(float(v), (atr >= float(v))[order]) for v in vols]
+    idx = np.arange(n)
+    out = []
+    for i, (tpm, slm) in enumerate(pairs):
+        if progress is not None:
+            progress(i / len(pairs))
+        tp, sl = bandit_eval.target_pcts(atr, float(tpm), float(slm), defaults)
+        ret, _, kind = bandit_eval.simulate_exits(inputs, idx, tp, sl, cost)
+        ret, kind = ret[order], kind[order]
+        ok = np.isfinite(ret)
+        for vol, vm in vmask:
+            m = ok & vm
+            c_n = np.concatenate([[0], np.cumsum(m)])
+            c_r = np.concatenate([[0.0], np.cumsum(np.where(m, ret, 0.0))])
+            c_tp = np.concatenate([[0], np.cumsum(m & (kind == 0))])
+            c_sl = np.concatenate([[0], np.cumsum(m & (kind == 1))])
+            for p, kk in zip(pb.tolist(), k.tolist()):
+                cnt = int(c_n[kk])
+                w, lo = int(c_tp[kk]), int(c_sl[kk])
+                out.append({
+                    "PBUY": p,
+                    "VOL_MIN": vol,
+                    "TP_ATR_MULT": float(tpm),
+                    "SL_ATR_MULT": float(slm),
+                    "count": cnt,
+                    "expectancy": (float(c_r[kk]) / cnt) if cnt else None,
+                    "total_return": float(c_r[kk]),
+                    "hit_rate": (w / (w + lo)) if (w + lo) else None,
+                    "tp": w,
+                    "sl": lo,
+                })
+    return out
+
+
+def _eval_chunk(db_path, horizon_s, pairs, pbuys, vols, defaults):
+    return evaluate_pairs(load(db_path, horizon_s), pairs, pbuys, vols, defaults)
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None or _POOL._max_workers != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return _POOL
+
+
+def _reset_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def run(
+    db_path: str,
+    grid: Dict[str, Sequence[float]],
+    defaults: Dict[str, float],
+    horizon_s: float = 600.0,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[float], Any]] = None,
+) -> Dict[str, Any]:
+    """``progress(frac)`` est appelé par paire TP/SL (par lot en mode pool); ce qu'il lève interrompt."""
+    size = bandit_eval.grid_size(grid)
+    if size > MAX_GRID_POINTS:
+        return {"ok": False, "error": f"grid too large ({size} > {MAX_GRID_POINTS} points)"}
+    inputs = load(db_path, horizon_s)
+    n = int(inputs["ts"].size)
+    if not n:
+        return {"ok": False, "error": "no labeled examples"}
+    pairs = list(itertools.product(grid["TP_ATR_MULT"], grid["SL_ATR_MULT"]))
+    pbuys, vols = list(grid["PBUY"]), list(grid["VOL_MIN"])
+    if workers is None:
+        workers = int(os.getenv("GRIDSEARCH_WORKERS") or min(4, os.cpu_count() or 1))
+    workers = max(1, min(int(workers), len(pairs)))
+    results, mode = None, "inline"
+    if workers > 1 and len(pairs) * n >= POOL_MIN_WORK:
+        # quelques lots par worker: progression plus fine, dataset déjà en cache côté worker
+        n_chunks = min(len(pairs), 4 * workers)
+        chunks = [pairs[i::n_chunks] for i in range(n_chunks)]
+        futs = []
+        try:
+            futs = [
+                _pool(workers).submit(_eval_chunk, db_path, horizon_s, c, pbuys, vols, defaults)
+                for c in chunks
+            ]
+            results = []
+            for i, f in enumerate(as_completed(futs)):
+                results.extend(f.result())
+                if progress is not None:
+                    progress((i + 1) / len(futs))
+            mode = "pool"
+        except (BrokenProcessPool, RuntimeError):
+            results = None
+            _reset_pool()  # pool cassé (worker tué): on recrée au prochain appel, calcul local
+        finally:
+            for f in futs:
+                f.cancel()
+    if results is None:
+        results = evaluate_pairs(inputs, pairs, pbuys, vols, defaults, progress)
+    results.sort(
+        key=lambda x: (x["expectancy"] if x["expectancy"] is not None else -1e9, x["count"]),
+        reverse=True,
+    )
+    return {
+        "ok": True,
+        "n_examples": n,
+        "grid_points": len(results),
+        "mode": mode,
+        "workers": workers if mode == "pool" else 1,
+        "results": results,
+    }
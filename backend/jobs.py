@@ -0,0 +1,364 @@
+"""
+Asynchronous research jobs (grid searches, backfills, bandit resets) off the request thread.
+
+``submit(kind, params)`` returns a job id at once; the job runs in a thread pool of
+the process that accepted it. State, progress, result and error live in the ``jobs``
+table, so any web worker can answer ``get(id)``. A job with the same kind and
+params already queued or running is returned instead of starting a second one
+(partial unique index on ``dedupe_key``). Cancellation is cooperative: the job
+calls ``ctx.progress()`` / ``ctx.check()``, which raise ``JobCancelled`` once
+``cancel_requested`` is set (from any process). Finished rows expire after their TTL;
+in-flight rows whose heartbeat stops (process died) are marked ``lost``.
+
+Job functions are ``fn(ctx, **params)`` and return something JSON-able.
+"""
+from __future__ import annotations
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs(
+  id TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  dedupe_key TEXT NOT NULL,
+  params_json TEXT,
+  state TEXT NOT NULL,         -- queued | running | done | failed | cancelled | lost
+  progress REAL DEFAULT 0.0,   -- 0..1
+  message TEXT,
+  result_json TEXT,
+  error TEXT,
+  cancel_requested INTEGER DEFAULT 0,
+  owner TEXT,
+  created_at REAL,
+  started_at REAL,
+  finished_at REAL,
+  heartbeat REAL,
+  expires_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_inflight ON jobs(dedupe_key)
+  WHERE state IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs(created_at);
+"""
+
+ACTIVE = ("queued", "running")
+
+log = logging.getLogger("jobs")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA)
+
+
+def dedupe_key(kind: str, params: Dict[str, Any]) -> str:
+    raw = json.dumps([kind, params], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _row(r: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if r is None:
+        return None
+    d = dict(r)
+    for k in ("params_json", "result_json"):
+        v = d.pop(k, None)
+        d[k[:-5]] = json.loads(v) if v else None
+    d["cancel_requested"] = bool(d.get("cancel_requested"))
+    d.pop("dedupe_key", None)
+    return d
+
+
+class JobContext:
+    """Passé au job: progression (écrite au plus toutes les ``min_interval_s``) et annulation."""
+
+    def __init__(self, queue: "JobQueue", job_id: str, min_interval_s: float = 1.0):
+        self.queue = queue
+        self.job_id = job_id
+        self.min_interval_s = float(min_interval_s)
+        self._cancel = threading.Event()
+        self._last_write = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.job_id)
+
+    def progress(self, frac: float, message: Optional[str] = None, force: bool = False):
+        """Met à jour la progression et lève ``JobCancelled`` si une annulation est demandée."""
+        now = time.time()
+        if force or now - self._last_write >= self.min_interval_s:
+            self._last_write = now
+            if self.queue._write_progress(self.job_id, frac, message):
+                self._cancel.set()
+        self.check()
+
+
+class JobQueue:
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_workers: int = 2,
+        ttl_s: float = 86400.0,
+        heartbeat_s: float = 15.0,
+        logger=None,
+    ):
+        self.connect = connect
+        self.max_workers = max(1, int(max_workers))
+        self.ttl_s = float(ttl_s)
+        self.heartbeat_s = max(1.0, float(heartbeat_s))
+        self.log = logger or log
+        self.owner = f"{os.uname().nodename if hasattr(os, 'uname') else ''}:{os.getpid()}"
+        self._kinds: Dict[str, Callable[..., Any]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._live: Dict[str, Tuple[JobContext, Future]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        conn = self.connect()
+        try:
+            ensure_schema(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- enregistrement / soumission ----------
+
+    def register(self, kind: str, fn: Callable[..., Any]):
+        self._kinds[kind] = fn
+
+    @property
+    def kinds(self) -> List[str]:
+        return sorted(self._kinds)
+
+    def check_params(self, kind: str, params: Dict[str, Any]) -> Optional[str]:
+        """Erreur si ``params`` ne colle pas à la signature ``fn(ctx, **params)``, sinon None."""
+        if kind not in self._kinds:
+            return f"unknown kind {kind!r}"
+        try:
+            args = list(inspect.signature(self._kinds[kind]).parameters.values())[1:]  # sans ctx
+        except (TypeError, ValueError):
+            return None
+        if any(a.kind is inspect.Parameter.VAR_KEYWORD for a in args):
+            return None
+        by_name = (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+        named = {a.name for a in args if a.kind in by_name}
+        unknown = sorted(set(params) - named)
+        if unknown:
+            return f"unknown params {unknown}; expected {sorted(named)}"
+        missing = sorted(a.name for a in args if a.name in named
+                         and a.default is inspect.Parameter.empty and a.name not in params)
+        if missing:
+            return f"missing params {missing}"
+        return None
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None,
+               ttl_s: Optional[float] = None) -> Tuple[str, bool]:
+        """-> (job_id, created); ``created`` False si un job identique est déjà en file/en cours."""
+        if kind not in self._kinds:
+            raise KeyError(kind)
+        params = dict(params or {})
+        key = dedupe_key(kind, params)
+        now = time.time()
+        ttl = self.ttl_s if ttl_s is None else float(ttl_s)
+        job_id = uuid.uuid4().hex
+        conn = self.connect()
+        try:
+            self._mark_lost(conn, now)
+            try:
+                conn.execute(
+                    "INSERT INTO jobs(id,kind,dedupe_key,params_json,state,progress,owner,"
+                    "created_at,heartbeat,expires_at) VALUES(?,?,?,?,?,?,?,?,?,?)",
+                    (job_id, kind, key, json.dumps(params, default=str), "queued", 0.0,
+                     self.owner, now, now, now + ttl),
+                )
+                conn.commit()
+            except sqlite3.IntegrityError:
+                r = conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key=? AND state IN ('queued','running')",
+                    (key,),
+                ).fetchone()
+                if r is not None:
+                    return r[0], False
+                raise
+        finally:
+            conn.close()
+        ctx = JobContext(self, job_id)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="job")
+            fut = self._executor.submit(self._run, kind, ctx, params)
+            self._live[job_id] = (ctx, fut)
+        self.start()
+        return job_id, True
+
+    # ---------- exécution ----------
+
+    def _run(self, kind: str, ctx: JobContext, params: Dict[str, Any]):
+        now = time.time()
+        conn = self.connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET state='running', started_at=?, heartbeat=? "
+                "WHERE id=? AND state='queued' AND cancel_requested=0",
+                (now, now, ctx.job_id),
+            )
+            conn.commit()
+            started = cur.rowcount == 1
+        finally:
+            conn.close()
+        state, result, error = "cancelled", None, None
+        if started:
+            try:
+                result = self._kinds[kind](ctx, **params)
+                state = "done"
+            except JobCancelled:
+                state = "cancelled"
+            except Exception as e:
+                state, error = "failed", f"{type(e).__name__}: {e}"
+                self.log.warning(f"[jobs] {kind} {ctx.job_id} failed: {error}")
+        self._finish(ctx.job_id, state, result, error)
+
+    def _finish(self, job_id: str, state: str, result: Any, error: Optional[str]):
+        now = time.time()
+        try:
+            payload = json.dumps(result, default=str) if result is not None else None
+        except (TypeError, ValueError) as e:
+            state, payload, error = "failed", None, f"result not JSON-able: {e}"
+        conn = self.connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET state=?, result_json=?, error=?, finished_at=?, heartbeat=?, "
+                "progress=CASE WHEN ?='done' THEN 1.0 ELSE progress END, "
+                "expires_at=? + (expires_at - created_at) WHERE id=?",
+                (state, payload, error, now, now, state, now, job_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._live.pop(job_id, None)
+
+    def _write_progress(self, job_id: str, frac: float, message: Optional[str]) -> bool:
+        """Écrit la progression; renvoie True si une annulation a été demandée."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET progress=?, message=COALESCE(?, message), heartbeat=? WHERE id=?",
+                (max(0.0, min(1.0, float(frac))), message, now, job_id),
+            )
+            conn.commit()
+            r = conn.execute("SELECT cancel_requested FROM jobs WHERE id=?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return bool(r and r[0])
+
+    # ---------- annulation / lecture ----------
+
+    def cancel(self, job_id: str) -> bool:
+        """Demande l'annulation; un job en file ne démarrera pas, un job en cours s'arrête au prochain check."""
+        conn = self.connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET cancel_requested=1 WHERE id=? AND state IN ('queued','running')",
+                (job_id,),
+            )
+            conn.commit()
+            hit = cur.rowcount == 1
+        finally:
+            conn.close()
+        with self._lock:
+            live = self._live.get(job_id)
+        if live is not None:
+            ctx, fut = live
+            ctx._cancel.set()
+            if fut.cancel():
+                self._finish(job_id, "cancelled", None, None)
+        return hit
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            return _row(conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone())
+        finally:
+            conn.close()
+
+    def list(self, limit: int = 50, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        conn = self.connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            sql = ("SELECT id,kind,params_json,state,progress,message,error,cancel_requested,owner,"
+                   "created_at,started_at,finished_at,heartbeat,expires_at FROM jobs")
+            args: Tuple = ()
+            if state:
+                sql, args = sql + " WHERE state=?", (state,)
+            rows = conn.execute(sql + " ORDER BY created_at DESC LIMIT ?", args + (int(limit),))
+            return [_row(r) for r in rows.fetchall()]
+        finally:
+            conn.close()
+
+    # ---------- entretien ----------
+
+    def _mark_lost(self, conn, now: float) -> int:
+        cur = conn.execute(
+            "UPDATE jobs SET state='lost', error='heartbeat lost', finished_at=? "
+            "WHERE state IN ('queued','running') AND heartbeat < ?",
+            (now, now - 4.0 * self.heartbeat_s),
+        )
+        return cur.rowcount
+
+    def maintain(self) -> Dict[str, int]:
+        """Heartbeat des jobs de ce process, jobs orphelins -> lost, purge des expirés."""
+        now = time.time()
+        with self._lock:
+            mine = list(self._live)
+        conn = self.connect()
+        try:
+            if mine:
+                conn.executemany("UPDATE jobs SET heartbeat=? WHERE id=?", [(now, j) for j in mine])
+            lost = self._mark_lost(conn, now)
+            purged = conn.execute(
+                "DELETE FROM jobs WHERE state NOT IN ('queued','running') AND expires_at < ?",
+                (now,),
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return {"lost": lost, "purged": purged}
+
+    def _loop(self):
+        while not self._stop.wait(self.heartbeat_s):
+            try:
+                self.maintain()
+            except Exception as e:
+                self.log.warning(f"[jobs] maintain: {e}")
+
+    def start(self) -> threading.Thread:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="jobs", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            ids = list(self._live)
+        for j in ids:
+            self.cancel(j)
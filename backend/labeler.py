@@ -0,0 +1,110 @@
+"""
+Sweep labeler for ``examples`` (outcome tp/sl/timeout + ret_k).
+
+Prices covering all pending windows are loaded once per source, hi/lo/last of
+every [ts, ts + k] window come from common.pricepath in one vectorized pass, and
+the updates go out in a single executemany. Works on a bare sqlite3 connection
+so it can run in a training worker process as well as inside app.py.
+"""
+from __future__ import annotations
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from common.pricepath import merge_windows, optional_path
+
+
+def load_label_paths(conn, ts_min: float, ts_max: float) -> list:
+    """
+    Séries de prix couvrant [ts_min, ts_max], une requête par source, dans l'ordre de
+    priorité de get_hilo_last_between: snapshots -> prices (OHLC) -> decision_trace.
+    """
+    out = []
+    for sql, hilo in (
+        (
+            "SELECT CAST(ts AS REAL), CAST(price AS REAL) FROM snapshots "
+            "WHERE CAST(ts AS REAL) >= ? AND CAST(ts AS REAL) <= ? AND price IS NOT NULL",
+            False,
+        ),
+        (
+            "SELECT COALESCE(CAST(ts AS REAL), CAST(t AS REAL)/1000.0) AS tsec, "
+            "CAST(high AS REAL), CAST(low AS REAL), CAST(close AS REAL) FROM prices "
+            "WHERE COALESCE(CAST(ts AS REAL), CAST(t AS REAL)/1000.0) >= ? "
+            "AND COALESCE(CAST(ts AS REAL), CAST(t AS REAL)/1000.0) <= ?",
+            True,
+        ),
+        (
+            "SELECT CAST(ts AS REAL), CAST(price AS REAL) FROM decision_trace "
+            "WHERE CAST(ts AS REAL) >= ? AND CAST(ts AS REAL) <= ? AND price IS NOT NULL",
+            False,
+        ),
+    ):
+        try:
+            rows = [tuple(r) for r in conn.execute(sql, (ts_min, ts_max)).fetchall()]
+        except sqlite3.Error:
+            rows = []
+        out.append(optional_path(rows, has_hilo=hilo))
+    return out
+
+
+def label_pending(
+    conn, k_minutes: float = 10, features: Sequence[str] = (), now: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Labellise les exemples sans outcome dont la fenêtre [ts, ts + k] est passée.
+    Renvoie {"n", "ids", "ts", "p_up", "outcome", "X"} (tableaux dans l'ordre des ids)
+    pour que l'appelant alimente calibration et monitor.
+    """
+    k_s = max(60.0, float(k_minutes) * 60.0)
+    now = time.time() if now is None else float(now)
+    empty = {"n": 0, "ids": np.zeros(0), "ts": np.zeros(0), "p_up": np.zeros(0),
+             "outcome": np.zeros(0, dtype="<U7"), "X": np.zeros((0, len(features)))}
+
+    feats = "".join(f", CAST({f} AS REAL)" for f in features)
+    rows = conn.execute(
+        "SELECT id, CAST(ts AS REAL), CAST(price AS REAL), "
+        "       CAST(tp_pct AS REAL), CAST(sl_pct AS REAL), CAST(p_up AS REAL)"
+        f"      {feats} "
+        "FROM examples "
+        "WHERE outcome IS NULL AND CAST(ts AS REAL) <= ? "
+        "ORDER BY id ASC",
+        (now - k_s,),
+    ).fetchall()
+    if not rows:
+        return empty
+
+    arr = np.array(
+        [tuple(np.nan if v is None else v for v in r) for r in rows], dtype=float
+    )
+    ids, ts0, entry = arr[:, 0], arr[:, 1], arr[:, 2]
+    tp_pct = np.nan_to_num(arr[:, 3], nan=0.0)
+    sl_pct = np.nan_to_num(arr[:, 4], nan=0.0)
+    p_up, X = arr[:, 5], arr[:, 6:]
+    ok = np.isfinite(ts0) & (ts0 > 0.0) & np.isfinite(entry) & (entry > 0.0)
+    if not ok.any():
+        return empty
+    ids, ts0, entry, tp_pct, sl_pct, p_up, X = (
+        ids[ok], ts0[ok], entry[ok], tp_pct[ok], sl_pct[ok], p_up[ok], X[ok]
+    )
+
+    # fenêtre de label: [ts0, ts0 + k]
+    paths = load_label_paths(conn, float(ts0.min()), float(ts0.max() + k_s))
+    hi, lo, last, has = merge_windows(paths, ts0, ts0 + k_s)
+
+    with np.errstate(invalid="ignore"):
+        tp_hit = has & (tp_pct > 0.0) & (hi >= entry * (1.0 + tp_pct))
+        sl_hit = has & (sl_pct > 0.0) & (lo <= entry * (1.0 - sl_pct))
+    # tp et sl touchés dans la même fenêtre: ordre inconnu -> timeout
+    outcome = np.where(
+        tp_hit & ~sl_hit, "tp", np.where(sl_hit & ~tp_hit, "sl", "timeout")
+    )
+    ret_k = np.where(has, last / entry - 1.0, 0.0)
+
+    conn.executemany(
+        "UPDATE examples SET outcome=?, ret_k=? WHERE id=?",
+        zip(outcome.tolist(), ret_k.tolist(), ids.astype(int).tolist()),
+    )
+    conn.commit()
+    return {"n": int(ids.size), "ids": ids, "ts": ts0, "p_up": p_up, "outcome": outcome, "X": X}
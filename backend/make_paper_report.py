@@ -6,6 +6,8 @@ from urllib.request import urlopen, Request
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 
+from common import tpsl
+
 def fetch_json(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -61,47 +63,6 @@ def load_returns(path):
                 pass
     return rets
 
-def build_grid(tp_min, tp_max, tp_step):
-    xs = []
-    v = tp_min
-    while v <= tp_max + 1e-12:
-        xs.append(round(v, 10))
-        v += tp_step
-    return xs
-
-def grid_search_tp(returns, tps, break_even, size):
-    best = None
-    for tp in tps:
-        hit = sum(1 for r in returns if r >= tp)
-        n   = len(returns); hr  = (hit / n) if n > 0 else 0.0
-        net = size * (tp - break_even) * hr
-        cand = {"tp": tp, "hit_rate": hr, "net_per_trade": net}
-        if best is None or cand["net_per_trade"] >= best["net_per_trade"]:  
-            best = cand
-    return best or {"tp": None, "hit_rate": 0.0, "net_per_trade": 0.0}
-
-def load_losses(history_path):
-    losses = []
-    with open(history_path, "r", newline="", encoding="utf-8") as f:
-        for r in csv.DictReader(f):
-            try:
-                ret = float(r.get("ret", "nan"))
-                if math.isfinite(ret) and ret < 0:
-                    losses.append(abs(ret))
-            except Exception:
-                pass
-    return losses
-
-def quantile(values, q):
-    if not values:
-        return None
-    vs = sorted(values)
-    idx = (len(vs)-1) * q
-    lo = int(math.floor(idx)); hi = int(math.ceil(idx))
-    if lo == hi: return vs[lo]
-    frac = idx - lo
-    return vs[lo]*(1-frac) + vs[hi]*frac
-
 def apply_param(base_url, key, value):
     payload = json.dumps({key: value}).encode("utf-8")
     req = Request(base_url.rstrip('/') + "/api/params/update", method="POST",
@@ -133,13 +94,14 @@ def main():
     rets = load_returns(args.history)
     if not rets:
         print("Aucun historique trouvé dans", args.history, file=sys.stderr); sys.exit(1)
-    tps = build_grid(max(args.tp_min, break_even + 0.0001), args.tp_max, args.tp_step)
+    tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step, floor=break_even + 0.0001, decimals=10)
     sizes = [float(s.strip()) for s in args.sizes.split(",") if s.strip()]
+    sr = tpsl.SortedReturns(rets)
 
-    # Optimal TP per size
+    # Optimal TP per size (ex aequo ou aucun hit -> plus grand TP)
     recs = []
     for size in sizes:
-        best = grid_search_tp(rets, tps, break_even, size)
+        best = sr.fit_tp(tps, break_even, size, ties="last", zero_hits="keep")
         recs.append((size, best))
 
     # Choose TP to apply (if asked)
@@ -157,16 +119,9 @@ def main():
                 applied_tp_line = f"Échec application MIN_TP_PCT ({e})"
 
     # SL recommendation from loss distribution
-    losses = [abs(x) for x in rets if x < 0]
-    n_losses = len(losses)
-    method = "floor"
-    sl_reco = args.sl_floor
-    if n_losses >= 5:
-        q = max(0.5, min(args.sl_quantile, 0.99))
-        qv = quantile(losses, q)
-        if qv is not None:
-            sl_reco = max(args.sl_floor, qv)
-            method = f"quantile_{q:.2f}"
+    losses = sr.losses.tolist()
+    sl_fit = sr.fit_sl(args.sl_quantile, args.sl_floor)
+    sl_reco, method, n_losses = sl_fit["sl"], sl_fit["method"], sl_fit["n_losses"]
 
     # Optionally apply SL
     applied_sl_line = None
@@ -213,14 +168,8 @@ def main():
         # Page 2: Net/trade overlay
         fig2 = plt.figure()
         ax2 = fig2.add_subplot(111)
-        xs = [tp*100 for tp in tps]
-        for size in sizes:
-            ys = []
-            for tp in tps:
-                hit = sum(1 for r in rets if r >= tp)
-                n   = len(rets); hr  = (hit / n) if n > 0 else 0.0
-                net = size * (tp - break_even) * hr
-                ys.append(net)
+        xs = tps * 100
+        for size, ys in zip(sizes, sr.net(tps, break_even, sizes)):
             ax2.plot(xs, ys, label=f"{int(size)} USDT")
         ax2.set_title("Net/trade ($) vs TP (%) — tailles superposées")
         ax2.set_xlabel("TP (%)")
@@ -232,12 +181,7 @@ def main():
         # Page 3: Hit rate vs TP
         fig3 = plt.figure()
         ax3 = fig3.add_subplot(111)
-        hr_y = []
-        for tp in tps:
-            hit = sum(1 for r in rets if r >= tp)
-            n   = len(rets); hr  = (hit / n) if n > 0 else 0.0
-            hr_y.append(hr*100.0)
-        ax3.plot(xs, hr_y)
+        ax3.plot(xs, sr.hit_rate(tps) * 100.0)
         ax3.set_title("Hit rate (%) vs TP (%)")
         ax3.set_xlabel("TP (%)")
         ax3.set_ylabel("Hit rate (%)")
@@ -1,58 +1,269 @@
 """
-Minimal multiclass logistic "stub" with online SGD-like API.
-If no model is present in KV, sgd_mc_predict raises so caller can fallback.
+Multiclass (down / flat / up) softmax regression over ``examples``.
+
+Labels come from the labeler: ``tp`` -> up, ``sl`` -> down, ``timeout`` -> by
+``ret_k`` (flat inside +/- FLAT_BAND). Training is vectorized mini-batch Adam with
+L2 and balanced class weights, warm-started from the previous weights. The model
+is published as JSON under MODEL_KEY (same key as before) and hot-swapped in
+model_registry. If no model is present in KV, sgd_mc_predict raises so caller can
+fallback.
 """
 from __future__ import annotations
 from typing import Callable, Dict, Any, List, Tuple, Optional
-import json, math, random
+import hashlib, json, math, threading, time
+
+import numpy as np
+
+from model_registry import REGISTRY
 
 MODEL_KEY = "mc_model_v1"
 
 FEATURES = ["reddit_avg","twitter_ema","sig_tech","atr_pct","ema_slope","vol_norm","hour_of_day"]
+CLASSES = ("down", "flat", "up")
+FLAT_BAND = 0.002  # |ret_k| sous ce seuil -> flat pour les timeouts
+
+
+def _softmax_np(Z: np.ndarray) -> np.ndarray:
+    Z = Z - Z.max(axis=1, keepdims=True)
+    E = np.exp(Z)
+    return E / E.sum(axis=1, keepdims=True)
+
+
+# ---------- modèle ----------
+
+class MCModel:
+    """Poids (K, d) + biais (K,) sur features standardisées (mu/sigma)."""
+
+    def __init__(self, W, b, features=None, mu=None, sigma=None, version=None, meta=None):
+        self.W = np.asarray(W, dtype=np.float64)
+        self.b = np.asarray(b, dtype=np.float64)
+        self.features = list(features or FEATURES)
+        d = len(self.features)
+        # False pour l'ancien format (stub sans mu/sigma): pas de warm start depuis ces poids
+        self.standardized = mu is not None and sigma is not None
+        self.mu = np.zeros(d) if mu is None else np.asarray(mu, dtype=np.float64)
+        self.sigma = np.ones(d) if sigma is None else np.asarray(sigma, dtype=np.float64)
+        self.version = version
+        self.meta = dict(meta or {})
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Matrice (n, d) dans l'ordre de ``features`` -> probas (n, 3) [down, flat, up]."""
+        X = np.asarray(X, dtype=np.float64)
+        return _softmax_np(((X - self.mu) / self.sigma) @ self.W.T + self.b)
+
+    def vector(self, row: Dict[str, Any]) -> np.ndarray:
+        return np.array([_num(row.get(f)) for f in self.features], dtype=np.float64)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "W": self.W.tolist(), "b": self.b.tolist(), "features": self.features,
+            "mu": self.mu.tolist(), "sigma": self.sigma.tolist(),
+            "classes": list(CLASSES), "version": self.version, **self.meta,
+        }
 
-def _softmax(z):
-    m = max(z)
-    e = [math.exp(v - m) for v in z]
-    s = sum(e)
-    return [v/s for v in e]
+    @classmethod
+    def from_json(cls, model: Dict[str, Any]) -> Optional["MCModel"]:
+        W = (model or {}).get("W"); b = (model or {}).get("b")
+        if not W or not b:
+            return None
+        return cls(W, b, model.get("features"), model.get("mu"), model.get("sigma"),
+                   model.get("version"))
+
+
+def _num(v, default: float = 0.0) -> float:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return default
+    return f if math.isfinite(f) else default
+
+
+def predict_proba(X: np.ndarray, model: Optional[MCModel] = None) -> np.ndarray:
+    """API batchée; sans ``model`` utilise la version active du registre."""
+    if model is None:
+        h = REGISTRY.get(MODEL_KEY)
+        if h is None:
+            raise RuntimeError("model missing")
+        model = h.model
+    return model.predict_proba(X)
+
+
+# ---------- inférence ligne à ligne (tri_patch) ----------
+
+def _mc_loader(kv_get):
+    def load(cur_version):
+        raw = kv_get(MODEL_KEY, None)
+        if not raw:
+            return None
+        model = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        version = (model or {}).get("version") or hashlib.sha1(
+            json.dumps(model, sort_keys=True).encode()).hexdigest()[:12]
+        if version == cur_version:
+            return None
+        m = MCModel.from_json(model)
+        return (m, version) if m is not None else None
+    return load
 
 def sgd_mc_predict(row: Dict[str, Any], kv_get: Callable[[str, Any], Any]) -> Dict[str, float]:
-    raw = kv_get(MODEL_KEY, None) if callable(getattr(kv_get, "__call__", None)) else None
-    if not raw:
+    """Poids décodés une fois et gardés dans model_registry; KV relu au plus toutes les refresh_s."""
+    h = REGISTRY.ensure(MODEL_KEY, _mc_loader(kv_get))
+    if h is None:
         raise RuntimeError("model missing")
-    try:
-        model = json.loads(raw)
-    except Exception:
-        raise RuntimeError("bad model")
-    W = model.get("W"); b = model.get("b")
-    if not W or not b:
-        raise RuntimeError("bad model")
-    # Build feature vector
-    x = [float(row.get(f, 0.0)) for f in FEATURES]
-    # Linear logits for 3 classes in order ["down","flat","up"]
-    logits = [
-        sum(wi*xi for wi, xi in zip(W[0], x)) + b[0],
-        sum(wi*xi for wi, xi in zip(W[1], x)) + b[1],
-        sum(wi*xi for wi, xi in zip(W[2], x)) + b[2],
-    ]
-    p = _softmax(logits)
+    p = h.model.predict_proba(h.model.vector(row)[None, :])[0]
     return {"down": float(p[0]), "flat": float(p[1]), "up": float(p[2])}
 
-def sgd_mc_train_online(select_rows, kv_get, kv_set, limit: int = 2000) -> Dict[str,str]:
+
+# ---------- données ----------
+
+def label_of(outcome, ret_k, flat_band: float = FLAT_BAND) -> Optional[int]:
+    o = str(outcome or "").lower()
+    if o == "tp":
+        return 2
+    if o == "sl":
+        return 0
+    if ret_k is None:
+        return None
+    r = _num(ret_k)
+    return 2 if r > flat_band else (0 if r < -flat_band else 1)
+
+def load_dataset(select_rows, limit: int = 20000, features: List[str] = FEATURES,
+                 flat_band: float = FLAT_BAND, asof=None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Very small "trainer": if there is no historical data, create a neutral model.
-    Otherwise, random-initialize small weights. This is a stub to unblock runtime.
-    Expect select_rows(sql, params) -> list[dict-like], but we don't depend on schema.
+    select_rows(sql, params) -> list[dict]; exemples labellisés, du plus ancien au plus récent.
+    ``asof(ts, features) -> (X, has)``: valeurs du feature store (point-in-time) si présentes.
     """
-    try:
-        data = select_rows("SELECT 1 LIMIT ?", (min(limit, 2000),))
-        # we don't actually use data here in the stub
-    except Exception:
-        data = []
-    # neutral-ish model: small randoms to avoid NaN
-    rnd = lambda: (random.random()-0.5)*0.02
-    W = [[rnd() for _ in FEATURES] for _ in range(3)]
-    b = [0.0, 0.0, 0.0]
-    model = {"W": W, "b": b, "features": FEATURES}
-    kv_set(MODEL_KEY, json.dumps(model))
-    return {"status": "ok", "classes": "down,flat,up", "features": ",".join(FEATURES)}
+    cols = ", ".join(f"CAST({f} AS REAL) AS {f}" for f in features)
+    rows = select_rows(
+        f"SELECT {cols}, outcome, CAST(ret_k AS REAL) AS ret_k, CAST(ts AS REAL) AS ts FROM examples "
+        "WHERE outcome IS NOT NULL ORDER BY id DESC LIMIT ?",
+        (int(limit),),
+    ) or []
+    X, y, ts = [], [], []
+    for r in reversed(rows):
+        lab = label_of(r.get("outcome"), r.get("ret_k"), flat_band)
+        if lab is None:
+            continue
+        X.append([_num(r.get(f)) for f in features])
+        y.append(lab)
+        ts.append(_num(r.get("ts"), math.nan))
+    if not y:
+        return np.zeros((0, len(features))), np.zeros(0, dtype=np.int64)
+    X = np.asarray(X, dtype=np.float64)
+    if asof is not None:
+        Xs, has = asof(np.asarray(ts, dtype=np.float64), features)
+        X = np.where(has[:, None] & np.isfinite(Xs), Xs, X)
+    return X, np.asarray(y, dtype=np.int64)
+
+
+# ---------- entraînement ----------
+
+def _scale(X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """mu = médiane, sigma = demi-écart p16-p84 (écart-type, puis 1 si dégénéré)."""
+    p16, mu, p84 = np.percentile(X, [16, 50, 84], axis=0)
+    sigma = (p84 - p16) / 2.0
+    std = X.std(axis=0)
+    return mu, np.where(sigma > 1e-9, sigma, np.where(std > 1e-9, std, 1.0))
+
+
+def train(X: np.ndarray, y: np.ndarray, features: List[str] = FEATURES, *,
+          init: Optional[MCModel] = None, l2: float = 1e-3, lr: float = 0.05,
+          epochs: int = 15, batch_size: int = 512, class_weight: str = "balanced",
+          seed: int = 0) -> MCModel:
+    """
+    Softmax L2, Adam mini-batch; warm start si ``init`` a les mêmes features et sa propre
+    standardisation. mu/sigma sont recalculés à chaque fit; W/b de ``init`` sont réexprimés
+    dans la nouvelle échelle (mêmes logits au départ).
+    """
+    n, d = X.shape
+    K = len(CLASSES)
+    mu, sigma = _scale(X)
+    if (init is not None and init.standardized and list(init.features) == list(features)
+            and init.W.shape == (K, d)):
+        W = init.W * (sigma / init.sigma)[None, :]
+        b = init.b + init.W @ ((mu - init.mu) / init.sigma)
+    else:
+        W, b = np.zeros((K, d)), np.zeros(K)
+    Z = (X - mu) / sigma
+    Y = np.eye(K)[y]
+
+    counts = np.bincount(y, minlength=K).astype(np.float64)
+    if class_weight == "balanced":
+        cw = np.where(counts > 0, n / (K * np.maximum(counts, 1.0)), 0.0)
+    else:
+        cw = np.ones(K)
+    sw = cw[y]
+
+    rng = np.random.default_rng(seed)
+    mW, vW, mb, vb = np.zeros_like(W), np.zeros_like(W), np.zeros(K), np.zeros(K)
+    b1, b2, eps, step = 0.9, 0.999, 1e-8, 0
+    bs = max(1, min(int(batch_size), n))
+    for _ in range(int(epochs)):
+        order = rng.permutation(n)
+        for i in range(0, n, bs):
+            idx = order[i:i + bs]
+            zb = Z[idx]
+            G = (_softmax_np(zb @ W.T + b) - Y[idx]) * sw[idx, None]
+            den = float(sw[idx].sum()) or 1.0
+            gW = G.T @ zb / den + l2 * W
+            gb = G.sum(axis=0) / den
+            step += 1
+            mW = b1 * mW + (1 - b1) * gW; vW = b2 * vW + (1 - b2) * gW * gW
+            mb = b1 * mb + (1 - b1) * gb; vb = b2 * vb + (1 - b2) * gb * gb
+            c1, c2 = 1 - b1 ** step, 1 - b2 ** step
+            W -= lr * (mW / c1) / (np.sqrt(vW / c2) + eps)
+            b -= lr * (mb / c1) / (np.sqrt(vb / c2) + eps)
+
+    P = _softmax_np(Z @ W.T + b)
+    meta = {
+        "n": int(n),
+        "class_counts": {c: int(k) for c, k in zip(CLASSES, counts)},
+        "train_acc": float((P.argmax(axis=1) == y).mean()),
+        "trained_at": time.time(),
+    }
+    return MCModel(W, b, features, mu, sigma, version=f"{int(meta['trained_at'] * 1000)}", meta=meta)
+
+
+def sgd_mc_train_online(select_rows, kv_get, kv_set, limit: int = 2000,
+                        asof=None) -> Dict[str,str]:
+    """
+    Entraîne sur les derniers ``limit`` exemples labellisés, en repartant des poids publiés.
+    Expect select_rows(sql, params) -> list[dict-like]. Publie en KV (MODEL_KEY) + registre.
+    """
+    X, y = load_dataset(select_rows, limit, asof=asof)
+    if X.shape[0] < 30 or len(np.unique(y)) < 2:
+        return {"status": "skipped", "reason": "not_enough_labels", "n": str(int(X.shape[0]))}
+    h = REGISTRY.ensure(MODEL_KEY, _mc_loader(kv_get))
+    init = h.model if h is not None else None
+    m = train(X, y, FEATURES, init=init)
+    kv_set(MODEL_KEY, json.dumps(m.to_json()))
+    REGISTRY.publish(MODEL_KEY, m, m.version, source="train")
+    return {"status": "ok", "classes": ",".join(CLASSES), "features": ",".join(FEATURES),
+            "n": str(m.meta["n"]), "version": str(m.version),
+            "train_acc": f"{m.meta['train_acc']:.4f}"}
+
+
+# ---------- worker de fond ----------
+
+_WORKER: Optional[threading.Thread] = None
+
+def start_background_trainer(select_rows, kv_get, kv_set, interval_s: float = 600.0,
+                             limit: int = 20000, logger=None, asof=None) -> threading.Thread:
+    """Thread daemon qui ré-entraîne toutes les ``interval_s`` secondes (idempotent)."""
+    global _WORKER
+    if _WORKER is not None and _WORKER.is_alive():
+        return _WORKER
+
+    def _run():
+        while True:
+            try:
+                out = sgd_mc_train_online(select_rows, kv_get, kv_set, limit=limit, asof=asof)
+                if logger is not None:
+                    logger.info(f"[mc-train] {out}")
+            except Exception as e:
+                if logger is not None:
+                    logger.warning(f"[mc-train] {e}")
+            time.sleep(max(30.0, float(interval_s)))
+
+    _WORKER = threading.Thread(target=_run, name="mc-train", daemon=True)
+    _WORKER.start()
+    return _WORKER
@@ -0,0 +1,307 @@
+"""
+Binary tp/sl logistic model trained with vectorized mini-batch Adam (NumPy).
+
+The feature matrix is loaded once with a single query, standardized with robust
+percentiles (median, (p84 - p16) / 2), then trained for a few epochs with early
+stopping on a time-ordered validation tail. The model is stored as a compact
+binary blob in the ``model_blobs`` table.
+"""
+from __future__ import annotations
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+MODEL_KEY = "sgd_model"
+_MAGIC = b"SGDB"
+_VERSION = 1
+_HDR = struct.Struct("<4sHHdd")  # magic, version, n_features, b, trained_at
+
+
+@dataclass
+class BinaryModel:
+    features: tuple
+    w: np.ndarray
+    b: float
+    mu: np.ndarray
+    sigma: np.ndarray
+    trained_at: float = 0.0
+
+    def standardize(self, X: np.ndarray) -> np.ndarray:
+        return (X - self.mu) / self.sigma
+
+    def decision(self, X: np.ndarray) -> np.ndarray:
+        return self.standardize(X) @ self.w + self.b
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """P(tp) pour une matrice (n, d) dans l'ordre de ``features``."""
+        return _sigmoid(self.decision(np.asarray(X, dtype=np.float64)))
+
+    def vector(self, row: Mapping[str, Any]) -> np.ndarray:
+        return np.array([_num(row.get(k)) for k in self.features], dtype=np.float64)
+
+    def predict_row(self, row: Mapping[str, Any]) -> float:
+        return float(self.predict_proba(self.vector(row)[None, :])[0])
+
+
+def _num(v, default: float = 0.0) -> float:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return default
+    return f if np.isfinite(f) else default
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    z = np.clip(z, -60.0, 60.0)
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _logloss(p: np.ndarray, y: np.ndarray) -> float:
+    p = np.clip(p, 1e-7, 1.0 - 1e-7)
+    return float(-np.mean(y * np.log(p) + (1.0 - y) * np.log1p(-p)))
+
+
+# ---------- données ----------
+
+
+def load_xy(conn, features: Sequence[str], limit: int = 100_000, asof=None):
+    """
+    Derniers ``limit`` exemples labellisés tp/sl, du plus ancien au plus récent.
+    ``asof(ts, features) -> (X, has)`` (feature_store) remplace les valeurs d'examples
+    par celles du store, point-in-time, là où il en a.
+    """
+    cols = ", ".join(f"CAST({f} AS REAL)" for f in features)
+    rows = conn.execute(
+        f"""
+        SELECT {cols}, outcome, CAST(ts AS REAL) FROM (
+            SELECT * FROM examples WHERE outcome IN ('tp','sl') ORDER BY id DESC LIMIT ?
+        ) ORDER BY id ASC
+        """,
+        (int(limit),),
+    ).fetchall()
+    if not rows:
+        return np.zeros((0, len(features))), np.zeros(0)
+    d = len(features)
+    X = np.array([tuple(r)[:d] for r in rows], dtype=np.float64)
+    y = np.fromiter((1.0 if r[d] == "tp" else 0.0 for r in rows), dtype=np.float64, count=len(rows))
+    if asof is not None:
+        ts = np.array([np.nan if r[d + 1] is None else r[d + 1] for r in rows], dtype=np.float64)
+        Xs, has = asof(ts, features)
+        X = np.where(has[:, None] & np.isfinite(Xs), Xs, X)
+    return np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0), y
+
+
+def robust_scaler(X: np.ndarray):
+    """Centre = médiane, échelle = (p84 - p16)/2, repli sur l'écart-type puis 1."""
+    if X.shape[0] == 0:
+        return np.zeros(X.shape[1]), np.ones(X.shape[1])
+    p16, p50, p84 = np.percentile(X, [16, 50, 84], axis=0)
+    sigma = (p84 - p16) / 2.0
+    std = X.std(axis=0)
+    sigma = np.where(sigma > 1e-9, sigma, np.where(std > 1e-9, std, 1.0))
+    return p50, sigma
+
+
+# ---------- entraînement ----------
+
+
+def train(
+    X: np.ndarray,
+    y: np.ndarray,
+    features: Sequence[str],
+    *,
+    epochs: int = 20,
+    batch_size: int = 512,
+    lr: float = 0.01,
+    l2: float = 1e-4,
+    val_frac: float = 0.15,
+    patience: int = 3,
+    init: Optional[BinaryModel] = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Mini-batch Adam sur la log-loss L2; renvoie {"model", "epochs", "val_logloss", ...}.
+    Warm start si ``init`` a les mêmes features (poids ramenés dans l'échelle du fit).
+    """
+    n, d = X.shape
+    mu, sigma = robust_scaler(X)
+    Z = (X - mu) / sigma
+
+    n_val = int(n * val_frac) if n >= 50 else 0
+    Zt, yt = Z[: n - n_val], y[: n - n_val]
+    Zv, yv = Z[n - n_val :], y[n - n_val :]
+
+    if (init is not None and tuple(init.features) == tuple(features)
+            and np.shape(init.w) == (d,)):
+        # w/b de ``init`` réexprimés dans la nouvelle standardisation (mêmes logits au départ)
+        w0, mu0, s0 = (np.asarray(a, dtype=np.float64) for a in (init.w, init.mu, init.sigma))
+        w = w0 * sigma / s0
+        b = float(init.b) + float(w0 @ ((mu - mu0) / s0))
+    else:
+        w, b = np.zeros(d), 0.0
+
+    rng = np.random.default_rng(seed)
+    m_w, v_w = np.zeros(d), np.zeros(d)
+    m_b = v_b = 0.0
+    b1, b2, eps = 0.9, 0.999, 1e-8
+    step = 0
+
+    best = (float("inf"), w.copy(), b, 0)
+    bad = 0
+    ep = 0
+    nt = Zt.shape[0]
+    bs = max(1, min(int(batch_size), nt))
+    for ep in range(1, int(epochs) + 1):
+        order = rng.permutation(nt)
+        for i in range(0, nt, bs):
+            idx = order[i : i + bs]
+            xb, yb = Zt[idx], yt[idx]
+            err = _sigmoid(xb @ w + b) - yb
+            g_w = xb.T @ err / len(idx) + l2 * w
+            g_b = float(err.mean())
+            step += 1
+            m_w = b1 * m_w + (1 - b1) * g_w
+            v_w = b2 * v_w + (1 - b2) * g_w * g_w
+            m_b = b1 * m_b + (1 - b1) * g_b
+            v_b = b2 * v_b + (1 - b2) * g_b * g_b
+            c1, c2 = 1 - b1**step, 1 - b2**step
+            w -= lr * (m_w / c1) / (np.sqrt(v_w / c2) + eps)
+            b -= lr * (m_b / c1) / (np.sqrt(v_b / c2) + eps)
+
+        if n_val:
+            loss = _logloss(_sigmoid(Zv @ w + b), yv)
+            if loss < best[0] - 1e-5:
+                best, bad = (loss, w.copy(), b, ep), 0
+            else:
+                bad += 1
+                if bad >= patience:
+                    break
+
+    if n_val:
+        val_loss, w, b, best_ep = best
+    else:
+        val_loss, best_ep = None, ep
+
+    model = BinaryModel(tuple(features), w, float(b), mu, sigma, time.time())
+    return {
+        "model": model,
+        "epochs": ep,
+        "best_epoch": best_ep,
+        "val_logloss": val_loss,
+        "train_logloss": _logloss(_sigmoid(Zt @ w + b), yt) if nt else None,
+    }
+
+
+# ---------- sérialisation ----------
+
+
+def to_blob(m: BinaryModel) -> bytes:
+    feats = "\n".join(m.features).encode()
+    d = len(m.features)
+    return (
+        _HDR.pack(_MAGIC, _VERSION, d, float(m.b), float(m.trained_at))
+        + np.asarray(m.w, "<f8").tobytes()
+        + np.asarray(m.mu, "<f8").tobytes()
+        + np.asarray(m.sigma, "<f8").tobytes()
+        + feats
+    )
+
+
+def from_blob(blob: bytes) -> BinaryModel:
+    magic, ver, d, b, ts = _HDR.unpack_from(blob, 0)
+    if magic != _MAGIC or ver != _VERSION:
+        raise ValueError("bad sgd model blob")
+    off = _HDR.size
+    arr = np.frombuffer(blob, "<f8", count=3 * d, offset=off).reshape(3, d)
+    feats = tuple(bytes(blob[off + 24 * d :]).decode().split("\n")) if d else ()
+    return BinaryModel(feats, arr[0].copy(), float(b), arr[1].copy(), arr[2].copy(), ts)
+
+
+def from_legacy(state: Mapping[str, Any], features: Sequence[str]) -> Optional[BinaryModel]:
+    """Ancien format JSON en KV: {"w", "b", "mu": {f: ..}, "sigma": {f: ..}}."""
+    if not state or "w" not in state:
+        return None
+    feats = tuple(state.get("features") or features)
+    mu, sg = state.get("mu") or {}, state.get("sigma") or {}
+    w = np.zeros(len(feats))
+    w[: len(state["w"])] = np.asarray(state["w"][: len(feats)], dtype=np.float64)
+    sigma = np.array([_num(sg.get(k), 1.0) or 1.0 for k in feats])
+    return BinaryModel(
+        feats, w, _num(state.get("b")), np.array([_num(mu.get(k)) for k in feats]), sigma
+    )
+
+
+def _ensure_table(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS model_blobs(key TEXT PRIMARY KEY, blob BLOB NOT NULL, ts REAL)"
+    )
+
+
+def save_model(conn, m: BinaryModel, key: str = MODEL_KEY):
+    _ensure_table(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO model_blobs(key, blob, ts) VALUES (?,?,?)",
+        (key, to_blob(m), float(m.trained_at or time.time())),
+    )
+    conn.commit()
+
+
+def model_version(conn, key: str = MODEL_KEY) -> Optional[float]:
+    """Horodatage du blob publié (sert de version), sans lire le blob."""
+    try:
+        r = conn.execute("SELECT ts FROM model_blobs WHERE key=?", (key,)).fetchone()
+    except Exception:
+        return None
+    return float(r[0]) if r and r[0] is not None else None
+
+
+def load_model(conn, key: str = MODEL_KEY) -> Optional[BinaryModel]:
+    try:
+        r = conn.execute("SELECT blob FROM model_blobs WHERE key=?", (key,)).fetchone()
+    except Exception:
+        return None
+    return from_blob(r[0]) if r else None
+
+
+# ---------- point d'entrée ----------
+
+
+def train_from_db(
+    conn,
+    features: Sequence[str],
+    limit: int = 100_000,
+    warm_start: bool = True,
+    registry=None,
+    asof=None,
+    **kw,
+) -> Dict[str, Any]:
+    """
+    Charge, entraîne, sauvegarde. Sans dépendance à app.py (utilisable hors process web).
+    ``registry`` (model_registry.ModelRegistry) reçoit le nouveau modèle à chaud;
+    ``asof`` voir load_xy.
+    """
+    t0 = time.perf_counter()
+    X, y = load_xy(conn, features, limit, asof=asof)
+    if X.shape[0] == 0:
+        return {"trained": 0}
+    init = None
+    if warm_start:
+        h = registry.get(MODEL_KEY) if registry is not None else None
+        init = h.model if h is not None and isinstance(h.model, BinaryModel) else load_model(conn)
+    out = train(X, y, features, init=init, **kw)
+    m = out["model"]
+    save_model(conn, m)
+    if registry is not None:
+        registry.publish(MODEL_KEY, m, float(m.trained_at), source="train")
+    return {
+        "trained": int(X.shape[0]),
+        "epochs": out["epochs"],
+        "best_epoch": out["best_epoch"],
+        "val_logloss": out["val_logloss"],
+        "train_logloss": out["train_logloss"],
+        "w_norm": float(np.abs(m.w).sum()),
+        "seconds": round(time.perf_counter() - t0, 4),
+    }
@@ -0,0 +1,302 @@
+"""
+Rolling model-quality monitor fed by the labeler.
+
+The last ``capacity`` labelled examples (p_up, outcome, features) sit in a ring
+buffer. For each configured window (default 50/200/500/2000 labels) running sums
+are kept for Brier, log-loss, tp/sl counts and calibration bins: a new label
+adds its contribution and removes the one of the label leaving the window, so
+every read is O(windows * bins). Feature drift is a PSI against a frozen
+reference histogram (quantile edges), with per-bin counts over the largest
+window maintained the same way.
+
+Outcomes: ``tp`` -> y=1, ``sl`` -> y=0, anything else (timeout) counts in the
+window but not in the probability metrics, as in the old SQL versions.
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+WINDOWS = (50, 200, 500, 2000)
+CAL_BINS = 10
+PSI_BINS = 10
+_EPS = 1e-6
+_RESYNC_EVERY = 10_000  # recalcul exact des sommes (dérive flottante)
+
+# colonnes des sommes par fenêtre
+_N, _NL, _TP, _BRIER, _LOGLOSS = range(5)
+
+
+def psi(ref: np.ndarray, cur: np.ndarray) -> float:
+    """Population Stability Index entre deux histogrammes (comptes ou proportions)."""
+    r = np.asarray(ref, dtype=np.float64)
+    c = np.asarray(cur, dtype=np.float64)
+    if r.sum() <= 0 or c.sum() <= 0:
+        return 0.0
+    r = np.maximum(r / r.sum(), 1e-4)
+    c = np.maximum(c / c.sum(), 1e-4)
+    return float(np.sum((c - r) * np.log(c / r)))
+
+
+class ModelMonitor:
+    def __init__(
+        self,
+        features: Sequence[str] = (),
+        windows: Sequence[int] = WINDOWS,
+        cal_bins: int = CAL_BINS,
+        psi_bins: int = PSI_BINS,
+    ):
+        self.features = tuple(features)
+        self.windows = tuple(sorted(int(w) for w in windows))
+        self.capacity = self.windows[-1]
+        self.cal_bins = int(cal_bins)
+        self.psi_bins = int(psi_bins)
+        self._lock = threading.Lock()
+        self.updated_at = 0.0
+        self._reset()
+        self.ref_edges: Optional[np.ndarray] = None  # (d, psi_bins - 1)
+        self.ref_hist: Optional[np.ndarray] = None  # (d, psi_bins)
+
+    def _reset(self):
+        cap, d = self.capacity, len(self.features)
+        self._p = np.full(cap, np.nan)
+        self._y = np.full(cap, np.nan)
+        self._x = np.full((cap, d), np.nan)
+        self._fbin = np.full((cap, d), -1, dtype=np.int64)
+        self._head = 0  # prochaine position d'écriture
+        self._count = 0  # labels passés dans le buffer
+        self._seen = 0  # labels vus au total (survit au checkpoint)
+        W = len(self.windows)
+        self._sums = np.zeros((W, 5))
+        self._cal = np.zeros((W, 3, self.cal_bins))  # count, sum p, pos
+        self._fhist = np.zeros((len(self.features), self.psi_bins))
+
+    # ---------- contributions élémentaires ----------
+
+    def _contrib(self, p: float, y: float):
+        lab = np.isfinite(y) and np.isfinite(p)
+        if not lab:
+            return np.array([1.0, 0.0, 0.0, 0.0, 0.0]), None
+        q = min(max(p, _EPS), 1.0 - _EPS)
+        ll = -(y * np.log(q) + (1.0 - y) * np.log(1.0 - q))
+        b = min(int(p * self.cal_bins), self.cal_bins - 1)
+        return np.array([1.0, 1.0, y, (p - y) ** 2, ll]), (b, p, y)
+
+    def _apply(self, w: int, p: float, y: float, sign: float):
+        s, cal = self._contrib(p, y)
+        self._sums[w] += sign * s
+        if cal is not None:
+            b, pp, yy = cal
+            self._cal[w, 0, b] += sign
+            self._cal[w, 1, b] += sign * pp
+            self._cal[w, 2, b] += sign * yy
+
+    def _fbins(self, x: np.ndarray) -> np.ndarray:
+        if self.ref_edges is None or not len(self.features):
+            return np.full(len(self.features), -1, dtype=np.int64)
+        out = np.array(
+            [np.searchsorted(self.ref_edges[j], x[j], side="right") for j in range(len(x))],
+            dtype=np.int64,
+        )
+        out[~np.isfinite(x)] = -1
+        return out
+
+    # ---------- alimentation ----------
+
+    def update(self, p_up, outcome, X=None) -> int:
+        """Ajoute des labels dans l'ordre (plus ancien d'abord). ``X`` (n, d) optionnel."""
+        p = np.atleast_1d(np.asarray(p_up, dtype=np.float64))
+        out = np.atleast_1d(np.asarray(outcome, dtype=object))
+        y = np.where(out == "tp", 1.0, np.where(out == "sl", 0.0, np.nan))
+        n = p.size
+        d = len(self.features)
+        if X is None:
+            X = np.full((n, d), np.nan)
+        X = np.asarray(X, dtype=np.float64).reshape(n, d)
+        with self._lock:
+            for i in range(n):
+                self._push(float(p[i]), float(y[i]), X[i])
+            if self.ref_edges is None and self._count >= self.capacity:
+                self._freeze_reference()
+            elif self._count % _RESYNC_EVERY < n:
+                self._resync()
+            self.updated_at = time.time()
+        return int(n)
+
+    def _push(self, p: float, y: float, x: np.ndarray):
+        cap = self.capacity
+        for w, size in enumerate(self.windows):
+            if self._count >= size:
+                j = (self._head - size) % cap
+                self._apply(w, self._p[j], self._y[j], -1.0)
+            self._apply(w, p, y, 1.0)
+        h = self._head
+        if self._count >= cap:
+            old = self._fbin[h]
+            for j in np.flatnonzero(old >= 0):
+                self._fhist[j, old[j]] -= 1.0
+        fb = self._fbins(x)
+        for j in np.flatnonzero(fb >= 0):
+            self._fhist[j, fb[j]] += 1.0
+        self._p[h], self._y[h], self._x[h], self._fbin[h] = p, y, x, fb
+        self._head = (h + 1) % cap
+        self._count += 1
+        self._seen += 1
+
+    def _ordered(self, k: Optional[int] = None):
+        """Indices des ``k`` derniers labels (du plus ancien au plus récent)."""
+        m = min(self._count, self.capacity)
+        k = m if k is None else min(int(k), m)
+        return (self._head - k + np.arange(k)) % self.capacity
+
+    def _resync(self):
+        """Recalcule exactement toutes les sommes depuis le buffer."""
+        self._sums[:] = 0.0
+        self._cal[:] = 0.0
+        for w, size in enumerate(self.windows):
+            for j in self._ordered(size):
+                self._apply(w, self._p[j], self._y[j], 1.0)
+        self._fhist[:] = 0.0
+        idx = self._ordered()
+        if self.ref_edges is not None and idx.size:
+            for i in idx:
+                self._fbin[i] = self._fbins(self._x[i])
+            fb = self._fbin[idx]
+            for j in range(len(self.features)):
+                v = fb[:, j]
+                self._fhist[j] = np.bincount(v[v >= 0], minlength=self.psi_bins)
+
+    def _freeze_reference(self):
+        X = self._x[self._ordered()]
+        qs = np.linspace(0, 1, self.psi_bins + 1)[1:-1]
+        edges, hist = [], []
+        for j in range(X.shape[1]):
+            col = X[:, j][np.isfinite(X[:, j])]
+            e = np.quantile(col, qs) if col.size else np.zeros(qs.size)
+            edges.append(e)
+            b = np.searchsorted(e, col, side="right")
+            hist.append(np.bincount(b, minlength=self.psi_bins))
+        self.ref_edges = np.asarray(edges, dtype=np.float64).reshape(len(self.features), -1)
+        self.ref_hist = np.asarray(hist, dtype=np.float64).reshape(len(self.features), -1)
+        self._resync()
+
+    def rebase(self):
+        """La fenêtre courante devient la référence PSI."""
+        with self._lock:
+            if min(self._count, self.capacity):
+                self._freeze_reference()
+
+    # ---------- lectures ----------
+
+    def _window_index(self, size: int) -> Optional[int]:
+        try:
+            return self.windows.index(int(size))
+        except ValueError:
+            return None
+
+    def _metrics(self, s: np.ndarray, n_avail: int) -> Dict[str, Any]:
+        n, nl, tp = int(round(s[_N])), int(round(s[_NL])), float(s[_TP])
+        return {
+            "n": min(n, n_avail),
+            "n_labeled": nl,
+            "brier": float(s[_BRIER] / nl) if nl else None,
+            "logloss": float(s[_LOGLOSS] / nl) if nl else None,
+            "hit_rate": float(tp / nl) if nl else None,
+        }
+
+    def window(self, size: int) -> Dict[str, Any]:
+        """Métriques sur les ``size`` derniers labels (O(1) si fenêtre configurée)."""
+        with self._lock:
+            w = self._window_index(size)
+            if w is not None:
+                return self._metrics(self._sums[w].copy(), self._count)
+            s = np.zeros(5)
+            for j in self._ordered(size):
+                s += self._contrib(self._p[j], self._y[j])[0]
+            return self._metrics(s, self._count)
+
+    def brier(self, size: int) -> Optional[float]:
+        return self.window(size)["brier"]
+
+    def hit_rate(self, size: int) -> Optional[float]:
+        return self.window(size)["hit_rate"]
+
+    def calibration_bins(self, size: int) -> list:
+        w = self._window_index(size)
+        if w is None:
+            w = len(self.windows) - 1
+        with self._lock:
+            cnt, sp, pos = self._cal[w].copy()
+        step = 1.0 / self.cal_bins
+        return [
+            {
+                "bin_from": i * step,
+                "bin_to": (i + 1) * step,
+                "p_mean": float(sp[i] / cnt[i]) if cnt[i] > 0.5 else None,
+                "hit": float(pos[i] / cnt[i]) if cnt[i] > 0.5 else None,
+                "count": int(round(cnt[i])),
+            }
+            for i in range(self.cal_bins)
+        ]
+
+    def psi(self) -> Dict[str, float]:
+        """PSI par feature: fenêtre la plus large vs référence figée ({} tant qu'il n'y en a pas)."""
+        with self._lock:
+            if self.ref_hist is None:
+                return {}
+            return {f: psi(self.ref_hist[j], self._fhist[j]) for j, f in enumerate(self.features)}
+
+    def summary(self) -> Dict[str, Any]:
+        psis = self.psi()
+        return {
+            "labels_seen": int(self._seen),
+            "updated_at": self.updated_at,
+            "windows": {str(w): self.window(w) for w in self.windows},
+            "psi": psis,
+            "psi_max": max(psis.values()) if psis else None,
+        }
+
+    # ---------- checkpoint ----------
+
+    def to_json(self) -> Dict[str, Any]:
+        with self._lock:
+            idx = self._ordered()
+            return {
+                "v": 1,
+                "features": list(self.features),
+                "windows": list(self.windows),
+                "seen": int(self._seen),
+                "p": np.round(self._p[idx], 6).tolist(),
+                "y": [None if not np.isfinite(v) else int(v) for v in self._y[idx]],
+                "x": np.where(np.isfinite(self._x[idx]), np.round(self._x[idx], 6), 0.0).tolist(),
+                "ref_edges": None if self.ref_edges is None else self.ref_edges.tolist(),
+                "ref_hist": None if self.ref_hist is None else self.ref_hist.tolist(),
+            }
+
+    def load_json(self, js: Optional[Dict[str, Any]]) -> bool:
+        if not isinstance(js, dict) or tuple(js.get("features") or ()) != self.features:
+            return False
+        if tuple(js.get("windows") or ()) != self.windows:
+            return False
+        p = np.asarray(js.get("p") or [], dtype=np.float64)[-self.capacity :]
+        y = np.array([np.nan if v is None else v for v in (js.get("y") or [])], dtype=np.float64)
+        y = y[-self.capacity :]
+        d = len(self.features)
+        x = np.asarray(js.get("x") or [], dtype=np.float64).reshape(-1, d)[-self.capacity :]
+        if not (p.size == y.size == x.shape[0]):
+            return False
+        with self._lock:
+            self._reset()
+            if js.get("ref_edges") is not None:
+                self.ref_edges = np.asarray(js["ref_edges"], dtype=np.float64).reshape(d, -1)
+                self.ref_hist = np.asarray(js["ref_hist"], dtype=np.float64).reshape(d, -1)
+            k = p.size
+            self._p[:k], self._y[:k], self._x[:k] = p, y, x
+            self._head = k % self.capacity
+            self._count = k
+            self._seen = max(int(js.get("seen") or 0), k)
+            self._resync()
+            self.updated_at = time.time()
+        return True
@@ -0,0 +1,85 @@
+"""
+In-memory registry of deserialized models shared by the predictors.
+
+A trainer calls ``publish(name, model, version)`` right after saving; readers call
+``get(name)`` (a dict lookup, no I/O) or ``ensure(name, loader)`` which also lets
+another process's newer version in, at most once every ``refresh_s`` seconds.
+Handles are immutable and swapped by a single assignment, so a reader always sees
+a complete (model, version) pair.
+"""
+from __future__ import annotations
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# loader(version_courante) -> (modèle, version) si nouveau, None si inchangé/absent
+Loader = Callable[[Optional[Any]], Optional[Tuple[Any, Any]]]
+
+
+@dataclass(frozen=True)
+class ModelHandle:
+    name: str
+    model: Any
+    version: Any
+    loaded_at: float
+    source: str = ""
+
+
+class ModelRegistry:
+    def __init__(self, refresh_s: float = 60.0):
+        self.refresh_s = float(refresh_s)
+        self._handles: Dict[str, ModelHandle] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[ModelHandle]:
+        return self._handles.get(name)
+
+    def publish(self, name: str, model: Any, version: Any, source: str = "publish") -> ModelHandle:
+        h = ModelHandle(name, model, version, time.time(), source)
+        with self._lock:
+            self._handles[name] = h
+            self._checked[name] = h.loaded_at
+        return h
+
+    def ensure(
+        self, name: str, loader: Loader, refresh_s: Optional[float] = None
+    ) -> Optional[ModelHandle]:
+        """Handle courant; recharge via ``loader`` si la dernière vérification est trop vieille."""
+        h = self._handles.get(name)
+        ttl = self.refresh_s if refresh_s is None else float(refresh_s)
+        if time.time() - self._checked.get(name, 0.0) < ttl:
+            return h
+        with self._lock:
+            if time.time() - self._checked.get(name, 0.0) < ttl:
+                return self._handles.get(name)
+            self._checked[name] = time.time()
+            cur = self._handles.get(name)
+        try:
+            res = loader(cur.version if cur is not None else None)
+        except Exception:
+            res = None
+        if res is None:
+            return cur
+        model, version = res
+        if cur is not None and version == cur.version:
+            return cur
+        return self.publish(name, model, version, source="load")
+
+    def invalidate(self, name: Optional[str] = None):
+        """Force une vérification au prochain ``ensure``."""
+        with self._lock:
+            if name is None:
+                self._checked.clear()
+            else:
+                self._checked.pop(name, None)
+
+    def info(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            n: {"version": h.version, "loaded_at": h.loaded_at, "source": h.source}
+            for n, h in list(self._handles.items())
+        }
+
+
+REGISTRY = ModelRegistry()
@@ -0,0 +1,421 @@
+"""
+Monte Carlo robustness of strategy parameters (MIN_TP_PCT, MIN_SL_PCT, PBUY, BUY_PCT).
+
+Two sources, both resampled with a moving-block bootstrap (``block`` consecutive
+draws kept together, so autocorrelation inside a block survives):
+
+- ``trades``: net roundtrip returns rebuilt FIFO from the ``trades`` ledger. Each
+  parameter set clips them to [-MIN_SL_PCT, MIN_TP_PCT] (final returns only, as in
+  walkforward.py); PBUY only thins the trade rate, by the share of recorded p_up
+  values above it relative to the current PBUY.
+- ``candles``: 1m candles from ``klines_1m`` (close-to-close log return plus the
+  high/low excursions of each minute). Synthetic paths are cut into slots of
+  ``HORIZON_MIN`` minutes; a slot is traded with probability share(p_up >= PBUY)
+  and exits at TP, SL (SL first when both fall in the same minute) or the slot's
+  last close, net of ``COST``.
+
+Equity compounds ``BUY_PCT`` of itself per trade. Per path: final PnL, max drawdown
+and the time (days) to the first trigger of the daily loss limit (realized loss
+since the start of the day >= DAILY_LOSS_LIMIT_PCT) and of MAX_CONSECUTIVE_LOSSES
+(streak reset by a win and at each new day, like risk_on_trade_result). Triggers
+are reported, not enforced: live they only start a cooloff. All parameter sets
+see the same bootstrap draws; paths are simulated in chunks of at most ``max_cells``
+path × step cells (trades or minutes), so memory does not grow with ``days``.
+
+    cd backend && python -m montecarlo trades --db data/app.db --tp 0.008,0.0105 --sl 0.0065 --paths 10000
+    cd backend && python -m montecarlo candles --db data/app.db --days 7 --pbuy 0.6,0.65
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import math
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import walkforward
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# cellules chemin × pas par bloc (~48 Mo de bougies float64 (p, minutes, 3) en mode candles)
+MAX_CHUNK_CELLS = 2_000_000
+
+SET_DEFAULTS = {
+    "MIN_TP_PCT": 0.0105,
+    "MIN_SL_PCT": 0.0065,
+    "PBUY": 0.60,
+    "BUY_PCT": 0.25,
+    "DAILY_LOSS_LIMIT_PCT": 0.1,
+    "MAX_CONSECUTIVE_LOSSES": 3,
+    "COST": 0.0024,
+    "HORIZON_MIN": 60,
+}
+
+
+# ---------- données ----------
+
+
+def load_ledger_returns(conn, symbol: Optional[str] = None, days: Optional[float] = None) -> Dict[str, Any]:
+    """Rendements nets des roundtrips FIFO du ledger + cadence (trades/jour) observée."""
+    sql = "SELECT ts, side, price, qty, fee FROM trades"
+    cond, args = [], []
+    if symbol:
+        cond.append("symbol=?")
+        args.append(symbol)
+    if days:
+        cond.append("ts >= ?")
+        args.append(time.time() - float(days) * 86400.0)
+    if cond:
+        sql += " WHERE " + " AND ".join(cond)
+    rows = conn.execute(sql + " ORDER BY ts ASC", args).fetchall()
+    trades = [{"ts": r[0], "side": r[1], "price": r[2], "qty": r[3], "fee": r[4]} for r in rows]
+    rts = walkforward.reconstruct_roundtrips(trades)
+    rets = np.asarray([x["ret"] for x in rts], dtype=np.float64)
+    span = (rts[-1]["exit_ts"] - rts[0]["entry_ts"]) / 86400.0 if len(rts) > 1 else 0.0
+    return {"returns": rets[np.isfinite(rets)], "trades_per_day": (len(rts) / span) if span > 0 else None}
+
+
+def load_candles(conn, symbol: str = "BTCUSDT", days: Optional[float] = None) -> np.ndarray:
+    """(n, 3): log(close/close_prev), log(high/close_prev), log(low/close_prev) des bougies 1m."""
+    sql = "SELECT high, low, close FROM klines_1m WHERE symbol=?"
+    args: List[Any] = [symbol]
+    if days:
+        sql += " AND minute >= ?"
+        args.append(int(time.time() - float(days) * 86400.0))
+    a = np.asarray(conn.execute(sql + " ORDER BY minute ASC", args).fetchall(), dtype=np.float64)
+    if a.ndim != 2 or a.shape[0] < 2:
+        return np.zeros((0, 3))
+    prev = a[:-1, 2]
+    out = np.log(a[1:] / prev[:, None])[:, [2, 0, 1]]
+    return out[np.all(np.isfinite(out), axis=1)]
+
+
+def load_p_up(conn, days: Optional[float] = 30.0) -> np.ndarray:
+    since = (time.time() - float(days) * 86400.0) if days else 0.0
+    rows = conn.execute(
+        "SELECT CAST(p_up AS REAL) FROM examples WHERE p_up IS NOT NULL AND CAST(ts AS REAL) >= ?",
+        (since,),
+    ).fetchall()
+    v = np.asarray([r[0] for r in rows], dtype=np.float64)
+    return v[np.isfinite(v)]
+
+
+def entry_rate(p_up: Optional[np.ndarray], pbuy: float) -> float:
+    """Part des p_up >= PBUY (1.0 sans historique)."""
+    if p_up is None or not p_up.size:
+        return 1.0
+    return float(np.mean(p_up >= float(pbuy)))
+
+
+# ---------- bootstrap / simulation ----------
+
+
+def block_indices(rng: np.random.Generator, n: int, n_paths: int, length: int, block: int) -> np.ndarray:
+    """Indices (n_paths, length) d'un bootstrap par blocs mobiles circulaires de taille ``block``."""
+    block = max(1, min(int(block), n))
+    nb = -(-int(length) // block)
+    starts = rng.integers(0, n, size=(n_paths, nb))
+    idx = (starts[:, :, None] + np.arange(block)) % n
+    return idx.reshape(n_paths, nb * block)[:, :length]
+
+
+def candle_trades(legs: np.ndarray, tp: float, sl: float, cost: float) -> np.ndarray:
+    """
+    legs (P, S, H, 3) minutes bootstrapées, un trade par créneau de H minutes
+    -> rendement net (P, S): TP, SL (prioritaire dans la même minute) ou dernière clôture.
+    """
+    c = np.cumsum(legs[..., 0], axis=-1)
+    base = c - legs[..., 0]  # log-prix à la clôture précédente
+    up = (base + legs[..., 1]) >= math.log1p(tp)
+    dn = (base + legs[..., 2]) <= math.log1p(-sl)
+    H = legs.shape[-2]
+    k_tp = np.where(up.any(-1), up.argmax(-1), H)
+    k_sl = np.where(dn.any(-1), dn.argmax(-1), H)
+    gross = np.where(
+        k_sl <= k_tp,
+        np.where(k_sl < H, -sl, np.expm1(c[..., -1])),
+        tp,
+    )
+    return gross - cost
+
+
+def equity_stats(R: np.ndarray, slot_days: float, buy_pct: float, daily_limit: float,
+                 max_losses: int) -> Dict[str, np.ndarray]:
+    """
+    R (P, T): rendement net par créneau (NaN = pas de trade), créneau de ``slot_days`` jours.
+    -> final, max_dd, t_daily, t_streak (jours, NaN si jamais), n_trades; chacun (P,).
+    """
+    P, T = R.shape
+    traded = np.isfinite(R)
+    r = np.where(traded, R, 0.0)
+    eq = np.cumprod(1.0 + buy_pct * r, axis=1)
+    peak = np.maximum.accumulate(np.maximum(eq, 1.0), axis=1)
+    mdd = np.max(1.0 - eq / peak, axis=1)
+
+    t_idx = np.arange(T)
+    day = np.floor(t_idx * slot_days + 1e-9).astype(np.int64)
+    new_day = np.r_[True, day[1:] != day[:-1]]
+    first = np.maximum.accumulate(np.where(new_day, t_idx, 0))  # 1er créneau du jour
+    eq_prev = np.concatenate([np.ones((P, 1)), eq[:, :-1]], axis=1)
+    day_base = eq_prev[:, first]
+    hit_daily = traded & ((eq / day_base - 1.0) <= -float(daily_limit)) if daily_limit > 0 else np.zeros_like(traded)
+
+    # série de pertes: remise à zéro sur un gain et à chaque nouveau jour
+    loss = traded & (r <= 0.0)
+    C = np.cumsum(loss, axis=1)
+    C_prev = C - loss
+    reset = np.where(traded & (r > 0.0), C, np.where(new_day[None, :], C_prev, -1))
+    streak = C - np.maximum(np.maximum.accumulate(reset, axis=1), 0)
+    hit_streak = loss & (streak >= int(max_losses)) if max_losses > 0 else np.zeros_like(traded)
+
+    def _first(h):
+        return np.where(h.any(axis=1), (h.argmax(axis=1) + 1) * slot_days, np.nan)
+
+    return {
+        "final": eq[:, -1] - 1.0,
+        "max_dd": mdd,
+        "t_daily": _first(hit_daily),
+        "t_streak": _first(hit_streak),
+        "n_trades": traded.sum(axis=1),
+    }
+
+
+def _dist(x: np.ndarray) -> Dict[str, Any]:
+    x = x[np.isfinite(x)]
+    if not x.size:
+        return {"n": 0}
+    out = {"n": int(x.size), "mean": float(x.mean()), "std": float(x.std())}
+    out.update({f"p{int(round(q * 100))}": float(v) for q, v in zip(QUANTILES, np.quantile(x, QUANTILES))})
+    return out
+
+
+def summarize(stats: Dict[str, np.ndarray], horizon_days: float) -> Dict[str, Any]:
+    P = int(stats["final"].size)
+    return {
+        "paths": P,
+        "final_pnl": _dist(stats["final"]),
+        "p_loss": float(np.mean(stats["final"] < 0)),
+        "max_drawdown": _dist(stats["max_dd"]),
+        "daily_loss_limit": {
+            "p_hit": float(np.mean(np.isfinite(stats["t_daily"]))),
+            "days_to_hit": _dist(stats["t_daily"]),
+        },
+        "max_consecutive_losses": {
+            "p_hit": float(np.mean(np.isfinite(stats["t_streak"]))),
+            "days_to_hit": _dist(stats["t_streak"]),
+        },
+        "trades_per_path": _dist(stats["n_trades"].astype(np.float64)),
+        "horizon_days": horizon_days,
+    }
+
+
+def _sets(sets: Optional[Sequence[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return [{**SET_DEFAULTS, **(s or {})} for s in (sets or [{}])]
+
+
+def _run_chunks(sets, n_paths, steps, max_cells, seed, one_chunk, progress) -> List[Dict[str, np.ndarray]]:
+    """Mêmes tirages pour tous les jeux (nombres aléatoires communs); stats concaténées."""
+    chunk = max(1, int(max_cells) // max(1, int(steps)))
+    rng = np.random.default_rng(seed)
+    acc: List[Dict[str, List[np.ndarray]]] = [{} for _ in sets]
+    done = 0
+    while done < n_paths:
+        p = min(int(chunk), n_paths - done)
+        for i, st in enumerate(one_chunk(rng, p)):
+            for k, v in st.items():
+                acc[i].setdefault(k, []).append(v)
+        done += p
+        if progress is not None:
+            progress(done / n_paths)
+    return [{k: np.concatenate(v) for k, v in a.items()} for a in acc]
+
+
+def simulate_trades(
+    returns: np.ndarray,
+    sets: Optional[Sequence[Dict[str, Any]]] = None,
+    trades_per_day: float = 10.0,
+    days: float = 30.0,
+    n_paths: int = 10000,
+    block: int = 5,
+    p_up: Optional[np.ndarray] = None,
+    base_pbuy: Optional[float] = None,
+    seed: Optional[int] = None,
+    max_cells: int = MAX_CHUNK_CELLS,
+    progress: Optional[Callable[[float], Any]] = None,
+) -> Dict[str, Any]:
+    r = np.asarray(returns, dtype=np.float64)
+    r = r[np.isfinite(r)]
+    if r.size < 2:
+        return {"ok": False, "error": "not enough roundtrips", "n": int(r.size)}
+    sets = _sets(sets)
+    base_rate = entry_rate(p_up, base_pbuy) if base_pbuy is not None else 1.0
+    cfg = []
+    for s in sets:
+        rate = entry_rate(p_up, s["PBUY"]) / base_rate if base_rate > 0 else 1.0
+        tpd = max(1e-6, float(trades_per_day) * rate)
+        cfg.append((s, tpd, max(1, int(round(days * tpd)))))
+    T = max(c[2] for c in cfg)
+
+    def one_chunk(rng, p):
+        draws = r[block_indices(rng, r.size, p, T, block)]
+        out = []
+        for s, tpd, t in cfg:
+            R = np.clip(draws[:, :t], -float(s["MIN_SL_PCT"]), float(s["MIN_TP_PCT"]))
+            out.append(equity_stats(R, 1.0 / tpd, float(s["BUY_PCT"]),
+                                    float(s["DAILY_LOSS_LIMIT_PCT"]), int(s["MAX_CONSECUTIVE_LOSSES"])))
+        return out
+
+    stats = _run_chunks(sets, int(n_paths), T, max_cells, seed, one_chunk, progress)
+    return {
+        "ok": True,
+        "source": "trades",
+        "n_returns": int(r.size),
+        "block": int(block),
+        "results": [
+            {"params": s, "trades_per_day": tpd, **summarize(st, days)}
+            for (s, tpd, _), st in zip(cfg, stats)
+        ],
+    }
+
+
+def simulate_candles(
+    legs: np.ndarray,
+    sets: Optional[Sequence[Dict[str, Any]]] = None,
+    days: float = 7.0,
+    n_paths: int = 10000,
+    block: int = 60,
+    p_up: Optional[np.ndarray] = None,
+    seed: Optional[int] = None,
+    max_cells: int = MAX_CHUNK_CELLS,
+    progress: Optional[Callable[[float], Any]] = None,
+) -> Dict[str, Any]:
+    legs = np.asarray(legs, dtype=np.float64)
+    if legs.shape[0] < 2:
+        return {"ok": False, "error": "no candles", "n": int(legs.shape[0])}
+    sets = _sets(sets)
+    minutes = int(round(days * 1440))
+    cfg = []
+    for s in sets:
+        H = max(1, int(s["HORIZON_MIN"]))
+        cfg.append((s, H, minutes // H, entry_rate(p_up, s["PBUY"])))
+
+    def one_chunk(rng, p):
+        path = legs[block_indices(rng, legs.shape[0], p, minutes, block)]  # (p, minutes, 3)
+        out = []
+        for s, H, S, rate in cfg:
+            R = candle_trades(path[:, : S * H].reshape(p, S, H, 3),
+                              float(s["MIN_TP_PCT"]), float(s["MIN_SL_PCT"]), float(s["COST"]))
+            R[rng.random(R.shape) >= rate] = np.nan
+            out.append(equity_stats(R, H / 1440.0, float(s["BUY_PCT"]),
+                                    float(s["DAILY_LOSS_LIMIT_PCT"]), int(s["MAX_CONSECUTIVE_LOSSES"])))
+        return out
+
+    stats = _run_chunks(sets, int(n_paths), minutes, max_cells, seed, one_chunk, progress)
+    return {
+        "ok": True,
+        "source": "candles",
+        "n_minutes": int(legs.shape[0]),
+        "block": int(block),
+        "results": [
+            {"params": s, "entry_rate": rate, "slots": S, **summarize(st, days)}
+            for (s, H, S, rate), st in zip(cfg, stats)
+        ],
+    }
+
+
+def run(db_path: str, source: str = "trades", sets=None, days: float = 30.0, n_paths: int = 10000,
+        block: Optional[int] = None, history_days: Optional[float] = None, symbol: str = "BTCUSDT",
+        base_pbuy: Optional[float] = None, trades_per_day: Optional[float] = None,
+        seed: Optional[int] = None, progress: Optional[Callable[[float], Any]] = None) -> Dict[str, Any]:
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        try:
+            p_up = load_p_up(conn, history_days or 30.0)
+        except sqlite3.Error:
+            p_up = None
+        if source == "candles":
+            legs = load_candles(conn, symbol, history_days)
+        else:
+            led = load_ledger_returns(conn, None, history_days)
+    finally:
+        conn.close()
+    if source == "candles":
+        return simulate_candles(legs, sets, days, n_paths, block or 60, p_up, seed, progress=progress)
+    tpd = trades_per_day or led["trades_per_day"] or 10.0
+    return simulate_trades(led["returns"], sets, tpd, days, n_paths, block or 5, p_up, base_pbuy, seed,
+                           progress=progress)
+
+
+# ---------- CLI ----------
+
+
+def _floats(s: Optional[str]) -> List[Optional[float]]:
+    return [float(x) for x in s.split(",") if x.strip()] if s else [None]
+
+
+def _grid_sets(a) -> List[Dict[str, Any]]:
+    out = []
+    for tp, sl, pb, bp in itertools.product(_floats(a.tp), _floats(a.sl), _floats(a.pbuy), _floats(a.buy_pct)):
+        s = {"DAILY_LOSS_LIMIT_PCT": a.daily_loss_limit, "MAX_CONSECUTIVE_LOSSES": a.max_losses,
+             "COST": a.cost, "HORIZON_MIN": a.horizon_min}
+        for k, v in (("MIN_TP_PCT", tp), ("MIN_SL_PCT", sl), ("PBUY", pb), ("BUY_PCT", bp)):
+            if v is not None:
+                s[k] = v
+        out.append(s)
+    return out
+
+
+def print_report(res: Dict[str, Any]):
+    print(f"source={res['source']} block={res['block']}")
+    print("{:>8} {:>8} {:>6} {:>6} | {:>9} {:>9} {:>9} {:>7} | {:>8} {:>8} | {:>7} {:>7}".format(
+        "TP%", "SL%", "PBUY", "BUY%", "PnL p5%", "PnL p50%", "PnL p95%", "P(loss)",
+        "DD p50%", "DD p95%", "P(daily)", "P(streak)"))
+    for r in res["results"]:
+        p, f, d = r["params"], r["final_pnl"], r["max_drawdown"]
+        print("{:>8.3f} {:>8.3f} {:>6.2f} {:>6.1f} | {:>9.2f} {:>9.2f} {:>9.2f} {:>7.3f} | {:>8.2f} {:>8.2f} | {:>7.3f} {:>7.3f}".format(
+            p["MIN_TP_PCT"] * 100, p["MIN_SL_PCT"] * 100, p["PBUY"], p["BUY_PCT"] * 100,
+            f.get("p5", math.nan) * 100, f.get("p50", math.nan) * 100, f.get("p95", math.nan) * 100, r["p_loss"],
+            d.get("p50", math.nan) * 100, d.get("p95", math.nan) * 100,
+            r["daily_loss_limit"]["p_hit"], r["max_consecutive_losses"]["p_hit"]))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Monte Carlo (bootstrap par blocs) des paramètres TP/SL/PBUY/taille")
+    ap.add_argument("source", choices=("trades", "candles"))
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "data/app.db"))
+    ap.add_argument("--symbol", default="BTCUSDT")
+    ap.add_argument("--tp", default=None, help="MIN_TP_PCT, liste séparée par des virgules")
+    ap.add_argument("--sl", default=None, help="MIN_SL_PCT")
+    ap.add_argument("--pbuy", default=None, help="PBUY")
+    ap.add_argument("--buy-pct", default=None, help="BUY_PCT (fraction de l'équité par trade)")
+    ap.add_argument("--base-pbuy", type=float, default=None, help="PBUY sous lequel le ledger a été produit")
+    ap.add_argument("--daily-loss-limit", type=float, default=SET_DEFAULTS["DAILY_LOSS_LIMIT_PCT"])
+    ap.add_argument("--max-losses", type=int, default=SET_DEFAULTS["MAX_CONSECUTIVE_LOSSES"])
+    ap.add_argument("--cost", type=float, default=SET_DEFAULTS["COST"], help="coût aller-retour (candles)")
+    ap.add_argument("--horizon-min", type=int, default=SET_DEFAULTS["HORIZON_MIN"], help="durée max d'un trade (candles)")
+    ap.add_argument("--days", type=float, default=30.0, help="horizon simulé")
+    ap.add_argument("--history-days", type=float, default=None, help="historique rééchantillonné (défaut: tout)")
+    ap.add_argument("--trades-per-day", type=float, default=None, help="défaut: cadence du ledger")
+    ap.add_argument("--paths", type=int, default=10000)
+    ap.add_argument("--block", type=int, default=None, help="taille de bloc (défaut: 5 trades / 60 minutes)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json", default=None, help="écrit le rapport complet dans ce fichier")
+    a = ap.parse_args(argv)
+
+    res = run(a.db, a.source, _grid_sets(a), a.days, a.paths, a.block, a.history_days, a.symbol,
+              a.base_pbuy, a.trades_per_day, a.seed)
+    if not res.get("ok"):
+        print(res.get("error"))
+        return 1
+    print_report(res)
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, csv, json, math, sys
+import argparse, json, math, sys
 from urllib.request import urlopen, Request
 from statistics import median
 
+import walkforward
+from common import tpsl
+
 def fetch_params(base_url):
     try:
         with urlopen(base_url.rstrip('/') + "/api/params") as r:
@@ -18,30 +21,6 @@ def post_params(base_url, payload):
     with urlopen(req) as r:
         return json.loads(r.read().decode("utf-8"))
 
-def load_losses(history_path):
-    losses = []
-    with open(history_path, "r", newline="", encoding="utf-8") as f:
-        for r in csv.DictReader(f):
-            try:
-                ret = float(r.get("ret", "nan"))
-                if math.isfinite(ret) and ret < 0:
-                    losses.append(abs(ret))
-            except Exception:
-                pass
-    return losses
-
-def quantile(values, q):
-    if not values:
-        return None
-    vs = sorted(values)
-    idx = (len(vs)-1) * q
-    lo = int(math.floor(idx))
-    hi = int(math.ceil(idx))
-    if lo == hi:
-        return vs[lo]
-    frac = idx - lo
-    return vs[lo]*(1-frac) + vs[hi]*frac
-
 def main():
     ap = argparse.ArgumentParser(description="Calcule un SL minimal basé sur un quantile des pertes observées (papier) et peut l'appliquer à l'API.")
     ap.add_argument("--base-url", default="http://localhost:5000")
@@ -50,22 +29,16 @@ def main():
     ap.add_argument("--floor", type=float, default=0.0060, help="Plancher minimum si l'historique est trop optimiste (ex: 0.006 = 0.60%).")
     ap.add_argument("--apply", action="store_true", help="Appliquer la valeur via /api/params/update (MIN_SL_PCT).")
     ap.add_argument("--csv", default="sl_optim_results.csv")
+    ap.add_argument("--walk-forward", default=None, metavar="TRAIN:TEST",
+                    help="Contrôle hors échantillon: SL fitté sur TRAIN roundtrips, évalué sur les TEST suivants.")
     args = ap.parse_args()
 
-    losses = load_losses(args.history)
-    n = len(losses)
+    rets = [r["ret"] for r in walkforward.load_roundtrips_csv(args.history) if math.isfinite(r["ret"])]
     params = fetch_params(args.base_url)
 
-    # Default to floor if not enough data
-    chosen = None
-    method = "floor"
-    if n >= 5:
-        qv = quantile(losses, max(0.5, min(args.quantile, 0.99)))
-        if qv is not None:
-            chosen = max(args.floor, qv)
-            method = f"quantile_{args.quantile:.2f}"
-    if chosen is None:
-        chosen = float(args.floor)
+    # floor si moins de 5 pertes
+    fit = tpsl.fit_sl(rets, args.quantile, args.floor)
+    chosen, method, n = fit["sl"], fit["method"], fit["n_losses"]
 
     # Optionally apply
     applied_ok = None
@@ -93,5 +66,12 @@ def main():
     # Print summary
     print(f"N_losses={n} | method={method} | SL*={chosen*100:.3f}% | applied={applied_ok} | csv={args.csv}")
 
+    if args.walk_forward:
+        train, test = walkforward.parse_walk_forward(args.walk_forward)
+        be = walkforward.break_even(params) if params.get("ok") else walkforward.break_even({})
+        print(f"\nWalk-forward (train={train}, test={test}, break-even={be*100:.3f}%):")
+        walkforward.print_report(walkforward.walk_forward_roundtrips(
+            rets, train, test, break_even=be, sl_quantile=args.quantile, sl_floor=args.floor))
+
 if __name__ == "__main__":
     main()
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, csv, json, math, os, statistics, sys
+import argparse, json, math, os, statistics, sys
 from urllib.request import urlopen, Request
 
+import walkforward
+from common import tpsl
+
 def fetch_json(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -13,51 +16,10 @@ def estimate_break_even(base_url, defaults):
         p = fetch_json(base_url.rstrip('/') + "/api/params")
     except Exception:
         p = {"ok": False}
-    fee_buy = defaults["fee_buy"]
-    fee_sell = defaults["fee_sell"]
-    slip = defaults["slippage"]
-    buf  = defaults["buffer"]
-    profile = defaults["profile"]
     if p.get("ok"):
-        prefer_maker = bool(p["params"].get("PREFER_MAKER", True))
-        maker_fee_buy = float(p["params"].get("MAKER_FEE_BUY", 0.00075))
-        maker_fee_sell = float(p["params"].get("MAKER_FEE_SELL", 0.00075))
-        taker_fee_buy = float(p["params"].get("FEE_RATE_BUY", 0.0010))
-        taker_fee_sell = float(p["params"].get("FEE_RATE_SELL", 0.0010))
-        fee_buy = maker_fee_buy if prefer_maker else taker_fee_buy
-        fee_sell = maker_fee_sell if prefer_maker else taker_fee_sell
-        slip = float(p["params"].get("SLIPPAGE", slip))
-        buf  = float(p["params"].get("FEE_BUFFER_PCT", buf))
-        profile = "maker" if prefer_maker else "taker"
-    return profile, fee_buy + fee_sell + slip + buf
-
-def load_roundtrips(path):
-    rows = []
-    with open(path, "r", newline="", encoding="utf-8") as f:
-        for r in csv.DictReader(f):
-            try:
-                rows.append({
-                    "entry_ts": float(r.get("entry_ts") or 0.0),
-                    "exit_ts": float(r.get("exit_ts") or 0.0),
-                    "ret": float(r.get("ret") or 0.0),
-                    "pnl": float(r.get("pnl") or 0.0),
-                    "alloc_cost": float(r.get("alloc_cost") or 0.0),
-                })
-            except Exception:
-                continue
-    return rows
-
-def grid_search_tp(returns, tps, break_even, size):
-    best = None
-    for tp in tps:
-        hit = sum(1 for r in returns if r >= tp)
-        n   = len(returns)
-        hr  = (hit / n) if n > 0 else 0.0
-        net = size * (tp - break_even) * hr
-        cand = {"tp": tp, "hit_rate": hr, "net_per_trade": net}
-        if best is None or cand["net_per_trade"] > best["net_per_trade"]:
-            best = cand
-    return best or {"tp": None, "hit_rate": 0.0, "net_per_trade": 0.0}
+        profile = "maker" if bool(p["params"].get("PREFER_MAKER", True)) else "taker"
+        return profile, walkforward.break_even(p)
+    return defaults["profile"], defaults["fee_buy"] + defaults["fee_sell"] + defaults["slippage"] + defaults["buffer"]
 
 def main():
     ap = argparse.ArgumentParser(description="Optimise TP à partir de l'historique papier (roundtrips).")
@@ -69,29 +31,27 @@ def main():
     ap.add_argument("--tp-step", type=float, default=0.0005)
     ap.add_argument("--apply", action="store_true", help="Applique MIN_TP_PCT=TP* via l'API.")
     ap.add_argument("--csv", default="tp_optim_results.csv")
+    ap.add_argument("--walk-forward", default=None, metavar="TRAIN:TEST",
+                    help="Contrôle hors échantillon: TP fitté sur TRAIN roundtrips, évalué sur les TEST suivants.")
     args = ap.parse_args()
 
     defaults = dict(fee_buy=0.00075, fee_sell=0.00075, slippage=0.0002, buffer=0.0005, profile="maker")
     profile, break_even = estimate_break_even(args.base_url, defaults)
 
-    rows = load_roundtrips(args.history)
+    rows = walkforward.load_roundtrips_csv(args.history)
     rets = [r["ret"] for r in rows if math.isfinite(r["ret"])]
     n = len(rets)
     if n == 0:
         print("Aucun roundtrip dans l'historique. Lance collect_paper_history d'abord.", file=sys.stderr)
         sys.exit(1)
 
-    # Build TP grid
-    tps = []
-    x = args.tp_min
-    while x <= args.tp_max + 1e-12:
-        tps.append(round(x, 8))
-        x += args.tp_step
+    tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step)
+    sr = tpsl.SortedReturns(rets)
 
     sizes = [float(s.strip()) for s in args.sizes.split(",") if s.strip()]
     out = []
     for size in sizes:
-        best = grid_search_tp(rets, tps, break_even, size)
+        best = sr.fit_tp(tps, break_even, size, zero_hits="keep")
         out.append({
             "profile": profile,
             "n_trades": n,
@@ -129,5 +89,11 @@ def main():
         print("{:>7.0f} {:>12.3f} {:>10.3f} {:>12.6f}".format(
             r["size_usdt"], r["tp_opt_pct"], r["hit_rate_at_opt"], r["net_per_trade_usdt"]))
 
+    if args.walk_forward:
+        train, test = walkforward.parse_walk_forward(args.walk_forward)
+        print(f"\nWalk-forward (size={sizes[0]:.0f}, train={train}, test={test}):")
+        walkforward.print_report(walkforward.walk_forward_roundtrips(
+            rets, train, test, break_even=break_even, size=sizes[0], tps=tps))
+
 if __name__ == "__main__":
     main()
@@ -5,6 +5,8 @@ from urllib.request import urlopen
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+from common import tpsl
+
 def fetch_json(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -41,14 +43,6 @@ def load_returns(path):
                 pass
     return rets
 
-def build_grid(tp_min, tp_max, tp_step):
-    xs = []
-    v = tp_min
-    while v <= tp_max + 1e-12:
-        xs.append(round(v, 10))
-        v += tp_step
-    return xs
-
 def main():
     ap = argparse.ArgumentParser(description="Deux figures: (1) Net/trade vs TP (superposition des tailles) (2) Hit rate (%) vs TP.")
     ap.add_argument("--base-url", default="http://localhost:5000")
@@ -69,19 +63,14 @@ def main():
     if not rets:
         print("Aucun historique trouvé dans", args.history, file=sys.stderr); sys.exit(1)
 
-    tps = build_grid(args.tp_min, args.tp_max, args.tp_step)
+    tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step, decimals=10)
+    sr = tpsl.SortedReturns(rets)
     sizes = [float(s.strip()) for s in args.sizes.split(",") if s.strip()]
 
     # (1) Net/trade vs TP (superpose plusieurs tailles sur une seule figure)
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(111)
-    for size in sizes:
-        ys = []
-        for tp in tps:
-            hit = sum(1 for r in rets if r >= tp)
-            n   = len(rets); hr  = (hit / n) if n > 0 else 0.0
-            net = size * (tp - break_even) * hr
-            ys.append(net)
+    for size, ys in zip(sizes, sr.net(tps, break_even, sizes)):
         ax1.plot([tp*100 for tp in tps], ys, label=f"{int(size)} USDT")
     ax1.set_title("Net/trade ($) vs TP (%) — tailles superposées")
     ax1.set_xlabel("TP (%)")
@@ -95,12 +84,7 @@ def main():
     # (2) Hit rate (%) vs TP (une seule courbe, indépendante de la taille)
     fig2 = plt.figure()
     ax2 = fig2.add_subplot(111)
-    hr_y = []
-    for tp in tps:
-        hit = sum(1 for r in rets if r >= tp)
-        n   = len(rets); hr  = (hit / n) if n > 0 else 0.0
-        hr_y.append(hr*100.0)
-    ax2.plot([tp*100 for tp in tps], hr_y)
+    ax2.plot([tp*100 for tp in tps], sr.hit_rate(tps) * 100.0)
     ax2.set_title("Hit rate (%) vs TP (%)")
     ax2.set_xlabel("TP (%)")
     ax2.set_ylabel("Hit rate (%)")
@@ -5,6 +5,8 @@ from urllib.request import urlopen
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+from common import tpsl
+
 def fetch_json(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -39,11 +41,6 @@ def load_returns(path):
             except Exception: pass
     return rets
 
-def build_grid(tp_min, tp_max, tp_step):
-    xs = []; v = tp_min
-    while v <= tp_max + 1e-12: xs.append(round(v, 10)); v += tp_step
-    return xs
-
 def main():
     ap = argparse.ArgumentParser(description="Trace la courbe Net/trade ($) en fonction du TP, à partir de l'historique papier.")
     ap.add_argument("--base-url", default="http://localhost:5000")
@@ -58,15 +55,10 @@ def main():
     break_even = estimate_break_even(args.base_url, defaults)
     rets = load_returns(args.history)
     if not rets: print("Aucun historique trouvé dans", args.history, file=sys.stderr); sys.exit(1)
-    tps = build_grid(args.tp_min, args.tp_max, args.tp_step)
+    tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step, decimals=10)
+    sr = tpsl.SortedReturns(rets)
     sizes = [float(s.strip()) for s in args.sizes.split(",") if s.strip()]
-    for size in sizes:
-        ys = []
-        for tp in tps:
-            hit = sum(1 for r in rets if r >= tp)
-            n = len(rets); hr = (hit / n) if n > 0 else 0.0
-            net = size * (tp - break_even) * hr
-            ys.append(net)
+    for size, ys in zip(sizes, sr.net(tps, break_even, sizes)):
         fig = plt.figure()
         ax = fig.add_subplot(111)
         ax.plot([tp*100 for tp in tps], ys, label=f"size={size:.0f} USDT")
@@ -3,6 +3,9 @@
 import argparse, csv, json, math, sys
 from urllib.request import urlopen
 
+import walkforward
+from common import tpsl
+
 def jget(url):
     with urlopen(url) as r:
         return json.loads(r.read().decode("utf-8"))
@@ -20,73 +23,6 @@ def fetch_trades(base_url):
     except Exception:
         return []
 
-def reconstruct_roundtrips(trades):
-    lots = []; out = []
-    for row in trades:
-        side = (row.get("side") or "").lower()
-        ts = float(row.get("time") or row.get("ts") or 0.0)
-        px = float(row.get("price") or 0.0)
-        qty = float(row.get("qty") or 0.0)
-        fee = float(row.get("fee") or 0.0)
-        if qty <= 0 or px <= 0: continue
-        if side == "buy":
-            lots.append([qty, px*qty + fee, ts, px])
-        elif side == "sell":
-            remain = qty; proceeds = px*qty - fee
-            alloc_cost = 0.0; entry_ts=None; entry_px=None
-            while remain > 1e-12 and lots:
-                lqty, lcost, lts, lpx = lots[0]
-                use = min(lqty, remain)
-                unit_cost = (lcost / lqty) if lqty > 0 else 0.0
-                alloc_cost += unit_cost * use
-                if entry_ts is None: entry_ts=float(lts); entry_px=float(lpx)
-                lqty -= use; remain -= use
-                if lqty <= 1e-12: lots.pop(0)
-                else:
-                    lots[0][0] = lqty; lots[0][1] = unit_cost * lqty
-            pnl = proceeds - alloc_cost
-            ret = (pnl / alloc_cost) if alloc_cost > 0 else 0.0
-            out.append({"entry_ts": entry_ts or ts, "exit_ts": ts, "ret": ret})
-    return out
-
-def tp_grid_search(returns, break_even, size, tp_min, tp_max, tp_step):
-    # démarre la grille au max(tp_min, break-even + 1 bp)
-    tp_min_eff = max(tp_min, break_even + 0.0001)
-
-    tps = []
-    v = tp_min_eff
-    while v <= tp_max + 1e-12:
-        tps.append(round(v, 8))
-        v += tp_step
-
-    best = {"tp": None, "hit_rate": 0.0, "net": 0.0}
-    n = len(returns)
-    if n == 0:
-        return best
-
-    for tp in tps:
-        hit = sum(1 for r in returns if r >= tp)
-        hr = hit / n
-        net = size * (tp - break_even) * hr
-        # garde le meilleur même si net <= 0
-        if best["tp"] is None or net >= best["net"]:
-            best = {"tp": tp, "hit_rate": hr, "net": net}
-
-    # fallback explicite si HR=0 : afficher BE + 1 bp
-    if best["hit_rate"] == 0.0 or best["tp"] is None:
-        best = {"tp": max(args.tp_min, break_even + 0.0001), "hit_rate": 0.0, "net_per_trade": 0.0}
-    return best
-
-
-def losses_quantile(losses_abs, q):
-    if not losses_abs: return None
-    vs = sorted(losses_abs)
-    idx = (len(vs)-1) * q
-    lo = int(idx//1); hi = int(-(-idx//1))
-    if lo == hi: return vs[lo]
-    frac = idx - lo
-    return vs[lo]*(1-frac) + vs[hi]*frac
-
 def main():
     ap = argparse.ArgumentParser(description="Résumé rolling windows pour TP/SL.")
     ap.add_argument("--base-url", default="http://localhost:5000")
@@ -98,44 +34,31 @@ def main():
     ap.add_argument("--sl-floor", type=float, default=0.0060)
     ap.add_argument("--windows", default="10,50,100,250,1000")
     ap.add_argument("--csv", default="rolling_summary.csv")
+    ap.add_argument("--walk-forward", default=None, metavar="TRAIN:TEST",
+                    help="Ajoute un walk-forward TP/SL (TRAIN roundtrips fit, TEST suivants évalués).")
     args = ap.parse_args()
 
     params = fetch_params(args.base_url)
-    pr = params.get("params", {})
-    prefer_maker = bool(pr.get("PREFER_MAKER", True))
-    maker_fee_buy = float(pr.get("MAKER_FEE_BUY", 0.00075))
-    maker_fee_sell = float(pr.get("MAKER_FEE_SELL", 0.00075))
-    taker_fee_buy = float(pr.get("FEE_RATE_BUY", 0.0010))
-    taker_fee_sell = float(pr.get("FEE_RATE_SELL", 0.0010))
-    slip = float(pr.get("SLIPPAGE", 0.0002))
-    buf  = float(pr.get("FEE_BUFFER_PCT", 0.0005))
-    fee_buy = maker_fee_buy if prefer_maker else taker_fee_buy
-    fee_sell = maker_fee_sell if prefer_maker else taker_fee_sell
-    be = fee_buy + fee_sell + slip + buf
+    be = walkforward.break_even(params)
+    tps = tpsl.tp_grid(args.tp_min, args.tp_max, args.tp_step, floor=be + 0.0001)
 
     trades = fetch_trades(args.base_url)
-    rts = reconstruct_roundtrips(trades)
+    rts = walkforward.reconstruct_roundtrips(trades)
     rets = [rt["ret"] for rt in rts]
     wins = [int(x.strip()) for x in args.windows.split(",") if x.strip()]
 
+    # toutes les fenêtres depuis un seul tri; ex aequo -> plus grand TP
+    table = tpsl.rolling_table(rets, wins, tps, be, args.primary_size, args.sl_quantile, args.sl_floor, ties="last")
     rows = []
-    for N in wins:
-        seg = rets[-N:] if len(rets) >= N else rets[:]
-        best = tp_grid_search(seg, be, args.primary_size, args.tp_min, args.tp_max, args.tp_step)
-        losses = [abs(x) for x in seg if x < 0]
-        if len(losses) >= 5:
-            sl = max(args.sl_floor, losses_quantile(losses, max(0.5, min(args.sl_quantile, 0.99))))
-            method = "quantile"
-        else:
-            sl = args.sl_floor; method="floor"
+    for t in table:
         rows.append({
-            "window": N,
-            "n_samples": len(seg),
-            "tp_opt_pct": best["tp"],
-            "hit_rate": best["hit_rate"],
-            "net_per_trade_usdt": best["net"],
-            "sl_reco_pct": sl,
-            "sl_method": method
+            "window": int(t["window"]),
+            "n_samples": int(t["n"]),
+            "tp_opt_pct": None if math.isnan(t["tp"]) else float(t["tp"]),
+            "hit_rate": float(t["hit_rate"]),
+            "net_per_trade_usdt": float(t["net_per_trade"]),
+            "sl_reco_pct": float(t["sl"]),
+            "sl_method": "quantile" if t["sl_quantile"] else "floor"
         })
 
     # print table
@@ -152,5 +75,13 @@ def main():
         w.writeheader()
         for r in rows: w.writerow(r)
 
+    if args.walk_forward:
+        train, test = walkforward.parse_walk_forward(args.walk_forward)
+        print(f"\nWalk-forward (train={train}, test={test}):")
+        walkforward.print_report(walkforward.walk_forward_roundtrips(
+            rets, train, test, break_even=be, size=args.primary_size, tps=tps,
+            sl_quantile=args.sl_quantile, sl_floor=args.sl_floor, ties="last",
+            exit_ts=[rt["exit_ts"] for rt in rts]))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,8 @@
+# les modules du backend s'importent depuis backend/ (import app, from common.x import ...)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# smoke_test.py interroge un serveur lancé (python tests/smoke_test.py), pas pytest
+collect_ignore = ["smoke_test.py"]
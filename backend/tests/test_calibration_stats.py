@@ -0,0 +1,107 @@
+import numpy as np
+
+import calibration
+from common.kvcheckpoint import KVCheckpoint
+
+DAY = 86400.0
+
+
+def _pairs(n, seed=0, a=0.3, s=1.5, t0=0.0):
+    rng = np.random.default_rng(seed)
+    p = rng.uniform(0.05, 0.95, n)
+    z = a + s * np.log(p / (1 - p))
+    y = (rng.random(n) < 1 / (1 + np.exp(-z))).astype(float)
+    ts = t0 + np.sort(rng.uniform(0, 5 * DAY, n))
+    return ts, p, y
+
+
+def _stats():
+    # max_days large: les ts synthétiques sont proches de l'époque
+    return calibration.CalibrationStats(max_days=10**6)
+
+
+def test_brier_count_and_platt_recovery():
+    ts, p, y = _pairs(20000)
+    st = _stats()
+    assert st.update(ts, p, y) == ts.size
+    assert st.count() == ts.size
+    rel = st.reliability(bins=10)
+    assert abs(rel["brier"] - np.mean((p - y) ** 2)) < 1e-9
+    assert sum(b["count"] for b in rel["bins"]) == ts.size
+    fit = st.platt()
+    assert fit["n"] == ts.size
+    assert abs(fit["A0_BIAS"] - 0.3) < 0.1 and abs(fit["SIGMOID_SCALE"] - 1.5) < 0.15
+
+
+def test_isotonic_is_monotone_and_json_roundtrip():
+    ts, p, y = _pairs(5000, seed=1)
+    st = _stats()
+    st.update(ts, p, y)
+    xs, ys = st.isotonic()
+    assert np.all(np.diff(ys) >= -1e-12)
+    back = _stats()
+    assert back.load_json(st.to_json())
+    assert back.count() == st.count()
+    np.testing.assert_allclose(back.isotonic()[1], ys)
+    assert back.apply_isotonic(0.5) == st.apply_isotonic(0.5)
+
+
+def test_non_finite_pairs_are_skipped():
+    st = _stats()
+    assert st.update([1.0, 2.0, np.nan], [0.5, np.nan, 0.5], [1.0, 0.0, 1.0]) == 1
+    assert st.count() == 1
+
+
+class _Examples:
+    """Table examples simulée: le labeler écrit le lot AVANT calibration_update."""
+
+    def __init__(self):
+        self.ts, self.p, self.y = np.zeros(0), np.zeros(0), np.zeros(0)
+
+    def write(self, ts, p, y):
+        self.ts = np.r_[self.ts, ts]
+        self.p = np.r_[self.p, p]
+        self.y = np.r_[self.y, y]
+
+    def backfill(self, st, before=None):
+        m = np.ones(self.ts.size, bool) if before is None else self.ts < before
+        st.update(self.ts[m], self.p[m], self.y[m])
+
+
+def _checkpoint(db, kv):
+    return KVCheckpoint(
+        _stats(), "calib_stats_v1", lambda k, d=None: kv.get(k, d), kv.__setitem__,
+        seq_key="calib_stats_seq", backfill=db.backfill,
+    )
+
+
+def _apply(ck, ts, p, y):
+    # comme app.calibration_update: borne = plus petit ts du lot
+    return ck.update(lambda st: st.update(ts, p, y), before=float(np.min(ts)))
+
+
+def test_first_run_backfill_does_not_double_count_the_batch():
+    ts, p, y = _pairs(300, seed=2)
+    db, kv = _Examples(), {}
+    db.write(ts[:200], p[:200], y[:200])  # historique déjà labellisé
+    db.write(ts[200:], p[200:], y[200:])  # lot courant, déjà écrit en base
+    ck = _checkpoint(db, kv)
+    _apply(ck, ts[200:], p[200:], y[200:])
+    assert ck.obj.count() == 300
+
+    # lot suivant: plus de backfill, simple ajout
+    ts2, p2, y2 = _pairs(50, seed=3, t0=6 * DAY)
+    db.write(ts2, p2, y2)
+    _apply(ck, ts2, p2, y2)
+    assert ck.obj.count() == 350
+
+
+def test_other_process_reloads_from_checkpoint():
+    ts, p, y = _pairs(100, seed=4)
+    db, kv = _Examples(), {}
+    db.write(ts, p, y)
+    writer = _checkpoint(db, kv)
+    _apply(writer, ts, p, y)
+    reader = _checkpoint(_Examples(), kv)
+    assert reader.get(0.0).count() == 100
+    assert reader.seq == writer.seq
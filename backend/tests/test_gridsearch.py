@@ -0,0 +1,10 @@
+import gridsearch
+
+
+def test_run_rejects_oversized_grid_before_loading(tmp_path):
+    side = int(gridsearch.MAX_GRID_POINTS ** 0.25) + 1
+    grid = {k: [0.1 * i for i in range(side)] for k in ("PBUY", "VOL_MIN", "TP_ATR_MULT", "SL_ATR_MULT")}
+    # base inexistante: le refus doit venir avant load()
+    res = gridsearch.run(str(tmp_path / "missing" / "x.db"), grid, {"COST": 0.0})
+    assert res["ok"] is False
+    assert "too large" in res["error"]
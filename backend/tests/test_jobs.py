@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    q = jobs.JobQueue(lambda: sqlite3.connect(path, timeout=5), max_workers=2, heartbeat_s=1.0)
+    yield q
+    q.stop()
+
+
+def _wait(q, job_id, states=("done", "failed", "cancelled", "lost"), timeout=5.0):
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        row = q.get(job_id)
+        if row and row["state"] in states:
+            return row
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {q.get(job_id)['state']}")
+
+
+def test_result_progress_and_param_check(queue):
+    def add(ctx, a, b=1):
+        ctx.progress(0.5, "half", force=True)
+        return {"sum": a + b}
+
+    queue.register("add", add)
+    assert queue.check_params("add", {"a": 1}) is None
+    assert "missing" in queue.check_params("add", {})
+    assert "unknown" in queue.check_params("add", {"a": 1, "c": 2})
+    assert "unknown kind" in queue.check_params("nope", {})
+    with pytest.raises(KeyError):
+        queue.submit("nope")
+    job_id, created = queue.submit("add", {"a": 2, "b": 3})
+    row = _wait(queue, job_id)
+    assert created and row["state"] == "done" and row["result"] == {"sum": 5}
+    assert row["progress"] == 1.0 and row["message"] == "half" and row["params"] == {"a": 2, "b": 3}
+
+
+def test_identical_inflight_submission_is_deduplicated(queue):
+    go = threading.Event()
+
+    def slow(ctx, n):
+        go.wait(5)
+        return n
+
+    queue.register("slow", slow)
+    j1, c1 = queue.submit("slow", {"n": 1})
+    j2, c2 = queue.submit("slow", {"n": 1})
+    j3, c3 = queue.submit("slow", {"n": 2})
+    assert (c1, c2, c3) == (True, False, True) and j2 == j1 and j3 != j1
+    go.set()
+    assert _wait(queue, j1)["state"] == "done"
+    _wait(queue, j3)
+    # terminé: une nouvelle soumission identique relance un job
+    j4, c4 = queue.submit("slow", {"n": 1})
+    assert c4 and j4 != j1
+    _wait(queue, j4)
+
+
+def test_cancel_running_and_queued(queue):
+    started = threading.Event()
+
+    def loop(ctx, k):
+        started.set()
+        for i in range(500):
+            ctx.progress(i / 500, force=True)
+            time.sleep(0.01)
+        return "finished"
+
+    queue.register("loop", loop)
+    a, _ = queue.submit("loop", {"k": "a"})
+    b, _ = queue.submit("loop", {"k": "b"})
+    c, _ = queue.submit("loop", {"k": "c"})  # 2 workers: c attend en file
+    assert started.wait(5)
+    assert queue.cancel(c)
+    assert queue.cancel(a)
+    assert _wait(queue, a)["state"] == "cancelled"
+    row_c = _wait(queue, c)
+    assert row_c["state"] == "cancelled" and row_c["started_at"] is None
+    assert queue.cancel(b)
+    assert _wait(queue, b)["state"] == "cancelled"
+    # terminé: plus rien à annuler
+    assert not queue.cancel(a)
+
+
+def test_cancel_requested_from_another_process(queue, tmp_path):
+    def loop(ctx):
+        while True:
+            ctx.progress(0.1, force=True)
+            time.sleep(0.01)
+
+    queue.register("loop", loop)
+    job_id, _ = queue.submit("loop")
+    other = sqlite3.connect(str(tmp_path / "jobs.db"))
+    other.execute("UPDATE jobs SET cancel_requested=1 WHERE id=?", (job_id,))
+    other.commit()
+    other.close()
+    assert _wait(queue, job_id)["state"] == "cancelled"
+
+
+def test_failed_job_records_error(queue):
+    def boom(ctx):
+        raise ValueError("bad input")
+
+    queue.register("boom", boom)
+    job_id, _ = queue.submit("boom")
+    row = _wait(queue, job_id)
+    assert row["state"] == "failed" and "ValueError: bad input" in row["error"]
+
+
+def test_lost_heartbeat_and_ttl_purge(queue, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "jobs.db"))
+    now = time.time()
+    # job d'un process mort: heartbeat figé
+    conn.execute(
+        "INSERT INTO jobs(id,kind,dedupe_key,state,created_at,heartbeat,expires_at) "
+        "VALUES('dead','slow','k','running',?,?,?)",
+        (now - 100, now - 100, now + 3600),
+    )
+    conn.commit()
+    assert queue.maintain()["lost"] == 1
+    row = queue.get("dead")
+    assert row["state"] == "lost" and row["error"] == "heartbeat lost"
+
+    queue.register("noop", lambda ctx: None)
+    job_id, _ = queue.submit("noop", ttl_s=0.05)
+    _wait(queue, job_id)
+    assert queue.maintain()["purged"] == 0
+    time.sleep(0.1)
+    # terminé + TTL échu -> purgé; le job perdu (TTL 1h) reste
+    assert queue.maintain()["purged"] == 1
+    assert queue.get(job_id) is None and queue.get("dead") is not None
+    conn.close()
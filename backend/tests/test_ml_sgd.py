@@ -0,0 +1,25 @@
+import numpy as np
+
+import ml_sgd
+
+
+def test_warm_start_keeps_logits_under_new_scaling():
+    rng = np.random.default_rng(3)
+    feats = ("a", "b", "c")
+    old = ml_sgd.BinaryModel(
+        feats, np.array([0.8, -1.2, 0.3]), -0.4,
+        np.array([1.0, -2.0, 0.5]), np.array([2.0, 0.5, 3.0]),
+    )
+    # nouvelle fenêtre: médianes et dispersions différentes de celles de ``old``
+    X = rng.normal([3.0, 1.0, -1.0], [5.0, 0.2, 1.0], size=(40, 3))
+    y = (rng.random(40) < 0.5).astype(float)
+    new = ml_sgd.train(X, y, feats, epochs=0, init=old)["model"]
+    assert not np.allclose(new.mu, old.mu)
+    np.testing.assert_allclose(new.decision(X), old.decision(X), rtol=1e-9, atol=1e-9)
+
+
+def test_warm_start_ignored_on_other_features():
+    old = ml_sgd.BinaryModel(("a",), np.array([1.0]), 0.5, np.zeros(1), np.ones(1))
+    X = np.arange(20, dtype=float).reshape(10, 2)
+    m = ml_sgd.train(X, np.zeros(10), ("a", "b"), epochs=0, init=old)["model"]
+    assert m.b == 0.0 and not m.w.any()
@@ -0,0 +1,80 @@
+import sqlite3
+
+import numpy as np
+
+import ml_sgd
+from model_registry import ModelRegistry
+
+
+def _model(w, trained_at):
+    return ml_sgd.BinaryModel(
+        ("a", "b"), np.array(w, dtype=float), 0.1, np.zeros(2), np.ones(2), trained_at
+    )
+
+
+def _blob_loader(conn):
+    """Comme app._sgd_model_loader: relit le blob seulement si sa version (ts) a changé."""
+    def load(cur_version):
+        ts = ml_sgd.model_version(conn)
+        if ts is None or ts == cur_version:
+            return None
+        return ml_sgd.load_model(conn), ts
+    return load
+
+
+def test_promote_then_rollback_through_blob():
+    conn = sqlite3.connect(":memory:")
+    reg = ModelRegistry(refresh_s=0.0)
+    load = _blob_loader(conn)
+    assert reg.ensure(ml_sgd.MODEL_KEY, load) is None
+
+    v1 = _model([1.0, 2.0], 1000.0)
+    ml_sgd.save_model(conn, v1)
+    h1 = reg.ensure(ml_sgd.MODEL_KEY, load)
+    assert h1.version == 1000.0 and h1.source == "load"
+    np.testing.assert_allclose(h1.model.w, v1.w)
+
+    # promotion: nouveau blob publié par un autre process
+    ml_sgd.save_model(conn, _model([3.0, 4.0], 2000.0))
+    h2 = reg.ensure(ml_sgd.MODEL_KEY, load)
+    assert h2.version == 2000.0
+    np.testing.assert_allclose(h2.model.w, [3.0, 4.0])
+
+    # rollback: l'ancien modèle est republié -> version différente, le registre suit
+    ml_sgd.save_model(conn, v1)
+    h3 = reg.ensure(ml_sgd.MODEL_KEY, load)
+    assert h3.version == 1000.0
+    np.testing.assert_allclose(h3.model.w, v1.w)
+    # version inchangée: même handle, pas de rechargement
+    assert reg.ensure(ml_sgd.MODEL_KEY, load) is h3
+
+
+def test_publish_wins_until_refresh_and_loader_errors_keep_current():
+    reg = ModelRegistry(refresh_s=3600.0)
+    calls = []
+
+    def load(cur):
+        calls.append(cur)
+        return "old", 1
+
+    h = reg.publish("m", "trained", 5, source="train")
+    # vérifié à la publication: pas de relecture avant refresh_s
+    assert reg.ensure("m", load) is h and calls == []
+    reg.invalidate("m")
+    assert reg.ensure("m", load).model == "old" and calls == [5]
+
+    def boom(cur):
+        raise RuntimeError("db down")
+
+    reg.invalidate()
+    assert reg.ensure("m", boom).model == "old"
+    assert reg.info()["m"]["version"] == 1
+
+
+def test_blob_roundtrip():
+    conn = sqlite3.connect(":memory:")
+    m = _model([0.5, -0.25], 123.0)
+    back = ml_sgd.from_blob(ml_sgd.to_blob(m))
+    assert back.features == m.features and back.trained_at == 123.0
+    np.testing.assert_allclose(back.w, m.w)
+    assert ml_sgd.load_model(conn) is None and ml_sgd.model_version(conn) is None
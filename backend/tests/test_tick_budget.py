@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from common.budget import TickBudget
+
+
+def test_call_returns_result_within_budget():
+    b = TickBudget(1.0)
+    assert b.call("price", lambda x: x * 2, 21) == 42
+    assert b.degraded == []
+
+
+def test_call_without_budget_runs_inline():
+    b = TickBudget(0.0)
+    assert b.call("risk", threading.current_thread) is threading.current_thread()
+
+
+def test_call_stops_waiting_and_skips_busy_stage():
+    release = threading.Event()
+    seen = []
+    b = TickBudget(0.05, on_degrade=seen.append)
+    assert b.call("slow", release.wait, 5.0, default="late") == "late"
+    assert b.degraded == ["slow"]
+
+    # l'appel précédent tourne encore: pas de 2e soumission, défaut immédiat
+    b2 = TickBudget(1.0)
+    assert b2.call("slow", lambda: "again") is None
+    assert b2.degraded == ["slow"]
+
+    release.set()
+    assert seen == ["slow"]
+
+
+def test_call_propagates_errors():
+    def boom():
+        raise RuntimeError("x")
+
+    with pytest.raises(RuntimeError):
+        TickBudget(1.0).call("snapshot", boom)
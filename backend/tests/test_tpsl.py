@@ -0,0 +1,27 @@
+import numpy as np
+
+from common.tpsl import fit_tp
+
+
+def test_fit_tp_keeps_zero_net_tp_when_break_even_above_all_hits():
+    # break-even au-dessus de tous les TP touchés: le TP à net nul (0.4 %) gagne,
+    # pas le premier point de la grille à net négatif
+    best = fit_tp([0.003, 0.003], [0.002, 0.003, 0.004], 0.005, 50)
+    assert best["tp"] == 0.004
+    assert best["net_per_trade"] == 0.0
+
+
+def test_fit_tp_zero_hits_modes():
+    tps = [0.002, 0.003]
+    assert fit_tp([0.001], tps, 0.005, 50)["tp"] == 0.002
+    assert fit_tp([0.001], tps, 0.005, 50, ties="last", zero_hits="keep")["tp"] == 0.003
+
+
+def test_fit_tp_matches_brute_force():
+    rng = np.random.default_rng(7)
+    rets = rng.normal(0.002, 0.004, 300)
+    tps = np.arange(0.001, 0.012, 0.0005)
+    be, size = 0.0015, 100.0
+    net = [size * (tp - be) * np.mean(rets >= tp) for tp in tps]
+    best = fit_tp(rets, tps, be, size)
+    assert best["tp"] == tps[int(np.argmax(net))]
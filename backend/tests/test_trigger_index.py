@@ -0,0 +1,71 @@
+import math
+import random
+
+from common.triggers import TriggerIndex
+
+
+def brute(lots, price):
+    """Référence: scan de tous les lots (TP si price >= tp, SL si price <= sl; 0/None = absent)."""
+    out = set()
+    for lot_id, (tp, sl) in lots.items():
+        if tp and tp > 0 and price >= tp:
+            out.add(lot_id)
+        if sl and sl > 0 and price <= sl:
+            out.add(lot_id)
+    return out
+
+
+def test_crossed_matches_brute_force_random():
+    rng = random.Random(0)
+    idx, lots = TriggerIndex(), {}
+    for step in range(3000):
+        op = rng.random()
+        if op < 0.5 or not lots:
+            lot_id = rng.randrange(200)
+            entry = rng.uniform(50_000, 70_000)
+            tp = entry * (1 + rng.uniform(0.001, 0.05)) if rng.random() > 0.05 else None
+            sl = entry * (1 - rng.uniform(0.001, 0.05)) if rng.random() > 0.05 else 0.0
+            idx.upsert(lot_id, tp, sl, payload={"id": lot_id})
+            lots[lot_id] = (tp, sl)
+        elif op < 0.65:
+            lot_id = rng.choice(list(lots))
+            assert idx.remove(lot_id)
+            del lots[lot_id]
+        price = rng.uniform(48_000, 75_000)
+        got = idx.crossed(price)
+        assert len(got) == len(set(got))
+        assert set(got) == brute(lots, price)
+        assert idx.any_crossed(price) == bool(got)
+        assert len(idx) == len(lots)
+
+
+def test_boundary_floats():
+    idx = TriggerIndex()
+    tp, sl = 0.1 + 0.2, 60000.000000001
+    idx.upsert("a", tp, 0.0)
+    idx.upsert("b", None, sl)
+    lots = {"a": (tp, 0.0), "b": (None, sl)}
+    for price in (
+        tp, math.nextafter(tp, -math.inf), math.nextafter(tp, math.inf),
+        sl, math.nextafter(sl, -math.inf), math.nextafter(sl, math.inf),
+    ):
+        assert set(idx.crossed(price)) == brute(lots, price), price
+        assert idx.any_crossed(price) == bool(brute(lots, price)), price
+    # égalité exacte: TP et SL déclenchent
+    assert idx.crossed_tp(tp) == ["a"]
+    assert idx.crossed_sl(sl) == ["b"]
+
+
+def test_same_trigger_price_and_upsert_replaces():
+    idx = TriggerIndex()
+    for i in range(5):
+        idx.upsert(i, 100.0, 90.0, payload=i)
+    assert sorted(idx.crossed(100.0)) == list(range(5))
+    assert sorted(idx.crossed(90.0)) == list(range(5))
+    idx.upsert(2, 200.0, 50.0, payload="moved")
+    assert idx.triggers(2) == (200.0, 50.0)
+    assert idx.payload(2) == "moved"
+    assert sorted(idx.crossed(100.0)) == [0, 1, 3, 4]
+    assert not idx.remove("missing")
+    idx.clear(key=("k",))
+    assert len(idx) == 0 and idx.key == ("k",) and idx.crossed(1e9) == []
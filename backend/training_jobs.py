@@ -0,0 +1,128 @@
+"""
+Jobs run by the training pool (training_pool.py) in spawned worker processes.
+
+Each job opens its own SQLite connection from ``db_path`` and never imports
+app.py, so a worker starts fast and holds no Flask/exchange state. Jobs return
+plain picklable results; the parent publishes them (model registry, calibration,
+monitor) in its ``on_done`` callbacks.
+"""
+from __future__ import annotations
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import bandit_eval
+import calibration
+import feature_store
+import labeler
+import ml_multiclass
+import ml_sgd
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA busy_timeout=30000;")
+    except sqlite3.Error:
+        pass
+    return conn
+
+
+class _KV:
+    """kv_get / kv_set / select_rows avec la même convention que app.py (JSON en TEXT)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, key, default=None):
+        r = self.conn.execute("SELECT value FROM kv WHERE key=? LIMIT 1", (key,)).fetchone()
+        if r is None or r[0] is None:
+            return default
+        try:
+            return json.loads(r[0])
+        except (TypeError, ValueError):
+            return r[0]
+
+    def set(self, key, value):
+        s = value if isinstance(value, str) else json.dumps(value)
+        self.conn.execute("INSERT OR REPLACE INTO kv(key,value) VALUES(?,?)", (key, s))
+        self.conn.commit()
+
+    def select(self, sql, params=()):
+        return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
+
+
+def _asof(conn, symbol: Optional[str]):
+    if not symbol:
+        return None
+    return lambda ts, features: feature_store.asof_matrix(conn, symbol, ts, features)
+
+
+def label(db_path: str, k_minutes: float, features: Sequence[str]) -> Dict[str, Any]:
+    conn = _connect(db_path)
+    try:
+        return labeler.label_pending(conn, k_minutes, features)
+    finally:
+        conn.close()
+
+
+def train_sgd(
+    db_path: str, features: Sequence[str], limit: int = 1200, lr: float = 0.05,
+    l2: float = 1e-4, asof_symbol: Optional[str] = None,
+) -> Dict[str, Any]:
+    conn = _connect(db_path)
+    try:
+        out = ml_sgd.train_from_db(
+            conn, features, limit=int(limit), lr=float(lr), l2=float(l2),
+            asof=_asof(conn, asof_symbol),
+        )
+        out["version"] = ml_sgd.model_version(conn)
+        return out
+    finally:
+        conn.close()
+
+
+def train_mc(db_path: str, limit: int = 20000, asof_symbol: Optional[str] = None) -> Dict[str, str]:
+    conn = _connect(db_path)
+    try:
+        kv = _KV(conn)
+        return ml_multiclass.sgd_mc_train_online(
+            kv.select, kv.get, kv.set, limit=int(limit), asof=_asof(conn, asof_symbol)
+        )
+    finally:
+        conn.close()
+
+
+def calibrate(stats_json: Dict[str, Any], days: Optional[float] = None) -> Dict[str, Any]:
+    """Fit Platt + isotonique sur un instantané des stats (calibration.CalibrationStats)."""
+    t0 = time.perf_counter()
+    st = calibration.CalibrationStats()
+    if not st.load_json(stats_json):
+        return {"ok": False, "error": "no_stats"}
+    fit = st.platt(days) or {}
+    xs, ys = st.isotonic(days)
+    return {
+        "ok": bool(fit),
+        "platt": fit,
+        "isotonic_points": int(len(xs)),
+        "n": st.count(days),
+        "seconds": round(time.perf_counter() - t0, 4),
+    }
+
+
+def eval_bandit_arms(
+    db_path: str, arms: Sequence[Dict[str, Any]], defaults: Dict[str, float],
+    days: Optional[float] = None, horizon_s: float = 600.0,
+    policies: Sequence[str] = ("ucb1", "thompson", "swucb"), seeds: int = 3,
+    epsilon: float = 0.03, window: int = 500,
+) -> Dict[str, Any]:
+    """Évaluation contrefactuelle des bras (bandit_eval.py); entrées gardées en cache par worker."""
+    conn = _connect(db_path)
+    try:
+        inputs = bandit_eval.load_inputs(conn, days, horizon_s, cache_key=db_path)
+    finally:
+        conn.close()
+    return bandit_eval.evaluate(inputs, arms, defaults, policies, seeds, epsilon, window)
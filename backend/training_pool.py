@@ -0,0 +1,278 @@
+"""
+Training scheduler: labeling and model fits in a process pool, off the engine thread.
+
+Jobs are named. A name is single-instance: submitting it while it is queued or
+running is a no-op. The queue is ordered by priority (lower first), then FIFO.
+Periodic jobs (``every``) are enqueued by the dispatcher thread when they are due.
+Workers come from a forkserver (spawn where unavailable): they never inherit the
+Flask/exchange state nor re-import ``__main__`` (engine.py would re-import app), and
+run the functions of training_jobs.py; ``on_done(result)`` runs back in this process to
+publish the result (model registry, calibration, monitor).
+
+Per-job runs, durations, last success and errors go to Prometheus and ``status()``.
+"""
+from __future__ import annotations
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+TRAINING_JOB_SECONDS = Histogram(
+    "training_job_duration_seconds",
+    "Duration of one training-pool job (seconds)",
+    ["job"],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600),
+)
+TRAINING_JOB_RUNS = Counter(
+    "training_job_runs_total", "Training-pool job runs", ["job", "status"]
+)
+TRAINING_JOB_RUNNING = Gauge(
+    "training_job_running", "1 while the job runs", ["job"], multiprocess_mode="livesum"
+)
+TRAINING_JOB_LAST_SUCCESS = Gauge(
+    "training_job_last_success_timestamp_seconds",
+    "Unix time of the last successful run",
+    ["job"],
+    multiprocess_mode="max",
+)
+TRAINING_QUEUE_DEPTH = Gauge(
+    "training_queue_depth", "Jobs waiting for a worker", multiprocess_mode="livesum"
+)
+
+log = logging.getLogger("training_pool")
+
+
+@dataclass
+class _Job:
+    name: str
+    fn: Callable
+    args: Tuple = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    priority: int = 10
+    on_done: Optional[Callable[[Any], Any]] = None
+    submitted_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class _Periodic:
+    name: str
+    interval_s: float
+    make: Callable[[], Optional[_Job]]
+    next_at: float = 0.0
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    state: str = "idle"  # idle | queued | running
+    last_start: Optional[float] = None
+    last_duration: Optional[float] = None
+    last_success: Optional[float] = None
+    last_error: Optional[str] = None
+    last_result: Any = None
+
+
+class TrainingPool:
+    def __init__(self, max_workers: int = 1, logger=None, mp_context: Optional[str] = None):
+        self.max_workers = max(1, int(max_workers))
+        self.log = logger or log
+        if mp_context is None:
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = "forkserver" if "forkserver" in methods else "spawn"
+        self._ctx = multiprocessing.get_context(mp_context)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, JobStats] = {}
+        self._periodic: Dict[str, _Periodic] = {}
+        self._running = 0
+        self._cv = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- soumission ----------
+
+    def submit(
+        self,
+        name: str,
+        fn: Callable,
+        args: Tuple = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        priority: int = 10,
+        on_done: Optional[Callable[[Any], Any]] = None,
+    ) -> bool:
+        """Met ``name`` en file; False s'il est déjà en file ou en cours (instance unique)."""
+        return self._enqueue(_Job(name, fn, tuple(args), dict(kwargs or {}), int(priority), on_done))
+
+    def submit_job(self, job: _Job) -> bool:
+        return self._enqueue(job)
+
+    def _enqueue(self, job: _Job) -> bool:
+        with self._cv:
+            st = self._stats.setdefault(job.name, JobStats())
+            if st.state != "idle":
+                return False
+            st.state = "queued"
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            TRAINING_QUEUE_DEPTH.set(len(self._heap))
+            self._cv.notify_all()
+        return True
+
+    def every(self, name: str, interval_s: float, make: Callable[[], Optional[_Job]],
+              first_in_s: float = 0.0):
+        """``make()`` -> _Job (ou None pour sauter ce tour), enfilé toutes les ``interval_s``."""
+        with self._cv:
+            self._periodic[name] = _Periodic(name, float(interval_s), make, time.time() + first_in_s)
+            self._cv.notify_all()
+
+    @staticmethod
+    def job(name: str, fn: Callable, *args, priority: int = 10,
+            on_done: Optional[Callable[[Any], Any]] = None, **kwargs) -> _Job:
+        return _Job(name, fn, args, kwargs, int(priority), on_done)
+
+    # ---------- exécution ----------
+
+    def start(self) -> "TrainingPool":
+        with self._cv:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._stop = False
+            self._thread = threading.Thread(target=self._dispatch, name="training-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, wait: bool = False):
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._ctx)
+        return self._executor
+
+    def _due_periodic(self, now: float) -> Tuple[List[_Periodic], float]:
+        """(périodiques échus, délai jusqu'au prochain); à appeler sous ``_cv``."""
+        wait, due = 5.0, []
+        for p in list(self._periodic.values()):
+            if now >= p.next_at:
+                p.next_at = now + p.interval_s
+                due.append(p)
+            wait = min(wait, max(0.0, p.next_at - now))
+        return due, wait
+
+    def _build(self, p: _Periodic):
+        """``make()`` hors verrou (il peut lire la base ou sérialiser un état), puis mise en file."""
+        try:
+            job = p.make()
+        except Exception as e:
+            self.log.warning(f"[training] {p.name}: build failed: {e}")
+            return
+        if job is not None:
+            job.name = p.name
+            self._enqueue(job)
+
+    def _dispatch(self):
+        while True:
+            with self._cv:
+                if self._stop:
+                    return
+                due, wait = self._due_periodic(time.time())
+            for p in due:
+                self._build(p)
+            with self._cv:
+                if self._stop:
+                    return
+                if not self._heap or self._running >= self.max_workers:
+                    self._cv.wait(timeout=max(0.05, wait))
+                    continue
+                _, _, job = heapq.heappop(self._heap)
+                TRAINING_QUEUE_DEPTH.set(len(self._heap))
+                st = self._stats[job.name]
+                st.state, st.last_start = "running", time.time()
+                self._running += 1
+                TRAINING_JOB_RUNNING.labels(job.name).set(1)
+                try:
+                    fut = self._pool().submit(job.fn, *job.args, **job.kwargs)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    self._executor = None
+                    fut = Future()
+                    fut.set_exception(e)
+                fut.add_done_callback(lambda f, j=job: self._finish(j, f))
+
+    def _finish(self, job: _Job, fut: Future):
+        t1 = time.time()
+        with self._cv:
+            st = self._stats[job.name]
+            dur = t1 - (st.last_start or t1)
+        err = fut.exception()
+        result = None if err is not None else fut.result()
+        if err is None and job.on_done is not None:
+            try:
+                job.on_done(result)
+            except Exception as e:
+                err = e
+        if isinstance(err, BrokenProcessPool):
+            with self._cv:
+                self._executor = None
+        with self._cv:
+            st.runs += 1
+            st.last_duration = dur
+            if err is None:
+                st.last_success, st.last_error, st.last_result = t1, None, _brief(result)
+            else:
+                st.failures += 1
+                st.last_error = f"{type(err).__name__}: {err}"
+            st.state = "idle"
+            self._running -= 1
+            self._cv.notify_all()
+        TRAINING_JOB_RUNNING.labels(job.name).set(0)
+        TRAINING_JOB_SECONDS.labels(job.name).observe(dur)
+        TRAINING_JOB_RUNS.labels(job.name, "ok" if err is None else "error").inc()
+        if err is None:
+            TRAINING_JOB_LAST_SUCCESS.labels(job.name).set(t1)
+        else:
+            self.log.warning(f"[training] {job.name} failed: {st.last_error}")
+
+    # ---------- état ----------
+
+    def status(self) -> Dict[str, Any]:
+        with self._cv:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": [j.name for _, _, j in sorted(self._heap)],
+                "jobs": {
+                    n: {
+                        "state": s.state,
+                        "runs": s.runs,
+                        "failures": s.failures,
+                        "last_start": s.last_start,
+                        "last_duration_s": s.last_duration,
+                        "last_success": s.last_success,
+                        "last_error": s.last_error,
+                        "last_result": s.last_result,
+                        "every_s": (self._periodic[n].interval_s if n in self._periodic else None),
+                    }
+                    for n, s in self._stats.items()
+                },
+            }
+
+
+def _brief(result: Any) -> Any:
+    """Résumé JSON-able d'un résultat (les tableaux du labeler ne sont pas gardés)."""
+    if isinstance(result, dict):
+        return {k: v for k, v in result.items() if isinstance(v, (str, int, float, bool, type(None)))}
+    return result if isinstance(result, (str, int, float, bool, type(None))) else None
@@ -0,0 +1,422 @@
+"""
+Walk-forward optimization of TP/SL and entry thresholds.
+
+Two tracks, both time-ordered with parameters fit on a train window and scored on
+the window that follows it (rolling, or anchored at the start):
+
+- roundtrips (closed paper trades, FIFO): TP = argmax of size * (tp - break_even) * hit_rate
+  over a TP grid, SL = quantile of absolute losses (floored). Out of sample the returns
+  are clipped to [-sl, tp] (final returns only: a trade that touched -sl then recovered
+  counts as recovered).
+- examples (labeled ``examples`` + stored price paths): PBUY x VOL_MIN x TP_ATR_MULT x
+  SL_ATR_MULT picked with gridsearch.evaluate_pairs on train, re-simulated on test.
+  Train examples whose horizon reaches into the test window are dropped (purge).
+
+Folds run in a process pool (``workers``); ``stability()`` reports per-parameter drift
+across folds and in-sample vs out-of-sample expectancy. The TP/SL helpers here back
+optimize_tp_from_history.py, optimize_sl_from_history.py, rolling_summary.py and
+adaptive_risk_manager.py; the TP/SL fits themselves live in common/tpsl.py.
+
+    cd backend && python -m walkforward roundtrips --history paper_roundtrips.csv --train 100 --test 25
+    cd backend && python -m walkforward examples --db data/app.db --train-days 7 --test-days 1
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.tpsl import fit_sl, fit_tp, score_tp_sl, tp_grid
+
+Split = Tuple[int, int, int, int]  # train [lo, hi), test [lo, hi)
+
+
+# ---------- roundtrips ----------
+
+
+def break_even(params: Dict[str, Any]) -> float:
+    """Coût aller-retour (frais maker/taker selon PREFER_MAKER + slippage + buffer) depuis /api/params."""
+    pr = params.get("params", params) or {}
+    prefer_maker = bool(pr.get("PREFER_MAKER", True))
+    if prefer_maker:
+        fee_buy = float(pr.get("MAKER_FEE_BUY", 0.00075))
+        fee_sell = float(pr.get("MAKER_FEE_SELL", 0.00075))
+    else:
+        fee_buy = float(pr.get("FEE_RATE_BUY", 0.0010))
+        fee_sell = float(pr.get("FEE_RATE_SELL", 0.0010))
+    slip = float(pr.get("SLIPPAGE", 0.0002))
+    buf = float(pr.get("FEE_BUFFER_PCT", 0.0005))
+    return fee_buy + fee_sell + slip + buf
+
+
+def reconstruct_roundtrips(trades: Sequence[Dict[str, Any]]) -> List[Dict[str, float]]:
+    """FIFO sur /api/trades -> [{entry_ts, exit_ts, ret}] avec ret = pnl / coût alloué (frais inclus)."""
+    lots = []
+    out = []
+    for row in trades:
+        side = (row.get("side") or "").lower()
+        ts = float(row.get("time") or row.get("ts") or 0.0)
+        px = float(row.get("price") or 0.0)
+        qty = float(row.get("qty") or 0.0)
+        fee = float(row.get("fee") or 0.0)
+        if qty <= 0 or px <= 0:
+            continue
+        if side == "buy":
+            lots.append([qty, px * qty + fee, ts])
+        elif side == "sell":
+            remain = qty
+            proceeds = px * qty - fee
+            alloc_cost = 0.0
+            entry_ts = None
+            while remain > 1e-12 and lots:
+                lqty, lcost, lts = lots[0]
+                use = min(lqty, remain)
+                unit_cost = (lcost / lqty) if lqty > 0 else 0.0
+                alloc_cost += unit_cost * use
+                if entry_ts is None:
+                    entry_ts = float(lts)
+                lqty -= use
+                remain -= use
+                if lqty <= 1e-12:
+                    lots.pop(0)
+                else:
+                    lots[0][0] = lqty
+                    lots[0][1] = unit_cost * lqty
+            pnl = proceeds - alloc_cost
+            ret = (pnl / alloc_cost) if alloc_cost > 0 else 0.0
+            out.append({"entry_ts": entry_ts or ts, "exit_ts": ts, "ret": ret})
+    return out
+
+
+def load_roundtrips_csv(path: str) -> List[Dict[str, float]]:
+    """paper_roundtrips.csv (collect_paper_history.py); lignes illisibles ignorées."""
+    rows = []
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            try:
+                rows.append({
+                    "entry_ts": float(r.get("entry_ts") or 0.0),
+                    "exit_ts": float(r.get("exit_ts") or 0.0),
+                    "ret": float(r.get("ret") or 0.0),
+                    "pnl": float(r.get("pnl") or 0.0),
+                    "alloc_cost": float(r.get("alloc_cost") or 0.0),
+                })
+            except Exception:
+                continue
+    # l'ordre des lignes du CSV n'est pas garanti: les folds suivent l'ordre de sortie
+    rows.sort(key=lambda r: r["exit_ts"])
+    return rows
+
+
+def parse_walk_forward(s: str) -> Tuple[int, int]:
+    """ "TRAIN:TEST" en nombre de roundtrips, ex: "100:25" -> (100, 25)."""
+    train, test = s.split(":", 1)
+    return int(train), int(test)
+
+
+def count_splits(n: int, train: int, test: int, step: Optional[int] = None,
+                 anchored: bool = False) -> List[Split]:
+    """Fenêtres par nombre d'éléments: train [lo, hi) puis test [hi, hi + test)."""
+    step = int(step or test)
+    out = []
+    hi = int(train)
+    while hi + test <= n:
+        out.append((0 if anchored else hi - int(train), hi, hi, hi + int(test)))
+        hi += step
+    return out
+
+
+def time_splits(ts: np.ndarray, train_s: float, test_s: float, step_s: Optional[float] = None,
+                anchored: bool = False, purge_s: float = 0.0) -> List[Split]:
+    """
+    Fenêtres temporelles sur ``ts`` trié. Le train s'arrête ``purge_s`` avant le test
+    (horizon des labels: un exemple train ne voit pas le début du test).
+    """
+    if not ts.size:
+        return []
+    step_s = float(step_s or test_s)
+    out = []
+    t = float(ts[0]) + float(train_s)
+    while t + test_s <= float(ts[-1]) + 1e-9:
+        lo = 0 if anchored else int(np.searchsorted(ts, t - train_s, side="left"))
+        hi = int(np.searchsorted(ts, t - purge_s, side="left"))
+        te_lo = int(np.searchsorted(ts, t, side="left"))
+        te_hi = int(np.searchsorted(ts, t + test_s, side="left"))
+        if hi > lo and te_hi > te_lo:
+            out.append((lo, hi, te_lo, te_hi))
+        t += step_s
+    return out
+
+
+def _fold_roundtrips(rets: np.ndarray, split: Split, cfg: Dict[str, Any]) -> Dict[str, Any]:
+    lo, hi, te_lo, te_hi = split
+    train, test = rets[lo:hi], rets[te_lo:te_hi]
+    be, size = cfg["break_even"], cfg["size"]
+    tp = fit_tp(train, np.asarray(cfg["tps"]), be, size, cfg.get("ties", "first"))["tp"]
+    tp = tp if tp is not None else float(cfg["tps"][0])
+    sl = fit_sl(train, cfg["sl_quantile"], cfg["sl_floor"])["sl"]
+    return {
+        "train": [lo, hi],
+        "test": [te_lo, te_hi],
+        "params": {"tp": tp, "sl": sl},
+        "is": score_tp_sl(train, tp, sl, be, size),
+        "oos": score_tp_sl(test, tp, sl, be, size),
+    }
+
+
+def walk_forward_roundtrips(
+    returns: Sequence[float],
+    train: int = 100,
+    test: int = 25,
+    step: Optional[int] = None,
+    anchored: bool = False,
+    break_even: float = 0.002,
+    size: float = 50.0,
+    tps: Optional[np.ndarray] = None,
+    sl_quantile: float = 0.80,
+    sl_floor: float = 0.0060,
+    workers: int = 1,
+    ties: str = "first",
+    exit_ts: Optional[Sequence[float]] = None,
+) -> Dict[str, Any]:
+    """
+    Folds par nombre de roundtrips, dans l'ordre de ``exit_ts`` s'il est fourni (sinon l'ordre reçu);
+    ``ties`` départage les TP ex aequo comme le script appelant (tpsl.fit_tp).
+    """
+    rets = np.asarray(returns, dtype=float)
+    if exit_ts is not None:
+        rets = rets[np.argsort(np.asarray(exit_ts, dtype=float), kind="stable")]
+    rets = rets[np.isfinite(rets)]
+    if tps is None:
+        tps = tp_grid(0.002, 0.015, 0.0005, floor=break_even + 0.0001)
+    cfg = {"break_even": break_even, "size": size, "tps": np.asarray(tps).tolist(),
+           "sl_quantile": sl_quantile, "sl_floor": sl_floor, "ties": ties}
+    splits = count_splits(int(rets.size), train, test, step, anchored)
+    folds = _map(_fold_roundtrips, [(rets, s, cfg) for s in splits], workers)
+    return {"n": int(rets.size), "folds": folds, "stability": stability(folds)}
+
+
+# ---------- examples (seuils d'entrée + multiplicateurs ATR) ----------
+
+
+def _slice(inputs: Dict[str, Any], lo: int, hi: int) -> Dict[str, Any]:
+    out = dict(inputs)
+    for k in ("ts", "price", "p_up", "atr_pct", "hour", "src"):
+        out[k] = inputs[k][lo:hi]
+    return out
+
+
+def _best(rows: List[Dict[str, Any]], min_count: int) -> Optional[Dict[str, Any]]:
+    ok = [r for r in rows if r["count"] >= min_count and r["expectancy"] is not None]
+    return max(ok, key=lambda r: (r["expectancy"], r["count"])) if ok else None
+
+
+def _fold_examples(db_path: str, horizon_s: float, split: Split, grid: Dict[str, Sequence[float]],
+                   defaults: Dict[str, float], min_count: int) -> Dict[str, Any]:
+    import gridsearch
+
+    inputs = gridsearch.load(db_path, horizon_s)
+    lo, hi, te_lo, te_hi = split
+    pairs = [(a, b) for a in grid["TP_ATR_MULT"] for b in grid["SL_ATR_MULT"]]
+    rows = gridsearch.evaluate_pairs(_slice(inputs, lo, hi), pairs, grid["PBUY"], grid["VOL_MIN"], defaults)
+    best = _best(rows, min_count)
+    fold = {
+        "train": [float(inputs["ts"][lo]), float(inputs["ts"][hi - 1])],
+        "test": [float(inputs["ts"][te_lo]), float(inputs["ts"][te_hi - 1])],
+        "params": None,
+        "is": None,
+        "oos": None,
+    }
+    if best is None:
+        return fold
+    keys = ("PBUY", "VOL_MIN", "TP_ATR_MULT", "SL_ATR_MULT")
+    oos = gridsearch.evaluate_pairs(
+        _slice(inputs, te_lo, te_hi),
+        [(best["TP_ATR_MULT"], best["SL_ATR_MULT"])], [best["PBUY"]], [best["VOL_MIN"]], defaults,
+    )[0]
+    stats = ("count", "expectancy", "total_return", "hit_rate", "tp", "sl")
+    fold["params"] = {k: best[k] for k in keys}
+    fold["is"] = {("n" if k == "count" else k): best[k] for k in stats}
+    fold["oos"] = {("n" if k == "count" else k): oos[k] for k in stats}
+    return fold
+
+
+def walk_forward_examples(
+    db_path: str,
+    grid: Dict[str, Sequence[float]],
+    defaults: Dict[str, float],
+    horizon_s: float = 600.0,
+    train_days: float = 7.0,
+    test_days: float = 1.0,
+    step_days: Optional[float] = None,
+    anchored: bool = False,
+    min_count: int = 30,
+    workers: int = 1,
+    progress: Optional[Callable[[float], Any]] = None,
+) -> Dict[str, Any]:
+    import gridsearch
+
+    inputs = gridsearch.load(db_path, horizon_s)
+    ts = inputs["ts"]
+    if not ts.size:
+        return {"ok": False, "error": "no labeled examples"}
+    splits = time_splits(ts, train_days * 86400.0, test_days * 86400.0,
+                         (step_days * 86400.0) if step_days else None, anchored, purge_s=horizon_s)
+    if not splits:
+        return {"ok": False, "error": "not enough history for one fold", "n": int(ts.size)}
+    grid = {k: [float(x) for x in v] for k, v in grid.items()}
+    tasks = [(db_path, horizon_s, s, grid, defaults, int(min_count)) for s in splits]
+    folds = _map(_fold_examples, tasks, workers, progress)
+    return {"ok": True, "n": int(ts.size), "folds": folds, "stability": stability(folds)}
+
+
+# ---------- exécution / rapport ----------
+
+
+def _map(fn: Callable, tasks: List[Tuple], workers: int,
+         progress: Optional[Callable[[float], Any]] = None) -> List[Any]:
+    """fn(*task) pour chaque tâche, dans l'ordre; pool de process si ``workers`` > 1."""
+    workers = max(1, min(int(workers or 1), len(tasks)))
+    if workers == 1:
+        out = []
+        for i, t in enumerate(tasks):
+            if progress is not None:
+                progress(i / len(tasks))
+            out.append(fn(*t))
+        return out
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        futs = [ex.submit(fn, *t) for t in tasks]
+        try:
+            for i, f in enumerate(futs):
+                f.result()
+                if progress is not None:
+                    progress((i + 1) / len(futs))
+        finally:
+            for f in futs:
+                f.cancel()
+        return [f.result() for f in futs]
+
+
+def stability(folds: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Dérive des paramètres entre folds + espérance in-sample vs out-of-sample."""
+    fitted = [f for f in folds if f.get("params")]
+    params: Dict[str, Any] = {}
+    for k in (fitted[0]["params"] if fitted else {}):
+        v = np.asarray([f["params"][k] for f in fitted], dtype=float)
+        d = np.abs(np.diff(v))
+        params[k] = {
+            "mean": float(v.mean()),
+            "std": float(v.std()),
+            "min": float(v.min()),
+            "max": float(v.max()),
+            "drift": float(d.mean()) if d.size else 0.0,  # |Δ| moyen d'un fold au suivant
+            "changes": int(np.count_nonzero(d > 1e-12)),
+            "last": float(v[-1]),
+        }
+    is_e = np.asarray([f["is"]["expectancy"] for f in fitted if f["is"]["expectancy"] is not None], dtype=float)
+    oos = [f["oos"] for f in fitted if f["oos"]["expectancy"] is not None]
+    oos_e = np.asarray([o["expectancy"] for o in oos], dtype=float)
+    oos_n = np.asarray([o["n"] for o in oos], dtype=float)
+    pooled = float((oos_e * oos_n).sum() / oos_n.sum()) if oos_n.sum() > 0 else None
+    return {
+        "folds": len(folds),
+        "fitted": len(fitted),
+        "params": params,
+        "is_expectancy": float(is_e.mean()) if is_e.size else None,
+        "oos_expectancy": pooled,
+        "oos_expectancy_mean": float(oos_e.mean()) if oos_e.size else None,
+        "oos_expectancy_std": float(oos_e.std()) if oos_e.size else None,
+        "oos_positive_share": float(np.mean(oos_e > 0)) if oos_e.size else None,
+        "oos_n": int(oos_n.sum()),
+        "degradation": (float(is_e.mean()) - float(oos_e.mean())) if (is_e.size and oos_e.size) else None,
+    }
+
+
+def print_report(res: Dict[str, Any]):
+    for i, f in enumerate(res.get("folds", [])):
+        p, o = f.get("params") or {}, f.get("oos") or {}
+        ps = " ".join(f"{k}={v:.5g}" for k, v in p.items()) or "(pas de fit)"
+        e = o.get("expectancy")
+        print(f"fold {i:>3} | {ps} | OOS n={o.get('n', 0)} exp={'-' if e is None else f'{e*100:.4f}%'}")
+    st = res.get("stability") or {}
+    print(f"folds={st.get('folds')} fitted={st.get('fitted')} OOS n={st.get('oos_n')}")
+    for k, v in (st.get("params") or {}).items():
+        print(f"  {k:<12} mean={v['mean']:.5g} std={v['std']:.3g} drift={v['drift']:.3g} last={v['last']:.5g}")
+    for k in ("is_expectancy", "oos_expectancy", "oos_positive_share", "degradation"):
+        v = st.get(k)
+        print(f"  {k:<20} {'-' if v is None else f'{v:.6f}'}")
+
+
+def _floats(s: str) -> List[float]:
+    return [float(x) for x in s.split(",") if x.strip()]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Walk-forward TP/SL (roundtrips) et seuils d'entrée (examples)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("roundtrips", help="folds par nombre de roundtrips (paper_roundtrips.csv)")
+    r.add_argument("--history", default="paper_roundtrips.csv")
+    r.add_argument("--train", type=int, default=100)
+    r.add_argument("--test", type=int, default=25)
+    r.add_argument("--break-even", type=float, default=0.002)
+    r.add_argument("--size", type=float, default=50.0)
+    r.add_argument("--tp-min", type=float, default=0.002)
+    r.add_argument("--tp-max", type=float, default=0.015)
+    r.add_argument("--tp-step", type=float, default=0.0005)
+    r.add_argument("--sl-quantile", type=float, default=0.80)
+    r.add_argument("--sl-floor", type=float, default=0.0060)
+    e = sub.add_parser("examples", help="folds temporels sur examples labellisés + chemins de prix")
+    e.add_argument("--db", default=os.getenv("DB_PATH", "data/app.db"))
+    e.add_argument("--train-days", type=float, default=7.0)
+    e.add_argument("--test-days", type=float, default=1.0)
+    e.add_argument("--horizon-s", type=float, default=600.0)
+    e.add_argument("--pbuy", default="0.55,0.58,0.60,0.62,0.64,0.66,0.68,0.70")
+    e.add_argument("--vol-min", default="0,0.001,0.0025")
+    e.add_argument("--tp-mult", default="0.4,0.6,0.8,1.0,1.2")
+    e.add_argument("--sl-mult", default="0.4,0.6,0.8,1.0")
+    e.add_argument("--cost", type=float, default=0.0024)
+    e.add_argument("--min-tp-pct", type=float, default=0.002)
+    e.add_argument("--min-sl-pct", type=float, default=0.002)
+    e.add_argument("--min-count", type=int, default=30)
+    for p in (r, e):
+        p.add_argument("--step", type=float, default=None, help="pas entre folds (défaut: taille du test)")
+        p.add_argument("--anchored", action="store_true", help="train depuis le début (fenêtre croissante)")
+        p.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+        p.add_argument("--json", default=None, help="écrit le rapport complet dans ce fichier")
+    a = ap.parse_args(argv)
+
+    if a.cmd == "roundtrips":
+        rets = [x["ret"] for x in load_roundtrips_csv(a.history) if math.isfinite(x["ret"])]
+        res = walk_forward_roundtrips(
+            rets, a.train, a.test, int(a.step) if a.step else None, a.anchored, a.break_even, a.size,
+            tp_grid(a.tp_min, a.tp_max, a.tp_step, floor=a.break_even + 0.0001),
+            a.sl_quantile, a.sl_floor, a.workers,
+        )
+    else:
+        grid = {"PBUY": _floats(a.pbuy), "VOL_MIN": _floats(a.vol_min),
+                "TP_ATR_MULT": _floats(a.tp_mult), "SL_ATR_MULT": _floats(a.sl_mult)}
+        defaults = {"COST": a.cost, "MIN_TP_PCT": a.min_tp_pct, "MIN_SL_PCT": a.min_sl_pct}
+        res = walk_forward_examples(
+            a.db, grid, defaults, a.horizon_s, a.train_days, a.test_days, a.step, a.anchored,
+            a.min_count, a.workers,
+        )
+        if not res.get("ok"):
+            print(res.get("error"))
+            return 1
+    print_report(res)
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())